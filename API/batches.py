@@ -0,0 +1,328 @@
+"""
+批量任务
+一个批次包含多个独立的条目，条目按顺序提交到智能体线程池，同时提交的条目数不超过批次的并发数，
+前面的条目结束后再提交后面的，一个批次不会占满线程池和队列。
+条目结束的顺序不固定，批次记录结束顺序，流式接口按结束顺序发送每个条目（带有条目序号）
+启用共享状态时批次所在的工作进程登记在共享存储中，其他进程收到该批次的请求时可以明确告知批次在哪个进程上
+"""
+
+import asyncio
+import json
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from fastapi.responses import StreamingResponse
+from sse_starlette.sse import EventSourceResponse
+
+from .config import logger, BATCH_CONFIG, SSE_CONFIG
+from .sse import SSEMessage
+from .services import agent_service, TaskRejected, TaskResult, TaskStatus
+from .shared_state import get_shared_state
+from .task_events import TERMINAL_STATUSES
+
+
+class BatchItem:
+    """批次中的一个条目"""
+
+    def __init__(self, index: int, user_id: str, task_func: Callable):
+        self.index = index
+        self.user_id = user_id
+        self.task_func = task_func
+        self.task_id: Optional[str] = None  # 提交到线程池后的任务ID
+        self.result: Optional[TaskResult] = None  # 结束后的最终结果
+
+    @property
+    def status(self) -> str:
+        """waiting 表示还没有提交到线程池，之后同任务状态"""
+        if self.result is not None:
+            return self.result.status.value
+        if self.task_id is None:
+            return "waiting"
+        current = agent_service.get_task_status(self.task_id)
+        return current.status.value if current is not None else TaskStatus.PENDING.value
+
+    def to_dict(self) -> Dict[str, Any]:
+        item = {"index": self.index, "task_id": self.task_id, "status": self.status}
+        if self.result is not None:
+            item.update({
+                "result": self.result.result,
+                "error": self.result.error,
+                "execution_time": self.result.execution_time
+            })
+        return item
+
+
+class TaskBatch:
+    """一个批次的条目、进度和结束顺序（只在事件循环中使用）"""
+
+    def __init__(self, batch_type: str, user_id: str, items: List[Tuple[str, Callable]],
+                 priority: int = 3, max_concurrency: int = None):
+        """
+        Args:
+            batch_type: 批次类型，也是条目的任务类型
+            user_id: 提交批次的用户
+            items: 条目列表，每项为 (条目所属用户ID, 任务函数)
+            priority: 条目任务的优先级
+            max_concurrency: 同时提交到线程池的条目数
+        """
+        self.batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+        self.batch_type = batch_type
+        self.user_id = user_id
+        self.priority = priority
+        self.max_concurrency = max_concurrency or BATCH_CONFIG["default_concurrency"]
+        self.items = [BatchItem(index, item_user, task_func) for index, (item_user, task_func) in enumerate(items)]
+        self.finished: List[int] = []  # 已结束条目的序号，按结束顺序
+        self.created_at = datetime.now()
+        self.completed_at: Optional[datetime] = None
+        self.cancelled = False
+        self.next_index = 0  # 下一个要提交的条目
+        self.runner: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()  # 每有条目结束时设置并替换
+
+    @property
+    def done(self) -> bool:
+        return self.completed_at is not None
+
+    @property
+    def status(self) -> str:
+        if not self.done:
+            return "running"
+        return "cancelled" if self.cancelled else "completed"
+
+    def progress(self) -> Dict[str, Any]:
+        """聚合进度：各状态的条目数和已结束的比例"""
+        counts: Dict[str, int] = {}
+        for item in self.items:
+            counts[item.status] = counts.get(item.status, 0) + 1
+        return {
+            "total": len(self.items),
+            "finished": len(self.finished),
+            "percent": round(len(self.finished) * 100 / len(self.items), 1) if self.items else 100.0,
+            "counts": counts
+        }
+
+    def to_dict(self, include_items: bool = True) -> Dict[str, Any]:
+        batch = {
+            "batch_id": self.batch_id,
+            "batch_type": self.batch_type,
+            "user_id": self.user_id,
+            "status": self.status,
+            "max_concurrency": self.max_concurrency,
+            "created_at": self.created_at.isoformat(),
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None,
+            "progress": self.progress()
+        }
+        if include_items:
+            batch["items"] = [item.to_dict() for item in self.items]
+        return batch
+
+    def item_event(self, index: int) -> Dict[str, Any]:
+        """一个条目结束的事件"""
+        return {
+            "type": "item",
+            "batch_id": self.batch_id,
+            **self.items[index].to_dict(),
+            "finished": self.finished.index(index) + 1,
+            "total": len(self.items)
+        }
+
+    def _finish_item(self, index: int, task_result: TaskResult):
+        self.items[index].result = task_result
+        self.finished.append(index)
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def events(self, heartbeat_interval: float = None) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """按结束顺序产出条目事件，最后产出批次结束事件
+
+        连接前已结束的条目先依次补发；heartbeat_interval 内没有条目结束时产出 None（用于发送心跳）
+        """
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.finished):
+                yield self.item_event(self.finished[sent])
+                sent += 1
+            if self.done:
+                yield {"type": "batch", **self.to_dict(include_items=False)}
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), heartbeat_interval)
+            except asyncio.TimeoutError:
+                yield None
+
+
+class BatchManager:
+    """批次登记与执行
+
+    批次在创建它的工作进程中执行和查询，启用共享状态时登记所在的工作进程（见 owner_worker）；
+    已结束的批次保留 ttl 秒，最多保留 max_batches 个
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**BATCH_CONFIG, **(config or {})}
+        self.batches: "OrderedDict[str, TaskBatch]" = OrderedDict()
+
+    def submit(self, batch: TaskBatch) -> TaskBatch:
+        """登记批次并开始执行（在事件循环中调用）
+
+        第一个条目在调用时同步提交，线程池拒绝时抛出 TaskRejected，批次不登记；
+        后续条目由后台协程按并发数陆续提交
+        """
+        batch.max_concurrency = max(1, min(batch.max_concurrency, self.config["max_concurrency"]))
+        if batch.items:
+            self._submit_item(batch, batch.items[0])
+            batch.next_index = 1
+        self._evict()
+        self.batches[batch.batch_id] = batch
+        shared = get_shared_state()
+        if shared is not None and shared.started:
+            shared.add_batch(batch.batch_id, batch.user_id)
+        batch.runner = asyncio.ensure_future(self._run(batch))
+        logger.info(f"批次 {batch.batch_id} 已创建: {len(batch.items)} 个条目，并发数 {batch.max_concurrency}")
+        return batch
+
+    def get(self, batch_id: str) -> Optional[TaskBatch]:
+        return self.batches.get(batch_id)
+
+    def owner_worker(self, batch_id: str) -> Optional[str]:
+        """不在当前工作进程中的批次所在的存活工作进程，没有共享状态或未登记时返回None"""
+        shared = get_shared_state()
+        if shared is None or not shared.started or batch_id in self.batches:
+            return None
+        worker_id = shared.batch_worker(batch_id)
+        return worker_id if worker_id != shared.worker_id else None
+
+    def cancel(self, batch_id: str) -> bool:
+        """取消批次：未提交的条目不再提交，已提交的任务一并取消；返回批次是否存在且未结束"""
+        batch = self.batches.get(batch_id)
+        if batch is None or batch.done:
+            return False
+        batch.cancelled = True
+        for item in batch.items:
+            if item.task_id is not None and item.result is None:
+                agent_service.cancel_task(item.task_id)
+        batch._notify()
+        return True
+
+    def _submit_item(self, batch: TaskBatch, item: BatchItem):
+        item.task_id = agent_service.submit_agent_task(
+            task_type=batch.batch_type,
+            user_id=item.user_id,
+            task_func=item.task_func,
+            priority=batch.priority
+        )
+
+    async def _submit_with_retry(self, batch: TaskBatch, item: BatchItem) -> bool:
+        """提交条目，线程池拒绝时按 Retry-After 等待后重试；放弃时条目以失败结束，返回是否已提交"""
+        for attempt in range(self.config["submit_retries"] + 1):
+            try:
+                self._submit_item(batch, item)
+                return True
+            except TaskRejected as e:
+                if attempt == self.config["submit_retries"]:
+                    error = e.detail
+                    break
+                await asyncio.sleep(e.retry_after)
+                if batch.cancelled:
+                    return False
+            except Exception as e:
+                error = getattr(e, "detail", None) or str(e)
+                break
+        batch._finish_item(item.index, TaskResult(task_id="", status=TaskStatus.FAILED,
+                                                  error=f"条目提交失败: {error}"))
+        return False
+
+    async def _run(self, batch: TaskBatch):
+        """保持批次同时提交的条目数不超过并发数，直到所有条目结束"""
+        waiters: Dict[asyncio.Future, int] = {}
+        if batch.next_index:
+            waiters[asyncio.ensure_future(agent_service.wait_task(batch.items[0].task_id))] = 0
+        try:
+            while waiters or (batch.next_index < len(batch.items) and not batch.cancelled):
+                while batch.next_index < len(batch.items) and len(waiters) < batch.max_concurrency \
+                        and not batch.cancelled:
+                    item = batch.items[batch.next_index]
+                    batch.next_index += 1
+                    if await self._submit_with_retry(batch, item):
+                        waiters[asyncio.ensure_future(agent_service.wait_task(item.task_id))] = item.index
+                if not waiters:
+                    continue
+                done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in done:
+                    index = waiters.pop(waiter)
+                    task_result = waiter.result() if waiter.exception() is None else None
+                    if task_result is None or task_result.status.value not in TERMINAL_STATUSES:
+                        task_result = TaskResult(task_id=batch.items[index].task_id, status=TaskStatus.FAILED,
+                                                 error="任务结果已不存在")
+                    batch._finish_item(index, task_result)
+        except asyncio.CancelledError:
+            for waiter in waiters:
+                waiter.cancel()
+            raise
+        finally:
+            # 取消后未提交的条目
+            for item in batch.items:
+                if item.result is None:
+                    batch._finish_item(item.index, TaskResult(task_id=item.task_id or "", status=TaskStatus.CANCELLED,
+                                                              error="批次已取消"))
+            batch.completed_at = datetime.now()
+            batch._notify()
+            logger.info(f"批次 {batch.batch_id} 已结束: {batch.progress()['counts']}")
+
+    def _evict(self):
+        """淘汰超过保留时间或超出数量上限的已结束批次"""
+        now = datetime.now()
+        evicted = [batch_id for batch_id, batch in self.batches.items()
+                   if batch.done and (now - batch.completed_at).total_seconds() > self.config["ttl"]]
+        for batch_id in evicted:
+            del self.batches[batch_id]
+        finished = [batch_id for batch_id, batch in self.batches.items() if batch.done]
+        for batch_id in finished[:max(0, len(self.batches) + 1 - self.config["max_batches"])]:
+            del self.batches[batch_id]
+            evicted.append(batch_id)
+        shared = get_shared_state()
+        if evicted and shared is not None and shared.started:
+            shared.remove_batches(evicted)
+
+    def get_status(self) -> Dict[str, Any]:
+        running = sum(1 for batch in self.batches.values() if not batch.done)
+        return {"batches": len(self.batches), "running": running}
+
+    async def aclose(self):
+        """停止提交批次的后续条目（已提交的任务随线程池关闭）"""
+        for batch in self.batches.values():
+            if batch.runner is not None and not batch.runner.done():
+                batch.runner.cancel()
+
+
+def batch_stream_response(batch: TaskBatch, stream_format: str = "ndjson"):
+    """按条目结束顺序推送批次结果的流式响应
+
+    ndjson：每行一个JSON事件；sse：item 和 batch 事件。没有条目结束时按 heartbeat_interval 发送心跳
+    """
+    heartbeat_interval = SSE_CONFIG["heartbeat_interval"]
+    if stream_format == "sse":
+        async def sse_stream():
+            async for event in batch.events(heartbeat_interval):
+                if event is None:
+                    yield SSEMessage.heartbeat()
+                else:
+                    yield SSEMessage.format_message(data=event, event=event["type"])
+        return EventSourceResponse(sse_stream())
+
+    async def ndjson_stream():
+        async for event in batch.events(heartbeat_interval):
+            if event is None:
+                event = {"type": "heartbeat", "timestamp": datetime.now().isoformat()}
+            yield json.dumps(event, ensure_ascii=False, default=str) + "\n"
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+
+# 全局批次管理器
+batch_manager = BatchManager()
@@ -30,8 +30,35 @@ SSE_CONFIG = {
     "heartbeat_interval": 30,  # 心跳间隔（秒）
     "connection_timeout": 60,  # 连接超时（秒）
     "cleanup_interval": 30,    # 清理间隔（秒）
-    "poll_interval": 0.1,      # 任务状态轮询间隔（秒）- 缩短到100ms
-    "status_message_interval": 50  # 状态消息发送间隔（轮询次数，即每50次轮询发送一次状态）
+    "task_check_interval": 1.0,      # 线程池流式任务暂无新片段时检查任务状态的间隔（秒）
+    "status_message_interval": 5.0,  # 等待期间发送处理中状态消息的间隔（秒）
+    "stream_channel_size": 256,      # 线程池流式任务实时通道最多缓存的片段数
+    "stream_channel_put_timeout": 60  # 通道已满（客户端读取过慢）时工作线程最多等待的秒数，超时后停止生成
+}
+
+# 任务状态推送配置（SSE订阅与webhook回调）
+TASK_EVENTS_CONFIG = {
+    "subscriber_queue_size": 100,   # 每个SSE订阅者最多缓存的事件数，读取过慢时丢弃最早的事件
+    "webhook_allowed_hosts": [h.strip() for h in os.getenv(
+        "WEBHOOK_ALLOWED_HOSTS", "localhost,127.0.0.1,::1").split(",") if h.strip()],  # 允许回调的主机，为空表示不限制
+    "webhook_batch_size": 20,       # 每次回调最多包含的事件数
+    "webhook_batch_interval": 0.5,  # 首个事件到达后等待多少秒再发送，期间结束的任务合并到同一批
+    "webhook_max_pending": 1000,    # 每个地址最多积压的事件数，超出时丢弃最早的事件
+    "webhook_max_retries": 5,       # 回调失败（非2xx或连接失败）后的重试次数
+    "webhook_retry_backoff": 1.0,   # 首次重试的等待秒数，之后每次翻倍
+    "webhook_timeout": 5.0,         # 回调请求超时（秒）
+    "webhook_cache_ttl": 5.0,       # 多进程时缓存共享存储中webhook登记的秒数
+}
+
+# 批量任务配置
+BATCH_CONFIG = {
+    "max_generate_items": int(os.getenv("BATCH_MAX_GENERATE_ITEMS", "50")),  # /batch/generate 每批最多的请求数
+    "max_chat_items": int(os.getenv("BATCH_MAX_CHAT_ITEMS", "20")),          # /chat/batch 每批最多的消息数
+    "default_concurrency": 2,  # 每批同时提交到线程池的任务数（排队和执行中的合计），其余条目等前面的结束后再提交
+    "max_concurrency": 4,      # 请求可以指定的每批并发数上限，避免一个批次占满智能体线程池
+    "submit_retries": 3,       # 条目被线程池拒绝（429）时按 Retry-After 等待后重试的次数
+    "ttl": 3600,               # 批次结束后保留进度和结果的秒数
+    "max_batches": 200,        # 最多保留的批次数，超出时淘汰最早结束的批次
 }
 
 # 多线程配置
@@ -41,12 +68,24 @@ THREAD_CONFIG = {
         "max_workers": 5,      # 智能体任务最大工作线程数（增加以提高并发）
         "queue_size": 30,      # 智能体任务队列大小（增加队列容量）
         "task_timeout": 300,   # 任务超时时间（秒）
+        "max_running_per_user": 3,  # 每个用户同时执行的任务数上限（None表示不限制），避免批量请求占满所有工作线程
+        "aging_interval": 30,  # 排队任务每等待多少秒优先级提升一级，低优先级任务不会一直排不上
+        "user_weights": {},    # 用户调度权重（默认1），例如 {"vip_user": 2}
+        "max_queue_wait": 120,  # 预计排队等待超过多少秒时拒绝新任务（429 + Retry-After），None表示只按队列长度限制
+        "initial_exec_estimate": 30,  # 还没有执行耗时样本时估算排队时间使用的单任务耗时（秒）
+        "exec_time_samples": 50,  # 按最近多少个任务的执行耗时估算排队时间
     },
     # 系统功能专用线程池配置
     "system_pool": {
         "max_workers": 8,      # 系统任务最大工作线程数（增加系统任务并发）
         "queue_size": 100,     # 系统任务队列大小（增加队列容量）
         "task_timeout": 60,    # 系统任务超时时间（秒）
+        "max_running_per_user": None,  # 系统任务大多以 system 用户提交，不限制
+        "aging_interval": 30,
+        "user_weights": {},
+        "max_queue_wait": None,
+        "initial_exec_estimate": 5,
+        "exec_time_samples": 50,
     },
     # 通用配置
     "cleanup_interval": 3600,  # 清理间隔（秒）
@@ -54,6 +93,30 @@ THREAD_CONFIG = {
     "max_session_inactive_hours": 24  # 会话不活跃清理时间（小时）
 }
 
+# 多进程共享状态配置（同一台机器上运行多个工作进程时，任务状态、用户会话和SSE连接登记保存在任务存储的SQLite文件中）
+SHARED_STATE_CONFIG = {
+    "enabled": os.getenv("SHARED_STATE", "true" if int(os.getenv("WORKERS", "1")) > 1 else "false").lower() == "true",  # 多于1个工作进程时默认启用
+    "heartbeat_interval": 5.0,     # 工作进程写入心跳的间隔（秒）
+    "worker_timeout_beats": 3,     # 超过这么多个心跳间隔没有心跳的工作进程视为已退出，其未完成的任务由其他进程接管
+    "connection_heartbeat_interval": 10.0,  # SSE连接心跳写入共享存储的最小间隔（秒）
+}
+
+# 任务结果存储配置（每个线程池一份）
+TASK_STORE_CONFIG = {
+    "backend": os.getenv("TASK_STORE_BACKEND", "sqlite" if SHARED_STATE_CONFIG["enabled"] else "memory"),  # memory：仅内存；sqlite：同时写入SQLite，重启后恢复未完成的任务（共享状态需要sqlite）
+    "sqlite_path": os.getenv("TASK_STORE_PATH", os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "tasks.db")),
+    "commit_batch_size": 512,  # SQLite每次提交最多包含的状态变更数（后台线程取走已积累的变更一起提交）
+    "memory_budget_mb": float(os.getenv("TASK_RESULT_MEMORY_MB", "64")),  # 已结束任务结果的内存预算，超出时淘汰最久未访问的结果
+    "max_entries": 10000,      # 最多保留的已结束任务数
+    "ttl": 24 * 3600,          # 已结束任务结果的保留时间（秒）
+    "sweep_interval": 300,     # 清理过期结果的最小间隔（秒）
+    "spill_enabled": os.getenv("TASK_RESULT_SPILL", "false").lower() == "true",  # 是否把较大的结果写入磁盘
+    "spill_dir": os.getenv("TASK_RESULT_SPILL_DIR", os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "task_results")),
+    "spill_threshold": 64 * 1024,  # 估算大小达到该值（字节）的结果写入磁盘，内存中只保留状态
+}
+
 # HTTP/2.0 和 SSL 配置
 HTTP2_CONFIG = {
     "enabled": True,           # 是否启用HTTP/2.0
@@ -73,7 +136,7 @@ HTTP2_CONFIG = {
 # 服务器配置
 SERVER_CONFIG = {
     "host": "0.0.0.0",
-    "workers": 1,             # 工作进程数（HTTP/2建议单进程）
+    "workers": int(os.getenv("WORKERS", "1")),  # 工作进程数，多于1个时启用共享状态（SHARED_STATE_CONFIG）
     "backlog": 2048,          # 连接队列大小
     "timeout_keep_alive": 5,  # Keep-Alive超时
     "timeout_graceful_shutdown": 30,  # 优雅关闭超时
@@ -88,6 +151,7 @@ SERVER_CONFIG = {
 API_ENDPOINTS = [
     "GET / - API信息",
     "GET /health - 健康检查", 
+    "GET /ready - 就绪检查（模型预热完成前返回503）",
     "POST /content/generate - 同步生成文案",
     "POST /content/generate/async - 异步生成文案",
     "POST /content/generate/stream - 流式生成文案（直接执行）",
@@ -100,9 +164,13 @@ API_ENDPOINTS = [
     "POST /chat/async - 异步对话聊天",
     "POST /chat/stream - 流式对话聊天（直接执行）",
     "POST /chat/stream/async - 流式对话聊天（线程池执行）",
-    "POST /content/batch/generate - 批量生成文案",
-    "POST /chat/batch - 批量对话",
+    "POST /content/batch/generate - 批量生成文案（?stream=ndjson|sse 按结束顺序返回条目）",
+    "POST /chat/batch - 批量对话（?stream=ndjson|sse 按结束顺序返回条目）",
+    "GET /batches/{batch_id} - 批次进度和条目结果",
+    "GET /batches/{batch_id}/stream - 按结束顺序推送批次条目（NDJSON或SSE）",
+    "DELETE /batches/{batch_id} - 取消批次",
     "GET /tasks/{task_id}/status - 任务状态查询",
+    "GET /tasks?user_id= - 列出用户最近的任务",
     "DELETE /tasks/{task_id} - 取消任务",
     "GET /system/status - 系统状态监控",
     "GET /system/pools - 线程池状态",
@@ -30,6 +30,8 @@ MESSAGES: Dict[Language, Dict[str, str]] = {
         # API响应消息
         "api_running": "小红书文案生成智能体 API 服务运行中",
         "service_healthy": "服务健康",
+        "service_ready": "服务已就绪",
+        "service_not_ready": "模型预热中，服务尚未就绪",
         "running": "运行中",
         "content_generation_success": "文案生成成功",
         "content_optimization_success": "内容优化成功",
@@ -41,6 +43,15 @@ MESSAGES: Dict[Language, Dict[str, str]] = {
         "version_restore_success": "版本恢复成功",
         "history_cleared": "历史记录已清空",
         "sse_connection_status_retrieved": "获取连接状态成功",
+        "webhook_registered": "webhook登记成功",
+        "webhook_removed": "webhook已注销",
+        "webhooks_retrieved": "获取webhook列表成功",
+        "webhook_not_found": "webhook不存在",
+        "batch_status_success": "获取批次进度成功",
+        "batch_cancel_success": "批次已取消",
+        "batch_not_found": "批次不存在",
+        "batch_on_other_worker": "批次在其他工作进程中执行，请使用提交批次时的流式响应或启用会话保持",
+        "batch_cancel_failed": "批次已结束，无法取消",
         
         # 错误消息
         "generation_failed": "生成失败",
@@ -72,6 +83,8 @@ MESSAGES: Dict[Language, Dict[str, str]] = {
         # API response messages
         "api_running": "Xiaohongshu Content Generation AI Agent API Service Running",
         "service_healthy": "Service Healthy",
+        "service_ready": "Service ready",
+        "service_not_ready": "Model is warming up, service is not ready yet",
         "running": "Running",
         "content_generation_success": "Content generation successful",
         "content_optimization_success": "Content optimization successful",
@@ -83,6 +96,15 @@ MESSAGES: Dict[Language, Dict[str, str]] = {
         "version_restore_success": "Version restore successful",
         "history_cleared": "History cleared",
         "sse_connection_status_retrieved": "Connection status retrieved successfully",
+        "webhook_registered": "Webhook registered",
+        "webhook_removed": "Webhook removed",
+        "webhooks_retrieved": "Webhooks retrieved successfully",
+        "webhook_not_found": "Webhook not found",
+        "batch_status_success": "Batch progress retrieved successfully",
+        "batch_cancel_success": "Batch cancelled",
+        "batch_not_found": "Batch not found",
+        "batch_on_other_worker": "Batch is running in another worker process; use the streaming response returned on submission or enable sticky sessions",
+        "batch_cancel_failed": "Batch already finished and cannot be cancelled",
         
         # Error messages
         "generation_failed": "Generation failed",
@@ -114,6 +136,8 @@ MESSAGES: Dict[Language, Dict[str, str]] = {
         # API響應訊息
         "api_running": "小紅書文案生成智慧體 API 服務運行中",
         "service_healthy": "服務健康",
+        "service_ready": "服務已就緒",
+        "service_not_ready": "模型預熱中，服務尚未就緒",
         "running": "運行中",
         "content_generation_success": "文案生成成功",
         "content_optimization_success": "內容優化成功",
@@ -125,6 +149,15 @@ MESSAGES: Dict[Language, Dict[str, str]] = {
         "version_restore_success": "版本恢復成功",
         "history_cleared": "歷史記錄已清空",
         "sse_connection_status_retrieved": "獲取連接狀態成功",
+        "webhook_registered": "webhook登記成功",
+        "webhook_removed": "webhook已註銷",
+        "webhooks_retrieved": "獲取webhook列表成功",
+        "webhook_not_found": "webhook不存在",
+        "batch_status_success": "獲取批次進度成功",
+        "batch_cancel_success": "批次已取消",
+        "batch_not_found": "批次不存在",
+        "batch_on_other_worker": "批次在其他工作程序中執行，請使用提交批次時的串流回應或啟用工作階段保持",
+        "batch_cancel_failed": "批次已結束，無法取消",
         
         # 錯誤訊息
         "generation_failed": "生成失敗",
@@ -156,6 +189,8 @@ MESSAGES: Dict[Language, Dict[str, str]] = {
         # API応答メッセージ
         "api_running": "Xiaohongshu コンテンツ生成AIエージェント APIサービス実行中",
         "service_healthy": "サービス正常",
+        "service_ready": "サービス準備完了",
+        "service_not_ready": "モデルのウォームアップ中のため、サービスはまだ準備できていません",
         "running": "実行中",
         "content_generation_success": "コンテンツ生成成功",
         "content_optimization_success": "コンテンツ最適化成功",
@@ -167,6 +202,15 @@ MESSAGES: Dict[Language, Dict[str, str]] = {
         "version_restore_success": "バージョン復元成功",
         "history_cleared": "履歴がクリアされました",
         "sse_connection_status_retrieved": "接続状態取得成功",
+        "webhook_registered": "Webhook登録成功",
+        "webhook_removed": "Webhook登録解除",
+        "webhooks_retrieved": "Webhook一覧取得成功",
+        "webhook_not_found": "Webhookが存在しません",
+        "batch_status_success": "バッチの進捗を取得しました",
+        "batch_cancel_success": "バッチをキャンセルしました",
+        "batch_not_found": "バッチが存在しません",
+        "batch_on_other_worker": "バッチは別のワーカープロセスで実行中です。送信時のストリーミングレスポンスを使用するか、スティッキーセッションを有効にしてください",
+        "batch_cancel_failed": "バッチは既に終了しているためキャンセルできません",
         
         # エラーメッセージ
         "generation_failed": "生成失敗",
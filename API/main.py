@@ -10,10 +10,11 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from .config import APP_CONFIG, CORS_CONFIG, logger
 from .services import agent_service, session_service
+from .batches import batch_manager
 from .sse import heartbeat_task
 
 # 导入所有路由
-from .routes import base, content, chat, feedback, sse, history
+from .routes import base, content, chat, feedback, sse, history, events, batches
 
 
 @asynccontextmanager
@@ -25,6 +26,9 @@ async def lifespan(app: FastAPI):
         # 初始化智能体
         await agent_service.initialize()
         
+        # 后台预热模型并保持驻留（预热完成前 /ready 返回503）
+        agent_service.start_warmup()
+        
         # 启动心跳任务
         asyncio.create_task(heartbeat_task())
         
@@ -60,12 +64,18 @@ async def lifespan(app: FastAPI):
     logger.info("正在关闭应用...")
     
     try:
+        # 停止提交批次的后续条目
+        await batch_manager.aclose()
+        
+        # 停止模型驻留任务并关闭异步客户端连接
+        await agent_service.aclose()
+        
         # 关闭所有线程池
         agent_service.shutdown()
-        logger.info("所有线程池已关闭")
+        logger.info("所有线程池及Ollama连接池已关闭")
         
         # 清理会话数据
-        session_service.user_sessions.clear()
+        session_service.shutdown()
         logger.info("会话数据已清理")
         
     except Exception as e:
@@ -95,5 +105,7 @@ app.include_router(chat.router)
 app.include_router(feedback.router)
 app.include_router(sse.router)
 app.include_router(history.router)
+app.include_router(events.router)
+app.include_router(batches.router)
 from .routes import i18n
 app.include_router(i18n.router) 
\ No newline at end of file
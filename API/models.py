@@ -87,6 +87,20 @@ class ContentGenerationRequest(I18nMixin):
         • False - 关闭思考模式，直接输出结果，会在prompt后添加'/no_think'""",
         example=True
     )
+    coalesce: bool = Field(
+        default=False,
+        description="""请求合并开关 - 仅对流式生成接口生效
+        • True - 与正在进行的完全相同的生成请求（规范化后的提示词、系统提示词和选项相同）共享同一次模型生成，中途加入时先重放已生成的内容
+        • False - 独立生成，适合需要多样化结果的请求""",
+        example=False
+    )
+    use_cache: bool = Field(
+        default=False,
+        description="""结果缓存开关 - 相同参数的请求直接返回缓存的结果
+        • True - 使用固定采样种子（确定性模式）生成并缓存结果；命中缓存时不调用模型，流式接口分片回放缓存内容
+        • False - 每次重新生成""",
+        example=False
+    )
 
 
 class ContentOptimizationRequest(I18nMixin):
@@ -99,6 +113,13 @@ class ContentOptimizationRequest(I18nMixin):
         • False - 关闭思考模式，直接输出结果，会在prompt后添加'/no_think'""",
         example=True
     )
+    use_cache: bool = Field(
+        default=False,
+        description="""结果缓存开关 - 相同参数的请求直接返回缓存的结果
+        • True - 使用固定采样种子（确定性模式）生成并缓存结果；命中缓存时不调用模型，流式接口分片回放缓存内容
+        • False - 每次重新生成""",
+        example=False
+    )
 
 
 class ChatRequest(I18nMixin):
@@ -150,6 +171,11 @@ class SSEConnectionRequest(I18nMixin):
     connection_type: str = Field(default="general", description="连接类型")
 
 
+class WebhookRequest(I18nMixin):
+    user_id: str = Field(..., description="用户ID")
+    url: str = Field(..., description="任务结束时回调的地址，默认只允许本机地址（WEBHOOK_ALLOWED_HOSTS）")
+
+
 class ApiResponse(BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True)
     
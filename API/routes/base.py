@@ -7,6 +7,7 @@ from typing import Optional
 
 from ..models import ApiResponse
 from ..services import agent_service, session_service
+from ..batches import batch_manager
 from ..config import logger, APP_CONFIG, API_ENDPOINTS, SSE_FEATURES
 from ..i18n import get_message, get_success_message, get_error_message
 
@@ -27,6 +28,8 @@ async def root(language: str = Query("zh-CN", description="语言代码")):
                 "language": language
             }
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取API信息失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -47,21 +50,50 @@ async def health_check(language: str = Query("zh-CN", description="语言代码"
             message=get_success_message("health_check_success", language),
             data={
                 "agent_ready": agent_ready,
+                "ollama": agent_service.get_ollama_status(),
                 "system_status": system_status,
                 "language": language
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"健康检查失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/ready", response_model=ApiResponse)
+async def readiness_check(language: str = Query("zh-CN", description="语言代码")):
+    """就绪检查：智能体初始化且模型预热完成前返回503"""
+    warmup_status = agent_service.warmup_manager.get_status()
+    if not agent_service.is_ready():
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "message": get_message("service_not_ready", language),
+                "agent_ready": agent_service.agent is not None,
+                "model_warmup": warmup_status
+            }
+        )
+    
+    return ApiResponse(
+        success=True,
+        message=get_success_message("service_ready", language),
+        data={
+            "ready": True,
+            "model_warmup": warmup_status,
+            "language": language
+        }
+    )
+
+
 @router.get("/system/status", response_model=ApiResponse)
 async def get_system_status(language: str = Query("zh-CN", description="语言代码")):
     """获取系统详细状态"""
     try:
         system_status = agent_service.get_system_status()
+        system_status["batches"] = batch_manager.get_status()
         
         return ApiResponse(
             success=True,
@@ -69,6 +101,8 @@ async def get_system_status(language: str = Query("zh-CN", description="语言
             data=system_status
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取系统状态失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -77,11 +111,15 @@ async def get_system_status(language: str = Query("zh-CN", description="语言
 @router.get("/tasks/{task_id}/status", response_model=ApiResponse)
 async def get_task_status(
     task_id: str, 
-    language: str = Query("zh-CN", description="语言代码")
+    language: str = Query("zh-CN", description="语言代码"),
+    wait: float = Query(0, ge=0, le=60, description="任务未结束时最多等待的秒数，任务结束后立即返回（0表示不等待）")
 ):
     """获取任务状态"""
     try:
-        task_result = agent_service.get_task_status(task_id)
+        if wait > 0:
+            task_result = await agent_service.wait_task(task_id, timeout=wait)
+        else:
+            task_result = agent_service.get_task_status(task_id)
         
         if task_result is None:
             raise HTTPException(
@@ -99,7 +137,8 @@ async def get_task_status(
                 "error": task_result.error,
                 "started_at": task_result.started_at.isoformat() if task_result.started_at else None,
                 "completed_at": task_result.completed_at.isoformat() if task_result.completed_at else None,
-                "execution_time": task_result.execution_time
+                "execution_time": task_result.execution_time,
+                "stats": task_result.stats
             }
         )
         
@@ -110,6 +149,42 @@ async def get_task_status(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/tasks", response_model=ApiResponse)
+async def list_user_tasks(
+    user_id: str = Query(..., description="用户ID"),
+    limit: int = Query(50, ge=1, le=200, description="最多返回的任务数"),
+    language: str = Query("zh-CN", description="语言代码")
+):
+    """列出用户最近提交的任务（不含结果内容，结果通过任务状态接口获取）"""
+    try:
+        tasks = agent_service.list_user_tasks(user_id, limit)
+        
+        return ApiResponse(
+            success=True,
+            message=get_success_message("task_status_success", language),
+            data={
+                "user_id": user_id,
+                "tasks": [
+                    {
+                        "task_id": task.task_id,
+                        "status": task.status.value,
+                        "error": task.error,
+                        "started_at": task.started_at.isoformat() if task.started_at else None,
+                        "completed_at": task.completed_at.isoformat() if task.completed_at else None,
+                        "execution_time": task.execution_time
+                    }
+                    for task in tasks
+                ]
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"列出用户任务失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.delete("/tasks/{task_id}", response_model=ApiResponse)
 async def cancel_task(
     task_id: str,
@@ -174,6 +249,8 @@ async def cleanup_system(
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"提交系统清理任务失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -198,6 +275,8 @@ async def cleanup_system_sync(
             data={"cleaned_hours": max_age_hours}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"系统清理失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -207,7 +286,11 @@ async def cleanup_system_sync(
 async def get_thread_pools_status(language: str = Query("zh-CN", description="语言代码")):
     """获取线程池详细状态"""
     try:
-        status = agent_service.get_system_status()
+        # 只读取两个线程池的状态，不收集后端、缓存等其他统计
+        status = {
+            "agent_pool": agent_service.agent_thread_pool.get_system_status(),
+            "system_pool": agent_service.system_thread_pool.get_system_status()
+        }
         
         # 分别展示两个线程池的状态
         return ApiResponse(
@@ -221,7 +304,12 @@ async def get_thread_pools_status(language: str = Query("zh-CN", description="
                     "queue_size": status["agent_pool"]["queue_size"],
                     "tasks_completed": status["agent_pool"]["tasks_completed"],
                     "tasks_failed": status["agent_pool"]["tasks_failed"],
-                    "tasks_pending": status["agent_pool"]["tasks_pending"]
+                    "tasks_pending": status["agent_pool"]["tasks_pending"],
+                    "submitted_per_minute": status["agent_pool"]["submitted_per_minute"],
+                    "finished_per_minute": status["agent_pool"]["finished_per_minute"],
+                    "max_running_per_user": status["agent_pool"]["max_running_per_user"],
+                    "user_queues": status["agent_pool"]["user_queues"],
+                    "admission": status["agent_pool"]["admission"]
                 },
                 "system_pool": {
                     "pool_name": "系统线程池", 
@@ -230,7 +318,12 @@ async def get_thread_pools_status(language: str = Query("zh-CN", description="
                     "queue_size": status["system_pool"]["queue_size"],
                     "tasks_completed": status["system_pool"]["tasks_completed"],
                     "tasks_failed": status["system_pool"]["tasks_failed"],
-                    "tasks_pending": status["system_pool"]["tasks_pending"]
+                    "tasks_pending": status["system_pool"]["tasks_pending"],
+                    "submitted_per_minute": status["system_pool"]["submitted_per_minute"],
+                    "finished_per_minute": status["system_pool"]["finished_per_minute"],
+                    "max_running_per_user": status["system_pool"]["max_running_per_user"],
+                    "user_queues": status["system_pool"]["user_queues"],
+                    "admission": status["system_pool"]["admission"]
                 },
                 "system_info": {
                     "total_tasks_completed": status["agent_pool"]["tasks_completed"] + status["system_pool"]["tasks_completed"],
@@ -241,6 +334,8 @@ async def get_thread_pools_status(language: str = Query("zh-CN", description="
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取线程池状态失败: {e}")
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""
+批量任务相关路由（批次进度查询、流式结果与取消）
+"""
+
+from typing import Literal
+
+from fastapi import APIRouter, HTTPException, Query
+
+from ..models import ApiResponse
+from ..batches import batch_manager, batch_stream_response, TaskBatch
+from ..config import logger
+from ..i18n import get_error_message, get_success_message
+
+router = APIRouter(prefix="/batches", tags=["batches"])
+
+
+def _get_batch(batch_id: str, language: str) -> TaskBatch:
+    batch = batch_manager.get(batch_id)
+    if batch is None:
+        # 多进程部署时批次只保存在创建它的工作进程中
+        worker_id = batch_manager.owner_worker(batch_id)
+        if worker_id is not None:
+            raise HTTPException(
+                status_code=409,
+                detail=get_error_message("batch_on_other_worker", language, f"{batch_id} @ {worker_id}")
+            )
+        raise HTTPException(
+            status_code=404,
+            detail=get_error_message("batch_not_found", language, batch_id)
+        )
+    return batch
+
+
+@router.get("/{batch_id}", response_model=ApiResponse)
+async def get_batch(
+    batch_id: str,
+    language: str = Query("zh-CN", description="语言代码"),
+    include_items: bool = Query(True, description="是否返回每个条目的状态和结果")
+):
+    """获取批次的聚合进度和条目结果"""
+    try:
+        batch = _get_batch(batch_id, language)
+
+        return ApiResponse(
+            success=True,
+            message=get_success_message("batch_status_success", language),
+            data=batch.to_dict(include_items=include_items)
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"获取批次状态失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/{batch_id}/stream")
+async def stream_batch(
+    batch_id: str,
+    format: Literal["ndjson", "sse"] = Query("ndjson", description="流格式"),
+    language: str = Query("zh-CN", description="语言代码")
+):
+    """按结束顺序推送批次的条目结果，已结束的条目先补发，全部结束后发送批次结束事件并关闭"""
+    return batch_stream_response(_get_batch(batch_id, language), format)
+
+
+@router.delete("/{batch_id}", response_model=ApiResponse)
+async def cancel_batch(
+    batch_id: str,
+    language: str = Query("zh-CN", description="语言代码")
+):
+    """取消批次：未提交的条目不再执行，已提交的任务一并取消"""
+    try:
+        _get_batch(batch_id, language)
+
+        if not batch_manager.cancel(batch_id):
+            raise HTTPException(
+                status_code=400,
+                detail=get_error_message("batch_cancel_failed", language, batch_id)
+            )
+
+        return ApiResponse(
+            success=True,
+            message=get_success_message("batch_cancel_success", language),
+            data={"batch_id": batch_id}
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"取消批次失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
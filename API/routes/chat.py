@@ -4,14 +4,16 @@
 
 import asyncio
 from datetime import datetime
+from typing import Literal, Optional
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Header
 from sse_starlette.sse import EventSourceResponse
 
 from ..models import ApiResponse, ChatRequest
-from ..services import agent_service
+from ..services import agent_service, stream_service, generation_stats, task_handler
 from ..sse import SSEMessage, sse_manager
-from ..config import logger
+from ..batches import batch_manager, batch_stream_response, TaskBatch
+from ..config import logger, BATCH_CONFIG
 from ..i18n import get_message, get_error_message, get_success_message
 
 router = APIRouter(prefix="/chat", tags=["chat"])
@@ -31,27 +33,35 @@ async def chat(request: ChatRequest):
             data={"response": response}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"对话失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@task_handler("chat")
+def chat_task(payload: dict) -> dict:
+    """在智能体工作线程中执行的聊天任务（payload 为请求体，服务重启后可恢复）"""
+    agent = agent_service.check_ready()
+    response = agent.chat(payload["message"], payload["language"])
+    return {"response": response}
+
+
 @router.post("/async", response_model=ApiResponse)
-async def chat_async(request: ChatRequest):
+async def chat_async(request: ChatRequest,
+                     deadline: Optional[float] = Header(None, alias="X-Task-Deadline", description="任务最晚在多少秒内开始执行")):
     """异步对话聊天（智能体线程池）"""
     try:
-        agent = agent_service.check_ready()
-        
-        def chat_task():
-            """在智能体工作线程中执行的聊天任务"""
-            response = agent.chat(request.message, request.language)
-            return {"response": response}
+        agent_service.check_ready()
         
         # 提交到智能体专用线程池
         task_id = agent_service.submit_agent_task(
             task_type="chat",
             user_id=request.user_id,
             task_func=chat_task,
+            payload=request.dict(),
+            deadline=deadline,
             priority=1  # 聊天任务最高优先级
         )
         
@@ -66,6 +76,8 @@ async def chat_async(request: ChatRequest):
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"提交聊天任务失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -78,26 +90,30 @@ async def chat_stream(request: ChatRequest):
         agent = agent_service.check_ready()
         
         async def sse_chat_stream():
+            from ..i18n import Language
+            try:
+                lang = Language(request.language)
+            except ValueError:
+                lang = Language.ZH_CN
+            stream = None
+            chunk_count = 0
+            generating = True
+            
             try:
                 connection_id = f"{request.user_id}_chat_{datetime.now().timestamp()}"
                 sse_manager.add_connection(connection_id, request.user_id)
                 
                 # 发送开始状态
-                from ..i18n import Language
-                try:
-                    lang = Language(request.language)
-                except ValueError:
-                    lang = Language.ZH_CN
                 
                 start_message = get_message("processing", lang)
                 action_message = get_message("chat", request.language)
                 yield SSEMessage.status("started", f"{start_message} {action_message}...")
                 
                 response_content = ""
-                chunk_count = 0
                 
-                # 直接传递enable_thinking参数给智能体，不修改全局状态
-                for chunk in agent.chat_stream(request.message, request.language, enable_thinking=request.enable_thinking):
+                # 直接传递enable_thinking参数给智能体，不修改全局状态；异步读取不阻塞事件循环
+                stream = agent.chat_astream(request.message, request.language, enable_thinking=request.enable_thinking, user_id=request.user_id)
+                async for chunk in stream:
                     if chunk:
                         response_content += chunk
                         chunk_count += 1
@@ -115,31 +131,43 @@ async def chat_stream(request: ChatRequest):
                         
                         # 更新心跳
                         sse_manager.update_heartbeat(connection_id)
-                        await asyncio.sleep(0.01)
+                generating = False
+                
+                stats = getattr(stream, "stats", None)
+                generation_stats.record("/chat/stream", lang, stats)
                 
                 # 发送完成状态
                 yield SSEMessage.complete({
                     "response": response_content,
                     "action": get_message("chat", request.language),
                     "total_chunks": chunk_count,
-                    "total_length": len(response_content)
+                    "total_length": len(response_content),
+                    "stats": stats.to_dict() if stats is not None else None
                 })
                 
+            except (asyncio.CancelledError, GeneratorExit):
+                # 客户端断开连接：关闭流，上游请求随之中断
+                if generating and stream is not None:
+                    await stream_service.abandon_stream(stream, "/chat/stream", lang, chunk_count)
+                raise
             except Exception as e:
                 logger.error(f"对话过程中出错: {e}")
-                yield SSEMessage.error(get_error_message("chat_failed", request.language, str(e)))
+                yield SSEMessage.error(get_error_message("chat_failed", request.language, str(e)), getattr(e, "code", None))
             finally:
                 sse_manager.remove_connection(connection_id)
         
         return EventSourceResponse(sse_chat_stream())
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"流式对话失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/stream/async")
-async def chat_stream_async(request: ChatRequest):
+async def chat_stream_async(request: ChatRequest,
+                            deadline: Optional[float] = Header(None, alias="X-Task-Deadline", description="任务最晚在多少秒内开始执行")):
     """智能流式对话聊天（SSE）- 空闲时直接执行，忙碌时使用线程池"""
     try:
         agent = agent_service.check_ready()
@@ -156,10 +184,16 @@ async def chat_stream_async(request: ChatRequest):
             target_language = Language.ZH_CN
             logger.warning(f"用户 {request.user_id} 使用了无效语言 '{request.language}'，已切换到默认语言: {target_language.value}")
         
-        def stream_chat_func():
+        def stream_chat_func(cancel_token=None):
             """流式聊天函数"""
-            # 返回流式聊天生成器，使用验证后的语言
-            return agent.chat_stream(request.message, target_language.value, enable_thinking=request.enable_thinking)
+            # 返回流式聊天生成器，使用验证后的语言；客户端断开时 cancel_token 被取消
+            return agent.chat_stream(request.message, target_language.value, enable_thinking=request.enable_thinking, user_id=request.user_id,
+                                     cancel_token=cancel_token)
+        
+        def stream_chat_afunc():
+            """线程池空闲时直接在事件循环中读取的异步生成器"""
+            return agent.chat_astream(request.message, target_language.value, enable_thinking=request.enable_thinking,
+                                      user_id=request.user_id)
         
         # 使用智能路由进行流式聊天
         async def sse_smart_stream():
@@ -167,12 +201,17 @@ async def chat_stream_async(request: ChatRequest):
                 generator_func=stream_chat_func,
                 user_id=request.user_id,
                 action=get_message("chat", target_language),  # 使用目标语言获取消息
-                language=target_language  # 传递语言参数给SSE处理
+                language=target_language,  # 传递语言参数给SSE处理
+                endpoint="/chat/stream/async",
+                deadline=deadline,
+                async_generator_func=stream_chat_afunc
             ):
                 yield message
         
         return EventSourceResponse(sse_smart_stream())
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"智能流式聊天任务失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -182,22 +221,24 @@ async def chat_stream_async(request: ChatRequest):
 async def batch_chat(
     messages: list[str],
     user_id: str,
-    language: str = Query("zh-CN", description="语言代码")
+    language: str = Query("zh-CN", description="语言代码"),
+    stream: Optional[Literal["ndjson", "sse"]] = Query(None, description="以NDJSON或SSE按结束顺序返回每个条目"),
+    max_concurrency: Optional[int] = Query(None, ge=1, description="本批同时提交到线程池的任务数")
 ):
-    """批量对话（智能体线程池）"""
+    """批量对话（智能体线程池），批次和流式返回同 /batch/generate"""
     try:
         agent = agent_service.check_ready()
         
-        if len(messages) > 5:  # 限制批量聊天数量
+        if len(messages) > BATCH_CONFIG["max_chat_items"]:  # 限制批量聊天数量
             raise HTTPException(
                 status_code=400,
-                detail=get_error_message("batch_chat_too_large", language, str(len(messages)))
+                detail=get_error_message("batch_chat_too_large", language, f"{len(messages)} / {BATCH_CONFIG['max_chat_items']}")
             )
         
-        task_ids = []
+        items = []
         
         for i, message in enumerate(messages):
-            def chat_task(msg=message, index=i):
+            def run_item(msg=message, index=i):
                 """批量聊天任务"""
                 response = agent.chat(msg, language)
                 return {
@@ -206,26 +247,32 @@ async def batch_chat(
                     "message_index": index
                 }
             
-            # 提交任务到智能体线程池
-            task_id = agent_service.submit_agent_task(
-                task_type="batch_chat",
-                user_id=user_id,
-                task_func=chat_task,
-                priority=2  # 批量聊天中等优先级
-            )
-            task_ids.append(task_id)
+            items.append((user_id, run_item))
+        
+        batch = batch_manager.submit(TaskBatch(
+            batch_type="batch_chat",
+            user_id=user_id,
+            items=items,
+            priority=2,  # 批量聊天中等优先级
+            max_concurrency=max_concurrency
+        ))
+        
+        if stream is not None:
+            return batch_stream_response(batch, stream)
         
         return ApiResponse(
             success=True,
             message=get_success_message("batch_tasks_submitted", language),
             data={
-                "task_ids": task_ids,
-                "total_tasks": len(task_ids),
+                **batch.to_dict(),
+                "total_tasks": len(items),
                 "message": get_message("batch_chat_started", language),
                 "pool": "agent"  # 标明使用的线程池
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"批量对话任务提交失败: {e}")
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
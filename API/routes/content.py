@@ -2,15 +2,18 @@
 内容生成相关路由
 """
 
-from fastapi import APIRouter, HTTPException, Query
+from typing import Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Query, Header
 from fastapi.responses import StreamingResponse
 from sse_starlette.sse import EventSourceResponse
 
 from Agent.xiaohongshu_agent import ContentRequest
 
 from ..models import ApiResponse, ContentGenerationRequest, ContentOptimizationRequest
-from ..services import agent_service, session_service, stream_service
-from ..config import logger
+from ..services import agent_service, session_service, stream_service, generation_stats, task_handler
+from ..batches import batch_manager, batch_stream_response, TaskBatch
+from ..config import logger, BATCH_CONFIG
 from ..i18n import get_message, get_error_message, get_success_message
 
 router = APIRouter(tags=["content"])
@@ -33,13 +36,14 @@ async def generate_content(request: ContentGenerationRequest):
             language=request.language
         )
         
-        result = agent.generate_complete_post(content_req)
+        result = agent.generate_complete_post(content_req, use_cache=request.use_cache)
         
         if result["success"]:
+            generation_stats.record("/generate", request.language, result.get("stats"))
+            
             # 保存到用户会话
-            session = session_service.get_user_session(request.user_id)
-            session["current_request"] = request.dict()
             session_service.add_content_to_history(request.user_id, result["content"], get_message("initial_generation", request.language))
+            session = session_service.update_user_session(request.user_id, current_request=request.dict())
             
             return ApiResponse(
                 success=True,
@@ -47,61 +51,74 @@ async def generate_content(request: ContentGenerationRequest):
                 data={
                     "content": result["content"],
                     "version": session["current_version_index"] + 1,
-                    "history_count": len(session["content_history"])
+                    "history_count": len(session["content_history"]),
+                    "stats": result.get("stats")
                 }
             )
         else:
             raise HTTPException(status_code=500, detail=result.get("error", get_error_message("generation_failed", request.language)))
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"生成文案失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@task_handler("generate")
+def generate_task(payload: dict) -> dict:
+    """在智能体工作线程中执行的生成任务（payload 为请求体，服务重启后可恢复）"""
+    agent = agent_service.check_ready()
+    request = ContentGenerationRequest(**payload)
+    
+    content_req = ContentRequest(
+        category=agent_service.parse_content_category(request.category),
+        topic=request.topic,
+        tone=request.tone,
+        length=request.length,
+        keywords=request.keywords or [],
+        target_audience=request.target_audience,
+        special_requirements=request.special_requirements,
+        language=request.language
+    )
+    
+    result = agent.generate_complete_post(content_req, use_cache=request.use_cache)
+    
+    if result["success"]:
+        generation_stats.record("/generate/async", request.language, result.get("stats"))
+        
+        # 保存到用户会话（线程安全）
+        session_service.add_content_to_history(
+            request.user_id, 
+            result["content"], 
+            get_message("initial_generation", request.language)
+        )
+        session = session_service.update_user_session(request.user_id, current_request=payload)
+        
+        return {
+            "content": result["content"],
+            "version": session["current_version_index"] + 1,
+            "history_count": len(session["content_history"]),
+            "stats": result.get("stats")
+        }
+    else:
+        raise Exception(result.get("error", "生成失败"))
+
+
 @router.post("/generate/async", response_model=ApiResponse)
-async def generate_content_async(request: ContentGenerationRequest):
+async def generate_content_async(request: ContentGenerationRequest,
+                                 deadline: Optional[float] = Header(None, alias="X-Task-Deadline", description="任务最晚在多少秒内开始执行")):
     """异步生成小红书文案（智能体线程池）"""
     try:
-        agent = agent_service.check_ready()
-        
-        def generate_task():
-            """在智能体工作线程中执行的生成任务"""
-            content_req = ContentRequest(
-                category=agent_service.parse_content_category(request.category),
-                topic=request.topic,
-                tone=request.tone,
-                length=request.length,
-                keywords=request.keywords or [],
-                target_audience=request.target_audience,
-                special_requirements=request.special_requirements,
-                language=request.language
-            )
-            
-            result = agent.generate_complete_post(content_req)
-            
-            if result["success"]:
-                # 保存到用户会话（线程安全）
-                session = session_service.get_user_session(request.user_id)
-                session["current_request"] = request.dict()
-                session_service.add_content_to_history(
-                    request.user_id, 
-                    result["content"], 
-                    get_message("initial_generation", request.language)
-                )
-                
-                return {
-                    "content": result["content"],
-                    "version": session["current_version_index"] + 1,
-                    "history_count": len(session["content_history"])
-                }
-            else:
-                raise Exception(result.get("error", "生成失败"))
+        agent_service.check_ready()
         
         # 提交到智能体专用线程池
         task_id = agent_service.submit_agent_task(
             task_type="generate",
             user_id=request.user_id,
             task_func=generate_task,
+            payload=request.dict(),
+            deadline=deadline,
             priority=1  # 生成任务高优先级
         )
         
@@ -116,6 +133,8 @@ async def generate_content_async(request: ContentGenerationRequest):
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"提交生成任务失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -139,30 +158,33 @@ async def generate_content_stream(request: ContentGenerationRequest):
         )
         
         # 保存当前请求到会话
-        session = session_service.get_user_session(request.user_id)
-        session["current_request"] = request.dict()
+        session_service.update_user_session(request.user_id, current_request=request.dict())
         
         # 使用SSE包装器，直接传递thinking参数给智能体
         async def sse_generate_stream():
             # 直接传递enable_thinking参数，不修改全局状态
-            generator = agent.generate_complete_post_stream(content_req, enable_thinking=request.enable_thinking)
+            generator = agent.generate_complete_post_astream(content_req, enable_thinking=request.enable_thinking, user_id=request.user_id,
+                                                             coalesce=request.coalesce, use_cache=request.use_cache)
             from ..i18n import Language
             try:
                 lang = Language(request.language)
             except ValueError:
                 lang = Language.ZH_CN
-            async for message in stream_service.generate_with_sse(generator, request.user_id, get_message("initial_generation", request.language), lang):
+            async for message in stream_service.generate_with_sse(generator, request.user_id, get_message("initial_generation", request.language), lang, endpoint="/generate/stream"):
                 yield message
         
         return EventSourceResponse(sse_generate_stream())
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"流式生成失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/generate/stream/async")
-async def generate_content_stream_async(request: ContentGenerationRequest):
+async def generate_content_stream_async(request: ContentGenerationRequest,
+                                        deadline: Optional[float] = Header(None, alias="X-Task-Deadline", description="任务最晚在多少秒内开始执行")):
     """智能流式生成内容（SSE）- 空闲时直接执行，忙碌时使用线程池"""
     try:
         agent = agent_service.check_ready()
@@ -180,13 +202,11 @@ async def generate_content_stream_async(request: ContentGenerationRequest):
             logger.warning(f"用户 {request.user_id} 使用了无效语言 '{request.language}'，已切换到默认语言: {target_language.value}")
         
         # 保存当前请求到会话，并记录目标语言
-        session = session_service.get_user_session(request.user_id)
-        session["current_request"] = request.dict()
-        session["target_language"] = target_language.value
+        session_service.update_user_session(request.user_id, current_request=request.dict(),
+                                            target_language=target_language.value)
         
-        def stream_generator_func():
-            """流式生成器函数"""
-            content_req = ContentRequest(
+        def build_content_request():
+            return ContentRequest(
                 category=agent_service.parse_content_category(request.category),
                 topic=request.topic,
                 tone=request.tone,
@@ -196,9 +216,19 @@ async def generate_content_stream_async(request: ContentGenerationRequest):
                 special_requirements=request.special_requirements,
                 language=target_language.value  # 使用验证后的语言
             )
-            
+        
+        def stream_generator_func(cancel_token=None):
+            """流式生成器函数（线程池中执行，客户端断开时 cancel_token 被取消）"""
             # 返回流式生成器
-            return agent.generate_complete_post_stream(content_req, enable_thinking=request.enable_thinking)
+            return agent.generate_complete_post_stream(build_content_request(), enable_thinking=request.enable_thinking, user_id=request.user_id,
+                                                       coalesce=request.coalesce, use_cache=request.use_cache,
+                                                       cancel_token=cancel_token)
+        
+        def stream_generator_afunc():
+            """线程池空闲时直接在事件循环中读取的异步生成器"""
+            return agent.generate_complete_post_astream(build_content_request(), enable_thinking=request.enable_thinking,
+                                                        user_id=request.user_id, coalesce=request.coalesce,
+                                                        use_cache=request.use_cache)
         
         # 使用智能路由进行流式生成
         async def sse_smart_stream():
@@ -206,12 +236,17 @@ async def generate_content_stream_async(request: ContentGenerationRequest):
                 generator_func=stream_generator_func,
                 user_id=request.user_id,
                 action=get_message("initial_generation", target_language),  # 使用目标语言获取消息
-                language=target_language  # 传递语言参数给SSE处理
+                language=target_language,  # 传递语言参数给SSE处理
+                endpoint="/generate/stream/async",
+                deadline=deadline,
+                async_generator_func=stream_generator_afunc
             ):
                 yield message
         
         return EventSourceResponse(sse_smart_stream())
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"智能流式生成任务失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -223,62 +258,78 @@ async def optimize_content(request: ContentOptimizationRequest):
     try:
         agent = agent_service.check_ready()
         
-        result = agent.optimize_content(request.content, request.language)
+        result = agent.optimize_content(request.content, request.language, use_cache=request.use_cache)
         
         if result["success"]:
+            generation_stats.record("/optimize", request.language, result.get("stats"))
+            
             # 保存到历史
-            session_service.add_content_to_history(request.user_id, result["content"], get_message("intelligent_optimization", request.language))
+            session_service.add_content_to_history(request.user_id, result["optimized"], get_message("intelligent_optimization", request.language))
             session = session_service.get_user_session(request.user_id)
             
             return ApiResponse(
                 success=True,
                 message=get_success_message("content_optimization_success", request.language),
                 data={
-                    "content": result["content"],
+                    "content": result["optimized"],
                     "version": session["current_version_index"] + 1,
-                    "history_count": len(session["content_history"])
+                    "history_count": len(session["content_history"]),
+                    "stats": result.get("stats")
                 }
             )
         else:
             raise HTTPException(status_code=500, detail=result.get("error", get_error_message("optimization_failed", request.language)))
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"优化内容失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@task_handler("optimize")
+def optimize_task(payload: dict) -> dict:
+    """在智能体工作线程中执行的优化任务（payload 为请求体，服务重启后可恢复）"""
+    agent = agent_service.check_ready()
+    request = ContentOptimizationRequest(**payload)
+    
+    result = agent.optimize_content(request.content, request.language, use_cache=request.use_cache)
+    
+    if result["success"]:
+        generation_stats.record("/optimize/async", request.language, result.get("stats"))
+        
+        # 保存到历史（线程安全）
+        session_service.add_content_to_history(
+            request.user_id, 
+            result["optimized"], 
+            get_message("intelligent_optimization", request.language)
+        )
+        session = session_service.get_user_session(request.user_id)
+        
+        return {
+            "content": result["optimized"],
+            "version": session["current_version_index"] + 1,
+            "history_count": len(session["content_history"]),
+            "stats": result.get("stats")
+        }
+    else:
+        raise Exception(result.get("error", "优化失败"))
+
+
 @router.post("/optimize/async", response_model=ApiResponse)
-async def optimize_content_async(request: ContentOptimizationRequest):
+async def optimize_content_async(request: ContentOptimizationRequest,
+                                 deadline: Optional[float] = Header(None, alias="X-Task-Deadline", description="任务最晚在多少秒内开始执行")):
     """异步优化内容（智能体线程池）"""
     try:
-        agent = agent_service.check_ready()
-        
-        def optimize_task():
-            """在智能体工作线程中执行的优化任务"""
-            result = agent.optimize_content(request.content, request.language)
-            
-            if result["success"]:
-                # 保存到历史（线程安全）
-                session_service.add_content_to_history(
-                    request.user_id, 
-                    result["content"], 
-                    get_message("intelligent_optimization", request.language)
-                )
-                session = session_service.get_user_session(request.user_id)
-                
-                return {
-                    "content": result["content"],
-                    "version": session["current_version_index"] + 1,
-                    "history_count": len(session["content_history"])
-                }
-            else:
-                raise Exception(result.get("error", "优化失败"))
+        agent_service.check_ready()
         
         # 提交到智能体专用线程池
         task_id = agent_service.submit_agent_task(
             task_type="optimize",
             user_id=request.user_id,
             task_func=optimize_task,
+            payload=request.dict(),
+            deadline=deadline,
             priority=2  # 优化任务中等优先级
         )
         
@@ -293,6 +344,8 @@ async def optimize_content_async(request: ContentOptimizationRequest):
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"提交优化任务失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -307,24 +360,28 @@ async def optimize_content_stream(request: ContentOptimizationRequest):
         # 使用SSE包装器，直接传递thinking参数给智能体
         async def sse_optimize_stream():
             # 直接传递enable_thinking参数，不修改全局状态
-            generator = agent.optimize_content_stream(request.content, request.language, enable_thinking=request.enable_thinking)
+            generator = agent.optimize_content_astream(request.content, request.language, enable_thinking=request.enable_thinking, user_id=request.user_id,
+                                                       use_cache=request.use_cache)
             from ..i18n import Language
             try:
                 lang = Language(request.language)
             except ValueError:
                 lang = Language.ZH_CN
-            async for message in stream_service.generate_with_sse(generator, request.user_id, get_message("intelligent_optimization", request.language), lang):
+            async for message in stream_service.generate_with_sse(generator, request.user_id, get_message("intelligent_optimization", request.language), lang, endpoint="/optimize/stream"):
                 yield message
         
         return EventSourceResponse(sse_optimize_stream())
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"流式优化失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/optimize/stream/async")
-async def optimize_content_stream_async(request: ContentOptimizationRequest):
+async def optimize_content_stream_async(request: ContentOptimizationRequest,
+                                        deadline: Optional[float] = Header(None, alias="X-Task-Deadline", description="任务最晚在多少秒内开始执行")):
     """智能流式优化内容（SSE）- 空闲时直接执行，忙碌时使用线程池"""
     try:
         agent = agent_service.check_ready()
@@ -341,10 +398,16 @@ async def optimize_content_stream_async(request: ContentOptimizationRequest):
             target_language = Language.ZH_CN
             logger.warning(f"用户 {request.user_id} 使用了无效语言 '{request.language}'，已切换到默认语言: {target_language.value}")
         
-        def stream_optimizer_func():
+        def stream_optimizer_func(cancel_token=None):
             """流式优化器函数"""
-            # 返回流式优化生成器，使用验证后的语言
-            return agent.optimize_content_stream(request.content, target_language.value, enable_thinking=request.enable_thinking)
+            # 返回流式优化生成器，使用验证后的语言；客户端断开时 cancel_token 被取消
+            return agent.optimize_content_stream(request.content, target_language.value, enable_thinking=request.enable_thinking, user_id=request.user_id,
+                                                 use_cache=request.use_cache, cancel_token=cancel_token)
+        
+        def stream_optimizer_afunc():
+            """线程池空闲时直接在事件循环中读取的异步生成器"""
+            return agent.optimize_content_astream(request.content, target_language.value, enable_thinking=request.enable_thinking,
+                                                  user_id=request.user_id, use_cache=request.use_cache)
         
         # 使用智能路由进行流式优化
         async def sse_smart_stream():
@@ -352,12 +415,17 @@ async def optimize_content_stream_async(request: ContentOptimizationRequest):
                 generator_func=stream_optimizer_func,
                 user_id=request.user_id,
                 action=get_message("intelligent_optimization", target_language),  # 使用目标语言获取消息
-                language=target_language  # 传递语言参数给SSE处理
+                language=target_language,  # 传递语言参数给SSE处理
+                endpoint="/optimize/stream/async",
+                deadline=deadline,
+                async_generator_func=stream_optimizer_afunc
             ):
                 yield message
         
         return EventSourceResponse(sse_smart_stream())
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"智能流式优化任务失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -366,22 +434,28 @@ async def optimize_content_stream_async(request: ContentOptimizationRequest):
 @router.post("/batch/generate", response_model=ApiResponse)
 async def batch_generate_content(
     requests: list[ContentGenerationRequest],
-    language: str = Query("zh-CN", description="语言代码")
+    language: str = Query("zh-CN", description="语言代码"),
+    stream: Optional[Literal["ndjson", "sse"]] = Query(None, description="以NDJSON或SSE按结束顺序返回每个条目"),
+    max_concurrency: Optional[int] = Query(None, ge=1, description="本批同时提交到线程池的任务数")
 ):
-    """批量生成内容（智能体线程池）"""
+    """批量生成内容（智能体线程池）
+    
+    创建一个批次，条目按批次并发数陆续提交。不指定 stream 时返回批次信息，之后通过 /batches/{batch_id} 查询进度；
+    指定 stream 时在同一个响应中按结束顺序推送每个条目（带有 index），最后推送批次结束事件
+    """
     try:
         agent = agent_service.check_ready()
         
-        if len(requests) > 10:  # 限制批量请求数量
+        if len(requests) > BATCH_CONFIG["max_generate_items"]:  # 限制批量请求数量
             raise HTTPException(
                 status_code=400, 
-                detail=get_error_message("batch_too_large", language, str(len(requests)))
+                detail=get_error_message("batch_too_large", language, f"{len(requests)} / {BATCH_CONFIG['max_generate_items']}")
             )
         
-        task_ids = []
+        items = []
         
         for i, request in enumerate(requests):
-            def generate_task(req=request):
+            def generate_task(req=request, index=i):
                 """批量生成任务"""
                 content_req = ContentRequest(
                     category=agent_service.parse_content_category(req.category),
@@ -394,7 +468,7 @@ async def batch_generate_content(
                     language=req.language
                 )
                 
-                result = agent.generate_complete_post(content_req)
+                result = agent.generate_complete_post(content_req, use_cache=req.use_cache)
                 
                 if result["success"]:
                     # 保存到用户会话
@@ -402,37 +476,44 @@ async def batch_generate_content(
                     session_service.add_content_to_history(
                         req.user_id, 
                         result["content"], 
-                        f"{get_message('batch_generation', req.language)} {i+1}"
+                        f"{get_message('batch_generation', req.language)} {index+1}"
                     )
                     
                     return {
                         "content": result["content"],
-                        "request_index": i,
+                        "request_index": index,
                         "topic": req.topic
                     }
                 else:
                     raise Exception(result.get("error", "生成失败"))
             
-            # 提交任务到智能体线程池，批量任务使用较低优先级
-            task_id = agent_service.submit_agent_task(
-                task_type="batch_generate",
-                user_id=request.user_id,
-                task_func=generate_task,
-                priority=3
-            )
-            task_ids.append(task_id)
+            items.append((request.user_id, generate_task))
+        
+        # 批量任务使用较低优先级
+        batch = batch_manager.submit(TaskBatch(
+            batch_type="batch_generate",
+            user_id=requests[0].user_id if requests else "",
+            items=items,
+            priority=3,
+            max_concurrency=max_concurrency
+        ))
+        
+        if stream is not None:
+            return batch_stream_response(batch, stream)
         
         return ApiResponse(
             success=True,
             message=get_success_message("batch_tasks_submitted", language),
             data={
-                "task_ids": task_ids,
-                "total_tasks": len(task_ids),
+                **batch.to_dict(),
+                "total_tasks": len(items),
                 "message": get_message("batch_generation_started", language),
                 "pool": "agent"  # 标明使用的线程池
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"批量生成任务提交失败: {e}")
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
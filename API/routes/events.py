@@ -0,0 +1,152 @@
+"""
+任务状态推送相关路由（SSE订阅与webhook登记）
+"""
+
+import asyncio
+from datetime import datetime
+
+from fastapi import APIRouter, HTTPException, Query
+from sse_starlette.sse import EventSourceResponse
+
+from ..models import ApiResponse, WebhookRequest
+from ..services import agent_service, TaskStatus
+from ..sse import SSEMessage, sse_manager
+from ..task_events import task_events, task_event, TERMINAL_STATUSES
+from ..config import logger, SSE_CONFIG
+from ..i18n import get_error_message, get_success_message
+
+router = APIRouter(tags=["events"])
+
+
+def _status_message(event: dict) -> str:
+    return SSEMessage.format_message(data=event, event="task_status")
+
+
+@router.get("/tasks/{task_id}/events")
+async def task_event_stream(task_id: str, language: str = Query("zh-CN", description="语言代码")):
+    """订阅一个任务的状态变更（SSE）
+
+    先发送任务的当前状态，之后每次状态变更发送一条 task_status 事件，任务结束（附带结果）后关闭流。
+    多进程部署时任务在其他工作进程中执行也能收到结束事件
+    """
+    if agent_service.get_task_status(task_id) is None:
+        raise HTTPException(status_code=404, detail=get_error_message("task_not_found", language, task_id))
+
+    async def stream():
+        # 先订阅再读取当前状态，两者之间的状态变更不会丢失
+        subscription = task_events.subscribe(task_id=task_id)
+        # 本进程的状态变更通过订阅收到；结束通知通过 wait_task 等待，包括其他工作进程执行的任务
+        waiter = asyncio.ensure_future(agent_service.wait_task(task_id))
+
+        def on_finished(future):
+            if not future.cancelled() and future.exception() is None and future.result() is not None:
+                subscription.offer(task_event(None, None, future.result()))
+
+        waiter.add_done_callback(on_finished)
+        try:
+            current = agent_service.get_task_status(task_id)
+            if current is None:
+                yield SSEMessage.error(get_error_message("task_not_found", language, task_id))
+                return
+            yield _status_message(task_event(None, None, current))
+            if current.status.value in TERMINAL_STATUSES:
+                return
+
+            while True:
+                event = await subscription.get(timeout=SSE_CONFIG["heartbeat_interval"])
+                if event is None:
+                    yield SSEMessage.heartbeat()
+                    continue
+                yield _status_message(event)
+                if event["status"] in TERMINAL_STATUSES:
+                    return
+        finally:
+            waiter.cancel()
+            task_events.unsubscribe(subscription)
+
+    return EventSourceResponse(stream())
+
+
+@router.get("/tasks/events")
+async def user_task_event_stream(
+    user_id: str = Query(..., description="用户ID"),
+    language: str = Query("zh-CN", description="语言代码")
+):
+    """订阅一个用户所有任务的状态变更（SSE）
+
+    先发送一条 snapshot 事件列出用户未结束的任务，之后持续发送 task_status 事件直到客户端断开。
+    多进程部署时只包含处理该连接的工作进程执行的任务，单个任务请使用 /tasks/{task_id}/events
+    """
+    connection_id = f"{user_id}_events_{datetime.now().timestamp()}"
+
+    async def stream():
+        subscription = task_events.subscribe(user_id=user_id)
+        try:
+            sse_manager.add_connection(connection_id, user_id)
+            unfinished = [
+                {"task_id": task.task_id, "status": task.status.value}
+                for task in agent_service.list_user_tasks(user_id)
+                if task.status in (TaskStatus.PENDING, TaskStatus.RUNNING)
+            ]
+            yield SSEMessage.format_message(
+                data={"type": "snapshot", "user_id": user_id, "tasks": unfinished, "timestamp": datetime.now().isoformat()},
+                event="snapshot"
+            )
+
+            while True:
+                event = await subscription.get(timeout=SSE_CONFIG["heartbeat_interval"])
+                if event is None:
+                    yield SSEMessage.heartbeat()
+                else:
+                    yield _status_message(event)
+                sse_manager.update_heartbeat(connection_id)
+        finally:
+            if subscription.dropped:
+                logger.warning(f"用户 {user_id} 的任务事件订阅读取过慢，丢弃了 {subscription.dropped} 个事件")
+            task_events.unsubscribe(subscription)
+            sse_manager.remove_connection(connection_id)
+
+    return EventSourceResponse(stream())
+
+
+@router.post("/webhooks", response_model=ApiResponse)
+async def register_webhook(request: WebhookRequest):
+    """登记webhook：用户的任务结束时向该地址POST {"events": [...]}（成批发送，失败重试）"""
+    error = task_events.validate_webhook_url(request.url)
+    if error is not None:
+        raise HTTPException(status_code=400, detail=error)
+    task_events.add_webhook(request.user_id, request.url)
+    return ApiResponse(
+        success=True,
+        message=get_success_message("webhook_registered", request.language),
+        data={"user_id": request.user_id, "url": request.url}
+    )
+
+
+@router.get("/webhooks", response_model=ApiResponse)
+async def list_webhooks(
+    user_id: str = Query(..., description="用户ID"),
+    language: str = Query("zh-CN", description="语言代码")
+):
+    """列出用户登记的webhook"""
+    return ApiResponse(
+        success=True,
+        message=get_success_message("webhooks_retrieved", language),
+        data={"user_id": user_id, "urls": task_events.user_webhooks(user_id)}
+    )
+
+
+@router.delete("/webhooks", response_model=ApiResponse)
+async def remove_webhook(
+    user_id: str = Query(..., description="用户ID"),
+    url: str = Query(..., description="webhook地址"),
+    language: str = Query("zh-CN", description="语言代码")
+):
+    """注销用户的webhook"""
+    if not task_events.remove_webhook(user_id, url):
+        raise HTTPException(status_code=404, detail=get_error_message("webhook_not_found", language, url))
+    return ApiResponse(
+        success=True,
+        message=get_success_message("webhook_removed", language),
+        data={"user_id": user_id, "url": url}
+    )
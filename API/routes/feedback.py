@@ -11,7 +11,7 @@ from sse_starlette.sse import EventSourceResponse
 from Agent.xiaohongshu_agent import ContentRequest
 
 from ..models import ApiResponse, FeedbackRequest
-from ..services import agent_service, session_service
+from ..services import agent_service, session_service, stream_service, generation_stats
 from ..sse import SSEMessage, sse_manager
 from ..config import logger
 from ..i18n import get_message, get_error_message, get_success_message
@@ -58,7 +58,8 @@ async def handle_feedback(request: FeedbackRequest):
             content=request.content,
             user_feedback=request.feedback,
             content_request=original_req,
-            language=target_language.value
+            language=target_language.value,
+            user_id=request.user_id
         )
         
         if result["success"]:
@@ -75,7 +76,7 @@ async def handle_feedback(request: FeedbackRequest):
             # 如果有新生成的内容，保存到历史
             if result.get("content"):
                 session_service.add_content_to_history(request.user_id, result["content"], action)
-                session["feedback_round"] = session.get("feedback_round", 0) + 1
+                session = session_service.update_user_session(request.user_id, feedback_round=session.get("feedback_round", 0) + 1)
             
             return ApiResponse(
                 success=True,
@@ -118,6 +119,10 @@ async def handle_feedback_stream(request: FeedbackRequest):
         session = session_service.get_user_session(request.user_id)
         
         async def sse_feedback_stream():
+            stream_generator = None
+            chunk_count = 0
+            generating = True
+            
             try:
                 connection_id = f"{request.user_id}_feedback_{datetime.now().timestamp()}"
                 sse_manager.add_connection(connection_id, request.user_id)
@@ -144,11 +149,12 @@ async def handle_feedback_stream(request: FeedbackRequest):
                 feedback_message = get_message("feedback_processing", target_language)
                 yield SSEMessage.status("processing", f"{processing_message} {feedback_message}...")
                 
-                stream_generator = agent.intelligent_loop_stream(
+                stream_generator = agent.intelligent_loop_astream(
                     content=request.content,
                     user_feedback=request.feedback,
                     content_request=original_req,
-                    language=target_language.value
+                    language=target_language.value,
+                    user_id=request.user_id
                 )
                 
                 # 确定操作类型
@@ -163,10 +169,8 @@ async def handle_feedback_stream(request: FeedbackRequest):
                 else:
                     action = get_message("feedback_processing", target_language)
                 
-                chunk_count = 0
-                
-                # 处理流式响应
-                for chunk in stream_generator:
+                # 处理流式响应（异步读取，不阻塞事件循环）
+                async for chunk in stream_generator:
                     if chunk:
                         content += chunk
                         chunk_count += 1
@@ -185,21 +189,26 @@ async def handle_feedback_stream(request: FeedbackRequest):
                         
                         # 更新心跳
                         sse_manager.update_heartbeat(connection_id)
-                        await asyncio.sleep(0.01)
+                generating = False
+                
+                # 只有调用模型的反馈分支带有生成统计
+                stats = getattr(stream_generator, "stats", None)
+                generation_stats.record("/feedback/stream", target_language, stats)
                 
                 # 保存到历史
                 if content and request.feedback in ["不满意", "重新生成", "需要优化"]:
                     session_service.add_content_to_history(request.user_id, content, action)
-                    session["feedback_round"] = session.get("feedback_round", 0) + 1
+                    updated = session_service.update_user_session(request.user_id, feedback_round=session.get("feedback_round", 0) + 1)
                     
                     # 发送完成状态
                     yield SSEMessage.complete({
                         "action": action,
                         "content": content,
-                        "version": session['current_version_index'] + 1,
-                        "feedback_round": session['feedback_round'],
+                        "version": updated['current_version_index'] + 1,
+                        "feedback_round": updated['feedback_round'],
                         "total_chunks": chunk_count,
-                        "total_length": len(content)
+                        "total_length": len(content),
+                        "stats": stats.to_dict() if stats is not None else None
                     })
                 else:
                     # 对于询问或完成类的反馈，直接返回确认消息
@@ -213,9 +222,14 @@ async def handle_feedback_stream(request: FeedbackRequest):
                         "total_length": len(content) if content else 0
                     })
                 
+            except (asyncio.CancelledError, GeneratorExit):
+                # 客户端断开连接：关闭流，上游请求随之中断
+                if generating and stream_generator is not None:
+                    await stream_service.abandon_stream(stream_generator, "/feedback/stream", target_language, chunk_count)
+                raise
             except Exception as e:
                 logger.error(f"反馈处理过程中出错: {e}")
-                yield SSEMessage.error(f"反馈处理失败: {str(e)}")
+                yield SSEMessage.error(f"反馈处理失败: {str(e)}", getattr(e, "code", None))
             finally:
                 sse_manager.remove_connection(connection_id)
         
@@ -5,7 +5,7 @@
 from fastapi import APIRouter, HTTPException, Query
 
 from ..models import ApiResponse, VersionRestoreRequest
-from ..services import session_service
+from ..services import agent_service, session_service
 from ..config import logger
 from ..i18n import Language, get_message, get_error_message, get_success_message
 
@@ -40,9 +40,9 @@ async def restore_version(request: VersionRestoreRequest):
         session = session_service.get_user_session(request.user_id)
         
         if 0 <= request.version_index < len(session["content_history"]):
-            session["current_version_index"] = request.version_index
             restored_content = session["content_history"][request.version_index]["content"]
-            session["last_generated_content"] = restored_content
+            session_service.update_user_session(request.user_id, current_version_index=request.version_index,
+                                                last_generated_content=restored_content)
             
             return ApiResponse(
                 success=True,
@@ -66,6 +66,9 @@ async def clear_history(user_id: str, language: Language = Query(default=Languag
     """清空用户历史"""
     try:
         session_service.clear_user_session(user_id)
+        # 历史清空后不再从之前的上下文继续
+        if agent_service.agent is not None:
+            agent_service.agent.context_store.invalidate(user_id)
         
         return ApiResponse(
             success=True,
@@ -65,6 +65,6 @@ async def get_sse_status(user_id: str, language: Language = Query(default=Langua
             "user_id": user_id,
             "active_connections": len(connections),
             "connection_ids": connections,
-            "total_connections": len(sse_manager.connections)
+            "total_connections": sse_manager.connection_count()
         }
     ) 
\ No newline at end of file
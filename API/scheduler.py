@@ -0,0 +1,133 @@
+"""
+线程池任务的按用户公平调度
+任务按优先级分级，同一级别内每个用户一个子队列，用户之间按赤字轮转（DRR）分配执行机会，权重越大的用户每轮可以执行越多任务；
+任务等待越久有效优先级越高（老化），低优先级任务不会被持续到来的高优先级任务饿死；
+每个用户同时执行的任务数可以设置上限，达到上限的用户暂时跳过，不占用其他用户的执行机会
+"""
+
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional, Tuple
+
+
+class FairTaskScheduler:
+    """按用户公平调度的任务队列（非线程安全，由调用方加锁）
+
+    队列中的任务需要有 task_id、user_id 和 priority 属性（数字越小优先级越高）
+    """
+
+    def __init__(self, max_running_per_user: int = None, aging_interval: float = 30.0,
+                 user_weights: Dict[str, float] = None):
+        """
+        Args:
+            max_running_per_user: 每个用户同时执行的任务数上限，None表示不限制
+            aging_interval: 任务每等待这么多秒有效优先级提升一级，None或0表示不老化
+            user_weights: 用户权重（默认1），权重为2的用户每轮可以执行2个任务
+        """
+        self.max_running_per_user = max_running_per_user
+        self.aging_interval = aging_interval
+        self.user_weights = dict(user_weights or {})
+        # 优先级 -> 用户 -> [(入队时间, 任务)]；用户的顺序即轮转顺序，队首用户当前轮到
+        self._classes: Dict[int, "OrderedDict[str, deque]"] = {}
+        self._deficits: Dict[Tuple[int, str], float] = {}
+        self._depths: Dict[str, int] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _weight(self, user_id: str) -> float:
+        return self.user_weights.get(user_id, 1.0)
+
+    def push(self, task: Any):
+        """任务入队（排在该用户同优先级任务之后）"""
+        users = self._classes.setdefault(task.priority, OrderedDict())
+        users.setdefault(task.user_id, deque()).append((time.monotonic(), task))
+        self._depths[task.user_id] = self._depths.get(task.user_id, 0) + 1
+        self._size += 1
+
+    def _forget(self, priority: int, user_id: str):
+        # 用户在该优先级的子队列已空
+        users = self._classes[priority]
+        del users[user_id]
+        self._deficits.pop((priority, user_id), None)
+        if not users:
+            del self._classes[priority]
+
+    def _taken(self, user_id: str):
+        self._size -= 1
+        self._depths[user_id] -= 1
+        if not self._depths[user_id]:
+            del self._depths[user_id]
+
+    def remove(self, task: Any) -> bool:
+        """从队列中移除任务（取消排队中的任务），返回是否找到"""
+        queue = self._classes.get(task.priority, {}).get(task.user_id)
+        if not queue:
+            return False
+        for entry in queue:
+            if entry[1] is task:
+                queue.remove(entry)
+                if not queue:
+                    self._forget(task.priority, task.user_id)
+                self._taken(task.user_id)
+                return True
+        return False
+
+    def _effective_priority(self, priority: int, now: float) -> float:
+        if not self.aging_interval:
+            return priority
+        oldest = min(queue[0][0] for queue in self._classes[priority].values())
+        return priority - (now - oldest) / self.aging_interval
+
+    def pop(self, running_per_user: Dict[str, int]) -> Optional[Any]:
+        """
+        取出下一个要执行的任务
+
+        Args:
+            running_per_user: 每个用户正在执行的任务数，用于判断是否达到并发上限
+
+        Returns:
+            下一个任务；队列为空或有任务的用户都已达到并发上限时返回None
+        """
+        now = time.monotonic()
+        order = sorted(self._classes, key=lambda priority: (self._effective_priority(priority, now), priority))
+        for priority in order:
+            task = self._pop_class(priority, running_per_user)
+            if task is not None:
+                return task
+        return None
+
+    def _pop_class(self, priority: int, running_per_user: Dict[str, int]) -> Optional[Any]:
+        users = self._classes[priority]
+        cap = self.max_running_per_user
+        eligible = [user for user in users if cap is None or running_per_user.get(user, 0) < cap]
+        if not eligible:
+            return None
+
+        # 赤字轮转：轮到的用户获得与权重相同的配额，配额够一个任务时出队，用完后轮到下一个用户
+        while True:
+            for user_id in eligible:
+                key = (priority, user_id)
+                deficit = self._deficits.get(key, 0.0)
+                if deficit < 1:
+                    deficit += self._weight(user_id)
+                if deficit < 1:
+                    self._deficits[key] = deficit
+                    users.move_to_end(user_id)
+                    continue
+
+                queue = users[user_id]
+                _, task = queue.popleft()
+                self._taken(user_id)
+                if not queue:
+                    self._forget(priority, user_id)
+                else:
+                    self._deficits[key] = deficit - 1
+                    if deficit - 1 < 1:
+                        users.move_to_end(user_id)
+                return task
+
+    def depths(self) -> Dict[str, int]:
+        """每个用户排队中的任务数"""
+        return dict(self._depths)
@@ -4,19 +4,34 @@
 
 import asyncio
 import concurrent.futures
+import json
+import math
 import threading
-import queue
 import time
-from datetime import datetime
-from typing import Dict, AsyncGenerator, Callable, Any, Optional
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, AsyncGenerator, Callable, Any, Optional, List
 from dataclasses import dataclass
 from enum import Enum
 
 from fastapi import HTTPException
 
 from Agent.xiaohongshu_agent import XiaohongshuAgent, ContentRequest, ContentCategory
+from LLM.http_pool import close_shared_pool
+from LLM.backend_pool import get_shared_backend_pool
+from LLM.warmup import ModelWarmupManager
+from LLM.model_catalog import get_shared_catalog, close_shared_catalog
+from LLM.stats import GenerationStatsAggregator
+from LLM.response_cache import get_shared_response_cache
+from LLM.cancellation import CancellationToken, cancel_scope
+from LLM.exceptions import GenerationCancelled
 from .sse import SSEMessage, sse_manager
-from .config import logger, THREAD_CONFIG
+from .stream_channel import StreamChannel
+from .scheduler import FairTaskScheduler
+from .task_store import create_task_store
+from .task_events import task_events, task_event
+from .shared_state import SharedState, get_shared_state, close_shared_state
+from .config import logger, THREAD_CONFIG, SSE_CONFIG, SHARED_STATE_CONFIG
 from .i18n import Language, get_message
 
 
@@ -32,6 +47,9 @@ class TaskRequest:
     priority: int = 1  # 优先级，数字越小优先级越高
     created_at: datetime = None
     timeout: float = 300.0  # 任务超时时间（秒）
+    cancel_token: Optional[CancellationToken] = None  # 取消令牌，未提供时提交到线程池时自动创建
+    payload: Optional[Dict[str, Any]] = None  # 可恢复任务的参数（JSON），任务函数为 TASK_HANDLERS[task_type]
+    deadline: Optional[datetime] = None  # 最晚开始执行的时间，预计无法按时开始的任务被拒绝，到期仍在排队的任务被丢弃
     
     def __post_init__(self):
         if self.created_at is None:
@@ -58,12 +76,84 @@ class TaskResult:
     started_at: datetime = None
     completed_at: datetime = None
     execution_time: float = 0.0
+    stats: Optional[Dict[str, Any]] = None  # Ollama生成统计（任务结果中带有 stats 时提取）
+
+
+def _deadline(seconds: Optional[float]) -> Optional[datetime]:
+    """把相对的截止秒数转换为任务的截止时间"""
+    return datetime.now() + timedelta(seconds=seconds) if seconds is not None else None
+
+
+class TaskRejected(HTTPException):
+    """线程池拒绝新任务（队列已满、预计排队过久或无法在截止时间前开始），返回429并附带 Retry-After"""
+    
+    def __init__(self, detail: str, estimated_wait: float):
+        self.estimated_wait = estimated_wait
+        self.retry_after = max(1, math.ceil(estimated_wait))
+        super().__init__(
+            status_code=429,
+            detail=f"{detail}，预计等待 {estimated_wait:.1f} 秒，请稍后重试",
+            headers={"Retry-After": str(self.retry_after), "X-Estimated-Wait": f"{estimated_wait:.1f}"}
+        )
+
+
+class SlidingWindowCounter:
+    """最近 window 秒内的事件数（按秒分桶的环形数组，记录和读取都是常数时间，非线程安全）"""
+    
+    def __init__(self, window: int = 60, clock: Callable[[], float] = time.monotonic):
+        self.window = window
+        self._clock = clock
+        self._counts = [0] * window
+        self._seconds = [0] * window  # 每个桶对应的整秒，过期的桶在下次使用时清零
+    
+    def record(self, count: int = 1):
+        second = int(self._clock())
+        index = second % self.window
+        if self._seconds[index] != second:
+            self._seconds[index] = second
+            self._counts[index] = 0
+        self._counts[index] += count
+    
+    def total(self) -> int:
+        oldest = int(self._clock()) - self.window
+        return sum(count for count, second in zip(self._counts, self._seconds) if second > oldest)
+
+
+# 可恢复任务的处理函数：任务类型 -> 以 payload 为唯一参数的函数
+TASK_HANDLERS: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+
+
+def task_handler(task_type: str):
+    """注册可恢复任务的处理函数（装饰器），使用持久化存储时服务重启后按任务类型找回处理函数"""
+    def decorator(func: Callable[[Dict[str, Any]], Any]):
+        TASK_HANDLERS[task_type] = func
+        return func
+    return decorator
 
 
 class ThreadPoolManager:
-    """线程池管理器"""
+    """线程池管理器
     
-    def __init__(self, max_workers: int = 10, queue_size: int = 100, pool_name: str = "default"):
+    事件驱动调度：提交任务时有空闲工作线程就立即执行，否则进入按用户公平调度的队列（见 API/scheduler.py）；
+    任务结束时在工作线程中直接取出下一个任务，没有后台分发线程和定时唤醒。
+    每个任务有一个结束时完成的 Future，协程可以通过 wait_task 等待任务结束而不必轮询
+    """
+    
+    def __init__(self, max_workers: int = 10, queue_size: int = 100, pool_name: str = "default",
+                 max_running_per_user: int = None, aging_interval: float = 30.0, user_weights: Dict[str, float] = None,
+                 max_queue_wait: float = None, initial_exec_estimate: float = 30.0, exec_time_samples: int = 50):
+        """
+        Args:
+            max_workers: 最大工作线程数
+            queue_size: 排队任务数上限
+            pool_name: 线程池名称
+            max_running_per_user: 每个用户同时执行的任务数上限，None表示不限制
+            aging_interval: 排队任务每等待这么多秒有效优先级提升一级
+            user_weights: 用户调度权重（默认1）
+            max_queue_wait: 预计排队等待超过这么多秒时拒绝新任务，None表示只按队列长度限制
+            initial_exec_estimate: 还没有执行耗时样本时估算排队时间使用的单任务耗时（秒）
+            exec_time_samples: 按最近多少个任务的执行耗时估算排队时间
+        """
         self.max_workers = max_workers
         self.queue_size = queue_size
         self.pool_name = pool_name
@@ -71,113 +161,239 @@ class ThreadPoolManager:
             max_workers=max_workers,
             thread_name_prefix=f"{pool_name}_worker"
         )
-        self.task_queue = queue.PriorityQueue(maxsize=queue_size)
+        self.task_queue = FairTaskScheduler(max_running_per_user, aging_interval, user_weights)
+        self.queued_tasks: Dict[str, TaskRequest] = {}  # 仍在队列中等待的任务
         self.running_tasks: Dict[str, TaskRequest] = {}
-        self.completed_tasks: Dict[str, TaskResult] = {}
+        self.running_per_user: Dict[str, int] = {}
+        self.task_results = create_task_store(pool_name)  # 所有任务的状态和已结束任务的结果
         self.task_futures: Dict[str, concurrent.futures.Future] = {}
+        self.done_futures: Dict[str, concurrent.futures.Future] = {}  # 未结束任务的结束通知，结果为最终的 TaskResult
+        self.cancel_tokens: Dict[str, CancellationToken] = {}  # 未结束任务的取消令牌
+        self.task_users: Dict[str, str] = {}  # 未结束任务的用户，用于发布状态事件
+        self.on_event: Optional[Callable[[Dict[str, Any]], Any]] = None  # 任务状态变更时调用（如 TaskEventBus.publish）
+        # 准入控制：按最近的执行耗时和队列深度估算排队时间，预计等待过久时提前拒绝
+        self.max_queue_wait = max_queue_wait
+        self.initial_exec_estimate = initial_exec_estimate
+        self.exec_times: deque = deque(maxlen=exec_time_samples)
+        self._exec_time_sum = 0.0
+        self.admission_counts: Dict[str, int] = {"rejected_queue_full": 0, "rejected_wait": 0,
+                                                 "rejected_deadline": 0, "shed_deadline": 0, "shed_cancelled": 0}
+        # 状态计数在状态变更时（持有锁）累加，状态查询不必遍历任务记录
+        self.queued_per_priority: Dict[int, int] = {}
+        self.task_counts: Dict[str, int] = {"submitted": 0, **{status.value: 0 for status in TaskStatus
+                                                               if status not in (TaskStatus.PENDING, TaskStatus.RUNNING)}}
+        self.submit_rate = SlidingWindowCounter(60)
+        self.finish_rate = SlidingWindowCounter(60)
         self.lock = threading.RLock()
         self._shutdown = False
         
-        # 启动任务分发线程
-        self.dispatcher_thread = threading.Thread(
-            target=self._task_dispatcher, 
-            daemon=True,
-            name=f"{pool_name}_dispatcher"
-        )
-        self.dispatcher_thread.start()
-        
         logger.info(f"线程池管理器 [{pool_name}] 初始化完成，最大工作线程数: {max_workers}")
     
     def submit_task(self, task_request: TaskRequest) -> str:
-        """提交任务到线程池"""
+        """提交任务到线程池
+        
+        Raises:
+            TaskRejected: 队列已满、预计排队超过 max_queue_wait 或无法在任务的截止时间前开始（429）
+        """
         try:
-            # 检查队列是否已满
-            if self.task_queue.full():
-                raise HTTPException(
-                    status_code=429, 
-                    detail=f"线程池 [{self.pool_name}] 任务队列已满，请稍后重试"
-                )
-            
-            # 将任务加入优先级队列
-            self.task_queue.put((task_request.priority, time.time(), task_request))
-            
-            # 初始化任务状态
             with self.lock:
-                self.completed_tasks[task_request.task_id] = TaskResult(
-                    task_id=task_request.task_id,
-                    status=TaskStatus.PENDING
-                )
+                if self._shutdown:
+                    raise RuntimeError(f"线程池 [{self.pool_name}] 已关闭")
+                
+                # 准入控制：队列满时先丢弃已取消或已过截止时间的排队任务，仍然没有空位再拒绝
+                if len(self.queued_tasks) >= self.queue_size:
+                    self._shed_queued()
+                estimated_wait = self.estimate_wait(task_request.priority)
+                if len(self.queued_tasks) >= self.queue_size:
+                    self.admission_counts["rejected_queue_full"] += 1
+                    raise TaskRejected(f"线程池 [{self.pool_name}] 任务队列已满", estimated_wait)
+                if self.max_queue_wait is not None and estimated_wait > self.max_queue_wait:
+                    self.admission_counts["rejected_wait"] += 1
+                    raise TaskRejected(f"线程池 [{self.pool_name}] 繁忙，预计排队超过 {self.max_queue_wait} 秒", estimated_wait)
+                if task_request.deadline is not None and \
+                        datetime.now() + timedelta(seconds=estimated_wait) > task_request.deadline:
+                    self.admission_counts["rejected_deadline"] += 1
+                    raise TaskRejected(f"线程池 [{self.pool_name}] 无法在截止时间前开始执行任务", estimated_wait)
+                
+                # 初始化任务状态
+                pending = TaskResult(task_id=task_request.task_id, status=TaskStatus.PENDING)
+                self.task_results.put(pending, user_id=task_request.user_id, task_request=task_request)
+                self.task_users[task_request.task_id] = task_request.user_id
+                self._publish(pending)
+                self.done_futures[task_request.task_id] = concurrent.futures.Future()
+                # 每个任务都有取消令牌，执行中的任务也可以取消
+                if task_request.cancel_token is None:
+                    task_request.cancel_token = CancellationToken()
+                self.cancel_tokens[task_request.task_id] = task_request.cancel_token
+                
+                # 将任务加入优先级队列，有空闲工作线程时立即分发
+                self.task_counts["submitted"] += 1
+                self.submit_rate.record()
+                self._enqueue(task_request)
+                self._dispatch()
             
             logger.info(f"任务 {task_request.task_id} 已提交到线程池 [{self.pool_name}]")
             return task_request.task_id
             
+        except TaskRejected as e:
+            logger.warning(f"线程池 [{self.pool_name}] 拒绝任务 {task_request.task_id}: {e.detail}")
+            raise
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"提交任务到线程池 [{self.pool_name}] 失败: {e}")
             raise HTTPException(status_code=500, detail=f"提交任务失败: {str(e)}")
     
-    def _task_dispatcher(self):
-        """任务分发器（在独立线程中运行）"""
-        logger.info(f"线程池 [{self.pool_name}] 任务分发器启动")
+    def estimate_wait(self, priority: int = 1) -> float:
+        """估算优先级为 priority 的新任务要排队多少秒（调用方持有锁）
         
-        while not self._shutdown:
+        排在它前面的是优先级不低于它的排队任务；空闲工作线程先接走这些任务，
+        剩下的按最近任务的平均执行耗时、所有工作线程并行消化
+        """
+        ahead = sum(count for queued_priority, count in self.queued_per_priority.items() if queued_priority <= priority)
+        idle = self.max_workers - len(self.running_tasks)
+        if ahead < idle:
+            return 0.0
+        mean = self._exec_time_sum / len(self.exec_times) if self.exec_times else self.initial_exec_estimate
+        return (ahead - idle + 1) * mean / self.max_workers
+    
+    def _record_exec_time(self, execution_time: float):
+        """记录一个任务的执行耗时（调用方持有锁）"""
+        if len(self.exec_times) == self.exec_times.maxlen:
+            self._exec_time_sum -= self.exec_times[0]
+        self.exec_times.append(execution_time)
+        self._exec_time_sum += execution_time
+    
+    def _enqueue(self, task_request: TaskRequest):
+        """任务进入队列（调用方持有锁）"""
+        self.task_queue.push(task_request)
+        self.queued_tasks[task_request.task_id] = task_request
+        self.queued_per_priority[task_request.priority] = self.queued_per_priority.get(task_request.priority, 0) + 1
+    
+    def _dequeue(self, task_request: TaskRequest, popped: bool = False):
+        """任务离开队列（调用方持有锁），popped 表示已经从调度队列中取出"""
+        if not popped:
+            self.task_queue.remove(task_request)
+        del self.queued_tasks[task_request.task_id]
+        self.queued_per_priority[task_request.priority] -= 1
+        if not self.queued_per_priority[task_request.priority]:
+            del self.queued_per_priority[task_request.priority]
+    
+    def _shed_reason(self, task_request: TaskRequest) -> Optional[TaskResult]:
+        """排队任务不应再执行时返回它的最终结果：令牌已取消（如SSE客户端已离开）或已过截止时间"""
+        if task_request.cancel_token is not None and task_request.cancel_token.cancelled:
+            self.admission_counts["shed_cancelled"] += 1
+            return TaskResult(task_id=task_request.task_id, status=TaskStatus.CANCELLED,
+                              error=f"任务在排队时已取消: {task_request.cancel_token.reason}")
+        if task_request.deadline is not None and datetime.now() > task_request.deadline:
+            self.admission_counts["shed_deadline"] += 1
+            return TaskResult(task_id=task_request.task_id, status=TaskStatus.TIMEOUT,
+                              error="任务未能在截止时间前开始执行")
+        return None
+    
+    def _shed_queued(self):
+        """从队列中丢弃已取消或已过截止时间的任务（调用方持有锁）"""
+        for task_id, task_request in list(self.queued_tasks.items()):
+            task_result = self._shed_reason(task_request)
+            if task_result is not None:
+                self._dequeue(task_request)
+                self._finish_task(task_result)
+                logger.info(f"任务 {task_id} 已从线程池 [{self.pool_name}] 的队列中丢弃: {task_result.error}")
+    
+    def _publish(self, task_result: TaskResult):
+        """发布任务状态事件（调用方持有锁）"""
+        if self.on_event is not None:
+            self.on_event(task_event(self.pool_name, self.task_users.get(task_result.task_id), task_result))
+    
+    def _finish_task(self, task_result: TaskResult, persist: bool = True):
+        """记录任务的最终结果并通知等待者（调用方持有锁）
+        
+        persist 为 False 时只通知等待者，存储中保留任务原来的状态（关闭时留给重启后恢复的任务）
+        """
+        task_id = task_result.task_id
+        task_request = self.running_tasks.pop(task_id, None)
+        if task_request is not None:
+            self.running_per_user[task_request.user_id] -= 1
+            if not self.running_per_user[task_request.user_id]:
+                del self.running_per_user[task_request.user_id]
+        self.task_futures.pop(task_id, None)
+        self.cancel_tokens.pop(task_id, None)
+        if persist:
+            self.task_results.put(task_result)
+            self._publish(task_result)
+            self.task_counts[task_result.status.value] += 1
+            self.finish_rate.record()
+        self.task_users.pop(task_id, None)
+        done = self.done_futures.pop(task_id, None)
+        if done is not None:
+            done.set_result(task_result)
+    
+    def _dispatch(self):
+        """把队列中的任务分发到空闲工作线程（调用方持有锁）"""
+        while self.task_queue and len(self.running_tasks) < self.max_workers and not self._shutdown:
+            task_request = self.task_queue.pop(self.running_per_user)
+            if task_request is None:
+                break  # 有任务的用户都已达到并发上限
+            self._dequeue(task_request, popped=True)
+            
+            # 已取消（如SSE客户端已离开）或已过截止时间的任务不再占用工作线程
+            shed = self._shed_reason(task_request)
+            if shed is not None:
+                self._finish_task(shed)
+                logger.info(f"任务 {task_request.task_id} 已从线程池 [{self.pool_name}] 的队列中丢弃: {shed.error}")
+                continue
+            
+            # 检查任务是否超时
+            if (datetime.now() - task_request.created_at).total_seconds() > task_request.timeout:
+                self._finish_task(TaskResult(
+                    task_id=task_request.task_id,
+                    status=TaskStatus.TIMEOUT,
+                    error="任务在队列中等待超时"
+                ))
+                logger.warning(f"任务 {task_request.task_id} 在线程池 [{self.pool_name}] 中等待超时")
+                continue
+            
+            # 提交任务到线程池执行
             try:
-                # 从队列获取任务（阻塞式，超时1秒）
-                try:
-                    priority, timestamp, task_request = self.task_queue.get(timeout=1.0)
-                except queue.Empty:
-                    continue
-                
-                # 检查任务是否超时
-                if (datetime.now() - task_request.created_at).total_seconds() > task_request.timeout:
-                    with self.lock:
-                        self.completed_tasks[task_request.task_id] = TaskResult(
-                            task_id=task_request.task_id,
-                            status=TaskStatus.TIMEOUT,
-                            error="任务在队列中等待超时"
-                        )
-                    logger.warning(f"任务 {task_request.task_id} 在线程池 [{self.pool_name}] 中等待超时")
-                    continue
+                self.running_tasks[task_request.task_id] = task_request
+                self.running_per_user[task_request.user_id] = self.running_per_user.get(task_request.user_id, 0) + 1
+                self.task_futures[task_request.task_id] = self.executor.submit(self._execute_task, task_request)
+                logger.info(f"任务 {task_request.task_id} 已分发到 [{self.pool_name}] 工作线程")
                 
-                # 提交任务到线程池执行
-                try:
-                    future = self.executor.submit(self._execute_task, task_request)
-                    
-                    with self.lock:
-                        self.running_tasks[task_request.task_id] = task_request
-                        self.task_futures[task_request.task_id] = future
-                    
-                    logger.info(f"任务 {task_request.task_id} 已分发到 [{self.pool_name}] 工作线程")
-                    
-                except Exception as e:
-                    logger.error(f"分发任务 {task_request.task_id} 到线程池 [{self.pool_name}] 失败: {e}")
-                    with self.lock:
-                        self.completed_tasks[task_request.task_id] = TaskResult(
-                            task_id=task_request.task_id,
-                            status=TaskStatus.FAILED,
-                            error=f"分发失败: {str(e)}"
-                        )
-                        
             except Exception as e:
-                logger.error(f"线程池 [{self.pool_name}] 任务分发器异常: {e}")
-                time.sleep(1)  # 避免快速循环
-        
-        logger.info(f"线程池 [{self.pool_name}] 任务分发器已停止")
+                logger.error(f"分发任务 {task_request.task_id} 到线程池 [{self.pool_name}] 失败: {e}")
+                self._finish_task(TaskResult(
+                    task_id=task_request.task_id,
+                    status=TaskStatus.FAILED,
+                    error=f"分发失败: {str(e)}"
+                ))
     
     def _execute_task(self, task_request: TaskRequest) -> TaskResult:
-        """执行任务（在工作线程中运行）"""
+        """执行任务（在工作线程中运行）
+        
+        任务函数在 cancel_scope 中执行：其中未显式传入令牌的 OllamaClient 调用使用任务的取消令牌，
+        取消时上游请求立即中断，任务以 CANCELLED 结束并释放工作线程
+        """
         start_time = datetime.now()
+        cancel_token = task_request.cancel_token
         
         try:
             # 更新任务状态为运行中
             with self.lock:
-                if task_request.task_id in self.completed_tasks:
-                    self.completed_tasks[task_request.task_id].status = TaskStatus.RUNNING
-                    self.completed_tasks[task_request.task_id].started_at = start_time
+                current = self.task_results.get(task_request.task_id)
+                if current is not None:
+                    current.status = TaskStatus.RUNNING
+                    current.started_at = start_time
+                    self.task_results.put(current)
+                    self._publish(current)
             
             logger.info(f"开始执行任务 {task_request.task_id} (线程池: {self.pool_name})")
             
-            # 执行任务函数
-            result = task_request.task_func(*task_request.args, **task_request.kwargs)
+            # 执行任务函数；任务函数吞掉了取消异常、仍然返回时同样视为已取消
+            cancel_token.raise_if_cancelled()
+            with cancel_scope(cancel_token):
+                result = task_request.task_func(*task_request.args, **task_request.kwargs)
+            cancel_token.raise_if_cancelled()
             
             # 计算执行时间
             end_time = datetime.now()
@@ -190,11 +406,28 @@ class ThreadPoolManager:
                 result=result,
                 started_at=start_time,
                 completed_at=end_time,
-                execution_time=execution_time
+                execution_time=execution_time,
+                stats=result.get("stats") if isinstance(result, dict) else None
             )
             
             logger.info(f"任务 {task_request.task_id} 在线程池 [{self.pool_name}] 执行完成，耗时 {execution_time:.2f}秒")
             
+        except GenerationCancelled as e:
+            end_time = datetime.now()
+            execution_time = (end_time - start_time).total_seconds()
+            
+            # 通过取消令牌中止的任务
+            task_result = TaskResult(
+                task_id=task_request.task_id,
+                status=TaskStatus.CANCELLED,
+                error=str(e),
+                started_at=start_time,
+                completed_at=end_time,
+                execution_time=execution_time
+            )
+            
+            logger.info(f"任务 {task_request.task_id} 在线程池 [{self.pool_name}] 中已取消，耗时 {execution_time:.2f}秒")
+            
         except Exception as e:
             # 计算执行时间
             end_time = datetime.now()
@@ -213,45 +446,114 @@ class ThreadPoolManager:
             logger.error(f"任务 {task_request.task_id} 在线程池 [{self.pool_name}] 执行失败: {e}")
         
         finally:
-            # 清理运行中的任务记录
+            # 记录结果，并把空出的工作线程交给队列中的下一个任务
             with self.lock:
-                self.running_tasks.pop(task_request.task_id, None)
-                self.task_futures.pop(task_request.task_id, None)
-                self.completed_tasks[task_request.task_id] = task_result
+                self._record_exec_time(task_result.execution_time)
+                self._finish_task(task_result)
+                self._dispatch()
         
         return task_result
     
     def get_task_status(self, task_id: str) -> Optional[TaskResult]:
         """获取任务状态"""
         with self.lock:
-            return self.completed_tasks.get(task_id)
+            return self.task_results.get(task_id)
+    
+    async def wait_task(self, task_id: str, timeout: float = None) -> Optional[TaskResult]:
+        """
+        等待任务结束（不轮询，任务结束时立即返回）
+        
+        Args:
+            task_id: 任务ID
+            timeout: 最多等待的秒数，None表示一直等待
+        
+        Returns:
+            Optional[TaskResult]: 任务结束时为最终结果，等待超时时为当前状态，任务不存在时为None
+        """
+        with self.lock:
+            done = self.done_futures.get(task_id)
+            if done is None:
+                task_result = self.task_results.get(task_id)
+        if done is None:
+            shared = get_shared_state()
+            if shared is None or not shared.started or task_result is None or task_result.status not in (TaskStatus.PENDING, TaskStatus.RUNNING):
+                return task_result
+            return await self._wait_remote_task(shared, task_id, timeout)
+        try:
+            # shield 避免等待超时或被取消时连带取消任务的结束通知
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(done)), timeout)
+        except asyncio.TimeoutError:
+            return self.get_task_status(task_id)
+    
+    async def _wait_remote_task(self, shared: SharedState, task_id: str, timeout: float = None) -> Optional[TaskResult]:
+        """等待其他工作进程中的任务结束：登记后由任务所在进程在结束状态提交后通知"""
+        watch = shared.watch_task(task_id)
+        try:
+            # 登记后再查询一次，登记前已结束的任务不会再收到通知
+            task_result = self.get_task_status(task_id)
+            if task_result is not None and task_result.status in (TaskStatus.PENDING, TaskStatus.RUNNING):
+                await asyncio.wait_for(asyncio.wrap_future(watch), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            shared.unwatch_task(task_id, watch)
+        return self.get_task_status(task_id)
     
     def cancel_task(self, task_id: str) -> bool:
-        """取消任务"""
+        """取消任务
+        
+        仍在队列中的任务直接取消；已开始执行的任务通过取消令牌中止：上游请求立即断开，
+        任务在下一个片段之前结束，状态变为 CANCELLED
+        """
         with self.lock:
-            # 取消正在运行的任务
-            if task_id in self.task_futures:
-                future = self.task_futures[task_id]
-                if future.cancel():
-                    self.completed_tasks[task_id] = TaskResult(
-                        task_id=task_id,
-                        status=TaskStatus.CANCELLED,
-                        error="任务已被取消"
-                    )
-                    self.running_tasks.pop(task_id, None)
-                    self.task_futures.pop(task_id, None)
-                    logger.info(f"任务 {task_id} 在线程池 [{self.pool_name}] 中已取消")
-                    return True
-            
-            return False
+            cancel_token = self.cancel_tokens.get(task_id)
+            # 仍在排队（或已分发但工作线程尚未开始执行）的任务直接结束
+            task_request = self.queued_tasks.get(task_id)
+            cancelled = task_request is not None
+            if cancelled:
+                self._dequeue(task_request)
+            if not cancelled and task_id in self.task_futures:
+                cancelled = self.task_futures[task_id].cancel()
+            if cancelled:
+                self._finish_task(TaskResult(
+                    task_id=task_id,
+                    status=TaskStatus.CANCELLED,
+                    error="任务已被取消"
+                ))
+                self._dispatch()
+        
+        # 在锁外执行取消回调（会断开上游连接）
+        if cancel_token is not None:
+            cancel_token.cancel("任务已被取消")
+        if cancelled:
+            logger.info(f"任务 {task_id} 在线程池 [{self.pool_name}] 中已取消")
+            return True
+        if cancel_token is not None:
+            logger.info(f"任务 {task_id} 在线程池 [{self.pool_name}] 中已请求取消")
+            return True
+        return False
+    
+    def is_idle(self) -> bool:
+        """没有运行或等待的任务（常数时间）"""
+        with self.lock:
+            return not self.running_tasks and not self.queued_tasks
+    
+    def can_start_immediately(self) -> bool:
+        """新任务提交后能否立即执行：有空闲工作线程且没有排队任务（常数时间）"""
+        with self.lock:
+            return len(self.running_tasks) < self.max_workers and not self.queued_tasks
     
     def get_system_status(self) -> Dict[str, Any]:
-        """获取线程池状态"""
+        """获取线程池状态
+        
+        任务数为本进程启动以来的累计值，速率为最近60秒内的次数；都由状态变更时维护的计数得到，不遍历任务记录
+        """
         with self.lock:
             running_tasks = len(self.running_tasks)
-            pending_tasks = self.task_queue.qsize()
-            completed_tasks = len([t for t in self.completed_tasks.values() if t.status == TaskStatus.COMPLETED])
-            failed_tasks = len([t for t in self.completed_tasks.values() if t.status == TaskStatus.FAILED])
+            pending_tasks = len(self.queued_tasks)
+            queued = self.task_queue.depths()
+            completed_tasks = self.task_counts[TaskStatus.COMPLETED.value]
+            failed_tasks = self.task_counts[TaskStatus.FAILED.value]
             
             return {
                 "max_workers": self.max_workers,
@@ -263,35 +565,85 @@ class ThreadPoolManager:
                 "failed_tasks": failed_tasks,
                 "tasks_completed": completed_tasks,
                 "tasks_failed": failed_tasks,
-                "tasks_pending": pending_tasks
+                "tasks_pending": pending_tasks,
+                "task_counts": dict(self.task_counts),
+                "submitted_per_minute": self.submit_rate.total(),
+                "finished_per_minute": self.finish_rate.total(),
+                "result_store": self.task_results.get_status(),
+                "admission": {
+                    "estimated_wait": round(self.estimate_wait(), 2),
+                    "max_queue_wait": self.max_queue_wait,
+                    "avg_execution_time": round(self._exec_time_sum / len(self.exec_times), 3) if self.exec_times else None,
+                    **self.admission_counts
+                },
+                "max_running_per_user": self.task_queue.max_running_per_user,
+                "user_queues": {
+                    user_id: {"queued": queued.get(user_id, 0), "running": self.running_per_user.get(user_id, 0)}
+                    for user_id in sorted(set(queued) | set(self.running_per_user))
+                }
             }
     
+    def list_user_tasks(self, user_id: str, limit: int = 50) -> List[TaskResult]:
+        """列出用户最近提交的任务（新任务在前，不含结果内容）"""
+        return self.task_results.list_user_tasks(user_id, limit)
+    
     def cleanup_old_tasks(self, max_age_hours: int = 24):
-        """清理旧任务"""
-        cutoff_time = datetime.now() - asyncio.timedelta(hours=max_age_hours)
+        """清理结束时间超过 max_age_hours 小时的任务结果"""
+        removed = self.task_results.cleanup(max_age_hours * 3600)
+        logger.info(f"线程池 [{self.pool_name}] 清理了 {removed} 个旧任务")
+    
+    def recover_tasks(self) -> Dict[str, int]:
+        """重新排队上次运行时未结束的任务（持久化存储）
         
-        with self.lock:
-            old_task_ids = [
-                task_id for task_id, result in self.completed_tasks.items()
-                if result.completed_at and result.completed_at < cutoff_time
-            ]
-            
-            for task_id in old_task_ids:
-                del self.completed_tasks[task_id]
-            
-            logger.info(f"线程池 [{self.pool_name}] 清理了 {len(old_task_ids)} 个旧任务")
+        有 payload 且任务类型已注册处理函数的任务以原任务ID重新提交，其余标记为失败
+        
+        Returns:
+            Dict[str, int]: {"recovered": 重新排队的任务数, "failed": 无法恢复的任务数}
+        """
+        recovered = failed = 0
+        for row in self.task_results.load_unfinished():
+            handler = TASK_HANDLERS.get(row["task_type"])
+            error = "服务重启，任务未完成且无法恢复"
+            if handler is not None and row["payload"] is not None:
+                try:
+                    self.submit_task(TaskRequest(
+                        task_id=row["task_id"],
+                        user_id=row["user_id"],
+                        task_type=row["task_type"],
+                        task_func=handler,
+                        args=(row["payload"],),
+                        kwargs={},
+                        priority=row["priority"],
+                        timeout=row["timeout"],
+                        payload=row["payload"]
+                    ))
+                    recovered += 1
+                    continue
+                except HTTPException as e:
+                    error = f"服务重启后重新排队失败: {e.detail}"
+            self.task_results.put(TaskResult(task_id=row["task_id"], status=TaskStatus.FAILED, error=error))
+            failed += 1
+        if recovered or failed:
+            logger.info(f"线程池 [{self.pool_name}] 恢复了 {recovered} 个未完成的任务，{failed} 个无法恢复")
+        return {"recovered": recovered, "failed": failed}
     
     def shutdown(self):
         """关闭线程池"""
         logger.info(f"正在关闭线程池 [{self.pool_name}]...")
-        self._shutdown = True
-        
-        # 等待分发线程结束
-        if self.dispatcher_thread.is_alive():
-            self.dispatcher_thread.join(timeout=5)
+        with self.lock:
+            self._shutdown = True
+            # 队列中尚未执行的任务不再执行，通知等待者；持久化存储中可恢复的任务保持排队状态，重启后继续执行
+            for task_id, task_request in list(self.queued_tasks.items()):
+                self._dequeue(task_request)
+                self._finish_task(TaskResult(
+                    task_id=task_id,
+                    status=TaskStatus.CANCELLED,
+                    error="线程池已关闭"
+                ), persist=not (self.task_results.durable and task_request.payload is not None))
         
-        # 关闭线程池
+        # 关闭线程池（等待执行中的任务结束），再写入剩余的状态变更
         self.executor.shutdown(wait=True)
+        self.task_results.close()
         logger.info(f"线程池 [{self.pool_name}] 已关闭")
 
 
@@ -304,13 +656,27 @@ class AgentService:
         self.agent_thread_pool = ThreadPoolManager(
             max_workers=THREAD_CONFIG["agent_pool"]["max_workers"],
             queue_size=THREAD_CONFIG["agent_pool"]["queue_size"],
-            pool_name="agent"
+            pool_name="agent",
+            max_running_per_user=THREAD_CONFIG["agent_pool"]["max_running_per_user"],
+            aging_interval=THREAD_CONFIG["agent_pool"]["aging_interval"],
+            user_weights=THREAD_CONFIG["agent_pool"]["user_weights"],
+            max_queue_wait=THREAD_CONFIG["agent_pool"]["max_queue_wait"],
+            initial_exec_estimate=THREAD_CONFIG["agent_pool"]["initial_exec_estimate"],
+            exec_time_samples=THREAD_CONFIG["agent_pool"]["exec_time_samples"]
         )
         self.system_thread_pool = ThreadPoolManager(
             max_workers=THREAD_CONFIG["system_pool"]["max_workers"],
             queue_size=THREAD_CONFIG["system_pool"]["queue_size"],
-            pool_name="system"
+            pool_name="system",
+            max_running_per_user=THREAD_CONFIG["system_pool"]["max_running_per_user"],
+            aging_interval=THREAD_CONFIG["system_pool"]["aging_interval"],
+            user_weights=THREAD_CONFIG["system_pool"]["user_weights"],
+            max_queue_wait=THREAD_CONFIG["system_pool"]["max_queue_wait"],
+            initial_exec_estimate=THREAD_CONFIG["system_pool"]["initial_exec_estimate"],
+            exec_time_samples=THREAD_CONFIG["system_pool"]["exec_time_samples"]
         )
+        # 模型预热与驻留管理
+        self.warmup_manager = ModelWarmupManager()
     
     async def initialize(self):
         """初始化智能体（异步）"""
@@ -318,6 +684,46 @@ class AgentService:
             logger.info("正在初始化小红书智能体...")
             self.agent = XiaohongshuAgent()
             logger.info("智能体初始化完成")
+            
+            # 任务状态变更推送给SSE订阅者和webhook
+            task_events.bind()
+            for pool in (self.agent_thread_pool, self.system_thread_pool):
+                pool.on_event = task_events.publish
+            
+            # 多进程共享状态：登记本进程，接收其他进程的任务结束通知和取消请求，定期接管已退出进程的任务
+            shared = get_shared_state()
+            if shared is not None:
+                for pool in (self.agent_thread_pool, self.system_thread_pool):
+                    pool.task_results.on_finished = shared.tasks_finished
+                shared.start(on_cancel=self._cancel_local_task, on_tick=self._recover_tasks)
+                sse_manager.shared = shared
+                task_events.shared = shared
+            
+            # 智能体就绪后重新排队上次运行时（或已退出的工作进程中）未完成的任务（持久化存储）
+            self._recover_tasks()
+        
+        # 后台定期刷新模型目录，健康检查只读取缓存
+        get_shared_catalog().start()
+    
+    def _recover_tasks(self):
+        if self.agent is None:
+            return
+        self.agent_thread_pool.recover_tasks()
+        self.system_thread_pool.recover_tasks()
+    
+    def start_warmup(self):
+        """在后台预热模型并保持驻留（不阻塞启动，预热完成前就绪检查返回未就绪）"""
+        logger.info("正在后台预热模型...")
+        self.warmup_manager.start()
+    
+    def get_ollama_status(self) -> Dict[str, Any]:
+        """获取缓存的Ollama连通状态和模型可用性（不访问Ollama）"""
+        model_name = self.agent.ollama_client.model_name if self.agent is not None else None
+        return get_shared_catalog().get_status(model_name)
+    
+    def is_ready(self) -> bool:
+        """智能体已初始化且模型已预热"""
+        return self.agent is not None and self.warmup_manager.ready
     
     def check_ready(self):
         """检查智能体是否就绪"""
@@ -341,8 +747,14 @@ class AgentService:
         }
         return category_mapping.get(category_str, ContentCategory.LIFESTYLE)
     
-    def submit_agent_task(self, task_type: str, user_id: str, task_func: Callable, *args, priority: int = 1, **kwargs) -> str:
-        """提交智能体任务到专用线程池"""
+    def submit_agent_task(self, task_type: str, user_id: str, task_func: Callable, *args, priority: int = 1,
+                          payload: Dict[str, Any] = None, deadline: float = None, **kwargs) -> str:
+        """提交智能体任务到专用线程池
+        
+        提供 payload 时任务函数以 payload 为唯一参数调用；task_func 为 TASK_HANDLERS 中注册的处理函数时，
+        使用持久化存储的服务重启后可以恢复未完成的任务。
+        deadline 为任务最晚在多少秒内开始执行，预计无法按时开始时抛出 TaskRejected
+        """
         import uuid
         task_id = f"{task_type}_{user_id}_{uuid.uuid4().hex[:8]}"
         
@@ -351,14 +763,18 @@ class AgentService:
             user_id=user_id,
             task_type=task_type,
             task_func=task_func,
-            args=args,
+            args=(payload,) if payload is not None else args,
             kwargs=kwargs,
-            priority=priority
+            priority=priority,
+            payload=payload,
+            deadline=_deadline(deadline)
         )
         
         return self.agent_thread_pool.submit_task(task_request)
     
-    def submit_stream_task(self, task_type: str, user_id: str, generator_func: Callable, *args, priority: int = 1, **kwargs) -> str:
+    def submit_stream_task(self, task_type: str, user_id: str, generator_func: Callable, *args, priority: int = 1,
+                           cancel_token: CancellationToken = None, on_cancelled: Callable[[int], Any] = None,
+                           channel: StreamChannel = None, deadline: float = None, **kwargs) -> str:
         """提交流式任务到智能体线程池
         
         Args:
@@ -367,6 +783,12 @@ class AgentService:
             generator_func: 生成器函数，必须返回一个生成器
             *args: 传递给生成器函数的参数
             priority: 任务优先级（数字越小优先级越高）
+            cancel_token: 取消令牌（可选），提供时也作为 cancel_token 关键字参数传给生成器函数；
+                取消后任务在下一个片段之前停止读取，状态变为 CANCELLED
+            on_cancelled: 任务被取消时的回调（可选），参数为取消前已读取的片段数
+            channel: 实时通道（可选），提供时每个片段读到后立即放入通道，结束或失败时关闭通道；
+                通道的消费者离开后任务取消令牌并停止生成
+            deadline: 任务最晚在多少秒内开始执行（可选），预计无法按时开始时抛出 TaskRejected
             **kwargs: 传递给生成器函数的关键字参数
         
         Returns:
@@ -374,28 +796,62 @@ class AgentService:
         """
         import uuid
         task_id = f"stream_{task_type}_{user_id}_{uuid.uuid4().hex[:8]}"
+        if cancel_token is not None:
+            kwargs["cancel_token"] = cancel_token
         
         def stream_task_wrapper():
             """流式任务包装器，在线程中执行生成器函数并收集结果"""
+            chunks = []
+            generator = None
+            start_time = time.monotonic()
+            put_timeout = SSE_CONFIG["stream_channel_put_timeout"]
             try:
+                # 在队列中等待时已被取消的任务不再调用模型
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                
                 # 执行生成器函数获取生成器
                 generator = generator_func(*args, **kwargs)
                 
-                # 收集生成器的所有内容
-                chunks = []
+                # 收集生成器的所有内容，有通道时同时实时转发
                 for chunk in generator:
                     chunks.append(chunk)
+                    if channel is not None and not channel.put(chunk, timeout=put_timeout):
+                        reason = "客户端已断开" if channel.abandoned else "客户端读取超时"
+                        if cancel_token is not None:
+                            cancel_token.cancel(reason)
+                        raise GenerationCancelled(f"生成已取消: {reason}")
+                    if cancel_token is not None:
+                        cancel_token.raise_if_cancelled()
                 
-                # 返回完整内容
-                return {
+                # 返回完整内容（生成器为 TokenStream 时附带生成统计）
+                stats = getattr(generator, "stats", None)
+                result = {
                     "chunks": chunks,
                     "full_content": "".join(chunks),
-                    "chunk_count": len(chunks)
+                    "chunk_count": len(chunks),
+                    "stats": stats.to_dict() if stats is not None else None
                 }
+                if channel is not None:
+                    channel.finish({**result, "execution_time": time.monotonic() - start_time})
+                return result
                 
+            except GenerationCancelled as e:
+                if channel is not None:
+                    channel.finish(error=e)
+                if on_cancelled is not None:
+                    on_cancelled(len(chunks))
+                raise
             except Exception as e:
                 logger.error(f"流式任务 {task_id} 执行失败: {e}")
+                if channel is not None:
+                    channel.finish(error=e)
                 raise
+            finally:
+                # 提前结束时关闭生成器，释放上游连接
+                close = getattr(generator, "close", None)
+                if close is not None:
+                    close()
         
         task_request = TaskRequest(
             task_id=task_id,
@@ -404,7 +860,9 @@ class AgentService:
             task_func=stream_task_wrapper,
             args=(),
             kwargs={},
-            priority=priority
+            priority=priority,
+            cancel_token=cancel_token,
+            deadline=_deadline(deadline)
         )
         
         return self.agent_thread_pool.submit_task(task_request)
@@ -436,48 +894,99 @@ class AgentService:
         # 再从系统线程池查找
         return self.system_thread_pool.get_task_status(task_id)
     
+    def list_user_tasks(self, user_id: str, limit: int = 50) -> List[TaskResult]:
+        """列出用户最近提交的任务（不含结果内容），智能体线程池的任务在前，每个线程池内新任务在前"""
+        tasks = self.agent_thread_pool.list_user_tasks(user_id, limit)
+        return tasks + self.system_thread_pool.list_user_tasks(user_id, limit - len(tasks))
+    
+    async def wait_task(self, task_id: str, timeout: float = None) -> Optional[TaskResult]:
+        """等待任务结束（从两个线程池中查找），参数和返回值同 ThreadPoolManager.wait_task"""
+        pool = self.agent_thread_pool if self.agent_thread_pool.get_task_status(task_id) else self.system_thread_pool
+        return await pool.wait_task(task_id, timeout)
+    
+    def _cancel_local_task(self, task_id: str) -> bool:
+        # 先尝试在智能体线程池取消，再尝试在系统线程池取消
+        return self.agent_thread_pool.cancel_task(task_id) or self.system_thread_pool.cancel_task(task_id)
+    
     def cancel_task(self, task_id: str) -> bool:
-        """取消任务（在两个线程池中尝试）"""
-        # 先尝试在智能体线程池取消
-        if self.agent_thread_pool.cancel_task(task_id):
+        """取消任务（在两个线程池中尝试）
+        
+        启用共享状态时，其他工作进程中的任务把取消请求转发给该进程，返回是否已转发
+        """
+        if self._cancel_local_task(task_id):
             return True
         
-        # 再尝试在系统线程池取消
-        return self.system_thread_pool.cancel_task(task_id)
+        shared = get_shared_state()
+        if shared is None or not shared.started:
+            return False
+        for pool in (self.agent_thread_pool, self.system_thread_pool):
+            task_result = pool.get_task_status(task_id)
+            if task_result is not None:
+                if task_result.status not in (TaskStatus.PENDING, TaskStatus.RUNNING):
+                    return False
+                worker_id = pool.task_results.get_worker(task_id)
+                if worker_id is not None and shared.forward_cancel(worker_id, task_id):
+                    logger.info(f"任务 {task_id} 在工作进程 {worker_id} 中，已转发取消请求")
+                    return True
+                return False
+        return False
     
     def get_system_status(self) -> Dict[str, Any]:
         """获取所有线程池的系统状态"""
         agent_status = self.agent_thread_pool.get_system_status()
         system_status = self.system_thread_pool.get_system_status()
         
+        shared = get_shared_state()
+        
         return {
             "agent_pool": agent_status,
             "system_pool": system_status,
+            "shared_state": shared.get_status() if shared is not None and shared.started else None,
+            "task_events": task_events.get_status(),
             "total_running_tasks": agent_status["running_tasks"] + system_status["running_tasks"],
             "total_pending_tasks": agent_status["pending_tasks"] + system_status["pending_tasks"],
             "total_completed_tasks": agent_status["completed_tasks"] + system_status["completed_tasks"],
-            "total_failed_tasks": agent_status["failed_tasks"] + system_status["failed_tasks"]
+            "total_failed_tasks": agent_status["failed_tasks"] + system_status["failed_tasks"],
+            "ollama_backends": get_shared_backend_pool().get_status(),
+            "model_warmup": self.warmup_manager.get_status(),
+            "generation_stats": generation_stats.get_summary(),
+            "context_reuse": self.agent.context_store.get_status() if self.agent is not None else None,
+            "coalescing": {
+                "sync": self.agent.ollama_client.coalescer.get_status(),
+                "async": self.agent.async_ollama_client.coalescer.get_status()
+            } if self.agent is not None else None,
+            "response_cache": get_shared_response_cache().get_status(),
+            "semantic_cache": self.agent.semantic_cache.get_status() if self.agent is not None else None
         }
     
     def is_agent_pool_idle(self) -> bool:
         """检查智能体线程池是否空闲（没有运行或等待的任务）"""
-        status = self.agent_thread_pool.get_system_status()
-        return status["running_tasks"] == 0 and status["pending_tasks"] == 0
+        return self.agent_thread_pool.is_idle()
     
     def can_execute_immediately(self) -> bool:
         """检查是否可以立即执行任务（有空闲线程且无等待队列）"""
-        status = self.agent_thread_pool.get_system_status()
-        return status["running_tasks"] < status["max_workers"] and status["pending_tasks"] == 0
+        return self.agent_thread_pool.can_start_immediately()
     
     def cleanup_old_tasks(self, max_age_hours: int = 24):
-        """清理所有线程池的旧任务"""
+        """清理所有线程池的旧任务，以及过期的用户-后端粘性绑定"""
         self.agent_thread_pool.cleanup_old_tasks(max_age_hours)
         self.system_thread_pool.cleanup_old_tasks(max_age_hours)
+        get_shared_backend_pool().cleanup_affinity()
+    
+    async def aclose(self):
+        """停止模型驻留任务并释放异步客户端的连接"""
+        await self.warmup_manager.stop()
+        await task_events.aclose()
+        if self.agent is not None:
+            await self.agent.aclose()
     
     def shutdown(self):
-        """关闭所有线程池"""
+        """关闭所有线程池并释放Ollama连接池"""
         self.agent_thread_pool.shutdown()
         self.system_thread_pool.shutdown()
+        close_shared_state()
+        close_shared_catalog()
+        close_shared_pool()
 
 
 class SessionService:
@@ -487,38 +996,52 @@ class SessionService:
         self.user_sessions: Dict[str, Dict] = {}
         self._lock = threading.RLock()
     
+    @staticmethod
+    def _new_session() -> Dict:
+        return {
+            "content_history": [],
+            "current_version_index": -1,
+            "feedback_round": 0,
+            "last_generated_content": "",
+            "current_request": None,
+            "created_at": datetime.now(),
+            "last_activity": datetime.now()
+        }
+    
+    @staticmethod
+    def _append_version(session: Dict, content: str, action: str):
+        version_info = {
+            "content": content,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "action": action,
+            "version": len(session["content_history"]) + 1
+        }
+        session["content_history"].append(version_info)
+        session["current_version_index"] = len(session["content_history"]) - 1
+        session["last_generated_content"] = content
+    
     def get_user_session(self, user_id: str) -> Dict:
         """获取用户会话（线程安全）"""
         with self._lock:
             if user_id not in self.user_sessions:
-                self.user_sessions[user_id] = {
-                    "content_history": [],
-                    "current_version_index": -1,
-                    "feedback_round": 0,
-                    "last_generated_content": "",
-                    "current_request": None,
-                    "created_at": datetime.now(),
-                    "last_activity": datetime.now()
-                }
+                self.user_sessions[user_id] = self._new_session()
             else:
                 # 更新最后活动时间
                 self.user_sessions[user_id]["last_activity"] = datetime.now()
             
             return self.user_sessions[user_id]
     
+    def update_user_session(self, user_id: str, **fields) -> Dict:
+        """更新用户会话的字段（线程安全），返回更新后的会话"""
+        with self._lock:
+            session = self.get_user_session(user_id)
+            session.update(fields)
+            return session
+    
     def add_content_to_history(self, user_id: str, content: str, action: str = "生成"):
         """添加内容到版本历史（线程安全）"""
         with self._lock:
-            session = self.get_user_session(user_id)
-            version_info = {
-                "content": content,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "action": action,
-                "version": len(session["content_history"]) + 1
-            }
-            session["content_history"].append(version_info)
-            session["current_version_index"] = len(session["content_history"]) - 1
-            session["last_generated_content"] = content
+            self._append_version(self.get_user_session(user_id), content, action)
     
     def clear_user_session(self, user_id: str):
         """清空用户会话（线程安全）"""
@@ -528,7 +1051,7 @@ class SessionService:
     
     def cleanup_inactive_sessions(self, max_inactive_hours: int = 24):
         """清理不活跃的会话"""
-        cutoff_time = datetime.now() - asyncio.timedelta(hours=max_inactive_hours)
+        cutoff_time = datetime.now() - timedelta(hours=max_inactive_hours)
         
         with self._lock:
             inactive_users = [
@@ -540,6 +1063,62 @@ class SessionService:
                 del self.user_sessions[user_id]
             
             logger.info(f"清理了 {len(inactive_users)} 个不活跃的用户会话")
+    
+    def shutdown(self):
+        """关闭时清理会话数据"""
+        with self._lock:
+            self.user_sessions.clear()
+
+
+class SharedSessionService(SessionService):
+    """多个工作进程共享的用户会话服务（会话保存在共享状态的SQLite中）
+    
+    get_user_session 返回会话的副本，修改会话需通过 update_user_session / add_content_to_history，
+    读-改-写在一个写事务中完成，不同进程同时修改同一用户的会话不会丢失更新
+    """
+    
+    @property
+    def shared(self) -> SharedState:
+        return get_shared_state()
+    
+    def _modify(self, user_id: str, func: Callable[[Dict], Any] = None) -> Dict:
+        now = datetime.now()
+        with self.shared.transaction() as db:
+            row = db.execute("SELECT data FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                session = self._new_session()
+            else:
+                session = json.loads(row[0])
+                session["created_at"] = datetime.fromisoformat(session["created_at"])
+            if func is not None:
+                func(session)
+            session["last_activity"] = now
+            data = json.dumps({**session, "created_at": session["created_at"].isoformat(), "last_activity": now.isoformat()},
+                              ensure_ascii=False, default=str)
+            db.execute("INSERT OR REPLACE INTO sessions (user_id, data, last_activity) VALUES (?, ?, ?)",
+                       (user_id, data, now.timestamp()))
+        return session
+    
+    def get_user_session(self, user_id: str) -> Dict:
+        return self._modify(user_id)
+    
+    def update_user_session(self, user_id: str, **fields) -> Dict:
+        return self._modify(user_id, lambda session: session.update(fields))
+    
+    def add_content_to_history(self, user_id: str, content: str, action: str = "生成"):
+        self._modify(user_id, lambda session: self._append_version(session, content, action))
+    
+    def clear_user_session(self, user_id: str):
+        self.shared.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+    
+    def cleanup_inactive_sessions(self, max_inactive_hours: int = 24):
+        cutoff_time = datetime.now() - timedelta(hours=max_inactive_hours)
+        with self.shared.transaction() as db:
+            removed = db.execute("DELETE FROM sessions WHERE last_activity < ?", (cutoff_time.timestamp(),)).rowcount
+        logger.info(f"清理了 {removed} 个不活跃的用户会话")
+    
+    def shutdown(self):
+        """会话由所有工作进程共享，关闭单个进程时保留"""
 
 
 class StreamService:
@@ -548,38 +1127,99 @@ class StreamService:
     def __init__(self, session_service: SessionService):
         self.session_service = session_service
     
-    async def generate_with_sse_smart(self, generator_func: Callable, user_id: str, action: str = "生成", language: Language = Language.ZH_CN, *args, **kwargs) -> AsyncGenerator[str, None]:
-        """智能流式生成：如果线程池空闲则直接执行，否则使用线程池"""
+    async def generate_with_sse_smart(self, generator_func: Callable, user_id: str, action: str = "生成", language: Language = Language.ZH_CN, *args, endpoint: str = None,
+                                      deadline: float = None, async_generator_func: Callable = None, **kwargs) -> AsyncGenerator[str, None]:
+        """智能流式生成：如果线程池空闲则直接在事件循环中读取异步生成器，否则使用线程池
+        
+        endpoint 用于按端点聚合生成统计，未提供时使用 action。
+        generator_func 返回同步生成器，只在线程池的工作线程中读取，需要接受 cancel_token 关键字参数，客户端断开时该令牌被取消，上游生成随之中断。
+        async_generator_func 返回相同内容的异步生成器（如 agent 的 *_astream），客户端断开时通过 aclose() 中断；
+        未提供时总是使用线程池，阻塞的同步生成器不会在事件循环中读取。
+        deadline 为排队时最晚在多少秒内开始执行；线程池拒绝任务时发送带 retry_after 的错误消息
+        """
+        cancel_token = CancellationToken()
+        
         # 检查是否可以立即执行
-        if agent_service.can_execute_immediately():
+        if async_generator_func is not None and agent_service.can_execute_immediately():
             logger.info(f"线程池空闲，直接执行流式任务 - 用户: {user_id}, 操作: {action}")
-            # 直接执行生成器函数
+            # 直接读取异步生成器，不阻塞事件循环
             try:
-                generator = generator_func(*args, **kwargs)
-                async for message in self.generate_with_sse(generator, user_id, action, language):
+                generator = async_generator_func(*args, **kwargs)
+                async for message in self.generate_with_sse(generator, user_id, action, language, endpoint=endpoint):
                     yield message
             except Exception as e:
                 logger.error(f"直接执行流式任务失败: {e}")
                 error_message = get_message("generation_failed", language) if action == get_message("initial_generation", language) else f"{action}失败"
-                yield SSEMessage.error(f"{error_message}: {str(e)}")
+                yield SSEMessage.error(f"{error_message}: {str(e)}", getattr(e, "code", None))
         else:
             # 使用线程池处理
             logger.info(f"线程池忙碌，使用任务队列 - 用户: {user_id}, 操作: {action}")
-            task_id = agent_service.submit_stream_task(
-                task_type="smart_stream",
-                user_id=user_id,
-                generator_func=generator_func,
-                priority=0,  # 最高优先级
-                *args,
-                **kwargs
-            )
+            # 工作线程通过有界通道实时转发片段，不必等任务结束后再回放
+            channel = StreamChannel(SSE_CONFIG["stream_channel_size"])
+            try:
+                task_id = agent_service.submit_stream_task(
+                    "smart_stream",
+                    user_id,
+                    generator_func,
+                    *args,
+                    priority=0,  # 最高优先级
+                    cancel_token=cancel_token,
+                    on_cancelled=lambda generated: self._record_cancelled(endpoint or action, language, generated),
+                    channel=channel,
+                    deadline=deadline,
+                    **kwargs
+                )
+            except TaskRejected as e:
+                yield SSEMessage.error(e.detail, "overloaded", retry_after=e.retry_after)
+                return
             
-            async for message in self.generate_with_sse_from_task(task_id, user_id, action, language):
+            async for message in self.generate_with_sse_from_task(task_id, channel, user_id, action, language, endpoint=endpoint):
                 yield message
     
-    async def generate_with_sse(self, generator, user_id: str, action: str = "生成", language: Language = Language.ZH_CN) -> AsyncGenerator[str, None]:
-        """通用的SSE生成器包装器"""
+    @staticmethod
+    def _record_cancelled(endpoint: str, language: Language, generated: int):
+        saved = generation_stats.record_cancelled(endpoint, language, generated)
+        logger.info(f"生成已取消 - 端点: {endpoint}, 取消前已生成 {generated} 个片段, 估算节省 {saved} token")
+    
+    async def abandon_stream(self, generator, endpoint: str, language: Language, generated: int,
+                             cancel_token: CancellationToken = None):
+        """客户端断开后中断生成：取消令牌（断开上游连接）、关闭生成器，并记录估算节省的token
+        
+        Args:
+            generator: 正在读取的生成器（异步生成器调用 aclose()）
+            endpoint: 统计使用的端点
+            language: 统计使用的语言
+            generated: 断开前已生成的片段数
+            cancel_token: 生成器使用的取消令牌（可选）
+        """
+        if cancel_token is not None:
+            cancel_token.cancel("客户端已断开")
+        self._record_cancelled(endpoint, language, generated)
+        try:
+            aclose = getattr(generator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            else:
+                close = getattr(generator, "close", None)
+                if close is not None:
+                    close()
+        except Exception as e:
+            logger.warning(f"关闭已断开连接的生成器失败: {e}")
+    
+    async def generate_with_sse(self, generator, user_id: str, action: str = "生成", language: Language = Language.ZH_CN, endpoint: str = None,
+                                cancel_token: CancellationToken = None) -> AsyncGenerator[str, None]:
+        """通用的SSE生成器包装器
+        
+        generator 必须是异步生成器：在事件循环中读取同步生成器会阻塞所有请求，同步生成器请通过 submit_stream_task 在线程池中执行。
+        生成器带有 stats 属性（TokenStream / AsyncTokenStream）时，生成统计会放入 complete 事件并按 endpoint 和语言聚合。
+        客户端在生成结束前断开时关闭生成器并取消 cancel_token，上游生成随之中断
+        """
+        if not hasattr(generator, "__aiter__"):
+            raise TypeError("generate_with_sse 只接受异步生成器，同步生成器请通过 submit_stream_task 在线程池中执行")
         connection_id = f"{user_id}_{datetime.now().timestamp()}"
+        content = ""
+        chunk_count = 0
+        generating = True
         
         try:
             # 添加连接
@@ -589,33 +1229,28 @@ class StreamService:
             start_message = get_message("processing", language)
             yield SSEMessage.status("started", f"{start_message} {action}...")
             
-            content = ""
-            chunk_count = 0
+            # 处理生成器内容
+            async for chunk in generator:
+                if chunk:
+                    content += chunk
+                    chunk_count += 1
+                    
+                    # 发送内容块
+                    yield SSEMessage.content_chunk(
+                        chunk=chunk,
+                        metadata={
+                            "action": action,
+                            "chunk_count": chunk_count,
+                            "total_length": len(content)
+                        }
+                    )
+                    
+                    # 更新心跳
+                    sse_manager.update_heartbeat(connection_id)
+            generating = False
             
-            # 处理生成器内容（同步生成器）
-            try:
-                for chunk in generator:
-                    if chunk:
-                        content += chunk
-                        chunk_count += 1
-                        
-                        # 发送内容块
-                        yield SSEMessage.content_chunk(
-                            chunk=chunk,
-                            metadata={
-                                "action": action,
-                                "chunk_count": chunk_count,
-                                "total_length": len(content)
-                            }
-                        )
-                        
-                        # 更新心跳
-                        sse_manager.update_heartbeat(connection_id)
-                        
-                        # 小延迟，避免发送过快
-                        await asyncio.sleep(0.01)
-            except StopIteration:
-                pass  # 生成器正常结束
+            stats = getattr(generator, "stats", None)
+            generation_stats.record(endpoint or action, language, stats)
             
             # 保存到历史
             if content:
@@ -628,27 +1263,38 @@ class StreamService:
                     "action": action,
                     "version": session["current_version_index"] + 1,
                     "total_chunks": chunk_count,
-                    "total_length": len(content)
+                    "total_length": len(content),
+                    "stats": stats.to_dict() if stats is not None else None
                 })
             else:
                 empty_content_message = get_message("generation_failed", language)
                 yield SSEMessage.error(empty_content_message)
+        
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客户端断开连接
+            if generating:
+                await self.abandon_stream(generator, endpoint or action, language, chunk_count, cancel_token)
+            raise
                 
         except Exception as e:
             logger.error(f"{action}过程中出错: {e}")
             error_message = get_message("generation_failed", language)
-            yield SSEMessage.error(f"{error_message}: {str(e)}")
+            yield SSEMessage.error(f"{error_message}: {str(e)}", getattr(e, "code", None))
         
         finally:
             # 移除连接
             sse_manager.remove_connection(connection_id)
     
-    async def generate_with_sse_from_task(self, task_id: str, user_id: str, action: str = "生成", language: Language = Language.ZH_CN) -> AsyncGenerator[str, None]:
-        """从线程池任务结果生成SSE流
+    async def generate_with_sse_from_task(self, task_id: str, channel: StreamChannel, user_id: str, action: str = "生成",
+                                          language: Language = Language.ZH_CN, endpoint: str = None) -> AsyncGenerator[str, None]:
+        """把线程池流式任务的输出实时转换为SSE流
         
-        这个方法会高频轮询任务状态，并将完成的结果转换为SSE流式输出
+        工作线程每读到一个片段就放入 channel，这里读到后立即发送，首个片段的延迟等于排队时间加模型首字延迟。
+        没有新片段时定期检查任务状态（排队超时、执行前被取消）并发送处理中状态；客户端提前断开时关闭通道并取消该任务
         """
         connection_id = f"{user_id}_{datetime.now().timestamp()}"
+        content = ""
+        chunk_count = 0
         
         try:
             # 添加连接
@@ -658,75 +1304,32 @@ class StreamService:
             start_message = get_message("processing", language)
             yield SSEMessage.status("started", f"{start_message} {action}...")
             
-            # 高效轮询任务状态
-            poll_count = 0
-            status_sent = False
-            last_status_time = datetime.now()
+            wait_start = time.monotonic()
+            last_status_time = None
             
             while True:
-                start_poll_time = datetime.now()
-                task_result = agent_service.get_task_status(task_id)
-                
-                if task_result is None:
-                    error_message = get_message("generation_failed", language)
-                    yield SSEMessage.error(f"{error_message}: 任务 {task_id} 不存在")
-                    return
+                kind, value = await channel.get(timeout=SSE_CONFIG["task_check_interval"])
                 
-                if task_result.status == TaskStatus.COMPLETED:
-                    # 任务完成，立即处理结果
-                    result = task_result.result
-                    
-                    if isinstance(result, dict) and "chunks" in result:
-                        # 流式任务结果，快速发送
-                        chunks = result["chunks"]
-                        full_content = result.get("full_content", "")
-                        
-                        for i, chunk in enumerate(chunks):
-                            if chunk:
-                                yield SSEMessage.content_chunk(
-                                    chunk=chunk,
-                                    metadata={
-                                        "action": action,
-                                        "chunk_count": i + 1,
-                                        "total_chunks": len(chunks),
-                                        "total_length": len(full_content)
-                                    }
-                                )
-                                # 更新心跳
-                                sse_manager.update_heartbeat(connection_id)
-                                await asyncio.sleep(0.02)  # 更快的模拟流式输出
-                        
-                        # 保存到历史
-                        if full_content:
-                            self.session_service.add_content_to_history(user_id, full_content, action)
-                            session = self.session_service.get_user_session(user_id)
-                            
-                            # 发送完成状态
-                            yield SSEMessage.complete({
-                                "content": full_content,
-                                "action": action,
-                                "version": session["current_version_index"] + 1,
-                                "total_chunks": len(chunks),
-                                "total_length": len(full_content),
-                                "execution_time": task_result.execution_time
-                            })
-                        else:
-                            empty_content_message = get_message("generation_failed", language)
-                            yield SSEMessage.error(empty_content_message)
-                    else:
-                        # 普通任务结果，直接输出
-                        content = str(result)
+                if kind == StreamChannel.CHUNK:
+                    if value:
+                        content += value
+                        chunk_count += 1
                         yield SSEMessage.content_chunk(
-                            chunk=content,
+                            chunk=value,
                             metadata={
                                 "action": action,
-                                "chunk_count": 1,
-                                "total_chunks": 1,
+                                "chunk_count": chunk_count,
                                 "total_length": len(content)
                             }
                         )
-                        
-                        # 保存到历史
+                        # 更新心跳
+                        sse_manager.update_heartbeat(connection_id)
+                
+                elif kind == StreamChannel.END:
+                    generation_stats.record(endpoint or action, language, value["stats"])
+                    
+                    # 保存到历史
+                    if content:
                         self.session_service.add_content_to_history(user_id, content, action)
                         session = self.session_service.get_user_session(user_id)
                         
@@ -735,76 +1338,81 @@ class StreamService:
                             "content": content,
                             "action": action,
                             "version": session["current_version_index"] + 1,
-                            "total_chunks": 1,
+                            "total_chunks": chunk_count,
                             "total_length": len(content),
-                            "execution_time": task_result.execution_time
+                            "execution_time": value["execution_time"],
+                            "stats": value["stats"]
                         })
-                    
-                    return
-                
-                elif task_result.status == TaskStatus.FAILED:
-                    error_message = get_message("generation_failed", language)
-                    yield SSEMessage.error(f"{error_message}: {task_result.error}")
-                    return
-                
-                elif task_result.status == TaskStatus.TIMEOUT:
-                    timeout_message = "超时" if language == Language.ZH_CN else "Timeout" if language == Language.EN_US else "タイムアウト" if language == Language.JA_JP else "超時"
-                    yield SSEMessage.error(f"{action}{timeout_message}")
+                    else:
+                        empty_content_message = get_message("generation_failed", language)
+                        yield SSEMessage.error(empty_content_message)
                     return
                 
-                elif task_result.status == TaskStatus.CANCELLED:
-                    cancelled_message = "已取消" if language == Language.ZH_CN else "Cancelled" if language == Language.EN_US else "キャンセル済み" if language == Language.JA_JP else "已取消"
-                    yield SSEMessage.error(f"{action}{cancelled_message}")
+                elif kind == StreamChannel.ERROR:
+                    if isinstance(value, GenerationCancelled):
+                        yield SSEMessage.error(f"{action}{self._cancelled_message(language)}", value.code)
+                    else:
+                        error_message = get_message("generation_failed", language)
+                        yield SSEMessage.error(f"{error_message}: {str(value)}", getattr(value, "code", None))
                     return
                 
                 else:
-                    # 任务还在进行中，智能化状态消息发送
-                    poll_count += 1
-                    current_time = datetime.now()
+                    # 暂无新片段：任务在开始执行前结束（排队超时或被取消）时通道不会被关闭，需要查询任务状态
+                    task_result = agent_service.get_task_status(task_id)
+                    
+                    if task_result is None:
+                        error_message = get_message("generation_failed", language)
+                        yield SSEMessage.error(f"{error_message}: 任务 {task_id} 不存在")
+                        return
                     
-                    # 获取配置
-                    from .config import SSE_CONFIG
-                    status_interval = SSE_CONFIG.get("status_message_interval", 50)
-                    poll_interval = SSE_CONFIG.get("poll_interval", 0.1)
+                    if task_result.status == TaskStatus.FAILED:
+                        error_message = get_message("generation_failed", language)
+                        yield SSEMessage.error(f"{error_message}: {task_result.error}")
+                        return
                     
-                    # 智能发送状态消息：首次 + 每5秒一次
-                    time_since_last_status = (current_time - last_status_time).total_seconds()
-                    should_send_status = (not status_sent or 
-                                        time_since_last_status >= 5.0 or 
-                                        poll_count % status_interval == 0)
+                    if task_result.status == TaskStatus.TIMEOUT:
+                        timeout_message = "超时" if language == Language.ZH_CN else "Timeout" if language == Language.EN_US else "タイムアウト" if language == Language.JA_JP else "超時"
+                        yield SSEMessage.error(f"{action}{timeout_message}")
+                        return
                     
-                    if should_send_status:
-                        elapsed_time = (current_time - start_poll_time).total_seconds()
+                    if task_result.status == TaskStatus.CANCELLED:
+                        yield SSEMessage.error(f"{action}{self._cancelled_message(language)}")
+                        return
+                    
+                    # 仍在排队或执行中：首次 + 每隔一段时间发送一次状态消息
+                    current_time = time.monotonic()
+                    if last_status_time is None or current_time - last_status_time >= SSE_CONFIG["status_message_interval"]:
                         processing_message = get_message("processing", language)
                         wait_message = "已等待" if language == Language.ZH_CN else "waiting" if language == Language.EN_US else "待機中" if language == Language.JA_JP else "已等待"
-                        yield SSEMessage.status("processing", f"{processing_message} {action}... ({wait_message} {elapsed_time:.1f}s)")
-                        status_sent = True
+                        yield SSEMessage.status("processing", f"{processing_message} {action}... ({wait_message} {current_time - wait_start:.1f}s)")
                         last_status_time = current_time
                     
-                    # 更新心跳但不发送消息
+                    # 更新心跳
                     sse_manager.update_heartbeat(connection_id)
-                    
-                    # 动态调整轮询间隔：任务运行时间越长，轮询间隔越长
-                    if poll_count < 10:  # 前1秒快速轮询
-                        actual_interval = 0.05
-                    elif poll_count < 50:  # 前5秒中速轮询
-                        actual_interval = poll_interval
-                    else:  # 5秒后慢速轮询
-                        actual_interval = min(poll_interval * 2, 0.3)
-                    
-                    await asyncio.sleep(actual_interval)
+        
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客户端断开连接：关闭通道使工作线程停止转发，并取消排队或执行中的任务（已结束的任务不受影响）
+            channel.abandon()
+            if agent_service.cancel_task(task_id):
+                logger.info(f"客户端已断开，取消任务 {task_id}")
+            raise
                 
         except Exception as e:
-            logger.error(f"SSE任务轮询错误: {e}")
+            logger.error(f"SSE任务流错误: {e}")
             error_message = get_message("generation_failed", language)
             yield SSEMessage.error(f"{error_message}: {str(e)}")
         
         finally:
             # 移除连接
             sse_manager.remove_connection(connection_id)
+    
+    @staticmethod
+    def _cancelled_message(language: Language) -> str:
+        return "已取消" if language == Language.ZH_CN else "Cancelled" if language == Language.EN_US else "キャンセル済み" if language == Language.JA_JP else "已取消"
 
 
 # 全局服务实例
+generation_stats = GenerationStatsAggregator()  # 按端点和语言聚合的Ollama生成统计
 agent_service = AgentService()
-session_service = SessionService()
+session_service = SharedSessionService() if SHARED_STATE_CONFIG["enabled"] else SessionService()
 stream_service = StreamService(session_service) 
\ No newline at end of file
@@ -0,0 +1,413 @@
+"""
+多进程共享状态
+同一台机器上运行多个工作进程（uvicorn/hypercorn --workers N）时，各进程通过任务存储的SQLite文件（WAL模式）共享：
+- 工作进程注册表：每个进程定期写入心跳，心跳超时的进程视为已退出，其未完成的任务由存活的进程接管
+- 跨进程通知：等待其他进程中任务的请求登记在 task_waiters 表中，任务所在进程提交结束状态后只通知登记了的进程；
+  取消其他进程中的任务时把请求转发给任务所在进程。通知通过本机UDP发送，端口登记在注册表中
+- SSE连接登记、用户的webhook登记、批次所在的工作进程登记（用户会话见 services.SharedSessionService，任务状态见 SQLiteTaskStore）
+"""
+
+import concurrent.futures
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .config import logger, SHARED_STATE_CONFIG, TASK_STORE_CONFIG
+
+
+WORKERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    pid INTEGER,
+    port INTEGER,          -- 接收通知的本机UDP端口
+    started_at REAL,
+    heartbeat REAL
+);
+"""
+
+_SCHEMA = WORKERS_SCHEMA + """
+CREATE TABLE IF NOT EXISTS task_waiters (
+    task_id TEXT NOT NULL,
+    worker_id TEXT NOT NULL,
+    PRIMARY KEY (task_id, worker_id)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    last_activity REAL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_activity ON sessions(last_activity);
+CREATE TABLE IF NOT EXISTS sse_connections (
+    connection_id TEXT PRIMARY KEY,
+    worker_id TEXT NOT NULL,
+    user_id TEXT,
+    connected_at REAL,
+    last_heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS idx_sse_connections_user ON sse_connections(user_id);
+CREATE TABLE IF NOT EXISTS webhooks (
+    user_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    created_at REAL,
+    PRIMARY KEY (user_id, url)
+);
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id TEXT PRIMARY KEY,
+    worker_id TEXT NOT NULL,  -- 执行批次的工作进程
+    user_id TEXT,
+    created_at REAL
+);
+"""
+
+_MAX_DATAGRAM_TASKS = 500  # 每个通知最多包含的任务数
+
+_worker_id: Optional[str] = None
+_worker_pid: Optional[int] = None
+
+
+def current_worker_id() -> str:
+    """当前工作进程的ID（进程号 + 随机后缀，进程号被复用时也不会与已退出的进程混淆）"""
+    global _worker_id, _worker_pid
+    if _worker_pid != os.getpid():
+        _worker_pid = os.getpid()
+        _worker_id = f"{_worker_pid}-{uuid.uuid4().hex[:6]}"
+    return _worker_id
+
+
+class SharedState:
+    """工作进程注册表和跨进程通知（线程安全）"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        """
+        Args:
+            config: 配置，未提供的字段使用 SHARED_STATE_CONFIG 中的默认值；path 默认与任务存储使用同一个SQLite文件
+        """
+        self.config = {"path": TASK_STORE_CONFIG["sqlite_path"], **SHARED_STATE_CONFIG, **(config or {})}
+        self.worker_id = current_worker_id()
+        path = self.config["path"]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.executescript(_SCHEMA)
+        self._db_lock = threading.RLock()
+        self._writes: "queue.SimpleQueue" = queue.SimpleQueue()  # 不需要立即可见的写入（SSE连接登记），由后台线程成批提交
+        self._waiters: Dict[str, List[concurrent.futures.Future]] = {}
+        self._waiters_lock = threading.Lock()
+        self._ports: Dict[str, int] = {}  # 存活的工作进程 -> 通知端口
+        self._sock: Optional[socket.socket] = None
+        self._on_cancel: Optional[Callable[[str], Any]] = None
+        self._on_tick: Optional[Callable[[], Any]] = None
+        self._threads: List[threading.Thread] = []
+        self._counters = {"notifications_sent": 0, "notifications_received": 0, "cancels_forwarded": 0, "workers_lost": 0}
+
+    @property
+    def worker_timeout(self) -> float:
+        return self.config["heartbeat_interval"] * self.config["worker_timeout_beats"]
+
+    @property
+    def started(self) -> bool:
+        return self._sock is not None
+
+    def start(self, on_cancel: Callable[[str], Any] = None, on_tick: Callable[[], Any] = None):
+        """
+        登记当前工作进程并启动后台线程
+
+        Args:
+            on_cancel: 收到其他进程转发的取消请求时调用，参数为任务ID
+            on_tick: 每次写入心跳后调用（接管已退出进程的未完成任务）
+        """
+        if self.started:
+            return
+        self._on_cancel = on_cancel
+        self._on_tick = on_tick
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(("127.0.0.1", 0))
+        port = self._sock.getsockname()[1]
+        now = time.time()
+        self.execute("INSERT OR REPLACE INTO workers (worker_id, pid, port, started_at, heartbeat) VALUES (?, ?, ?, ?, ?)",
+                     (self.worker_id, os.getpid(), port, now, now))
+        self._refresh_workers()
+        for target, name in ((self._listen, "listener"), (self._maintain, "maintainer")):
+            thread = threading.Thread(target=target, daemon=True, name=f"shared_state_{name}")
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"共享状态已启用: 工作进程 {self.worker_id}，通知端口 {port}，存储 {self.config['path']}")
+
+    # ---- 数据库 ----
+
+    def execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        """执行一条语句（自动提交）"""
+        with self._db_lock:
+            return self._db.execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """写事务（BEGIN IMMEDIATE），其他进程的写入在事务结束前等待，用于读-改-写"""
+        with self._db_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    # ---- 工作进程注册表 ----
+
+    def _refresh_workers(self) -> List[str]:
+        """写入心跳，删除心跳超时的工作进程；返回本次发现已退出的进程"""
+        now = time.time()
+        with self.transaction() as db:
+            db.execute("UPDATE workers SET heartbeat = ? WHERE worker_id = ?", (now, self.worker_id))
+            rows = db.execute("SELECT worker_id, port, heartbeat FROM workers").fetchall()
+            lost = [worker_id for worker_id, _, heartbeat in rows if now - heartbeat > self.worker_timeout]
+            for worker_id in lost:
+                db.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+                db.execute("DELETE FROM sse_connections WHERE worker_id = ?", (worker_id,))
+                db.execute("DELETE FROM task_waiters WHERE worker_id = ?", (worker_id,))
+                db.execute("DELETE FROM batches WHERE worker_id = ?", (worker_id,))
+        self._ports = {worker_id: port for worker_id, port, _ in rows if worker_id not in lost}
+        return lost
+
+    def _maintain(self):
+        # 有写入时立即成批提交；没有写入时按心跳间隔唤醒
+        interval = self.config["heartbeat_interval"]
+        next_beat = time.monotonic() + interval
+        while True:
+            batch = []
+            try:
+                batch.append(self._writes.get(timeout=max(0.0, next_beat - time.monotonic())))
+                while True:
+                    batch.append(self._writes.get_nowait())
+            except queue.Empty:
+                pass
+            stop = None in batch
+            writes = [op for op in batch if op is not None]
+            try:
+                if writes:
+                    with self.transaction() as db:
+                        for sql, params in writes:
+                            db.execute(sql, params)
+                if time.monotonic() >= next_beat or stop:
+                    next_beat = time.monotonic() + interval
+                    if stop:
+                        return
+                    lost = self._refresh_workers()
+                    if lost:
+                        self._counters["workers_lost"] += len(lost)
+                        logger.warning(f"工作进程 {', '.join(lost)} 心跳超时，已从注册表中移除")
+                    if self._on_tick is not None:
+                        self._on_tick()
+            except Exception as e:
+                logger.error(f"共享状态维护失败: {e}")
+
+    def live_workers(self) -> List[str]:
+        """存活的工作进程（最近一次心跳时的注册表）"""
+        return sorted(self._ports)
+
+    # ---- 跨进程通知 ----
+
+    def _send(self, worker_id: str, message: Dict[str, Any]) -> bool:
+        port = self._ports.get(worker_id)
+        if port is None:
+            rows = self.execute("SELECT port FROM workers WHERE worker_id = ?", (worker_id,))
+            if not rows:
+                return False
+            port = self._ports[worker_id] = rows[0][0]
+        try:
+            self._sock.sendto(json.dumps(message).encode("utf-8"), ("127.0.0.1", port))
+        except OSError as e:
+            logger.warning(f"向工作进程 {worker_id} 发送通知失败: {e}")
+            return False
+        self._counters["notifications_sent"] += 1
+        return True
+
+    def _listen(self):
+        while True:
+            try:
+                data, _ = self._sock.recvfrom(65536)
+            except OSError:
+                return  # 已关闭
+            try:
+                message = json.loads(data)
+            except ValueError:
+                continue
+            self._counters["notifications_received"] += 1
+            if message.get("type") == "stop":
+                return
+            if message.get("type") == "finished":
+                self._resolve(message["task_ids"])
+            elif message.get("type") == "cancel" and self._on_cancel is not None:
+                try:
+                    self._on_cancel(message["task_id"])
+                except Exception as e:
+                    logger.error(f"处理转发的取消请求失败: {e}")
+
+    def _resolve(self, task_ids: List[str]):
+        with self._waiters_lock:
+            futures = [future for task_id in task_ids for future in self._waiters.pop(task_id, ())]
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+
+    def watch_task(self, task_id: str) -> concurrent.futures.Future:
+        """
+        登记等待其他进程中的任务结束
+
+        登记在返回前已提交，调用方随后应再查询一次任务状态，避免错过登记前已结束的任务
+
+        Returns:
+            concurrent.futures.Future: 任务所在进程提交结束状态后完成（结果为None），需用 unwatch_task 注销
+        """
+        future = concurrent.futures.Future()
+        with self._waiters_lock:
+            self._waiters.setdefault(task_id, []).append(future)
+        self.execute("INSERT OR IGNORE INTO task_waiters (task_id, worker_id) VALUES (?, ?)", (task_id, self.worker_id))
+        return future
+
+    def unwatch_task(self, task_id: str, future: concurrent.futures.Future):
+        with self._waiters_lock:
+            futures = self._waiters.get(task_id)
+            if futures is not None and future in futures:
+                futures.remove(future)
+                if futures:
+                    return
+                del self._waiters[task_id]
+        self._writes.put(("DELETE FROM task_waiters WHERE task_id = ? AND worker_id = ?", (task_id, self.worker_id)))
+
+    def tasks_finished(self, task_ids: List[str]):
+        """任务的结束状态已提交（任务存储的写入线程调用）：通知登记了等待的工作进程"""
+        targets: Dict[str, List[str]] = {}
+        for start in range(0, len(task_ids), _MAX_DATAGRAM_TASKS):
+            chunk = task_ids[start:start + _MAX_DATAGRAM_TASKS]
+            marks = ", ".join("?" * len(chunk))
+            with self.transaction() as db:
+                rows = db.execute(f"SELECT task_id, worker_id FROM task_waiters WHERE task_id IN ({marks})", chunk).fetchall()
+                if rows:
+                    db.execute(f"DELETE FROM task_waiters WHERE task_id IN ({marks})", chunk)
+            for task_id, worker_id in rows:
+                targets.setdefault(worker_id, []).append(task_id)
+        for worker_id, ids in targets.items():
+            if worker_id == self.worker_id:
+                self._resolve(ids)
+            else:
+                self._send(worker_id, {"type": "finished", "task_ids": ids})
+
+    def forward_cancel(self, worker_id: str, task_id: str) -> bool:
+        """把取消请求转发给任务所在的工作进程，返回是否已发送"""
+        if worker_id == self.worker_id or not self._send(worker_id, {"type": "cancel", "task_id": task_id}):
+            return False
+        self._counters["cancels_forwarded"] += 1
+        return True
+
+    # ---- SSE连接登记 ----
+
+    def register_connection(self, connection_id: str, user_id: str):
+        now = time.time()
+        self._writes.put(("INSERT OR REPLACE INTO sse_connections (connection_id, worker_id, user_id, connected_at, last_heartbeat) "
+                          "VALUES (?, ?, ?, ?, ?)", (connection_id, self.worker_id, user_id, now, now)))
+
+    def touch_connection(self, connection_id: str):
+        self._writes.put(("UPDATE sse_connections SET last_heartbeat = ? WHERE connection_id = ?", (time.time(), connection_id)))
+
+    def unregister_connection(self, connection_id: str):
+        self._writes.put(("DELETE FROM sse_connections WHERE connection_id = ?", (connection_id,)))
+
+    def user_connections(self, user_id: str) -> List[str]:
+        """用户在所有工作进程上的SSE连接"""
+        return [row[0] for row in self.execute(
+            "SELECT connection_id FROM sse_connections WHERE user_id = ? ORDER BY connected_at", (user_id,))]
+
+    def connection_count(self) -> int:
+        return self.execute("SELECT COUNT(*) FROM sse_connections")[0][0]
+
+    # ---- webhook登记 ----
+
+    def add_webhook(self, user_id: str, url: str):
+        self.execute("INSERT OR REPLACE INTO webhooks (user_id, url, created_at) VALUES (?, ?, ?)", (user_id, url, time.time()))
+
+    def remove_webhook(self, user_id: str, url: str) -> bool:
+        with self.transaction() as db:
+            return db.execute("DELETE FROM webhooks WHERE user_id = ? AND url = ?", (user_id, url)).rowcount > 0
+
+    def user_webhooks(self, user_id: str) -> List[str]:
+        return [row[0] for row in self.execute("SELECT url FROM webhooks WHERE user_id = ? ORDER BY url", (user_id,))]
+
+    # ---- 批次登记 ----
+
+    def add_batch(self, batch_id: str, user_id: str):
+        self._writes.put(("INSERT OR REPLACE INTO batches (batch_id, worker_id, user_id, created_at) VALUES (?, ?, ?, ?)",
+                          (batch_id, self.worker_id, user_id, time.time())))
+
+    def remove_batches(self, batch_ids: List[str]):
+        for batch_id in batch_ids:
+            self._writes.put(("DELETE FROM batches WHERE batch_id = ?", (batch_id,)))
+
+    def batch_worker(self, batch_id: str) -> Optional[str]:
+        """批次所在的工作进程，未登记（或所在进程已退出）时返回None"""
+        rows = self.execute("SELECT worker_id FROM batches WHERE batch_id = ?", (batch_id,))
+        return rows[0][0] if rows else None
+
+    # ---- 状态 ----
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "workers": self.live_workers(),
+            "path": self.config["path"],
+            "waiting_tasks": len(self._waiters),
+            **self._counters,
+        }
+
+    def close(self):
+        """注销当前工作进程并停止后台线程"""
+        if self.started:
+            self._writes.put(None)
+            self._sock.sendto(json.dumps({"type": "stop"}).encode("utf-8"), self._sock.getsockname())
+            for thread in self._threads:
+                thread.join(timeout=5)
+            with self.transaction() as db:
+                db.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+                db.execute("DELETE FROM sse_connections WHERE worker_id = ?", (self.worker_id,))
+                db.execute("DELETE FROM task_waiters WHERE worker_id = ?", (self.worker_id,))
+                db.execute("DELETE FROM batches WHERE worker_id = ?", (self.worker_id,))
+            self._sock.close()
+            self._sock = None
+        with self._db_lock:
+            self._db.close()
+
+
+_shared_state: Optional[SharedState] = None
+_shared_state_pid: Optional[int] = None
+_shared_state_lock = threading.Lock()
+
+
+def get_shared_state() -> Optional[SharedState]:
+    """获取当前工作进程的共享状态，未启用（SHARED_STATE_CONFIG["enabled"] 为 False）时返回None"""
+    global _shared_state, _shared_state_pid
+    if not SHARED_STATE_CONFIG["enabled"]:
+        return None
+    with _shared_state_lock:
+        # 按进程号区分：fork 出的工作进程重新创建
+        if _shared_state is None or _shared_state_pid != os.getpid():
+            _shared_state = SharedState()
+            _shared_state_pid = os.getpid()
+        return _shared_state
+
+
+def close_shared_state():
+    """关闭当前工作进程的共享状态"""
+    global _shared_state
+    with _shared_state_lock:
+        if _shared_state is not None and _shared_state_pid == os.getpid():
+            _shared_state.close()
+        _shared_state = None
@@ -0,0 +1,321 @@
+"""
+SQLite持久化的任务结果存储
+在内存存储（TaskResultStore）之外把任务的提交、开始和结束写入SQLite（WAL模式）：
+状态变更先进入内存队列，由后台线程成批写入并提交，请求线程不等待磁盘；
+进程重启后可以查询之前的任务状态，并取回未结束的任务重新排队；
+多个工作进程共用一个文件时（见 API/shared_state.py），每个任务记录所在的进程，只接管已退出进程的任务
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from .config import logger, SHARED_STATE_CONFIG
+from .shared_state import WORKERS_SCHEMA, current_worker_id
+from .task_store import TaskResultStore, _CompactStreamResult
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    pool TEXT NOT NULL,
+    user_id TEXT,
+    task_type TEXT,
+    priority INTEGER,
+    payload TEXT,          -- 可恢复任务的参数（JSON），为NULL的任务重启后无法恢复
+    timeout REAL,
+    worker TEXT,           -- 提交或接管任务的工作进程
+    status TEXT NOT NULL,
+    result TEXT,           -- 结果（JSON）
+    result_format TEXT,    -- json 或 stream（流式结果的紧凑形式）
+    error TEXT,
+    stats TEXT,
+    created_at REAL,
+    started_at REAL,
+    finished_at REAL,
+    execution_time REAL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_pool_status ON tasks(pool, status);
+CREATE INDEX IF NOT EXISTS idx_tasks_user ON tasks(user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_finished ON tasks(pool, finished_at);
+"""
+
+_COLUMNS = "task_id, status, result, result_format, error, stats, started_at, finished_at, execution_time"
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[float]:
+    return value.timestamp() if value is not None else None
+
+
+def _datetime(value: Optional[float]) -> Optional[datetime]:
+    return datetime.fromtimestamp(value) if value is not None else None
+
+
+def _dumps(value: Any) -> Optional[str]:
+    return json.dumps(value, ensure_ascii=False, default=str) if value is not None else None
+
+
+class SQLiteTaskStore(TaskResultStore):
+    """内存存储 + SQLite持久化（线程安全）"""
+
+    durable = True
+
+    def __init__(self, config: Dict[str, Any] = None, name: str = "default", clock: Callable[[], float] = time.time):
+        """
+        Args:
+            config: 配置，未提供的字段使用 TASK_STORE_CONFIG 中的默认值（sqlite_path、commit_batch_size 等）
+            name: 线程池名称，多个线程池共用一个数据库文件，按名称区分
+            clock: 时间函数，默认 time.time
+        """
+        super().__init__(config, name=name, clock=clock)
+        path = self.config["sqlite_path"]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._writer_db = self._connect(path)
+        self._writer_db.executescript(_SCHEMA + WORKERS_SCHEMA)
+        columns = {row[1] for row in self._writer_db.execute("PRAGMA table_info(tasks)")}
+        if "worker" not in columns:
+            self._writer_db.execute("ALTER TABLE tasks ADD COLUMN worker TEXT")
+        self.worker_id = current_worker_id()
+        self.on_finished: Optional[Callable[[List[str]], Any]] = None  # 结束状态提交后调用，参数为任务ID列表
+        self._reader_db = self._connect(path)
+        self._read_lock = threading.Lock()
+        self._writes: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._db_counters = {"commits": 0, "writes": 0, "write_errors": 0}
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, daemon=True, name=f"{name}_task_store_writer")
+        self._writer.start()
+
+    @staticmethod
+    def _connect(path: str) -> sqlite3.Connection:
+        db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")  # WAL模式下进程崩溃不丢已提交的数据，只有断电可能丢失最后几次提交
+        db.execute("PRAGMA busy_timeout=5000")
+        return db
+
+    # ---- 写入 ----
+
+    def put(self, task_result, user_id: str = None, task_request=None):
+        super().put(task_result, user_id, task_request)
+        status = task_result.status.value
+        if status == "pending" and task_request is not None:
+            self._writes.put(("submit", (
+                task_result.task_id, self.name, task_request.user_id, task_request.task_type, task_request.priority,
+                _dumps(task_request.payload), task_request.timeout, self.worker_id, status,
+                _timestamp(task_request.created_at),
+            )))
+        elif status in ("pending", "running"):
+            self._writes.put(("status", (status, _timestamp(task_result.started_at), task_result.task_id)))
+        else:
+            self._writes.put(("finish", task_result))
+
+    def _write_loop(self):
+        # 阻塞等待第一条变更，再取走队列中已有的变更一起提交：空闲时不唤醒，繁忙时自然成批
+        batch_size = self.config["commit_batch_size"]
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < batch_size:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            stop = self._apply(batch)
+            if stop:
+                return
+
+    def _apply(self, batch: List[tuple]) -> bool:
+        waiters, finished, stop = [], [], False
+        try:
+            self._writer_db.execute("BEGIN")
+            for kind, data in batch:
+                if kind == "submit":
+                    self._writer_db.execute(
+                        "INSERT INTO tasks (task_id, pool, user_id, task_type, priority, payload, timeout, worker, status, "
+                        "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(task_id) DO UPDATE SET "
+                        "worker = excluded.worker, status = excluded.status, result = NULL, error = NULL, "
+                        "started_at = NULL, finished_at = NULL",
+                        data)
+                elif kind == "status":
+                    self._writer_db.execute("UPDATE tasks SET status = ?, started_at = ? WHERE task_id = ?", data)
+                elif kind == "finish":
+                    self._writer_db.execute(
+                        "INSERT INTO tasks (task_id, pool, status, result, result_format, error, stats, "
+                        "started_at, finished_at, execution_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT(task_id) DO UPDATE SET status = excluded.status, result = excluded.result, "
+                        "result_format = excluded.result_format, error = excluded.error, stats = excluded.stats, "
+                        "started_at = COALESCE(excluded.started_at, tasks.started_at), "
+                        "finished_at = excluded.finished_at, execution_time = excluded.execution_time",
+                        self._finish_row(data))
+                    finished.append(data.task_id)
+                elif kind == "delete":
+                    self._writer_db.execute("DELETE FROM tasks WHERE pool = ? AND finished_at < ?", (self.name, data))
+                else:
+                    waiters.append(data)
+                    stop = stop or kind == "close"
+            self._writer_db.execute("COMMIT")
+            self._db_counters["commits"] += 1
+            self._db_counters["writes"] += len(batch) - len(waiters)
+        except sqlite3.Error as e:
+            finished = []
+            self._db_counters["write_errors"] += 1
+            logger.error(f"写入任务状态失败（{len(batch)}条变更）: {e}")
+            try:
+                self._writer_db.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+        if finished and self.on_finished is not None:
+            try:
+                self.on_finished(finished)
+            except Exception as e:
+                logger.error(f"通知任务结束失败: {e}")
+        for event in waiters:
+            event.set()
+        return stop
+
+    def _finish_row(self, task_result) -> tuple:
+        result = _CompactStreamResult.compact(task_result.result)
+        if isinstance(result, _CompactStreamResult):
+            result_text, result_format = _dumps(result.to_json()), "stream"
+        else:
+            result_text, result_format = _dumps(result), "json"
+        return (
+            task_result.task_id, self.name, task_result.status.value, result_text, result_format, task_result.error,
+            _dumps(task_result.stats), _timestamp(task_result.started_at),
+            _timestamp(task_result.completed_at) or self._clock(), task_result.execution_time,
+        )
+
+    def flush(self):
+        """等待此前的状态变更全部提交"""
+        if self._closed:
+            return
+        event = threading.Event()
+        self._writes.put(("flush", event))
+        event.wait()
+
+    def cleanup(self, max_age_seconds: float) -> int:
+        removed = super().cleanup(max_age_seconds)
+        self._writes.put(("delete", self._clock() - max_age_seconds))
+        return removed
+
+    def close(self):
+        """提交剩余的状态变更并关闭数据库连接"""
+        if self._closed:
+            return
+        self._closed = True
+        event = threading.Event()
+        self._writes.put(("close", event))
+        event.wait()
+        self._writer.join()
+        self._writer_db.close()
+        with self._read_lock:
+            self._reader_db.close()
+
+    # ---- 读取 ----
+
+    def _query(self, sql: str, params: tuple) -> List[tuple]:
+        with self._read_lock:
+            return self._reader_db.execute(sql, params).fetchall()
+
+    def _row_to_result(self, row: tuple, with_result: bool = True):
+        # 延迟导入，services 模块依赖本模块
+        from .services import TaskResult, TaskStatus
+        task_id, status, result, result_format, error, stats, started_at, finished_at, execution_time = row
+        if with_result and result is not None:
+            result = json.loads(result)
+            if result_format == "stream":
+                result = _CompactStreamResult.from_json(result).expand()
+        else:
+            result = None
+        return TaskResult(
+            task_id=task_id,
+            status=TaskStatus(status),
+            result=result,
+            error=error,
+            started_at=_datetime(started_at),
+            completed_at=_datetime(finished_at),
+            execution_time=execution_time or 0.0,
+            stats=json.loads(stats) if stats else None,
+        )
+
+    def get(self, task_id: str):
+        """获取任务状态：先查内存，内存中已淘汰或重启前的任务从SQLite读取（按主键查询）"""
+        task_result = super().get(task_id)
+        if task_result is not None:
+            return task_result
+        rows = self._query(f"SELECT {_COLUMNS} FROM tasks WHERE task_id = ? AND pool = ?", (task_id, self.name))
+        if not rows:
+            return None
+        finished_at = rows[0][7]
+        if finished_at is not None and self._clock() - finished_at > self.config["ttl"]:
+            return None
+        return self._row_to_result(rows[0])
+
+    def list_user_tasks(self, user_id: str, limit: int = 50) -> List[Any]:
+        tasks = super().list_user_tasks(user_id, limit)
+        if len(tasks) >= limit:
+            return tasks
+        seen = {task.task_id for task in tasks}
+        deadline = self._clock() - self.config["ttl"]
+        rows = self._query(
+            f"SELECT {_COLUMNS} FROM tasks WHERE user_id = ? AND pool = ? "
+            f"AND (finished_at IS NULL OR finished_at >= ?) ORDER BY created_at DESC LIMIT ?",
+            (user_id, self.name, deadline, limit + len(seen)))
+        for row in rows:
+            if row[0] not in seen and len(tasks) < limit:
+                tasks.append(self._row_to_result(row, with_result=False))
+        return tasks
+
+    def get_worker(self, task_id: str) -> Optional[str]:
+        """任务所在的工作进程"""
+        rows = self._query("SELECT worker FROM tasks WHERE task_id = ? AND pool = ?", (task_id, self.name))
+        return rows[0][0] if rows else None
+
+    def load_unfinished(self) -> List[Dict[str, Any]]:
+        """
+        接管已退出的工作进程（包括上次运行的本进程）未结束的任务
+
+        所在进程仍在注册表中且心跳未超时的任务不接管；查询和接管在同一个写事务中，多个进程同时接管时每个任务只归一个进程
+
+        Returns:
+            List[Dict]: 按提交顺序排列，包含 task_id、user_id、task_type、priority、timeout 和 payload（无法恢复的任务为None）
+        """
+        self.flush()
+        cutoff = time.time() - SHARED_STATE_CONFIG["heartbeat_interval"] * SHARED_STATE_CONFIG["worker_timeout_beats"]
+        with self._read_lock:
+            self._reader_db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._reader_db.execute(
+                    "SELECT t.task_id, t.user_id, t.task_type, t.priority, t.timeout, t.payload FROM tasks t "
+                    "LEFT JOIN workers w ON w.worker_id = t.worker "
+                    "WHERE t.pool = ? AND t.status IN ('pending', 'running') AND t.worker IS NOT ? "
+                    "AND (w.worker_id IS NULL OR w.heartbeat < ?) ORDER BY t.created_at",
+                    (self.name, self.worker_id, cutoff)).fetchall()
+                self._reader_db.executemany("UPDATE tasks SET worker = ? WHERE task_id = ?",
+                                            [(self.worker_id, row[0]) for row in rows])
+                self._reader_db.execute("COMMIT")
+            except BaseException:
+                self._reader_db.execute("ROLLBACK")
+                raise
+        return [
+            {
+                "task_id": task_id, "user_id": user_id, "task_type": task_type, "priority": priority,
+                "timeout": timeout, "payload": json.loads(payload) if payload is not None else None,
+            }
+            for task_id, user_id, task_type, priority, timeout, payload in rows
+        ]
+
+    def get_status(self) -> Dict[str, Any]:
+        status = super().get_status()
+        status.update({
+            "backend": "sqlite",
+            "sqlite_path": self.config["sqlite_path"],
+            "worker_id": self.worker_id,
+            "pending_writes": self._writes.qsize(),
+            **self._db_counters,
+        })
+        return status
@@ -7,7 +7,7 @@ import asyncio
 from datetime import datetime
 from typing import Dict, List, Any
 
-from .config import logger, SSE_CONFIG
+from .config import logger, SSE_CONFIG, SHARED_STATE_CONFIG
 
 
 class SSEMessage:
@@ -58,17 +58,17 @@ class SSEMessage:
         )
     
     @staticmethod
-    def error(error_msg: str, error_code: str = None) -> str:
-        """错误消息"""
-        return SSEMessage.format_message(
-            data={
-                "type": "error",
-                "message": error_msg,
-                "code": error_code,
-                "timestamp": datetime.now().isoformat()
-            },
-            event="error"
-        )
+    def error(error_msg: str, error_code: str = None, retry_after: int = None) -> str:
+        """错误消息（retry_after 为建议的重试等待秒数，服务繁忙拒绝请求时提供）"""
+        data = {
+            "type": "error",
+            "message": error_msg,
+            "code": error_code,
+            "timestamp": datetime.now().isoformat()
+        }
+        if retry_after is not None:
+            data["retry_after"] = retry_after
+        return SSEMessage.format_message(data=data, event="error")
     
     @staticmethod
     def content_chunk(chunk: str, chunk_type: str = "content", metadata: Dict = None) -> str:
@@ -113,35 +113,59 @@ class SSEMessage:
 
 
 class SSEConnectionManager:
-    """SSE连接管理器"""
+    """SSE连接管理器
+    
+    connections 只包含当前工作进程的连接；设置 shared（多进程共享状态）后连接同时登记到共享存储，
+    查询用户连接和连接总数时包含所有工作进程
+    """
     
     def __init__(self):
         self.connections: Dict[str, Dict] = {}
+        self.shared = None  # API.shared_state.SharedState
     
     def add_connection(self, connection_id: str, user_id: str):
         """添加连接"""
         self.connections[connection_id] = {
             "user_id": user_id,
             "connected_at": datetime.now(),
-            "last_heartbeat": datetime.now()
+            "last_heartbeat": datetime.now(),
+            "shared_heartbeat": datetime.now()
         }
+        if self.shared is not None:
+            self.shared.register_connection(connection_id, user_id)
     
     def remove_connection(self, connection_id: str):
         """移除连接"""
         if connection_id in self.connections:
             del self.connections[connection_id]
+            if self.shared is not None:
+                self.shared.unregister_connection(connection_id)
     
     def get_user_connections(self, user_id: str) -> List[str]:
         """获取用户的所有连接"""
+        if self.shared is not None:
+            return self.shared.user_connections(user_id)
         return [
             conn_id for conn_id, info in self.connections.items()
             if info["user_id"] == user_id
         ]
     
+    def connection_count(self) -> int:
+        """连接总数"""
+        if self.shared is not None:
+            return self.shared.connection_count()
+        return len(self.connections)
+    
     def update_heartbeat(self, connection_id: str):
-        """更新心跳时间"""
-        if connection_id in self.connections:
-            self.connections[connection_id]["last_heartbeat"] = datetime.now()
+        """更新心跳时间（每个片段都会调用，写入共享存储时按间隔节流）"""
+        info = self.connections.get(connection_id)
+        if info is None:
+            return
+        now = datetime.now()
+        info["last_heartbeat"] = now
+        if self.shared is not None and (now - info["shared_heartbeat"]).total_seconds() >= SHARED_STATE_CONFIG["connection_heartbeat_interval"]:
+            info["shared_heartbeat"] = now
+            self.shared.touch_connection(connection_id)
     
     async def cleanup_expired_connections(self):
         """清理过期连接"""
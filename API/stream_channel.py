@@ -0,0 +1,123 @@
+"""
+线程池流式任务到事件循环的有界通道
+工作线程每读到一个片段就放入通道，SSE生成器在事件循环中等待读取，片段产生后立即发给客户端；
+通道满时工作线程等待（背压），客户端断开后工作线程的写入立即返回失败
+"""
+
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Optional, Tuple
+
+
+class StreamChannel:
+    """单生产者（工作线程）、单消费者（事件循环）的有界通道"""
+
+    # get() 返回的事件类型
+    CHUNK = "chunk"      # 文本片段
+    END = "end"          # 生产者正常结束，值为生产者提供的结果
+    ERROR = "error"      # 生产者失败，值为异常
+    TIMEOUT = "timeout"  # 等待超时，值为None
+
+    def __init__(self, maxsize: int = 256, loop: asyncio.AbstractEventLoop = None):
+        """
+        Args:
+            maxsize: 最多缓存的片段数
+            loop: 消费者所在的事件循环，默认使用当前正在运行的事件循环
+        """
+        self.maxsize = maxsize
+        self._loop = loop or asyncio.get_running_loop()
+        self._items: deque = deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._waiter: Optional[asyncio.Future] = None
+        self._finished = False
+        self._result: Any = None
+        self._error: Optional[BaseException] = None
+        self._abandoned = False
+
+    @property
+    def abandoned(self) -> bool:
+        """消费者是否已离开"""
+        return self._abandoned
+
+    def _wake_consumer(self):
+        # 在事件循环线程中执行
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def _notify_consumer(self):
+        # 调用方持有锁；只在消费者等待时跨线程唤醒，避免每个片段都调度一次回调
+        if self._waiter is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wake_consumer)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    def put(self, chunk: str, timeout: float = None) -> bool:
+        """
+        放入一个片段（工作线程调用），通道满时等待消费者读取
+
+        Args:
+            chunk: 文本片段
+            timeout: 通道满时最多等待的秒数，None表示一直等待
+
+        Returns:
+            bool: 是否放入；消费者已离开或等待超时时返回False，生产者应停止生成
+        """
+        with self._not_full:
+            if not self._not_full.wait_for(lambda: self._abandoned or len(self._items) < self.maxsize, timeout):
+                return False
+            if self._abandoned:
+                return False
+            self._items.append(chunk)
+            self._notify_consumer()
+            return True
+
+    def finish(self, result: Any = None, error: BaseException = None):
+        """结束通道（工作线程调用），error 不为None时表示生产者失败"""
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            self._result = result
+            self._error = error
+            self._notify_consumer()
+
+    def abandon(self):
+        """消费者离开（事件循环调用），唤醒等待写入的生产者"""
+        with self._not_full:
+            self._abandoned = True
+            self._items.clear()
+            self._not_full.notify_all()
+
+    async def get(self, timeout: float = None) -> Tuple[str, Any]:
+        """
+        读取下一个事件（事件循环调用）
+
+        Args:
+            timeout: 没有新事件时最多等待的秒数
+
+        Returns:
+            (事件类型, 值)：(CHUNK, 片段)、(END, 结果)、(ERROR, 异常) 或 (TIMEOUT, None)
+        """
+        while True:
+            with self._not_full:
+                if self._items:
+                    chunk = self._items.popleft()
+                    self._not_full.notify()
+                    return self.CHUNK, chunk
+                if self._finished:
+                    if self._error is not None:
+                        return self.ERROR, self._error
+                    return self.END, self._result
+                self._waiter = self._loop.create_future()
+                waiter = self._waiter
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                return self.TIMEOUT, None
+            finally:
+                with self._lock:
+                    self._waiter = None
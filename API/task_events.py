@@ -0,0 +1,254 @@
+"""
+任务状态推送
+线程池在任务状态变更（排队、开始执行、结束）时发布事件，SSE订阅者按任务或用户接收，
+用户登记的webhook在任务结束时收到回调（成批发送、失败重试），客户端不必轮询任务状态
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Set
+from urllib.parse import urlparse
+
+import httpx
+
+from .config import logger, TASK_EVENTS_CONFIG
+
+TERMINAL_STATUSES = {"completed", "failed", "timeout", "cancelled"}
+
+
+def task_event(pool: str, user_id: Optional[str], task_result) -> Dict[str, Any]:
+    """把 TaskResult 转换为推送的事件，结束状态的事件包含结果"""
+    status = task_result.status.value
+    event = {
+        "type": "task_status",
+        "task_id": task_result.task_id,
+        "user_id": user_id,
+        "pool": pool,
+        "status": status,
+        "timestamp": datetime.now().isoformat()
+    }
+    if status in TERMINAL_STATUSES:
+        event.update({
+            "result": task_result.result,
+            "error": task_result.error,
+            "started_at": task_result.started_at.isoformat() if task_result.started_at else None,
+            "completed_at": task_result.completed_at.isoformat() if task_result.completed_at else None,
+            "execution_time": task_result.execution_time,
+            "stats": task_result.stats
+        })
+    return event
+
+
+class TaskSubscription:
+    """一个SSE订阅者的事件队列（只在事件循环中使用）"""
+
+    def __init__(self, task_id: str = None, user_id: str = None, maxsize: int = 100):
+        self.task_id = task_id
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.dropped = 0  # 读取过慢时丢弃的最早事件数
+
+    def offer(self, event: Dict[str, Any]):
+        """放入事件，队列已满时丢弃最早的事件"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float = None) -> Optional[Dict[str, Any]]:
+        """等待下一个事件，超时返回None"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class _WebhookTarget:
+    """一个webhook地址的待发送事件"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.pending: List[Dict[str, Any]] = []
+        self.sender: Optional[asyncio.Task] = None
+
+
+class TaskEventBus:
+    """任务事件总线
+
+    publish 可以在任意线程调用（工作线程持有线程池锁时也只调度一个事件循环回调），分发在事件循环中进行。
+    webhook 登记在启用共享状态时保存在共享存储中，由执行任务的工作进程发送回调
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = {**TASK_EVENTS_CONFIG, **(config or {})}
+        self.shared = None  # API.shared_state.SharedState
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task_subscribers: Dict[str, Set[TaskSubscription]] = {}
+        self._user_subscribers: Dict[str, Set[TaskSubscription]] = {}
+        self._webhooks: Dict[str, Set[str]] = {}  # 未启用共享状态时的登记：用户ID -> 地址
+        self._webhook_cache: Dict[str, tuple] = {}  # 共享状态的登记缓存：用户ID -> (读取时间, 地址列表)
+        self._targets: Dict[str, _WebhookTarget] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._counters = {"events_published": 0, "webhook_batches_sent": 0, "webhook_events_sent": 0,
+                          "webhook_retries": 0, "webhook_events_dropped": 0}
+
+    def bind(self, loop: asyncio.AbstractEventLoop = None):
+        """绑定分发事件的事件循环（应用启动时调用），绑定前发布的事件被忽略"""
+        self._loop = loop or asyncio.get_running_loop()
+
+    # ---- 发布 ----
+
+    def publish(self, event: Dict[str, Any]):
+        """发布事件（线程安全）"""
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._deliver, event)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    def _deliver(self, event: Dict[str, Any]):
+        self._counters["events_published"] += 1
+        for subscription in self._task_subscribers.get(event["task_id"], ()):
+            subscription.offer(event)
+        user_id = event.get("user_id")
+        if user_id is None:
+            return
+        for subscription in self._user_subscribers.get(user_id, ()):
+            subscription.offer(event)
+        if event["status"] in TERMINAL_STATUSES:
+            for url in self.user_webhooks(user_id):
+                self._enqueue_webhook(url, event)
+
+    # ---- SSE订阅 ----
+
+    def subscribe(self, task_id: str = None, user_id: str = None) -> TaskSubscription:
+        """订阅一个任务或一个用户所有任务的事件（在事件循环中调用）"""
+        subscription = TaskSubscription(task_id, user_id, self.config["subscriber_queue_size"])
+        if task_id is not None:
+            self._task_subscribers.setdefault(task_id, set()).add(subscription)
+        else:
+            self._user_subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: TaskSubscription):
+        index, key = ((self._task_subscribers, subscription.task_id) if subscription.task_id is not None
+                      else (self._user_subscribers, subscription.user_id))
+        subscribers = index.get(key)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del index[key]
+
+    # ---- webhook登记 ----
+
+    def validate_webhook_url(self, url: str) -> Optional[str]:
+        """检查webhook地址，返回错误原因，地址可用时返回None"""
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            return "webhook地址必须是 http 或 https URL"
+        allowed = self.config["webhook_allowed_hosts"]
+        if allowed and parsed.hostname not in allowed:
+            return f"webhook地址的主机 {parsed.hostname} 不在允许列表中: {', '.join(allowed)}"
+        return None
+
+    def add_webhook(self, user_id: str, url: str):
+        """登记用户的webhook，用户的任务结束时向该地址发送回调"""
+        if self.shared is not None:
+            self.shared.add_webhook(user_id, url)
+            self._webhook_cache.pop(user_id, None)
+        else:
+            self._webhooks.setdefault(user_id, set()).add(url)
+
+    def remove_webhook(self, user_id: str, url: str) -> bool:
+        """注销用户的webhook，返回是否存在"""
+        if self.shared is not None:
+            self._webhook_cache.pop(user_id, None)
+            return self.shared.remove_webhook(user_id, url)
+        urls = self._webhooks.get(user_id)
+        if not urls or url not in urls:
+            return False
+        urls.discard(url)
+        if not urls:
+            del self._webhooks[user_id]
+        return True
+
+    def user_webhooks(self, user_id: str) -> List[str]:
+        """用户登记的webhook地址（共享存储中的登记缓存 webhook_cache_ttl 秒）"""
+        if self.shared is None:
+            return sorted(self._webhooks.get(user_id, ()))
+        cached = self._webhook_cache.get(user_id)
+        now = time.monotonic()
+        if cached is None or now - cached[0] >= self.config["webhook_cache_ttl"]:
+            cached = (now, self.shared.user_webhooks(user_id))
+            self._webhook_cache[user_id] = cached
+        return cached[1]
+
+    # ---- webhook发送 ----
+
+    def _enqueue_webhook(self, url: str, event: Dict[str, Any]):
+        target = self._targets.get(url)
+        if target is None:
+            target = self._targets[url] = _WebhookTarget(url)
+        target.pending.append(event)
+        overflow = len(target.pending) - self.config["webhook_max_pending"]
+        if overflow > 0:
+            del target.pending[:overflow]
+            self._counters["webhook_events_dropped"] += overflow
+        if target.sender is None or target.sender.done():
+            target.sender = asyncio.ensure_future(self._send_webhooks(target))
+
+    async def _send_webhooks(self, target: _WebhookTarget):
+        """把积累的事件成批发送到一个webhook地址，失败时按指数退避重试"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.config["webhook_timeout"])
+        # 等待一小段时间，让同时结束的任务合并到一批
+        await asyncio.sleep(self.config["webhook_batch_interval"])
+        while target.pending:
+            batch = target.pending[:self.config["webhook_batch_size"]]
+            del target.pending[:len(batch)]
+            for attempt in range(self.config["webhook_max_retries"] + 1):
+                try:
+                    response = await self._client.post(target.url, json={"events": batch})
+                    if response.status_code < 300:
+                        self._counters["webhook_batches_sent"] += 1
+                        self._counters["webhook_events_sent"] += len(batch)
+                        break
+                    error = f"状态码 {response.status_code}"
+                except httpx.HTTPError as e:
+                    error = str(e) or type(e).__name__
+                if attempt == self.config["webhook_max_retries"]:
+                    self._counters["webhook_events_dropped"] += len(batch)
+                    logger.warning(f"webhook {target.url} 发送失败（{error}），已放弃 {len(batch)} 个事件")
+                    break
+                self._counters["webhook_retries"] += 1
+                await asyncio.sleep(self.config["webhook_retry_backoff"] * 2 ** attempt)
+        if not target.pending and self._targets.get(target.url) is target:
+            del self._targets[target.url]
+
+    # ---- 状态 ----
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "task_subscribers": sum(len(subscribers) for subscribers in self._task_subscribers.values()),
+            "user_subscribers": sum(len(subscribers) for subscribers in self._user_subscribers.values()),
+            "webhook_targets_pending": sum(len(target.pending) for target in self._targets.values()),
+            **self._counters
+        }
+
+    async def aclose(self):
+        """停止发送webhook并关闭HTTP客户端"""
+        for target in list(self._targets.values()):
+            if target.sender is not None:
+                target.sender.cancel()
+        self._targets.clear()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._loop = None
+
+
+# 全局任务事件总线
+task_events = TaskEventBus()
@@ -0,0 +1,360 @@
+"""
+线程池任务结果存储
+排队中和执行中的任务常驻内存；已结束任务的结果按TTL过期，并受条目数和内存预算限制，超出时淘汰最久未访问的结果。
+流式任务的结果只保存完整文本和每个片段的长度，读取时再切分出片段；
+启用落盘时较大的结果写入磁盘，内存中只保留状态。按用户建立二级索引，用于列出用户的任务
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Any, Callable, Dict, List, Optional
+
+from .config import logger, TASK_STORE_CONFIG
+
+
+# 每个已结束条目的固定开销估算（TaskResult、索引和字典项），结果本身另算
+_ENTRY_OVERHEAD = 600
+
+
+def _estimate_size(obj: Any, depth: int = 0) -> int:
+    """粗略估算对象占用的内存（字节）"""
+    size = sys.getsizeof(obj)
+    if depth > 8:
+        return size
+    if isinstance(obj, dict):
+        size += sum(_estimate_size(key, depth + 1) + _estimate_size(value, depth + 1) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_estimate_size(item, depth + 1) for item in obj)
+    return size
+
+
+class _CompactStreamResult:
+    """流式任务结果的紧凑形式：片段只保存长度，文本只保存一份"""
+
+    __slots__ = ("fields", "lengths")
+
+    def __init__(self, fields: Dict[str, Any], lengths: array):
+        self.fields = fields      # 去掉 chunks 的结果字典，包含 full_content
+        self.lengths = lengths    # 每个片段的字符数
+
+    @classmethod
+    def compact(cls, result: Any) -> Any:
+        """结果为 {"chunks": [...], "full_content": ...} 且文本一致时返回紧凑形式，否则原样返回"""
+        if not isinstance(result, dict):
+            return result
+        chunks = result.get("chunks")
+        text = result.get("full_content")
+        if not isinstance(chunks, list) or not isinstance(text, str) or "".join(chunks) != text:
+            return result
+        fields = {key: value for key, value in result.items() if key != "chunks"}
+        return cls(fields, array("I", (len(chunk) for chunk in chunks)))
+
+    def expand(self) -> Dict[str, Any]:
+        text = self.fields["full_content"]
+        chunks, start = [], 0
+        for length in self.lengths:
+            chunks.append(text[start:start + length])
+            start += length
+        return {"chunks": chunks, **self.fields}
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"fields": self.fields, "lengths": self.lengths.tolist()}
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "_CompactStreamResult":
+        return cls(data["fields"], array("I", data["lengths"]))
+
+    def estimate_size(self) -> int:
+        return _estimate_size(self.fields) + self.lengths.buffer_info()[1] * self.lengths.itemsize
+
+
+class _StoredResult:
+    """已结束任务的存储条目"""
+
+    __slots__ = ("task_result", "user_id", "finished_at", "size", "spill_path")
+
+    def __init__(self, task_result, user_id: Optional[str], finished_at: float, size: int, spill_path: Optional[str]):
+        self.task_result = task_result  # result 字段为紧凑形式，已落盘时为None
+        self.user_id = user_id
+        self.finished_at = finished_at
+        self.size = size                # 计入内存预算的估算大小
+        self.spill_path = spill_path
+
+
+class TaskResultStore:
+    """有界的任务结果存储（线程安全）"""
+
+    durable = False  # 状态是否在重启后保留
+
+    def __init__(self, config: Dict[str, Any] = None, name: str = "default", clock: Callable[[], float] = time.time):
+        """
+        Args:
+            config: 配置，未提供的字段使用 TASK_STORE_CONFIG 中的默认值
+            name: 存储名称（线程池名称），落盘时作为子目录
+            clock: 时间函数，默认 time.time
+        """
+        self.config = {**TASK_STORE_CONFIG, **(config or {})}
+        self.name = name
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._live: Dict[str, Any] = {}                                # 未结束任务 -> TaskResult
+        self._live_users: Dict[str, Optional[str]] = {}
+        self._done: "OrderedDict[str, _StoredResult]" = OrderedDict()  # 已结束任务，按访问顺序排列
+        self._by_user: Dict[str, "OrderedDict[str, None]"] = {}        # 用户 -> 任务ID（按提交顺序）
+        self._memory_bytes = 0
+        self._spilled_entries = 0  # 结果已落盘的已结束任务数
+        self._last_sweep = clock()
+        self._counters = {"evictions": 0, "expired": 0, "spilled": 0, "spill_errors": 0}
+
+    @property
+    def _budget(self) -> int:
+        return int(self.config["memory_budget_mb"] * 1024 * 1024)
+
+    def _spill_dir(self) -> str:
+        return os.path.join(self.config["spill_dir"], self.name)
+
+    def _index(self, task_id: str, user_id: Optional[str]):
+        if user_id is not None:
+            self._by_user.setdefault(user_id, OrderedDict())[task_id] = None
+
+    def _unindex(self, task_id: str, user_id: Optional[str]):
+        tasks = self._by_user.get(user_id)
+        if tasks is not None:
+            tasks.pop(task_id, None)
+            if not tasks:
+                del self._by_user[user_id]
+
+    def put(self, task_result, user_id: str = None, task_request=None):
+        """
+        保存任务状态；状态为 PENDING/RUNNING 的任务常驻内存，其余视为已结束
+
+        Args:
+            task_result: TaskResult
+            user_id: 提交任务的用户（首次保存时提供，之后沿用）
+            task_request: 提交时的 TaskRequest（首次保存时提供），持久化存储用它在重启后恢复任务
+        """
+        task_id = task_result.task_id
+        if task_result.status.value in ("pending", "running"):
+            with self._lock:
+                if user_id is None:
+                    user_id = self._live_users.get(task_id)
+                self._drop(task_id, unindex=False)
+                self._live[task_id] = task_result
+                self._live_users[task_id] = user_id
+                self._index(task_id, user_id)
+            return
+
+        compact = _CompactStreamResult.compact(task_result.result)
+        if isinstance(compact, _CompactStreamResult):
+            size = compact.estimate_size()
+        else:
+            size = _estimate_size(compact)
+        spill_path = None
+        if self.config["spill_enabled"] and size >= self.config["spill_threshold"]:
+            spill_path = self._write_spill(task_id, compact)
+            if spill_path is not None:
+                compact, size = None, 0
+        stored_result = replace(task_result, result=compact)
+
+        with self._lock:
+            if user_id is None:
+                user_id = self._live_users.get(task_id)
+                if user_id is None and task_id in self._done:
+                    user_id = self._done[task_id].user_id
+            self._drop(task_id, unindex=False)
+            self._done[task_id] = _StoredResult(stored_result, user_id, self._clock(), size + _ENTRY_OVERHEAD, spill_path)
+            self._memory_bytes += size + _ENTRY_OVERHEAD
+            if spill_path:
+                self._spilled_entries += 1
+            self._index(task_id, user_id)
+            self._enforce_limits()
+        self._maybe_sweep()
+
+    def _drop(self, task_id: str, unindex: bool = True) -> Optional[_StoredResult]:
+        # 调用方持有锁；unindex 为False时保留用户索引中的位置（任务状态更新）
+        self._live.pop(task_id, None)
+        user_id = self._live_users.pop(task_id, None)
+        entry = self._done.pop(task_id, None)
+        if entry is not None:
+            self._memory_bytes -= entry.size
+            user_id = entry.user_id
+            if entry.spill_path:
+                self._spilled_entries -= 1
+                self._remove_spill(entry.spill_path)
+        if unindex:
+            self._unindex(task_id, user_id)
+        return entry
+
+    def _enforce_limits(self):
+        # 调用方持有锁：超出条目数或内存预算时淘汰最久未访问的结果
+        while self._done and (len(self._done) > self.config["max_entries"] or self._memory_bytes > self._budget):
+            self._drop(next(iter(self._done)))
+            self._counters["evictions"] += 1
+
+    def _expired(self, entry: _StoredResult, now: float) -> bool:
+        return now - entry.finished_at > self.config["ttl"]
+
+    def get(self, task_id: str):
+        """
+        获取任务状态
+
+        Returns:
+            TaskResult: 未结束的任务返回正在更新的对象，已结束的任务返回完整结果的副本；不存在或已过期时返回None
+        """
+        with self._lock:
+            task_result = self._live.get(task_id)
+            if task_result is not None:
+                return task_result
+            entry = self._done.get(task_id)
+            if entry is None:
+                return None
+            if self._expired(entry, self._clock()):
+                self._drop(task_id)
+                self._counters["expired"] += 1
+                return None
+            self._done.move_to_end(task_id)
+            stored_result, spill_path = entry.task_result, entry.spill_path
+
+        result = self._read_spill(spill_path) if spill_path else stored_result.result
+        if isinstance(result, _CompactStreamResult):
+            result = result.expand()
+        return replace(stored_result, result=result)
+
+    def list_user_tasks(self, user_id: str, limit: int = 50) -> List[Any]:
+        """
+        列出用户最近提交的任务（新任务在前，不含结果内容）
+
+        Returns:
+            List[TaskResult]: result 字段为None的任务状态
+        """
+        now = self._clock()
+        tasks = []
+        with self._lock:
+            for task_id in reversed(list(self._by_user.get(user_id, ()))):
+                if len(tasks) >= limit:
+                    break
+                task_result = self._live.get(task_id)
+                if task_result is None:
+                    entry = self._done[task_id]
+                    if self._expired(entry, now):
+                        continue
+                    task_result = entry.task_result
+                tasks.append(replace(task_result, result=None))
+        return tasks
+
+    def _maybe_sweep(self):
+        now = self._clock()
+        with self._lock:
+            if now - self._last_sweep < self.config["sweep_interval"]:
+                return
+            self._last_sweep = now
+        self.cleanup(self.config["ttl"])
+
+    def cleanup(self, max_age_seconds: float) -> int:
+        """
+        删除结束时间早于 max_age_seconds 秒之前的任务结果
+
+        Returns:
+            int: 删除的任务数
+        """
+        deadline = self._clock() - max_age_seconds
+        with self._lock:
+            old_task_ids = [task_id for task_id, entry in self._done.items() if entry.finished_at < deadline]
+            for task_id in old_task_ids:
+                self._drop(task_id)
+            self._counters["expired"] += len(old_task_ids)
+        return len(old_task_ids)
+
+    def _write_spill(self, task_id: str, result: Any) -> Optional[str]:
+        if isinstance(result, _CompactStreamResult):
+            data = {"compact": result.to_json()}
+        else:
+            data = {"result": result}
+        path = os.path.join(self._spill_dir(), f"{task_id}.json")
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            # 无法序列化的结果留在内存中
+            with self._lock:
+                self._counters["spill_errors"] += 1
+            logger.warning(f"任务结果落盘失败 {task_id}: {e}")
+            return None
+        with self._lock:
+            self._counters["spilled"] += 1
+        return path
+
+    def _read_spill(self, path: str) -> Any:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            with self._lock:
+                self._counters["spill_errors"] += 1
+            logger.error(f"读取落盘的任务结果失败 {path}: {e}")
+            return None
+        if "compact" in data:
+            return _CompactStreamResult.from_json(data["compact"])
+        return data["result"]
+
+    @staticmethod
+    def _remove_spill(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取存储占用等统计"""
+        with self._lock:
+            return {
+                "backend": "memory",
+                "live_tasks": len(self._live),
+                "finished_tasks": len(self._done),
+                "users": len(self._by_user),
+                "memory_bytes": self._memory_bytes,
+                "memory_budget_bytes": self._budget,
+                "spilled_tasks": self._spilled_entries,
+                **self._counters,
+            }
+
+    def load_unfinished(self) -> List[Dict[str, Any]]:
+        """上次运行时未结束的任务（持久化存储重启后恢复用），内存存储没有"""
+        return []
+
+    def get_worker(self, task_id: str) -> Optional[str]:
+        """任务所在的工作进程（多进程共享存储用），内存存储的任务都在当前进程"""
+        return None
+
+    def flush(self):
+        """等待尚未写入的状态变更完成（持久化存储用）"""
+
+    def close(self):
+        """释放存储占用的资源"""
+
+
+def create_task_store(name: str, config: Dict[str, Any] = None) -> TaskResultStore:
+    """
+    按配置创建任务结果存储
+
+    Args:
+        name: 线程池名称
+        config: 配置，未提供的字段使用 TASK_STORE_CONFIG 中的默认值
+
+    Returns:
+        TaskResultStore: backend 为 "sqlite" 时为 SQLiteTaskStore，否则为内存存储
+    """
+    config = {**TASK_STORE_CONFIG, **(config or {})}
+    if config["backend"] == "sqlite":
+        from .sqlite_task_store import SQLiteTaskStore
+        return SQLiteTaskStore(config, name=name)
+    return TaskResultStore(config, name=name)
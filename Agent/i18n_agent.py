@@ -131,7 +131,34 @@ PROMPT_TEMPLATES: Dict[Language, Dict[str, str]] = {
 2. 改进表达方式和结构
 3. 增强吸引力和互动性
 4. 避免重复原文案的表达
-"""
+""",
+        "regeneration_with_context": """
+用户对上面的文案不满意，请根据原始需求重新生成一个更好的版本。
+请生成一个全新的、更优质的文案版本，避免重复之前的内容和表达方式。
+""",
+        
+        "optimization_with_context": """
+请优化上面的文案，让它更加吸引人和有效：
+1. 提升标题吸引力
+2. 改善内容结构和可读性
+3. 优化用词表达
+4. 增强互动性
+5. 完善话题标签
+
+请提供优化后的完整文案。
+""",
+        
+        "conversation_replay": """
+以下是之前的对话记录：
+{history}
+
+请结合上面的对话回复用户的最新消息：
+{message}
+""",
+        
+        "conversation_user_turn": "用户：{content}",
+        
+        "conversation_assistant_turn": "助手：{content}"
     },
     
     Language.EN_US: {
@@ -248,7 +275,34 @@ Requirements:
 2. Improve expression and structure
 3. Enhance attractiveness and interactivity
 4. Avoid repeating original expressions
-"""
+""",
+        "regeneration_with_context": """
+The user is not satisfied with the content above. Please regenerate a better version based on the original requirements.
+Please generate a brand new, higher quality content version, avoiding repetition of previous content and expressions.
+""",
+        
+        "optimization_with_context": """
+Please optimize the content above to make it more attractive and effective:
+1. Improve title attractiveness
+2. Improve content structure and readability
+3. Optimize word choice and expression
+4. Enhance interactivity
+5. Perfect the hashtags
+
+Please provide the complete optimized content.
+""",
+        
+        "conversation_replay": """
+Here is the previous conversation:
+{history}
+
+Please reply to the user's latest message in the context of the conversation above:
+{message}
+""",
+        
+        "conversation_user_turn": "User: {content}",
+        
+        "conversation_assistant_turn": "Assistant: {content}"
     },
     
     Language.ZH_TW: {
@@ -365,7 +419,34 @@ Requirements:
 2. 改進表達方式和結構
 3. 增強吸引力和互動性
 4. 避免重複原文案的表達
-"""
+""",
+        "regeneration_with_context": """
+用戶對上面的文案不滿意，請根據原始需求重新生成一個更好的版本。
+請生成一個全新的、更優質的文案版本，避免重複之前的內容和表達方式。
+""",
+        
+        "optimization_with_context": """
+請優化上面的文案，讓它更加吸引人和有效：
+1. 提升標題吸引力
+2. 改善內容結構和可讀性
+3. 優化用詞表達
+4. 增強互動性
+5. 完善話題標籤
+
+請提供優化後的完整文案。
+""",
+        
+        "conversation_replay": """
+以下是之前的對話記錄：
+{history}
+
+請結合上面的對話回覆用戶的最新消息：
+{message}
+""",
+        
+        "conversation_user_turn": "用戶：{content}",
+        
+        "conversation_assistant_turn": "助手：{content}"
     },
     
     Language.JA_JP: {
@@ -482,7 +563,34 @@ Xiaohongshuハッシュタグ専門家として、以下のコンテンツに関
 2. 表現と構造を改善
 3. 魅力とインタラクティブ性を向上
 4. 元の表現の重複を避ける
-"""
+""",
+        "regeneration_with_context": """
+ユーザーは上記のコンテンツに満足していません。元の要件に基づいて、より良いバージョンを再生成してください。
+以前のコンテンツと表現の重複を避けて、まったく新しい、より高品質なコンテンツバージョンを生成してください。
+""",
+        
+        "optimization_with_context": """
+上記のコンテンツをより魅力的で効果的になるように最適化してください：
+1. タイトルの魅力を向上
+2. コンテンツの構造と読みやすさを改善
+3. 言葉遣いと表現を最適化
+4. インタラクティブ性を強化
+5. ハッシュタグを充実させる
+
+最適化された完全なコンテンツを提供してください。
+""",
+        
+        "conversation_replay": """
+これまでの会話履歴は以下の通りです：
+{history}
+
+上記の会話を踏まえて、ユーザーの最新メッセージに返信してください：
+{message}
+""",
+        
+        "conversation_user_turn": "ユーザー：{content}",
+        
+        "conversation_assistant_turn": "アシスタント：{content}"
     }
 }
 
@@ -14,6 +14,13 @@ from enum import Enum
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from LLM.ollama_client import OllamaClient
+from LLM.async_ollama_client import AsyncOllamaClient
+from LLM.context_store import ConversationContextStore, content_fingerprint
+from LLM.response_cache import replay_frames, areplay_frames
+from LLM.semantic_cache import SemanticCache
+from LLM.stats import GenerationStats, TokenStream, AsyncTokenStream, extract_response
+from LLM.cancellation import CancellationToken
+from LLM.exceptions import GenerationCancelled
 from .i18n_agent import (
     Language, 
     get_prompt_template, 
@@ -121,15 +128,19 @@ class OllamaLangChainLLM(LLM):
 class XiaohongshuAgent:
     """小红书文案生成智能体"""
     
-    def __init__(self, enable_stream: bool = True, enable_thinking: bool = True):
+    def __init__(self, enable_stream: bool = True, enable_thinking: bool = True, reuse_context: bool = None):
         """初始化智能体
         
         Args:
             enable_stream: 是否启用流式响应
             enable_thinking: 是否启用思考模式
+            reuse_context: 是否按用户复用Ollama返回的上下文token（默认读取 OLLAMA_CONTEXT_REUSE）
         """
+        # 客户端使用进程内共享连接池，LangChain适配器复用同一个客户端
         self.ollama_client = OllamaClient()
+        self.async_ollama_client = AsyncOllamaClient()
         self.llm = OllamaLangChainLLM(
+            ollama_client=self.ollama_client,
             enable_stream=enable_stream,
             enable_thinking=enable_thinking
         )
@@ -137,6 +148,10 @@ class XiaohongshuAgent:
             memory_key="chat_history",
             return_messages=True
         )
+        # 每个用户的对话和文案上下文，多轮对话和反馈回环时只需发送新增的提示词
+        self.context_store = ConversationContextStore(None if reuse_context is None else {"enabled": reuse_context})
+        # 主题近似重复缓存，近似主题的文案请求（use_cache）直接返回之前的结果
+        self.semantic_cache = SemanticCache()
         
         # 存储配置
         self.enable_stream = enable_stream
@@ -349,8 +364,8 @@ class XiaohongshuAgent:
         
         return True
     
-    def generate_complete_post(self, request: ContentRequest) -> Dict[str, Any]:
-        """生成完整的小红书文案"""
+    def generate_complete_post(self, request: ContentRequest, use_cache: bool = False) -> Dict[str, Any]:
+        """生成完整的小红书文案（use_cache为True时使用生成结果缓存）"""
         
         try:
             # 获取语言参数
@@ -387,14 +402,32 @@ class XiaohongshuAgent:
             if not self.enable_thinking:
                 requirement += "/no_think"
             
+            # 近似主题已有结果时直接返回
+            cached = self._semantic_lookup(request, None, use_cache)
+            if cached is not None:
+                return {
+                    "success": True,
+                    "content": cached,
+                    "request": request.__dict__,
+                    "stats": GenerationStats(done_reason="cache").to_dict()
+                }
+            
             # 直接使用 Ollama 客户端生成内容，避免 LangChain Agent 的中文干扰
-            result = self.ollama_client.generate(requirement, stream=self.enable_stream)
+            stats = []
+            result = self.ollama_client.generate(requirement, stream=self.enable_stream, on_stats=stats.append,
+                                                 use_cache=use_cache)
+            if use_cache and self.semantic_cache.enabled and stats and stats[0].done_reason != "length":
+                self.semantic_cache.add(self._semantic_partition(request, None), request.topic, result)
             
             return {
                 "success": True,
                 "content": result,
-                "request": request.__dict__
+                "request": request.__dict__,
+                "stats": stats[0].to_dict() if stats else None
             }
+        except GenerationCancelled:
+            # 线程池任务被取消，交给线程池把任务标记为 CANCELLED
+            raise
         except Exception as e:
             return {
                 "success": False,
@@ -402,8 +435,9 @@ class XiaohongshuAgent:
                 "request": request.__dict__
             }
     
-    def optimize_content(self, content: str, language: str = "zh-CN") -> Dict[str, Any]:
-        """优化现有内容"""
+    def optimize_content(self, content: str, language: str = "zh-CN", user_id: str = None,
+                         use_cache: bool = False) -> Dict[str, Any]:
+        """优化现有内容（use_cache为True时使用生成结果缓存）"""
         try:
             # 获取语言参数
             try:
@@ -411,8 +445,11 @@ class XiaohongshuAgent:
             except ValueError:
                 lang = Language.ZH_CN
             
+            # 启用上下文复用且该文案仍在缓存中时，提示词不再包含原文案
+            context = self._post_context(user_id, content)
+            
             # 使用国际化模板
-            prompt_template = get_prompt_template("content_optimization", lang)
+            prompt_template = get_prompt_template("optimization_with_context" if context is not None else "content_optimization", lang)
             optimization_query = prompt_template.format(content=content)
             
             # 添加语言指令
@@ -423,13 +460,17 @@ class XiaohongshuAgent:
                 optimization_query += "/no_think"
             
             # 直接使用 Ollama 客户端，避免 LangChain Agent 的中文干扰
-            result = self.ollama_client.generate(optimization_query, stream=self.enable_stream)
+            stats = []
+            result = self._generate_post(optimization_query, user_id, context, on_stats=stats.append, use_cache=use_cache)
             
             return {
                 "success": True,
                 "original": content,
-                "optimized": result
+                "optimized": result,
+                "stats": stats[0].to_dict() if stats else None
             }
+        except GenerationCancelled:
+            raise
         except Exception as e:
             return {
                 "success": False,
@@ -452,6 +493,8 @@ class XiaohongshuAgent:
             
             response = self.agent.run(contextualized_message)
             return response
+        except GenerationCancelled:
+            raise
         except Exception as e:
             # 根据语言返回错误消息
             error_messages = {
@@ -466,6 +509,10 @@ class XiaohongshuAgent:
             except ValueError:
                 return error_messages[Language.ZH_CN]
     
+    async def aclose(self):
+        """释放异步客户端持有的连接"""
+        await self.async_ollama_client.aclose()
+    
     def update_config(self, enable_stream: bool = None, enable_thinking: bool = None):
         """更新配置"""
         if enable_stream is not None:
@@ -476,8 +523,12 @@ class XiaohongshuAgent:
             self.enable_thinking = enable_thinking
             self.llm.enable_thinking = enable_thinking
     
-    def generate_complete_post_stream(self, request: ContentRequest, enable_thinking: bool = None):
-        """流式生成完整的小红书文案"""
+    def _build_post_prompt(self, request: ContentRequest, enable_thinking: bool = None):
+        """构建流式文案生成的提示词和系统提示
+        
+        Returns:
+            tuple: (提示词, 系统提示词或None)
+        """
         
         try:
             # 获取语言参数
@@ -522,43 +573,184 @@ class XiaohongshuAgent:
         elif language == Language.ZH_TW:
             system_prompt = "您是小紅書的專業內容創作者。請使用繁體中文回答，不要使用簡體字。"
         
+        return requirement, system_prompt
+
+    def _reuse_context(self, user_id: Optional[str]) -> bool:
+        """是否对该用户启用上下文复用（需要用户ID区分会话）"""
+        return bool(user_id) and self.context_store.config["enabled"]
+    
+    def _post_context(self, user_id: Optional[str], content: str) -> Optional[List[int]]:
+        """获取生成 content 时保存的上下文；content 不是该用户最近一次生成的文案或缓存已失效时返回None"""
+        if not self._reuse_context(user_id):
+            return None
+        return self.context_store.get(user_id, "post", self.ollama_client.model_name, content_fingerprint(content))
+    
+    def _save_post_context(self, user_id: Optional[str]):
+        """返回在生成结束后保存文案上下文的回调，未启用上下文复用时返回None"""
+        if not self._reuse_context(user_id):
+            return None
+        
+        def on_done(stream):
+            self.context_store.put(user_id, "post", self.ollama_client.model_name, stream.context, content_fingerprint(stream.text))
+        return on_done
+    
+    def _generate_post(self, prompt: str, user_id: str = None, context: List[int] = None, on_stats=None,
+                       use_cache: bool = False) -> Optional[str]:
+        """非流式生成文案；启用上下文复用时通过流式接口读取，以便取得并保存新的上下文"""
+        if not self._reuse_context(user_id):
+            return self.ollama_client.generate(prompt, stream=self.enable_stream, on_stats=on_stats, use_cache=use_cache)
+        stream = self.ollama_client.generate_stream(prompt, user_id=user_id, on_stats=on_stats, context=context,
+                                                    on_done=self._save_post_context(user_id), use_cache=use_cache)
+        return "".join(stream)
+
+    def _semantic_partition(self, request: ContentRequest, enable_thinking: bool = None) -> tuple:
+        """近似重复缓存的分区键：分类、语言和其他生成参数都相同时才比较主题"""
+        thinking_enabled = enable_thinking if enable_thinking is not None else self.enable_thinking
+        return (request.category.value, request.language, request.tone, request.length, request.target_audience,
+                tuple(request.keywords or ()), request.special_requirements, thinking_enabled,
+                self.ollama_client.model_name)
+    
+    def _semantic_lookup(self, request: ContentRequest, enable_thinking: bool = None, use_cache: bool = False) -> Optional[str]:
+        """查找近似主题已生成的文案，未启用或未命中时返回None"""
+        if not (use_cache and self.semantic_cache.enabled):
+            return None
+        match = self.semantic_cache.lookup(self._semantic_partition(request, enable_thinking), request.topic)
+        return match["value"] if match is not None else None
+    
+    def _save_semantic(self, request: ContentRequest, enable_thinking: bool = None, use_cache: bool = False, on_done=None):
+        """返回在流结束后把文案加入近似重复缓存的回调（并调用原有的回调）"""
+        if not (use_cache and self.semantic_cache.enabled):
+            return on_done
+        partition = self._semantic_partition(request, enable_thinking)
+        
+        def save(stream):
+            # 被长度截断的文案不缓存
+            if stream.stats is not None and stream.stats.done_reason != "length":
+                self.semantic_cache.add(partition, request.topic, stream.text)
+            if on_done is not None:
+                on_done(stream)
+        return save
+    
+    def generate_complete_post_stream(self, request: ContentRequest, enable_thinking: bool = None, user_id: str = None,
+                                      coalesce: bool = False, use_cache: bool = False, cancel_token: CancellationToken = None):
+        """流式生成完整的小红书文案（coalesce为True时与进行中的相同请求共享一次生成，use_cache为True时命中缓存则分片回放，
+        cancel_token 取消时中断上游生成）"""
+        cached = self._semantic_lookup(request, enable_thinking, use_cache)
+        if cached is not None:
+            chunk_chars = self.ollama_client.response_cache.config["replay_chunk_chars"]
+            return TokenStream(replay_frames(cached, chunk_chars), extract_response, on_done=self._save_post_context(user_id))
+        
+        requirement, system_prompt = self._build_post_prompt(request, enable_thinking)
+        on_done = self._save_semantic(request, enable_thinking, use_cache, self._save_post_context(user_id))
+        
         # 使用流式生成器，传递系统提示
-        return self.ollama_client.generate_stream(requirement, system_prompt)
+        return self.ollama_client.generate_stream(requirement, system_prompt, user_id=user_id,
+                                                  on_done=on_done, coalesce=coalesce, use_cache=use_cache,
+                                                  cancel_token=cancel_token)
+    
+    def generate_complete_post_astream(self, request: ContentRequest, enable_thinking: bool = None, user_id: str = None,
+                                       coalesce: bool = False, use_cache: bool = False):
+        """异步流式生成完整的小红书文案（不阻塞事件循环），流结束后 stats 属性为生成统计"""
+        cached = self._semantic_lookup(request, enable_thinking, use_cache)
+        if cached is not None:
+            chunk_chars = self.async_ollama_client.response_cache.config["replay_chunk_chars"]
+            return AsyncTokenStream(areplay_frames(cached, chunk_chars), extract_response,
+                                    on_done=self._save_post_context(user_id))
+        
+        requirement, system_prompt = self._build_post_prompt(request, enable_thinking)
+        on_done = self._save_semantic(request, enable_thinking, use_cache, self._save_post_context(user_id))
+        
+        return self.async_ollama_client.generate_stream(requirement, system_prompt, user_id=user_id,
+                                                        on_done=on_done, coalesce=coalesce, use_cache=use_cache)
 
-    def chat_stream(self, message: str, language: str = "zh-CN", enable_thinking: bool = None):
-        """流式对话"""
+    def _contextualize_chat_message(self, message: str, language: str = "zh-CN", enable_thinking: bool = None) -> str:
+        """为聊天消息添加语言指令和思考模式标记"""
+        # 为聊天消息添加语言上下文
         try:
-            # 为聊天消息添加语言上下文
-            try:
-                lang = Language(language)
-            except ValueError:
-                lang = Language.ZH_CN
-            
-            # 使用标准化的语言指令，并将语言信息附加到消息中
-            language_instruction = get_language_instruction(lang)
-            contextualized_message = f"{language_instruction}。|language:{language}|用户消息：{message}"
+            lang = Language(language)
+        except ValueError:
+            lang = Language.ZH_CN
+        
+        # 使用标准化的语言指令，并将语言信息附加到消息中
+        language_instruction = get_language_instruction(lang)
+        contextualized_message = f"{language_instruction}。|language:{language}|用户消息：{message}"
+        
+        # 处理思考模式 - 优先使用参数，否则使用实例设置
+        thinking_enabled = enable_thinking if enable_thinking is not None else self.enable_thinking
+        if not thinking_enabled and not contextualized_message.endswith("/no_think"):
+            contextualized_message += "/no_think"
+        return contextualized_message
+    
+    def _build_chat_messages(self, message: str, language: str = "zh-CN", enable_thinking: bool = None) -> List[Dict[str, str]]:
+        """构建对话消息列表（包含最近的对话历史）"""
+        contextualized_message = self._contextualize_chat_message(message, language, enable_thinking)
+        
+        # 构建对话消息
+        messages = [{"role": "user", "content": contextualized_message}]
+        
+        # 如果有对话历史，添加到消息中
+        chat_history = self.memory.chat_memory.messages
+        if chat_history:
+            # 转换LangChain消息格式到Ollama格式
+            for msg in chat_history[-10:]:  # 只保留最近10条消息
+                if hasattr(msg, 'content'):
+                    if isinstance(msg, HumanMessage):
+                        messages.insert(-1, {"role": "user", "content": msg.content})
+                    elif isinstance(msg, AIMessage):
+                        messages.insert(-1, {"role": "assistant", "content": msg.content})
+        
+        return messages
+    
+    def _chat_fingerprint(self) -> str:
+        # 对话记忆发生变化（如经由 chat() 新增了消息）后，缓存的上下文不再包含完整的对话
+        return str(len(self.memory.chat_memory.messages))
+    
+    def _build_context_chat_prompt(self, message: str, language: str = "zh-CN", enable_thinking: bool = None,
+                                   user_id: str = None):
+        """上下文复用模式下构建对话提示词
+        
+        Returns:
+            tuple: (提示词, 上下文token或None)；上下文失效时提示词包含最近的对话记录（完整重放）
+        """
+        try:
+            lang = Language(language)
+        except ValueError:
+            lang = Language.ZH_CN
+        
+        contextualized_message = self._contextualize_chat_message(message, language, enable_thinking)
+        context = self.context_store.get(user_id, "chat", self.ollama_client.model_name, self._chat_fingerprint())
+        chat_history = self.memory.chat_memory.messages
+        if context is not None or not chat_history:
+            return contextualized_message, context
+        
+        turns = []
+        for msg in chat_history[-10:]:  # 与消息模式一样只重放最近10条消息
+            if isinstance(msg, HumanMessage):
+                turns.append(get_prompt_template("conversation_user_turn", lang).format(content=msg.content))
+            elif isinstance(msg, AIMessage):
+                turns.append(get_prompt_template("conversation_assistant_turn", lang).format(content=msg.content))
+        prompt = get_prompt_template("conversation_replay", lang).format(history="\n".join(turns), message=contextualized_message)
+        return prompt, None
+    
+    def _save_chat_context(self, user_id: str):
+        """返回在对话结束后保存上下文的回调"""
+        def on_done(stream):
+            self.context_store.put(user_id, "chat", self.ollama_client.model_name, stream.context, self._chat_fingerprint())
+        return on_done
+    
+    def chat_stream(self, message: str, language: str = "zh-CN", enable_thinking: bool = None, user_id: str = None,
+                    cancel_token: CancellationToken = None):
+        """流式对话（启用上下文复用时从该用户上一轮的上下文继续，cancel_token 取消时中断上游生成）"""
+        try:
+            if self._reuse_context(user_id):
+                prompt, context = self._build_context_chat_prompt(message, language, enable_thinking, user_id)
+                return self.ollama_client.generate_stream(prompt, user_id=user_id, context=context,
+                                                          on_done=self._save_chat_context(user_id), cancel_token=cancel_token)
             
-            # 处理思考模式 - 优先使用参数，否则使用实例设置
-            thinking_enabled = enable_thinking if enable_thinking is not None else self.enable_thinking
-            if not thinking_enabled and not contextualized_message.endswith("/no_think"):
-                contextualized_message += "/no_think"
-            
-            # 构建对话消息
-            messages = [{"role": "user", "content": contextualized_message}]
-            
-            # 如果有对话历史，添加到消息中
-            chat_history = self.memory.chat_memory.messages
-            if chat_history:
-                # 转换LangChain消息格式到Ollama格式
-                for msg in chat_history[-10:]:  # 只保留最近10条消息
-                    if hasattr(msg, 'content'):
-                        if isinstance(msg, HumanMessage):
-                            messages.insert(-1, {"role": "user", "content": msg.content})
-                        elif isinstance(msg, AIMessage):
-                            messages.insert(-1, {"role": "assistant", "content": msg.content})
+            messages = self._build_chat_messages(message, language, enable_thinking)
             
             # 使用流式生成器
-            return self.ollama_client.chat_stream(messages)
+            return self.ollama_client.chat_stream(messages, user_id=user_id, cancel_token=cancel_token)
         except Exception as e:
             def error_generator():
                 # 根据语言返回错误消息
@@ -575,8 +767,41 @@ class XiaohongshuAgent:
                     yield error_messages[Language.ZH_CN]
             return error_generator()
 
-    def optimize_content_stream(self, content: str, language: str = "zh-CN", enable_thinking: bool = None):
-        """流式优化现有内容"""
+    def chat_astream(self, message: str, language: str = "zh-CN", enable_thinking: bool = None, user_id: str = None):
+        """异步流式对话（不阻塞事件循环），流结束后 stats 属性为生成统计"""
+        try:
+            if self._reuse_context(user_id):
+                prompt, context = self._build_context_chat_prompt(message, language, enable_thinking, user_id)
+                return self.async_ollama_client.generate_stream(prompt, user_id=user_id, context=context,
+                                                                on_done=self._save_chat_context(user_id))
+            messages = self._build_chat_messages(message, language, enable_thinking)
+        except Exception as e:
+            async def error_generator():
+                # 根据语言返回错误消息
+                error_messages = {
+                    Language.ZH_CN: f"对话出错：{str(e)}",
+                    Language.EN_US: f"Chat error: {str(e)}",
+                    Language.ZH_TW: f"對話出錯：{str(e)}",
+                    Language.JA_JP: f"チャットエラー：{str(e)}"
+                }
+                try:
+                    yield error_messages.get(Language(language), error_messages[Language.ZH_CN])
+                except ValueError:
+                    yield error_messages[Language.ZH_CN]
+            return error_generator()
+        
+        return self.async_ollama_client.chat_stream(messages, user_id=user_id)
+
+    def _build_optimization_prompt(self, content: str, language: str = "zh-CN", enable_thinking: bool = None,
+                                   continued: bool = False):
+        """构建流式内容优化的提示词和系统提示
+        
+        Args:
+            continued: 是否从生成该文案时的上下文继续，此时提示词不再包含原文案
+        
+        Returns:
+            tuple: (提示词, 系统提示词或None)
+        """
         try:
             # 获取语言参数
             lang = Language(language)
@@ -584,7 +809,7 @@ class XiaohongshuAgent:
             lang = Language.ZH_CN
         
         # 使用国际化模板
-        prompt_template = get_prompt_template("content_optimization", lang)
+        prompt_template = get_prompt_template("optimization_with_context" if continued else "content_optimization", lang)
         optimization_query = prompt_template.format(content=content)
         
         # 添加语言指令
@@ -604,10 +829,29 @@ class XiaohongshuAgent:
         elif lang == Language.ZH_TW:
             system_prompt = "您是小紅書の專業內容優化專家。請使用繁體中文回答，不要使用簡體字。"
         
+        return optimization_query, system_prompt
+
+    def optimize_content_stream(self, content: str, language: str = "zh-CN", enable_thinking: bool = None, user_id: str = None,
+                                use_cache: bool = False, cancel_token: CancellationToken = None):
+        """流式优化现有内容（cancel_token 取消时中断上游生成）"""
+        context = self._post_context(user_id, content)
+        optimization_query, system_prompt = self._build_optimization_prompt(content, language, enable_thinking, continued=context is not None)
+        
         # 使用流式生成器，传递系统提示
-        return self.ollama_client.generate_stream(optimization_query, system_prompt)
+        return self.ollama_client.generate_stream(optimization_query, system_prompt, user_id=user_id, context=context,
+                                                  on_done=self._save_post_context(user_id), use_cache=use_cache,
+                                                  cancel_token=cancel_token)
+    
+    def optimize_content_astream(self, content: str, language: str = "zh-CN", enable_thinking: bool = None, user_id: str = None,
+                                 use_cache: bool = False):
+        """异步流式优化现有内容（不阻塞事件循环），流结束后 stats 属性为生成统计"""
+        context = self._post_context(user_id, content)
+        optimization_query, system_prompt = self._build_optimization_prompt(content, language, enable_thinking, continued=context is not None)
+        
+        return self.async_ollama_client.generate_stream(optimization_query, system_prompt, user_id=user_id, context=context,
+                                                        on_done=self._save_post_context(user_id), use_cache=use_cache)
 
-    def intelligent_loop(self, content: str, user_feedback: str, content_request: ContentRequest = None, language: str = "zh-CN"):
+    def intelligent_loop(self, content: str, user_feedback: str, content_request: ContentRequest = None, language: str = "zh-CN", user_id: str = None):
         """智能体回环处理
         
         Args:
@@ -615,6 +859,7 @@ class XiaohongshuAgent:
             user_feedback: 用户反馈 ("不满意", "满意", "需要优化", "重新生成")
             content_request: 原始内容请求，用于重新生成
             language: 回复语言，默认简体中文
+            user_id: 用户ID（可选），启用上下文复用时从生成该文案时的上下文继续
             
         Returns:
             Dict: 处理结果
@@ -661,10 +906,10 @@ class XiaohongshuAgent:
             if user_feedback == "不满意" or user_feedback == "重新生成":
                 # 用户不满意，重新生成内容
                 if content_request:
-                    return self.regenerate_with_improvements(content_request, content)
+                    return self.regenerate_with_improvements(content_request, content, user_id=user_id)
                 else:
                     # 如果没有原始请求，尝试从内容中推断并重新生成
-                    return self.regenerate_from_content(content, language)
+                    return self.regenerate_from_content(content, language, user_id=user_id)
                     
             elif user_feedback == "满意":
                 # 用户满意，询问是否需要优化
@@ -677,7 +922,7 @@ class XiaohongshuAgent:
                 
             elif user_feedback == "需要优化":
                 # 用户需要优化，执行智能优化
-                return self.optimize_content(content, language)
+                return self.optimize_content(content, language, user_id=user_id)
                 
             elif user_feedback == "不需要优化，已完成":
                 # 用户完全满意，结束流程
@@ -696,6 +941,8 @@ class XiaohongshuAgent:
                     "message": messages[lang]["unknown_feedback"]
                 }
                 
+        except GenerationCancelled:
+            raise
         except Exception as e:
             return {
                 "success": False,
@@ -703,7 +950,7 @@ class XiaohongshuAgent:
                 "message": messages[lang]["error_occurred"]
             }
     
-    def regenerate_with_improvements(self, request: ContentRequest, previous_content: str):
+    def regenerate_with_improvements(self, request: ContentRequest, previous_content: str, user_id: str = None):
         """基于用户不满意重新生成改进版本"""
         try:
             # 获取语言参数
@@ -720,35 +967,11 @@ class XiaohongshuAgent:
                 Language.JA_JP: "改良版を再生成しました。満足いただけるかご確認ください"
             }
             
-            # 使用国际化模板
-            prompt_template = get_prompt_template("regeneration_with_improvements", language)
-            
-            # 格式化关键词和特殊要求
-            keywords_section = format_keywords_section(request.keywords, language)
-            special_requirements_section = format_special_requirements_section(request.special_requirements, language)
-            
-            # 翻译分类到目标语言
-            translated_category = translate_category(request.category.value, language)
-            
-            improvement_prompt = prompt_template.format(
-                category=translated_category,
-                topic=request.topic,
-                tone=request.tone,
-                length=request.length,
-                target_audience=request.target_audience,
-                keywords_section=keywords_section,
-                special_requirements_section=special_requirements_section,
-                previous_content=previous_content
-            )
-            
-            # 添加语言指令
-            improvement_prompt = add_language_instruction_to_prompt(improvement_prompt, language)
+            # 启用上下文复用且之前的文案仍在缓存中时，只发送简短的重新生成指令
+            context = self._post_context(user_id, previous_content)
+            improvement_prompt = self._build_improvement_prompt(request, previous_content, continued=context is not None)
             
-            # 处理思考模式
-            if not self.enable_thinking:
-                improvement_prompt += "/no_think"
-            
-            result = self.ollama_client.generate(improvement_prompt, stream=self.enable_stream)
+            result = self._generate_post(improvement_prompt, user_id, context)
             
             return {
                 "success": True,
@@ -757,6 +980,8 @@ class XiaohongshuAgent:
                 "message": messages[language]
             }
             
+        except GenerationCancelled:
+            raise
         except Exception as e:
             return {
                 "success": False,
@@ -764,7 +989,7 @@ class XiaohongshuAgent:
                 "action": "error"
             }
     
-    def regenerate_from_content(self, content: str, language: str = "zh-CN"):
+    def regenerate_from_content(self, content: str, language: str = "zh-CN", user_id: str = None):
         """从现有内容推断需求并重新生成"""
         try:
             # 获取语言参数
@@ -781,18 +1006,10 @@ class XiaohongshuAgent:
                 Language.JA_JP: "元のコンテンツに基づいて改良版を再生成しました"
             }
             
-            # 使用国际化模板
-            prompt_template = get_prompt_template("regeneration_from_content", lang)
-            regeneration_prompt = prompt_template.format(content=content)
-            
-            # 添加语言指令
-            regeneration_prompt = add_language_instruction_to_prompt(regeneration_prompt, lang)
+            context = self._post_context(user_id, content)
+            regeneration_prompt = self._build_regeneration_prompt(content, language, continued=context is not None)
             
-            # 处理思考模式
-            if not self.enable_thinking:
-                regeneration_prompt += "/no_think"
-            
-            result = self.ollama_client.generate(regeneration_prompt, stream=self.enable_stream)
+            result = self._generate_post(regeneration_prompt, user_id, context)
             
             return {
                 "success": True,
@@ -801,6 +1018,8 @@ class XiaohongshuAgent:
                 "message": messages[lang]
             }
             
+        except GenerationCancelled:
+            raise
         except Exception as e:
             return {
                 "success": False,
@@ -808,8 +1027,9 @@ class XiaohongshuAgent:
                 "action": "error"
             }
     
-    def intelligent_loop_stream(self, content: str, user_feedback: str, content_request: ContentRequest = None, language: str = "zh-CN"):
-        """流式智能体回环处理"""
+    def intelligent_loop_stream(self, content: str, user_feedback: str, content_request: ContentRequest = None, language: str = "zh-CN", user_id: str = None,
+                                cancel_token: CancellationToken = None):
+        """流式智能体回环处理（cancel_token 取消时中断上游生成）"""
         # 获取语言参数
         try:
             lang = Language(language)
@@ -848,13 +1068,14 @@ class XiaohongshuAgent:
             if user_feedback == "不满意" or user_feedback == "重新生成":
                 # 重新生成流式版本
                 if content_request:
-                    return self.regenerate_with_improvements_stream(content_request, content)
+                    return self.regenerate_with_improvements_stream(content_request, content, user_id=user_id,
+                                                                    cancel_token=cancel_token)
                 else:
-                    return self.regenerate_from_content_stream(content, language)
+                    return self.regenerate_from_content_stream(content, language, user_id=user_id, cancel_token=cancel_token)
                     
             elif user_feedback == "需要优化":
                 # 流式优化
-                return self.optimize_content_stream(content, language)
+                return self.optimize_content_stream(content, language, user_id=user_id, cancel_token=cancel_token)
                 
             else:
                 # 对于其他情况，返回简单的生成器
@@ -873,8 +1094,27 @@ class XiaohongshuAgent:
                 yield f"{messages[lang]['error']}{str(e)}"
             return error_response()
     
-    def regenerate_with_improvements_stream(self, request: ContentRequest, previous_content: str):
-        """流式重新生成改进版本"""
+    def intelligent_loop_astream(self, content: str, user_feedback: str, content_request: ContentRequest = None, language: str = "zh-CN", user_id: str = None):
+        """异步流式智能体回环处理（需要调用模型的分支不阻塞事件循环，且返回的流带有 stats 属性）"""
+        if user_feedback == "不满意" or user_feedback == "重新生成":
+            if content_request:
+                return self.regenerate_with_improvements_astream(content_request, content, user_id=user_id)
+            return self.regenerate_from_content_astream(content, language, user_id=user_id)
+        if user_feedback == "需要优化":
+            return self.optimize_content_astream(content, language, user_id=user_id)
+        
+        async def fixed_messages():
+            # 其他反馈只返回固定提示消息，无需访问模型
+            for chunk in self.intelligent_loop_stream(content, user_feedback, content_request, language):
+                yield chunk
+        return fixed_messages()
+    
+    def _build_improvement_prompt(self, request: ContentRequest, previous_content: str, continued: bool = False) -> str:
+        """构建重新生成改进版本的提示词
+        
+        Args:
+            continued: 是否从生成之前文案时的上下文继续，此时提示词不再包含原始需求和之前的文案
+        """
         # 获取语言参数
         try:
             language = Language(request.language) if hasattr(request, 'language') and request.language else Language.ZH_CN
@@ -882,7 +1122,7 @@ class XiaohongshuAgent:
             language = Language.ZH_CN
         
         # 使用国际化模板
-        prompt_template = get_prompt_template("regeneration_with_improvements", language)
+        prompt_template = get_prompt_template("regeneration_with_context" if continued else "regeneration_with_improvements", language)
         
         # 格式化关键词和特殊要求
         keywords_section = format_keywords_section(request.keywords, language)
@@ -909,10 +1149,29 @@ class XiaohongshuAgent:
         if not self.enable_thinking:
             improvement_prompt += "/no_think"
         
-        return self.ollama_client.generate_stream(improvement_prompt)
+        return improvement_prompt
     
-    def regenerate_from_content_stream(self, content: str, language: str = "zh-CN"):
-        """流式从现有内容重新生成"""
+    def regenerate_with_improvements_stream(self, request: ContentRequest, previous_content: str, user_id: str = None,
+                                            cancel_token: CancellationToken = None):
+        """流式重新生成改进版本"""
+        context = self._post_context(user_id, previous_content)
+        prompt = self._build_improvement_prompt(request, previous_content, continued=context is not None)
+        return self.ollama_client.generate_stream(prompt, user_id=user_id, context=context,
+                                                  on_done=self._save_post_context(user_id), cancel_token=cancel_token)
+    
+    def regenerate_with_improvements_astream(self, request: ContentRequest, previous_content: str, user_id: str = None):
+        """异步流式重新生成改进版本"""
+        context = self._post_context(user_id, previous_content)
+        prompt = self._build_improvement_prompt(request, previous_content, continued=context is not None)
+        return self.async_ollama_client.generate_stream(prompt, user_id=user_id, context=context,
+                                                        on_done=self._save_post_context(user_id))
+    
+    def _build_regeneration_prompt(self, content: str, language: str = "zh-CN", continued: bool = False) -> str:
+        """构建从现有内容重新生成的提示词
+        
+        Args:
+            continued: 是否从生成该文案时的上下文继续，此时提示词不再包含原文案
+        """
         # 获取语言参数
         try:
             lang = Language(language)
@@ -920,7 +1179,7 @@ class XiaohongshuAgent:
             lang = Language.ZH_CN
         
         # 使用国际化模板
-        prompt_template = get_prompt_template("regeneration_from_content", lang)
+        prompt_template = get_prompt_template("regeneration_with_context" if continued else "regeneration_from_content", lang)
         regeneration_prompt = prompt_template.format(content=content)
         
         # 添加语言指令
@@ -930,7 +1189,22 @@ class XiaohongshuAgent:
         if not self.enable_thinking:
             regeneration_prompt += "/no_think"
         
-        return self.ollama_client.generate_stream(regeneration_prompt)
+        return regeneration_prompt
+    
+    def regenerate_from_content_stream(self, content: str, language: str = "zh-CN", user_id: str = None,
+                                       cancel_token: CancellationToken = None):
+        """流式从现有内容重新生成"""
+        context = self._post_context(user_id, content)
+        prompt = self._build_regeneration_prompt(content, language, continued=context is not None)
+        return self.ollama_client.generate_stream(prompt, user_id=user_id, context=context,
+                                                  on_done=self._save_post_context(user_id), cancel_token=cancel_token)
+    
+    def regenerate_from_content_astream(self, content: str, language: str = "zh-CN", user_id: str = None):
+        """异步流式从现有内容重新生成"""
+        context = self._post_context(user_id, content)
+        prompt = self._build_regeneration_prompt(content, language, continued=context is not None)
+        return self.async_ollama_client.generate_stream(prompt, user_id=user_id, context=context,
+                                                        on_done=self._save_post_context(user_id))
 
 
 def main():
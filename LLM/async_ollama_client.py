@@ -0,0 +1,475 @@
+"""
+异步Ollama客户端
+基于 httpx.AsyncClient 的非阻塞实现，供 FastAPI 的 async 路由在事件循环内直接流式读取
+"""
+
+import asyncio
+import sys
+import os
+import time
+from typing import Optional, Dict, Any, List, AsyncGenerator
+
+import httpx
+
+# 添加上级目录到路径，以便以脚本方式运行时导入LLM模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM.http_pool import OLLAMA_POOL_CONFIG
+from LLM.backend_pool import BackendPool, OllamaBackend, get_shared_backend_pool
+from LLM.resilience import OLLAMA_RESILIENCE_CONFIG, hedge_delay
+from LLM.coalescer import AsyncStreamCoalescer, coalesce_key
+from LLM.response_cache import get_shared_response_cache, response_cache_key
+from LLM.ndjson import aiter_frames
+from LLM.stats import (
+    GenerationStats, AsyncTokenStream, StatsCallback, DoneCallback, extract_response, extract_message_content
+)
+from LLM.exceptions import (
+    OllamaError, OllamaConnectionError, OllamaTimeoutError, OllamaResponseError
+)
+
+
+def _build_limits(config: Dict[str, Any]) -> httpx.Limits:
+    """将连接池配置转换为 httpx 的连接限制"""
+    return httpx.Limits(
+        max_connections=config["pool_connections"] * config["pool_maxsize"],
+        max_keepalive_connections=config["pool_maxsize"] if config["keep_alive"] else 0,
+        keepalive_expiry=config.get("keepalive_expiry", 60.0)
+    )
+
+
+class AsyncOllamaClient:
+    """异步Ollama客户端"""
+
+    def __init__(self, base_url: str = None, pool_config: Dict[str, Any] = None, backend_pool: BackendPool = None,
+                 resilience_config: Dict[str, Any] = None):
+        """
+        初始化异步Ollama客户端
+
+        Args:
+            base_url: Ollama服务器的URL；不提供时使用共享后端池（默认为本地11434端口）
+            pool_config: 连接池配置，未提供的字段使用 OLLAMA_POOL_CONFIG 中的默认值
+            backend_pool: 使用的后端池，提供时忽略base_url，每次请求按路由策略选择后端
+            resilience_config: 超时与对冲配置，未提供的字段使用 OLLAMA_RESILIENCE_CONFIG 中的默认值
+        """
+        if backend_pool is None:
+            backend_pool = BackendPool([base_url]) if base_url else get_shared_backend_pool()
+        self.backend_pool = backend_pool
+        self.model_name = "qwen3-redbook-q8:latest"
+        self.pool_config = {**OLLAMA_POOL_CONFIG, **(pool_config or {})}
+        self.resilience_config = {**OLLAMA_RESILIENCE_CONFIG, **(resilience_config or {})}
+        self.timeout = httpx.Timeout(
+            float(self.resilience_config["read_timeout"]),
+            connect=float(self.resilience_config["connect_timeout"])
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+        # 相同的进行中生成请求合并为一次上游请求（按请求开启）
+        self.coalescer = AsyncStreamCoalescer()
+        # 生成结果缓存（按请求开启，同步和异步客户端共用）
+        self.response_cache = get_shared_response_cache()
+
+    @property
+    def base_url(self) -> str:
+        """首个后端的URL（单后端时即为服务器地址）"""
+        return self.backend_pool.primary.url
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """获取底层 httpx 客户端（首次访问时创建）"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=_build_limits(self.pool_config),
+                timeout=self.timeout
+            )
+        return self._client
+
+    async def aclose(self):
+        """关闭客户端，释放所有连接"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    def _build_generate_payload(self, prompt: str, system_prompt: str = None, stream: bool = True,
+                                context: List[int] = None, seed: int = None) -> Dict[str, Any]:
+        """构建 /api/generate 请求体（与同步客户端保持一致）"""
+        payload = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.backend_pool.config["keep_alive"]
+        }
+
+        # 如果有系统提示词，添加到选项中
+        if system_prompt:
+            payload["options"] = {
+                "system": system_prompt,
+                "temperature": 0.7,
+                "top_p": 0.9
+            }
+
+        # 延续上一轮返回的上下文token，Ollama只需处理新增的提示词
+        if context:
+            payload["context"] = context
+
+        # 固定采样种子，相同输入得到相同输出（使用缓存时的确定性模式）
+        if seed is not None:
+            payload.setdefault("options", {})["seed"] = seed
+        return payload
+
+    async def _request_frames(self, backend: OllamaBackend, path: str, payload: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        向指定后端发送流式请求并逐帧解析，不做后端池记账
+
+        Raises:
+            OllamaTimeoutError: 连接或读取超时
+            OllamaConnectionError: 连接失败或读取中断
+            OllamaResponseError: 状态码非200、响应无法解析或返回了错误帧
+        """
+        try:
+            async with self.client.stream("POST", f"{backend.url}{path}", json=payload) as response:
+                if response.status_code != 200:
+                    raise OllamaResponseError(f"Ollama返回状态码 {response.status_code}", backend.url, response.status_code)
+                try:
+                    # 按到达的原始字节增量解码
+                    async for data in aiter_frames(response.aiter_bytes()):
+                        if 'error' in data:
+                            raise OllamaResponseError(f"Ollama返回错误: {data['error']}", backend.url)
+                        yield data
+                        if data.get('done'):
+                            break
+                except ValueError:
+                    raise OllamaResponseError("无法解析Ollama响应", backend.url)
+        except httpx.TimeoutException as e:
+            raise OllamaTimeoutError(f"请求Ollama超时: {e}", backend.url) from e
+        except httpx.HTTPError as e:
+            raise OllamaConnectionError(f"连接Ollama失败: {e}", backend.url) from e
+
+    async def _stream_frames(self, path: str, payload: Dict[str, Any], user_id: str = None) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        向选中的后端发送流式请求，逐帧返回解析后的JSON
+
+        负责后端的选择与释放，并记录首字延迟和请求结果供后端池路由和熔断器使用。
+        启用对冲且有多个可用后端时，首个token迟迟未到会向另一个后端发起对冲请求。
+
+        Raises:
+            OllamaError: 请求失败或所有后端均已熔断
+        """
+        backend = self.backend_pool.acquire(user_id)
+        if self.resilience_config["hedging_enabled"] and len(self.backend_pool.backends) > 1:
+            async for data in self._hedged_frames(backend, path, payload):
+                yield data
+            return
+
+        start_time = time.monotonic()
+        ttft = None
+        error = False
+        cancelled = False
+        try:
+            async for data in self._request_frames(backend, path, payload):
+                if ttft is None:
+                    ttft = time.monotonic() - start_time
+                yield data
+        except (GeneratorExit, asyncio.CancelledError):
+            cancelled = True
+            raise
+        except OllamaError:
+            error = True
+            raise
+        finally:
+            # 出字前被取消（客户端断开、任务取消）的请求不计入后端的成功/失败
+            self.backend_pool.release(backend, ttft, error, cancelled=cancelled and ttft is None)
+
+    async def _run_attempt(self, index: int, backend: OllamaBackend, path: str, payload: Dict[str, Any], frames: asyncio.Queue):
+        """执行一次（对冲）请求，把每一帧放入共享队列"""
+        start_time = time.monotonic()
+        ttft = None
+        error = False
+        cancelled = False
+        try:
+            async for data in self._request_frames(backend, path, payload):
+                if ttft is None:
+                    ttft = time.monotonic() - start_time
+                await frames.put((index, "frame", data))
+            await frames.put((index, "end", None))
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception as e:
+            # 任何异常都要放入队列，否则等待该请求的 _hedged_frames 会一直阻塞
+            error = True
+            if not isinstance(e, OllamaError):
+                e = OllamaConnectionError(f"连接Ollama失败: {e}", backend.url)
+            await frames.put((index, "error", e))
+        finally:
+            # 出字前被取消的请求不计入后端的成功/失败
+            self.backend_pool.release(backend, ttft, error, cancelled=cancelled and ttft is None)
+
+    async def _hedged_frames(self, backend: OllamaBackend, path: str, payload: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        对冲请求：首个token超过阈值（后端TTFT的p95）未到达，或首个请求在出字前失败时，
+        向另一个后端再发一次，保留先开始输出的流并取消其余请求
+        """
+        frames: asyncio.Queue = asyncio.Queue()
+        attempts = []  # [(后端, 任务)]
+
+        def launch(target: OllamaBackend):
+            task = asyncio.create_task(self._run_attempt(len(attempts), target, path, payload, frames))
+            attempts.append((target, task))
+
+        def launch_hedge() -> bool:
+            alternative = self.backend_pool.acquire_alternative([b.url for b, _ in attempts])
+            if alternative is None:
+                return False
+            launch(alternative)
+            return True
+
+        launch(backend)
+        hedge_at = time.monotonic() + hedge_delay(backend.p95_ttft, self.resilience_config)
+        hedged = False
+        failed = 0
+        winner = None
+        try:
+            # 等待第一个出字的请求
+            while winner is None:
+                try:
+                    if hedged:
+                        index, kind, item = await frames.get()
+                    else:
+                        index, kind, item = await asyncio.wait_for(frames.get(), max(0.0, hedge_at - time.monotonic()))
+                except asyncio.TimeoutError:
+                    hedged = True
+                    launch_hedge()
+                    continue
+
+                if kind == "error":
+                    failed += 1
+                    if not hedged:
+                        hedged = True
+                        launch_hedge()
+                    if failed == len(attempts):
+                        raise item
+                    continue
+
+                winner = index
+                for i, (_, task) in enumerate(attempts):
+                    if i != winner:
+                        task.cancel()
+                if kind == "end":
+                    return
+                yield item
+
+            # 继续输出获胜请求的后续内容
+            while True:
+                index, kind, item = await frames.get()
+                if index != winner:
+                    continue
+                if kind == "frame":
+                    yield item
+                elif kind == "error":
+                    raise item
+                else:
+                    return
+        finally:
+            for _, task in attempts:
+                task.cancel()
+
+    async def _post_json(self, path: str, payload: Dict[str, Any], user_id: str = None) -> Optional[Dict[str, Any]]:
+        """
+        向选中的后端发送非流式请求
+
+        Returns:
+            Dict: 响应JSON，状态码非200时返回None
+
+        Raises:
+            OllamaError: 连接失败、超时、响应无法解析或所有后端均已熔断
+        """
+        backend = self.backend_pool.acquire(user_id)
+        start_time = time.monotonic()
+        error = True
+        cancelled = False
+        try:
+            response = await self.client.post(f"{backend.url}{path}", json=payload)
+            if response.status_code == 200:
+                try:
+                    data = response.json()
+                except ValueError as e:
+                    raise OllamaResponseError("无法解析Ollama响应", backend.url) from e
+                error = False
+                return data
+            return None
+        except httpx.TimeoutException as e:
+            raise OllamaTimeoutError(f"请求Ollama超时: {e}", backend.url) from e
+        except httpx.HTTPError as e:
+            raise OllamaConnectionError(f"连接Ollama失败: {e}", backend.url) from e
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # 非流式请求没有首字时间，以总耗时近似；被取消的请求不计入后端的成功/失败
+            self.backend_pool.release(backend, None if error else time.monotonic() - start_time,
+                                      error and not cancelled, cancelled=cancelled)
+
+    async def check_connection(self) -> bool:
+        """
+        检查Ollama服务连接状态
+
+        Returns:
+            bool: 任一后端连接成功返回True，否则返回False
+        """
+        for backend in self.backend_pool.backends:
+            try:
+                response = await self.client.get(f"{backend.url}/api/tags")
+                if response.status_code == 200:
+                    return True
+            except httpx.HTTPError:
+                continue
+        return False
+
+    async def list_models(self) -> Optional[Dict[str, Any]]:
+        """
+        获取可用模型列表
+
+        Returns:
+            Dict: 模型列表（来自第一个可用后端），失败返回None
+        """
+        for backend in self.backend_pool.backends:
+            try:
+                response = await self.client.get(f"{backend.url}/api/tags")
+                if response.status_code == 200:
+                    return response.json()
+            except (httpx.HTTPError, ValueError):
+                continue
+        return None
+
+    def generate_stream(self, prompt: str, system_prompt: str = None, user_id: str = None,
+                        on_stats: StatsCallback = None, context: List[int] = None,
+                        on_done: DoneCallback = None, coalesce: bool = False, use_cache: bool = False) -> AsyncTokenStream:
+        """
+        生成文本回复的异步流式生成器
+
+        Args:
+            prompt: 输入提示词
+            system_prompt: 系统提示词（可选）
+            user_id: 用户ID（可选），多后端时保持用户到后端的粘性
+            on_stats: 生成结束时接收 GenerationStats 的回调（可选）
+            context: 上一轮结束帧返回的上下文token（可选），提供时从该上下文继续生成
+            on_done: 读完整个流后的回调（可选），参数为流本身，可从中取得新的 context 和完整文本
+            coalesce: 是否与进行中的相同请求（提示词、系统提示词、选项和上下文都相同）共享同一次上游生成
+            use_cache: 是否使用生成结果缓存（固定采样种子），命中时分片回放缓存的输出
+
+        Returns:
+            AsyncTokenStream: 逐个返回文本片段（async for），结束后 stats 属性为本次生成的统计信息
+
+        Raises:
+            OllamaError: 迭代时请求失败（不再把错误信息当作文本片段返回）
+        """
+        seed = self.response_cache.seed if use_cache else None
+        payload = self._build_generate_payload(prompt, system_prompt, context=context, seed=seed)
+
+        def start():
+            if coalesce:
+                return self.coalescer.subscribe(
+                    coalesce_key("/api/generate", payload),
+                    lambda: self._stream_frames("/api/generate", payload, user_id)
+                )
+            return self._stream_frames("/api/generate", payload, user_id)
+
+        if use_cache:
+            frames = self.response_cache.astream(response_cache_key(payload), start, self.model_name)
+        else:
+            frames = start()
+        return AsyncTokenStream(frames, extract_response, on_stats, on_done)
+
+    async def generate(self, prompt: str, system_prompt: str = None, user_id: str = None,
+                       on_stats: StatsCallback = None, use_cache: bool = False) -> Optional[str]:
+        """
+        生成文本回复（非流式）
+
+        Args:
+            prompt: 输入提示词
+            system_prompt: 系统提示词（可选）
+            user_id: 用户ID（可选），多后端时保持用户到后端的粘性
+            on_stats: 生成结束时接收 GenerationStats 的回调（可选）
+            use_cache: 是否使用生成结果缓存（固定采样种子）
+
+        Returns:
+            str: 生成的文本，失败返回None
+        """
+        seed = self.response_cache.seed if use_cache else None
+        payload = self._build_generate_payload(prompt, system_prompt, stream=False, seed=seed)
+        key = response_cache_key(payload) if use_cache else None
+        try:
+            if key is not None:
+                cached = await asyncio.to_thread(self.response_cache.get, key)
+                if cached is not None:
+                    if on_stats is not None:
+                        on_stats(GenerationStats(done_reason="cache"))
+                    return cached
+            result = await self._post_json("/api/generate", payload, user_id)
+            if result is None:
+                return None
+            if on_stats is not None:
+                on_stats(GenerationStats.from_frame(result))
+            if key is not None and result.get('done_reason') in (None, "stop"):
+                await asyncio.to_thread(self.response_cache.put, key, result.get('response', ''), self.model_name)
+            return result.get('response', '')
+        except OllamaError as e:
+            print(f"生成文本失败: {e}")
+            return None
+
+    def chat_stream(self, messages: list, user_id: str = None, on_stats: StatsCallback = None) -> AsyncTokenStream:
+        """
+        对话模式的异步流式生成器
+
+        Args:
+            messages: 对话历史，格式为[{"role": "user", "content": "..."}]
+            user_id: 用户ID（可选），多后端时把同一用户的多轮对话保持在同一后端
+            on_stats: 生成结束时接收 GenerationStats 的回调（可选）
+
+        Returns:
+            AsyncTokenStream: 逐个返回助手回复的文本片段（async for），结束后 stats 属性为本次生成的统计信息
+
+        Raises:
+            OllamaError: 迭代时请求失败（不再把错误信息当作文本片段返回）
+        """
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": True,
+            "keep_alive": self.backend_pool.config["keep_alive"]
+        }
+        return AsyncTokenStream(self._stream_frames("/api/chat", payload, user_id), extract_message_content, on_stats)
+
+    async def chat(self, messages: list, user_id: str = None, on_stats: StatsCallback = None) -> Optional[str]:
+        """
+        对话模式（非流式）
+
+        Args:
+            messages: 对话历史，格式为[{"role": "user", "content": "..."}]
+            user_id: 用户ID（可选），多后端时把同一用户的多轮对话保持在同一后端
+            on_stats: 生成结束时接收 GenerationStats 的回调（可选）
+
+        Returns:
+            str: 助手回复，失败返回None
+        """
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": False,
+            "keep_alive": self.backend_pool.config["keep_alive"]
+        }
+        try:
+            result = await self._post_json("/api/chat", payload, user_id)
+            if result is None:
+                return None
+            if on_stats is not None:
+                on_stats(GenerationStats.from_frame(result))
+            return result.get('message', {}).get('content', '')
+        except OllamaError as e:
+            print(f"对话失败: {e}")
+            return None
@@ -0,0 +1,274 @@
+"""
+Ollama后端池
+在多个Ollama服务之间做负载均衡：跟踪每个后端的在途请求数、首字延迟(TTFT)和错误率，
+按最少负载或最低延迟选择后端，并保持用户到后端的粘性以复用后端上的提示词缓存
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List, Iterable
+
+from LLM.resilience import CircuitBreaker
+from LLM.exceptions import OllamaCircuitOpenError
+
+
+# 后端池默认配置
+OLLAMA_BACKEND_CONFIG = {
+    # 逗号分隔的后端地址列表，默认仅使用本地Ollama
+    "urls": [url.strip().rstrip("/") for url in os.getenv("OLLAMA_BACKENDS", "http://localhost:11434").split(",") if url.strip()],
+    "strategy": os.getenv("OLLAMA_ROUTING_STRATEGY", "least_load"),  # least_load | least_latency
+    "affinity_ttl": 1800,          # 用户粘性保持时间（秒），超过后重新选择后端
+    "window_size": 50,             # 统计TTFT和错误率的滑动窗口大小（请求数）
+    "ttft_ewma_alpha": 0.3,        # TTFT指数加权平均系数
+    "unhealthy_error_rate": 0.5,   # 错误率超过该值时视为不健康，不再保持粘性
+    "error_penalty": 4.0,          # 路由打分时错误率的惩罚系数
+    # 模型在后端的驻留时间，随每次请求下发（如 "30m"、"-1" 表示常驻），避免空闲后被卸载
+    "keep_alive": os.getenv("OLLAMA_KEEP_ALIVE", "30m"),
+}
+
+ROUTING_STRATEGIES = ("least_load", "least_latency")
+
+
+class OllamaBackend:
+    """单个Ollama后端的运行统计"""
+
+    def __init__(self, url: str, window_size: int = 50, ttft_ewma_alpha: float = 0.3):
+        self.url = url.rstrip("/")
+        self.in_flight = 0
+        self.total_requests = 0
+        self.total_errors = 0
+        self.ttft_ewma: Optional[float] = None
+        self.last_request_at: Optional[float] = None  # 最近一次请求的时间（monotonic）
+        self._ttft_alpha = ttft_ewma_alpha
+        self._ttft_samples: deque = deque(maxlen=window_size)
+        self._outcomes: deque = deque(maxlen=window_size)  # True表示失败
+        self.breaker = CircuitBreaker()
+
+    @property
+    def error_rate(self) -> float:
+        """最近窗口内的错误率"""
+        if not self._outcomes:
+            return 0.0
+        return sum(self._outcomes) / len(self._outcomes)
+
+    @property
+    def p95_ttft(self) -> Optional[float]:
+        """最近窗口内TTFT的95分位数（秒）"""
+        if not self._ttft_samples:
+            return None
+        samples = sorted(self._ttft_samples)
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def record_ttft(self, ttft: float):
+        """记录一次首字延迟"""
+        self._ttft_samples.append(ttft)
+        if self.ttft_ewma is None:
+            self.ttft_ewma = ttft
+        else:
+            self.ttft_ewma = self._ttft_alpha * ttft + (1 - self._ttft_alpha) * self.ttft_ewma
+
+    def record_outcome(self, error: bool):
+        """记录一次请求结果，同时更新熔断器"""
+        self.total_requests += 1
+        if error:
+            self.total_errors += 1
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        self._outcomes.append(error)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出状态信息"""
+        p95 = self.p95_ttft
+        return {
+            "url": self.url,
+            "in_flight": self.in_flight,
+            "total_requests": self.total_requests,
+            "total_errors": self.total_errors,
+            "error_rate": round(self.error_rate, 4),
+            "ttft_ewma_ms": round(self.ttft_ewma * 1000, 2) if self.ttft_ewma is not None else None,
+            "ttft_p95_ms": round(p95 * 1000, 2) if p95 is not None else None,
+            "circuit": self.breaker.to_dict(),
+        }
+
+
+class BackendPool:
+    """Ollama后端池（线程安全，可同时被同步和异步客户端使用）"""
+
+    def __init__(self, urls: Iterable[str] = None, strategy: str = None, config: Dict[str, Any] = None):
+        """
+        初始化后端池
+
+        Args:
+            urls: 后端地址列表，默认使用 OLLAMA_BACKEND_CONFIG["urls"]
+            strategy: 路由策略，least_load（最少在途请求）或 least_latency（最低预估延迟）
+            config: 其他配置项，未提供的字段使用 OLLAMA_BACKEND_CONFIG 中的默认值
+        """
+        self.config = {**OLLAMA_BACKEND_CONFIG, **(config or {})}
+        urls = list(urls) if urls is not None else list(self.config["urls"])
+        if not urls:
+            raise ValueError("后端池至少需要一个Ollama地址")
+
+        self.strategy = strategy or self.config["strategy"]
+        if self.strategy not in ROUTING_STRATEGIES:
+            raise ValueError(f"不支持的路由策略: {self.strategy}，可选: {', '.join(ROUTING_STRATEGIES)}")
+
+        self.backends: List[OllamaBackend] = [
+            OllamaBackend(url, self.config["window_size"], self.config["ttft_ewma_alpha"])
+            for url in dict.fromkeys(url.rstrip("/") for url in urls)
+        ]
+        self._by_url = {backend.url: backend for backend in self.backends}
+        self._affinity: Dict[str, tuple] = {}  # user_id -> (url, 最后使用时间)
+        self._lock = threading.Lock()
+
+    @property
+    def primary(self) -> OllamaBackend:
+        """首个后端（用于兼容单地址的场景）"""
+        return self.backends[0]
+
+    def get_backend(self, url: str) -> Optional[OllamaBackend]:
+        """按地址获取后端"""
+        return self._by_url.get(url.rstrip("/"))
+
+    def _is_healthy(self, backend: OllamaBackend) -> bool:
+        return backend.error_rate < self.config["unhealthy_error_rate"]
+
+    def _score(self, backend: OllamaBackend) -> float:
+        """路由打分，越小越优先"""
+        penalty = 1.0 + backend.error_rate * self.config["error_penalty"]
+        if self.strategy == "least_latency":
+            # 预估延迟 = 平均TTFT × (在途请求数 + 1)；没有样本的后端优先探测
+            ttft = backend.ttft_ewma if backend.ttft_ewma is not None else 0.0
+            return ttft * (backend.in_flight + 1) * penalty
+        return (backend.in_flight + 1) * penalty
+
+    def select(self, user_id: str = None, exclude: Iterable[str] = ()) -> OllamaBackend:
+        """
+        选择一个后端（不增加在途计数）
+
+        Args:
+            user_id: 用户ID，提供时优先使用该用户粘性绑定的后端
+            exclude: 需要排除的后端地址
+
+        Returns:
+            OllamaBackend: 选中的后端，所有后端熔断时返回None
+        """
+        excluded = set(exclude)
+        with self._lock:
+            return self._select_locked(user_id, excluded)
+
+    def _select_locked(self, user_id: Optional[str], excluded: set, strict: bool = False) -> Optional[OllamaBackend]:
+        now = time.monotonic()
+        # 熔断器打开的后端不参与路由
+        available = [b for b in self.backends if b.breaker.is_available()]
+        candidates = [b for b in available if b.url not in excluded]
+        if not candidates:
+            if strict or not available:
+                return None
+            candidates = available
+
+        if user_id is not None:
+            bound = self._affinity.get(user_id)
+            if bound and now - bound[1] < self.config["affinity_ttl"]:
+                backend = self._by_url.get(bound[0])
+                if backend in candidates and self._is_healthy(backend):
+                    self._affinity[user_id] = (backend.url, now)
+                    return backend
+
+        backend = min(candidates, key=self._score)
+        if user_id is not None:
+            self._affinity[user_id] = (backend.url, now)
+        return backend
+
+    def acquire(self, user_id: str = None, exclude: Iterable[str] = ()) -> OllamaBackend:
+        """
+        选择后端并增加其在途请求计数，使用完毕后必须调用 release()
+
+        Raises:
+            OllamaCircuitOpenError: 所有后端的熔断器都处于打开状态
+        """
+        backend = self._acquire(user_id, set(exclude), strict=False)
+        if backend is None:
+            raise OllamaCircuitOpenError("所有Ollama后端均已熔断，请稍后重试")
+        return backend
+
+    def acquire_alternative(self, exclude: Iterable[str]) -> Optional[OllamaBackend]:
+        """获取一个不在排除列表中的可用后端（用于对冲/故障转移），没有则返回None"""
+        return self._acquire(None, set(exclude), strict=True)
+
+    def _acquire(self, user_id: Optional[str], excluded: set, strict: bool) -> Optional[OllamaBackend]:
+        with self._lock:
+            backend = self._select_locked(user_id, excluded, strict)
+            # 半开状态下占用探测名额；名额刚被并发请求占满时视为不可用
+            if backend is None or not backend.breaker.allow_request():
+                return None
+            backend.in_flight += 1
+            backend.last_request_at = time.monotonic()
+            return backend
+
+    def release(self, backend: OllamaBackend, ttft: float = None, error: bool = False, cancelled: bool = False):
+        """
+        释放后端并记录本次请求的统计
+
+        Args:
+            backend: acquire() 返回的后端
+            ttft: 首字延迟（秒），未收到任何内容时为None
+            error: 请求是否失败
+            cancelled: 请求是否在收到首个token前被主动取消（如对冲失败方），取消的请求不计入成功/失败，
+                       占用的半开探测名额归还给熔断器
+        """
+        with self._lock:
+            backend.in_flight = max(0, backend.in_flight - 1)
+            if ttft is not None:
+                backend.record_ttft(ttft)
+            if cancelled:
+                backend.breaker.release_probe()
+            else:
+                backend.record_outcome(error)
+
+    def forget_user(self, user_id: str):
+        """移除用户的粘性绑定"""
+        with self._lock:
+            self._affinity.pop(user_id, None)
+
+    def cleanup_affinity(self):
+        """清理过期的粘性绑定"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [uid for uid, (_, ts) in self._affinity.items() if now - ts >= self.config["affinity_ttl"]]
+            for uid in expired:
+                del self._affinity[uid]
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取后端池状态"""
+        with self._lock:
+            return {
+                "strategy": self.strategy,
+                "affinity_users": len(self._affinity),
+                "backends": [backend.to_dict() for backend in self.backends],
+            }
+
+
+# 进程级共享后端池
+_shared_backend_pool: Optional[BackendPool] = None
+_shared_backend_pool_lock = threading.Lock()
+
+
+def get_shared_backend_pool() -> BackendPool:
+    """获取进程内共享的后端池（根据 OLLAMA_BACKEND_CONFIG 创建）"""
+    global _shared_backend_pool
+    if _shared_backend_pool is None:
+        with _shared_backend_pool_lock:
+            if _shared_backend_pool is None:
+                _shared_backend_pool = BackendPool()
+    return _shared_backend_pool
+
+
+def configure_shared_backend_pool(urls: Iterable[str], strategy: str = None, config: Dict[str, Any] = None) -> BackendPool:
+    """使用新的后端列表重建共享后端池"""
+    global _shared_backend_pool
+    with _shared_backend_pool_lock:
+        _shared_backend_pool = BackendPool(urls, strategy, config)
+    return _shared_backend_pool
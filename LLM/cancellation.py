@@ -0,0 +1,107 @@
+"""
+生成取消令牌
+调用方（SSE连接、线程池任务）持有令牌，客户端已断开或任务被取消时调用 cancel()；
+流式读取在每一帧之间检查令牌，注册的回调会立即断开上游连接，阻塞中的读取（如等待首个token）也能被中断；
+线程池在 cancel_scope 中执行任务，任务内未显式传入令牌的 OllamaClient 调用使用 current_cancel_token()
+"""
+
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Callable
+
+from LLM.exceptions import GenerationCancelled
+
+
+class CancellationToken:
+    """线程安全的取消令牌（可以在事件循环线程中取消、在工作线程中检查）"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: Dict[int, Callable[[], None]] = {}
+        self._next_id = 0
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = None) -> bool:
+        """
+        取消并依次执行已注册的回调
+
+        Args:
+            reason: 取消原因
+
+        Returns:
+            bool: 本次调用是否首次取消
+        """
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"执行取消回调失败: {e}")
+        return True
+
+    def register(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        注册取消时执行的回调（已取消时立即执行）
+
+        Returns:
+            注销该回调的函数，请求结束后必须调用，避免之后的取消影响已归还连接池的连接
+        """
+        with self._lock:
+            if not self._event.is_set():
+                callback_id = self._next_id
+                self._next_id += 1
+                self._callbacks[callback_id] = callback
+                return lambda: self._unregister(callback_id)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback_id: int):
+        with self._lock:
+            self._callbacks.pop(callback_id, None)
+
+    def raise_if_cancelled(self):
+        """
+        Raises:
+            GenerationCancelled: 已取消
+        """
+        if self._event.is_set():
+            raise GenerationCancelled(f"生成已取消: {self.reason}" if self.reason else "生成已取消")
+
+    def wait(self, timeout: float = None) -> bool:
+        """等待取消，返回是否已取消"""
+        return self._event.wait(timeout)
+
+
+_current_token: ContextVar[Optional[CancellationToken]] = ContextVar("cancel_token", default=None)
+
+
+def current_cancel_token() -> Optional[CancellationToken]:
+    """当前任务的取消令牌（不在 cancel_scope 中时为None）"""
+    return _current_token.get()
+
+
+@contextmanager
+def cancel_scope(token: Optional[CancellationToken]):
+    """
+    在当前线程（上下文）中把 token 设为当前任务的取消令牌
+
+    Args:
+        token: 取消令牌，为None时清除当前令牌
+    """
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
@@ -0,0 +1,298 @@
+"""
+相同生成请求的合并（single-flight）
+规范化后的提示词、系统提示词和选项完全相同的进行中请求只向Ollama发送一次，
+上游的每一帧分发给所有订阅者；中途加入的订阅者先重放已经输出的帧，再继续接收新帧
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from typing import Optional, Dict, Any, List, Callable, Iterator, AsyncIterator
+
+
+# 参与合并键计算时忽略的字段（不影响生成结果）
+_IGNORED_FIELDS = ("stream", "keep_alive")
+
+
+def _normalize_text(text: Optional[str]) -> Optional[str]:
+    # 只折叠空白字符，不改变大小写和标点
+    return " ".join(text.split()) if isinstance(text, str) else text
+
+
+def coalesce_key(path: str, payload: Dict[str, Any]) -> str:
+    """
+    计算请求的合并键
+
+    Args:
+        path: 接口路径
+        payload: 请求体
+
+    Returns:
+        str: 规范化的提示词、系统提示词和选项的摘要
+    """
+    normalized = {key: value for key, value in payload.items() if key not in _IGNORED_FIELDS}
+    normalized["prompt"] = _normalize_text(normalized.get("prompt"))
+    normalized["system"] = _normalize_text(normalized.get("system"))
+    options = dict(normalized.get("options") or {})
+    if "system" in options:
+        options["system"] = _normalize_text(options["system"])
+    normalized["options"] = options
+    data = json.dumps({"path": path, "payload": normalized}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    """一次进行中的上游请求"""
+
+    def __init__(self, key: str, condition=None):
+        self.key = key
+        self.condition = condition   # 新帧到达或请求结束时通知订阅者
+        self.task: Optional[asyncio.Task] = None
+        self.frames: List[Dict[str, Any]] = []
+        self.finished = False
+        self.cancelled = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.started_at = time.monotonic()
+
+
+class _CoalescerStats:
+    """合并统计（同步和异步合并器共用）"""
+
+    def __init__(self):
+        self.flights = 0        # 实际发往Ollama的请求数
+        self.coalesced = 0      # 加入已有请求的订阅数
+        self.late_joins = 0     # 加入时已有输出、需要重放的订阅数
+        self.cancelled = 0      # 所有订阅者都提前离开而取消的上游请求数
+
+    def to_dict(self, active: int) -> Dict[str, Any]:
+        subscriptions = self.flights + self.coalesced
+        return {
+            "active_flights": active,
+            "flights": self.flights,
+            "coalesced": self.coalesced,
+            "late_joins": self.late_joins,
+            "cancelled": self.cancelled,
+            "coalesce_rate": round(self.coalesced / subscriptions, 4) if subscriptions else None,
+        }
+
+
+class _Subscription:
+    """同步订阅：按自己的位置读取共享的帧列表"""
+
+    def __init__(self, coalescer: "StreamCoalescer", flight: _Flight):
+        self._coalescer = coalescer
+        self._flight = flight
+        self._index = 0
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        flight = self._flight
+        with flight.condition:
+            while self._index >= len(flight.frames) and not flight.finished:
+                flight.condition.wait()
+            if self._index < len(flight.frames):
+                frame = flight.frames[self._index]
+                self._index += 1
+                return frame
+        self.close()
+        if flight.error is not None:
+            raise flight.error
+        raise StopIteration
+
+    def close(self):
+        """离开该请求；最后一个订阅者离开时取消上游请求"""
+        if not self._closed:
+            self._closed = True
+            self._coalescer._release(self._flight)
+
+
+class StreamCoalescer:
+    """同步客户端的请求合并器（线程安全）"""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = _CoalescerStats()
+
+    def subscribe(self, key: str, start: Callable[[], Iterator[Dict[str, Any]]]) -> _Subscription:
+        """
+        订阅合并键对应的请求，没有进行中的请求时用 start 发起一个
+
+        Args:
+            key: 合并键（见 coalesce_key）
+            start: 发起上游请求、逐帧返回响应的函数
+
+        Returns:
+            逐帧返回响应的迭代器（从第一帧开始）
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                # 各请求的条件变量共用合并器的锁，订阅、离开和分发互斥
+                flight = _Flight(key, threading.Condition(self._lock))
+                self._flights[key] = flight
+                self._stats.flights += 1
+            else:
+                self._stats.coalesced += 1
+                if flight.frames:
+                    self._stats.late_joins += 1
+            flight.subscribers += 1
+
+        if leader:
+            # 由独立线程驱动上游，任何一个订阅者离开都不影响其他订阅者
+            threading.Thread(target=self._drive, args=(flight, start), name="ollama-coalesce", daemon=True).start()
+        return _Subscription(self, flight)
+
+    def _drive(self, flight: _Flight, start: Callable[[], Iterator[Dict[str, Any]]]):
+        error = None
+        try:
+            frames = start()
+            try:
+                for frame in frames:
+                    if flight.cancelled:
+                        break
+                    with flight.condition:
+                        flight.frames.append(frame)
+                        flight.condition.notify_all()
+            finally:
+                close = getattr(frames, "close", None)
+                if close is not None:
+                    close()
+        except Exception as e:
+            error = e
+        finally:
+            with flight.condition:
+                flight.error = error
+                flight.finished = True
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+                flight.condition.notify_all()
+
+    def _release(self, flight: _Flight):
+        with self._lock:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.finished:
+                flight.cancelled = True
+                self._stats.cancelled += 1
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取合并统计"""
+        with self._lock:
+            return self._stats.to_dict(len(self._flights))
+
+
+class _AsyncSubscription:
+    """异步订阅"""
+
+    def __init__(self, coalescer: "AsyncStreamCoalescer", flight: _Flight,
+                 start: Callable[[], AsyncIterator[Dict[str, Any]]]):
+        self._coalescer = coalescer
+        self._flight = flight
+        self._start = start
+        self._index = 0
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        flight = self._flight
+        coalescer = self._coalescer
+        # 在事件循环中第一次读取时才启动上游任务
+        coalescer._ensure_driver(flight, self._start)
+        async with flight.condition:
+            while self._index >= len(flight.frames) and not flight.finished:
+                await flight.condition.wait()
+            if self._index < len(flight.frames):
+                frame = flight.frames[self._index]
+                self._index += 1
+                return frame
+        await self.aclose()
+        if flight.error is not None:
+            raise flight.error
+        raise StopAsyncIteration
+
+    async def aclose(self):
+        """离开该请求；最后一个订阅者离开时取消上游任务"""
+        if not self._closed:
+            self._closed = True
+            self._coalescer._release(self._flight)
+
+
+class AsyncStreamCoalescer:
+    """异步客户端的请求合并器（在单个事件循环内使用）"""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._stats = _CoalescerStats()
+
+    def subscribe(self, key: str, start: Callable[[], AsyncIterator[Dict[str, Any]]]) -> _AsyncSubscription:
+        """
+        订阅合并键对应的请求，没有进行中的请求时在第一次读取时用 start 发起一个
+
+        Returns:
+            逐帧返回响应的异步迭代器（从第一帧开始）
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(key)
+            self._flights[key] = flight
+            self._stats.flights += 1
+        else:
+            self._stats.coalesced += 1
+            if flight.frames:
+                self._stats.late_joins += 1
+        flight.subscribers += 1
+        return _AsyncSubscription(self, flight, start)
+
+    def _ensure_driver(self, flight: _Flight, start: Callable[[], AsyncIterator[Dict[str, Any]]]):
+        if flight.condition is None:
+            flight.condition = asyncio.Condition()
+        if flight.task is None and not flight.finished:
+            flight.task = asyncio.create_task(self._drive(flight, start))
+
+    async def _drive(self, flight: _Flight, start: Callable[[], AsyncIterator[Dict[str, Any]]]):
+        error = None
+        frames = start()
+        try:
+            async for frame in frames:
+                async with flight.condition:
+                    flight.frames.append(frame)
+                    flight.condition.notify_all()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            error = e
+        finally:
+            aclose = getattr(frames, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            async with flight.condition:
+                flight.error = error
+                flight.finished = True
+                flight.condition.notify_all()
+
+    def _release(self, flight: _Flight):
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and not flight.finished:
+            flight.cancelled = True
+            self._stats.cancelled += 1
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            if flight.task is not None:
+                flight.task.cancel()
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取合并统计"""
+        return self._stats.to_dict(len(self._flights))
@@ -0,0 +1,141 @@
+"""
+对话上下文复用
+保存每个用户会话最近一次 /api/generate 结束帧返回的 context（上下文token），
+下一轮请求带上它继续生成，Ollama只需处理新增的提示词；缓存失效时由调用方回退到完整重放
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Tuple
+
+
+# 上下文复用默认配置
+OLLAMA_CONTEXT_CONFIG = {
+    "enabled": os.getenv("OLLAMA_CONTEXT_REUSE", "false").lower() == "true",  # 是否启用（默认关闭）
+    "ttl": 1800,           # 上下文有效期（秒），超过后回退到完整重放
+    "max_entries": 1000,   # 最多保存的会话数，超出时淘汰最久未使用的会话
+    "max_tokens": 6144,    # 上下文token数上限，超过后回退到完整重放，避免超出模型上下文窗口被截断
+}
+
+
+def content_fingerprint(text: str) -> str:
+    """计算文本指纹，用于确认缓存的上下文对应的就是当前要处理的内容"""
+    return hashlib.sha1(text.strip().encode('utf-8')).hexdigest()
+
+
+@dataclass
+class ContextEntry:
+    """单个会话的上下文"""
+    context: List[int]
+    model: str
+    fingerprint: Optional[str]
+    created_at: float
+    last_used_at: float
+    turns: int = 1
+
+
+class ConversationContextStore:
+    """按 (用户ID, 会话类型) 保存上下文token（线程安全）"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        """
+        初始化上下文存储
+
+        Args:
+            config: 配置，未提供的字段使用 OLLAMA_CONTEXT_CONFIG 中的默认值
+        """
+        self.config = {**OLLAMA_CONTEXT_CONFIG, **(config or {})}
+        self._entries: "OrderedDict[Tuple[str, str], ContextEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations: Dict[str, int] = {}
+
+    def _invalidate_locked(self, key: Tuple[str, str], reason: str):
+        self._entries.pop(key, None)
+        self._invalidations[reason] = self._invalidations.get(reason, 0) + 1
+
+    def get(self, user_id: str, kind: str, model: str, fingerprint: str = None) -> Optional[List[int]]:
+        """
+        获取可以继续使用的上下文
+
+        Args:
+            user_id: 用户ID
+            kind: 会话类型（如 "chat"、"post"）
+            model: 当前使用的模型，与保存时不同则失效
+            fingerprint: 当前会话状态的指纹，与保存时不同则失效
+
+        Returns:
+            List[int]: 上下文token，没有或已失效时返回None（调用方应完整重放）
+        """
+        key = (user_id, kind)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            reason = None
+            if time.monotonic() - entry.last_used_at > self.config["ttl"]:
+                reason = "expired"
+            elif entry.model != model:
+                reason = "model_changed"
+            elif entry.fingerprint != fingerprint:
+                reason = "fingerprint_mismatch"
+            elif len(entry.context) > self.config["max_tokens"]:
+                reason = "too_long"
+            if reason is not None:
+                self._invalidate_locked(key, reason)
+                self._misses += 1
+                return None
+
+            entry.last_used_at = time.monotonic()
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry.context
+
+    def put(self, user_id: str, kind: str, model: str, context: Optional[List[int]], fingerprint: str = None):
+        """保存一轮生成结束后返回的上下文（context为空时清除该会话）"""
+        key = (user_id, kind)
+        now = time.monotonic()
+        with self._lock:
+            if not context:
+                self._entries.pop(key, None)
+                return
+            previous = self._entries.get(key)
+            self._entries[key] = ContextEntry(
+                context=context,
+                model=model,
+                fingerprint=fingerprint,
+                created_at=previous.created_at if previous is not None else now,
+                last_used_at=now,
+                turns=previous.turns + 1 if previous is not None else 1
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.config["max_entries"]:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str, kind: str = None):
+        """使用户的上下文失效（未指定会话类型时清除该用户的所有会话）"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id and (kind is None or key[1] == kind)]:
+                self._invalidate_locked(key, "reset")
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取命中率和失效统计"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.config["enabled"],
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else None,
+                "invalidations": dict(self._invalidations),
+                "avg_context_tokens": round(sum(len(e.context) for e in self._entries.values()) / len(self._entries), 2)
+                if self._entries else None,
+            }
@@ -0,0 +1,50 @@
+"""
+Ollama客户端异常类型
+流式接口出错时抛出这些异常，而不是把错误信息当作模型输出返回
+"""
+
+from typing import Optional
+
+
+class OllamaError(Exception):
+    """Ollama调用异常基类"""
+
+    code = "ollama_error"
+
+    def __init__(self, message: str, backend_url: Optional[str] = None):
+        super().__init__(message)
+        self.backend_url = backend_url
+
+
+class OllamaConnectionError(OllamaError):
+    """无法连接到Ollama后端，或连接在读取过程中断开"""
+
+    code = "ollama_connection_error"
+
+
+class OllamaTimeoutError(OllamaError):
+    """连接或读取超时"""
+
+    code = "ollama_timeout"
+
+
+class OllamaResponseError(OllamaError):
+    """后端返回了非200状态码或无法解析的数据"""
+
+    code = "ollama_bad_response"
+
+    def __init__(self, message: str, backend_url: Optional[str] = None, status_code: Optional[int] = None):
+        super().__init__(message, backend_url)
+        self.status_code = status_code
+
+
+class OllamaCircuitOpenError(OllamaError):
+    """所有可用后端的熔断器均处于打开状态，请求被快速拒绝"""
+
+    code = "ollama_circuit_open"
+
+
+class GenerationCancelled(OllamaError):
+    """生成被调用方取消（如SSE客户端已断开），上游请求已中断"""
+
+    code = "generation_cancelled"
@@ -0,0 +1,205 @@
+"""
+Ollama HTTP连接池
+为所有OllamaClient实例提供共享的keep-alive连接，避免每次请求都重新建立TCP连接
+"""
+
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+# 连接池默认配置
+OLLAMA_POOL_CONFIG = {
+    "pool_connections": int(os.getenv("OLLAMA_POOL_CONNECTIONS", 4)),  # 缓存的主机连接池数量（按主机区分）
+    "pool_maxsize": int(os.getenv("OLLAMA_POOL_MAXSIZE", 32)),         # 每个主机保留的最大连接数
+    "pool_block": False,        # 连接数达到上限时是否阻塞等待（False则临时新建连接）
+    "keep_alive": True,         # 是否复用HTTP连接（Connection: keep-alive）
+    "tcp_keepalive": True,      # 是否开启TCP层keepalive探测，防止空闲连接被中间设备断开
+    "tcp_keepalive_idle": 60,   # 空闲多少秒后开始发送keepalive探测
+    "tcp_keepalive_interval": 15,  # keepalive探测间隔（秒）
+    "tcp_keepalive_count": 4,   # 探测失败多少次后断开连接
+    "max_retries": 0,           # 连接级重试次数（流式生成不适合自动重试）
+}
+
+
+def _build_socket_options(config: Dict[str, Any]) -> list:
+    """根据配置构建socket选项"""
+    options = list(HTTPConnection.default_socket_options)
+    if not config.get("tcp_keepalive"):
+        return options
+
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    # 以下选项并非所有平台都支持（如Windows/macOS缺少部分常量）
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, config["tcp_keepalive_idle"]))
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, config["tcp_keepalive_interval"]))
+    if hasattr(socket, "TCP_KEEPCNT"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPCNT, config["tcp_keepalive_count"]))
+    return options
+
+
+# 当前线程正在发出的请求的连接观察者（见 watch_connection）
+_connection_watch = threading.local()
+
+
+@contextmanager
+def watch_connection(callback: Optional[Callable[[HTTPConnection], None]]):
+    """
+    在当前线程的请求开始等待响应头之前，把使用的连接传给 callback
+
+    Ollama在生成出首个token后才返回响应头，提示词处理期间还没有响应对象；
+    拿到连接后可以在这段时间内断开它（如取消生成），后端随之停止处理
+
+    Args:
+        callback: 接收 urllib3 连接的回调，为None时不观察
+    """
+    previous = getattr(_connection_watch, "callback", None)
+    _connection_watch.callback = callback
+    try:
+        yield
+    finally:
+        _connection_watch.callback = previous
+
+
+def _notify_watcher(connection: HTTPConnection):
+    callback = getattr(_connection_watch, "callback", None)
+    if callback is not None:
+        callback(connection)
+
+
+class _WatchedHTTPConnection(HTTPConnection):
+    def getresponse(self, *args, **kwargs):
+        _notify_watcher(self)
+        return super().getresponse(*args, **kwargs)
+
+
+class _WatchedHTTPSConnection(HTTPSConnection):
+    def getresponse(self, *args, **kwargs):
+        _notify_watcher(self)
+        return super().getresponse(*args, **kwargs)
+
+
+class _WatchedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _WatchedHTTPConnection
+
+
+class _WatchedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _WatchedHTTPSConnection
+
+
+class KeepAliveHTTPAdapter(HTTPAdapter):
+    """支持TCP keepalive选项的HTTP适配器（连接可通过 watch_connection 观察）"""
+
+    def __init__(self, socket_options: list = None, **kwargs):
+        self.socket_options = socket_options
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options is not None:
+            kwargs["socket_options"] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _WatchedHTTPConnectionPool,
+            "https": _WatchedHTTPSConnectionPool,
+        }
+
+
+class OllamaConnectionPool:
+    """Ollama HTTP连接池
+
+    封装一个挂载了连接池适配器的 requests.Session，线程安全，可被多个客户端共享。
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        初始化连接池
+
+        Args:
+            config: 连接池配置，未提供的字段使用 OLLAMA_POOL_CONFIG 中的默认值
+        """
+        self.config = {**OLLAMA_POOL_CONFIG, **(config or {})}
+        self._lock = threading.Lock()
+        self._session: Optional[requests.Session] = None
+        self._closed = False
+
+    def _create_session(self) -> requests.Session:
+        """创建挂载连接池适配器的会话"""
+        session = requests.Session()
+        adapter = KeepAliveHTTPAdapter(
+            socket_options=_build_socket_options(self.config),
+            pool_connections=self.config["pool_connections"],
+            pool_maxsize=self.config["pool_maxsize"],
+            pool_block=self.config["pool_block"],
+            max_retries=self.config["max_retries"]
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        if not self.config["keep_alive"]:
+            session.headers["Connection"] = "close"
+        return session
+
+    @property
+    def session(self) -> requests.Session:
+        """获取共享会话（首次访问时创建，关闭后再次访问会重新创建）"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create_session()
+                    self._closed = False
+        return self._session
+
+    @property
+    def closed(self) -> bool:
+        """连接池是否已关闭"""
+        return self._closed
+
+    def close(self):
+        """关闭连接池，释放所有保持的连接"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+            self._closed = True
+
+
+# 进程级共享连接池
+_shared_pool: Optional[OllamaConnectionPool] = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_shared_pool() -> OllamaConnectionPool:
+    """获取进程内共享的连接池"""
+    global _shared_pool
+    if _shared_pool is None:
+        with _shared_pool_lock:
+            if _shared_pool is None:
+                _shared_pool = OllamaConnectionPool()
+    return _shared_pool
+
+
+def configure_shared_pool(config: Dict[str, Any]) -> OllamaConnectionPool:
+    """使用新的配置重建共享连接池（会关闭旧连接池）"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is not None:
+            _shared_pool.close()
+        _shared_pool = OllamaConnectionPool(config)
+    return _shared_pool
+
+
+def close_shared_pool():
+    """关闭共享连接池（应用退出时调用）"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is not None:
+            _shared_pool.close()
+            _shared_pool = None
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+本地模拟Ollama服务
+实现 /api/generate、/api/chat、/api/tags 和 /api/pull，流式响应使用与Ollama一致的NDJSON分帧
+（紧凑JSON、每帧一行、chunked传输），可以配置首字延迟、生成速度、抖动、错误注入和停顿，
+用于在没有GPU和模型的环境中压测API层（线程池、SSE、会话）并得到可复现的基准结果。
+
+启动：
+    python LLM/mock_ollama_server.py --port 11435 --ttft 0.3 --tokens-per-sec 30
+    OLLAMA_BACKENDS=http://127.0.0.1:11435 python start_api.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Dict, Any, List
+
+
+# 模拟服务默认配置
+MOCK_OLLAMA_CONFIG = {
+    "models": ["qwen3-redbook-q8:latest"],  # /api/tags 返回的模型
+    "ttft": 0.2,               # 首字延迟（秒）
+    "tokens_per_sec": 40.0,    # 生成速度
+    "jitter": 0.2,             # 每个token间隔的随机抖动比例（0.2 表示 ±20%）
+    "response_tokens": 120,    # 每次生成的token数（请求的 num_predict 更小时以其为准）
+    "load_duration": 0.0,      # 首次请求某个模型时模拟的加载耗时（秒）
+    "error_rate": 0.0,         # 直接返回HTTP错误的请求比例
+    "error_status": 500,       # 注入错误时的HTTP状态码
+    "stream_error_rate": 0.0,  # 流式输出中途返回错误帧的请求比例
+    "stall_rate": 0.0,         # 流式输出中途停顿的请求比例
+    "stall_seconds": 5.0,      # 停顿时长（秒），大于客户端读超时可模拟卡死的后端
+    "seed": None,              # 随机数种子，设置后错误注入、停顿和抖动可复现
+}
+
+# 生成内容使用的token（带小红书文案风格）
+_TOKENS = [
+    "姐妹们", "！", "今天", "给大家", "分享", "一个", "宝藏", "好物", "，", "真的", "绝了", "😍",
+    "\n\n", "✨", "质地", "很", "轻薄", "，", "上脸", "不", "油腻", "。", "性价比", "超高", "，",
+    "学生党", "也", "能", "冲", "💰", "\n\n", "#", "好物分享", " ", "#", "种草", "\n",
+]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _encode(frame: Dict[str, Any]) -> bytes:
+    # 与Ollama一致：紧凑JSON、非ASCII字符不转义、换行结尾
+    return (json.dumps(frame, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def _prompt_tokens(text: str) -> int:
+    # 粗略估算提示词token数（中文约每1.5个字符一个token）
+    return max(1, int(len(text) / 1.5))
+
+
+class MockOllamaServer:
+    """可嵌入测试和基准脚本的模拟Ollama服务（后台线程运行）"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, config: Dict[str, Any] = None):
+        """
+        初始化模拟服务
+
+        Args:
+            host: 监听地址
+            port: 监听端口，0表示随机选择空闲端口
+            config: 配置，未提供的字段使用 MOCK_OLLAMA_CONFIG 中的默认值
+        """
+        self.config = {**MOCK_OLLAMA_CONFIG, **(config or {})}
+        self.models: List[str] = list(self.config["models"])
+        self._loaded: set = set()
+        self._random = random.Random(self.config["seed"])
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "generate": 0, "chat": 0, "tags": 0, "pull": 0,
+                          "errors": 0, "stream_errors": 0, "stalls": 0, "tokens": 0, "active": 0}
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockOllamaServer":
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """在当前线程中运行服务（命令行模式）"""
+        self._httpd.serve_forever()
+
+    def stop(self):
+        """停止服务"""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取请求计数"""
+        with self._lock:
+            return dict(self._counters)
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def _chance(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def _token_interval(self) -> float:
+        base = 1.0 / self.config["tokens_per_sec"] if self.config["tokens_per_sec"] > 0 else 0.0
+        jitter = self.config["jitter"]
+        if not jitter or not base:
+            return base
+        with self._lock:
+            return base * self._random.uniform(1 - jitter, 1 + jitter)
+
+    def _load(self, model: str) -> float:
+        # 模拟模型首次加载
+        with self._lock:
+            first = model not in self._loaded
+            self._loaded.add(model)
+        if first and self.config["load_duration"] > 0:
+            time.sleep(self.config["load_duration"])
+            return self.config["load_duration"]
+        return 0.0
+
+    def _tokens_for(self, body: Dict[str, Any], text: str) -> List[str]:
+        """根据提示词（和采样种子）确定性地选出生成的token"""
+        count = self.config["response_tokens"]
+        num_predict = (body.get("options") or {}).get("num_predict")
+        if isinstance(num_predict, int) and num_predict >= 0:
+            count = min(count, num_predict)
+        seed = (body.get("options") or {}).get("seed")
+        digest = hashlib.sha1(f"{text}|{seed}".encode("utf-8")).digest()
+        rng = random.Random(int.from_bytes(digest[:8], "big"))
+        return [rng.choice(_TOKENS) for _ in range(count)]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, data: Dict[str, Any]):
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _start_stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+            def _write_frame(self, frame: Dict[str, Any]):
+                data = _encode(frame)
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def _end_stream(self):
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            def _read_body(self) -> Dict[str, Any]:
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length) if length else b""
+                return json.loads(raw) if raw else {}
+
+            def do_GET(self):
+                server._count("requests")
+                if self.path == "/api/tags":
+                    server._count("tags")
+                    models = [{"name": name, "model": name, "modified_at": _now(), "size": 0} for name in server.models]
+                    self._send_json(200, {"models": models})
+                elif self.path == "/api/version":
+                    self._send_json(200, {"version": "0.0.0-mock"})
+                elif self.path == "/":
+                    body = b"Ollama is running"
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self._send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                server._count("requests")
+                try:
+                    body = self._read_body()
+                except ValueError:
+                    self._send_json(400, {"error": "invalid JSON"})
+                    return
+
+                if self.path == "/api/pull":
+                    server._count("pull")
+                    self._pull(body)
+                    return
+                if self.path not in ("/api/generate", "/api/chat"):
+                    self._send_json(404, {"error": "not found"})
+                    return
+
+                chat = self.path == "/api/chat"
+                server._count("chat" if chat else "generate")
+                model = body.get("model", "")
+                if model not in server.models:
+                    self._send_json(404, {"error": f"model '{model}' not found, try pulling it first"})
+                    return
+                if server._chance(server.config["error_rate"]):
+                    server._count("errors")
+                    self._send_json(server.config["error_status"], {"error": "mock injected error"})
+                    return
+
+                server._count("active")
+                try:
+                    self._generate(body, chat)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前断开
+                    pass
+                finally:
+                    server._count("active", -1)
+
+            def _generate(self, body: Dict[str, Any], chat: bool):
+                model = body["model"]
+                started = time.monotonic()
+                load_seconds = server._load(model)
+                if chat:
+                    messages = body.get("messages") or []
+                    text = "\n".join(str(message.get("content", "")) for message in messages)
+                else:
+                    text = body.get("prompt", "")
+                    # 空提示词只加载模型（预热请求）
+                    if not text:
+                        self._send_done_only(body, model, load_seconds, started)
+                        return
+
+                tokens = server._tokens_for(body, text)
+                prompt_count = _prompt_tokens(text)
+                context = list(body.get("context") or []) + list(range(prompt_count + len(tokens)))
+
+                def frame_for(token: str) -> Dict[str, Any]:
+                    frame = {"model": model, "created_at": _now()}
+                    if chat:
+                        frame["message"] = {"role": "assistant", "content": token}
+                    else:
+                        frame["response"] = token
+                    frame["done"] = False
+                    return frame
+
+                def done_frame(eval_seconds: float, done_reason: str) -> Dict[str, Any]:
+                    frame = frame_for("")
+                    frame.update({
+                        "done": True,
+                        "done_reason": done_reason,
+                        "total_duration": int((time.monotonic() - started) * 1e9),
+                        "load_duration": int(load_seconds * 1e9),
+                        "prompt_eval_count": prompt_count,
+                        "prompt_eval_duration": int(server.config["ttft"] * 1e9),
+                        "eval_count": len(tokens),
+                        "eval_duration": int(eval_seconds * 1e9),
+                    })
+                    if not chat:
+                        frame["context"] = context
+                    return frame
+
+                time.sleep(server.config["ttft"])
+                stall_at = self._pick(len(tokens)) if server._chance(server.config["stall_rate"]) else None
+                error_at = self._pick(len(tokens)) if server._chance(server.config["stream_error_rate"]) else None
+                done_reason = "length" if len(tokens) < server.config["response_tokens"] else "stop"
+
+                if body.get("stream") is False:
+                    eval_seconds = server._token_interval() * len(tokens)
+                    time.sleep(eval_seconds)
+                    server._count("tokens", len(tokens))
+                    frame = done_frame(eval_seconds, done_reason)
+                    if chat:
+                        frame["message"] = {"role": "assistant", "content": "".join(tokens)}
+                    else:
+                        frame["response"] = "".join(tokens)
+                    self._send_json(200, frame)
+                    return
+
+                self._start_stream()
+                eval_started = time.monotonic()
+                for index, token in enumerate(tokens):
+                    if index == stall_at:
+                        server._count("stalls")
+                        time.sleep(server.config["stall_seconds"])
+                    if index == error_at:
+                        server._count("stream_errors")
+                        self._write_frame({"error": "mock injected stream error"})
+                        self._end_stream()
+                        return
+                    self._write_frame(frame_for(token))
+                    server._count("tokens")
+                    time.sleep(server._token_interval())
+                self._write_frame(done_frame(time.monotonic() - eval_started, done_reason))
+                self._end_stream()
+
+            def _send_done_only(self, body: Dict[str, Any], model: str, load_seconds: float, started: float):
+                frame = {
+                    "model": model, "created_at": _now(), "response": "", "done": True, "done_reason": "load",
+                    "total_duration": int((time.monotonic() - started) * 1e9), "load_duration": int(load_seconds * 1e9),
+                }
+                if body.get("stream") is False:
+                    self._send_json(200, frame)
+                else:
+                    self._start_stream()
+                    self._write_frame(frame)
+                    self._end_stream()
+
+            @staticmethod
+            def _pick(count: int) -> int:
+                with server._lock:
+                    return server._random.randrange(count) if count else 0
+
+            def _pull(self, body: Dict[str, Any]):
+                name = body.get("model") or body.get("name") or ""
+                statuses = [{"status": "pulling manifest"}, {"status": "verifying sha256 digest"},
+                            {"status": "writing manifest"}, {"status": "success"}]
+                with server._lock:
+                    if name and name not in server.models:
+                        server.models.append(name)
+                if body.get("stream") is False:
+                    self._send_json(200, statuses[-1])
+                    return
+                self._start_stream()
+                for status in statuses:
+                    self._write_frame(status)
+                    time.sleep(0.01)
+                self._end_stream()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟Ollama服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=11435, help="监听端口（默认11435，避免与真实Ollama冲突）")
+    parser.add_argument("--model", action="append", dest="models", help="可用模型，可重复指定")
+    parser.add_argument("--ttft", type=float, default=MOCK_OLLAMA_CONFIG["ttft"], help="首字延迟（秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=MOCK_OLLAMA_CONFIG["tokens_per_sec"], help="生成速度")
+    parser.add_argument("--jitter", type=float, default=MOCK_OLLAMA_CONFIG["jitter"], help="token间隔抖动比例")
+    parser.add_argument("--tokens", type=int, default=MOCK_OLLAMA_CONFIG["response_tokens"], help="每次生成的token数")
+    parser.add_argument("--load-duration", type=float, default=MOCK_OLLAMA_CONFIG["load_duration"], help="模型首次加载耗时（秒）")
+    parser.add_argument("--error-rate", type=float, default=MOCK_OLLAMA_CONFIG["error_rate"], help="返回HTTP错误的请求比例")
+    parser.add_argument("--error-status", type=int, default=MOCK_OLLAMA_CONFIG["error_status"], help="注入错误的HTTP状态码")
+    parser.add_argument("--stream-error-rate", type=float, default=MOCK_OLLAMA_CONFIG["stream_error_rate"], help="中途返回错误帧的请求比例")
+    parser.add_argument("--stall-rate", type=float, default=MOCK_OLLAMA_CONFIG["stall_rate"], help="中途停顿的请求比例")
+    parser.add_argument("--stall-seconds", type=float, default=MOCK_OLLAMA_CONFIG["stall_seconds"], help="停顿时长（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子")
+    args = parser.parse_args()
+
+    config = {
+        "ttft": args.ttft,
+        "tokens_per_sec": args.tokens_per_sec,
+        "jitter": args.jitter,
+        "response_tokens": args.tokens,
+        "load_duration": args.load_duration,
+        "error_rate": args.error_rate,
+        "error_status": args.error_status,
+        "stream_error_rate": args.stream_error_rate,
+        "stall_rate": args.stall_rate,
+        "stall_seconds": args.stall_seconds,
+        "seed": args.seed,
+    }
+    if args.models:
+        config["models"] = args.models
+
+    server = MockOllamaServer(args.host, args.port, config)
+    print(f"模拟Ollama服务已启动: {server.url}")
+    print(f"首字延迟 {args.ttft}s, 生成速度 {args.tokens_per_sec} token/s, 抖动 ±{args.jitter * 100:.0f}%, "
+          f"错误率 {args.error_rate}, 中途错误率 {args.stream_error_rate}, 停顿率 {args.stall_rate}")
+    print(f"API使用该服务: OLLAMA_BACKENDS={server.url} python start_api.py")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n模拟Ollama服务已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Ollama模型目录缓存
+缓存每个后端的连通状态和模型列表，并建立 模型名 -> 模型信息 的索引；
+后台线程定期刷新，健康检查和设置检查直接读取缓存，不在请求路径上访问Ollama
+"""
+
+import threading
+import time
+from typing import Optional, Dict, Any, List
+
+import requests
+
+from LLM.http_pool import OllamaConnectionPool, get_shared_pool
+from LLM.backend_pool import BackendPool, get_shared_backend_pool
+
+
+# 模型目录默认配置
+OLLAMA_CATALOG_CONFIG = {
+    "ttl": 30,                # 缓存有效期（秒），超过后在后台刷新
+    "refresh_interval": 15,   # 后台刷新间隔（秒）
+    "request_timeout": (3, 5),  # 访问 /api/tags 的 (连接超时, 读取超时)
+}
+
+
+class ModelCatalog:
+    """模型目录缓存（线程安全）"""
+
+    def __init__(self, backend_pool: BackendPool = None, pool: OllamaConnectionPool = None,
+                 config: Dict[str, Any] = None):
+        """
+        初始化模型目录
+
+        Args:
+            backend_pool: 需要跟踪的后端池，默认使用共享后端池
+            pool: 使用的HTTP连接池，默认使用共享连接池
+            config: 目录配置，未提供的字段使用 OLLAMA_CATALOG_CONFIG 中的默认值
+        """
+        self.backend_pool = backend_pool or get_shared_backend_pool()
+        self.pool = pool or get_shared_pool()
+        self.config = {**OLLAMA_CATALOG_CONFIG, **(config or {})}
+        self._reachable: Dict[str, bool] = {}
+        self._models: Dict[str, List[Dict[str, Any]]] = {}  # 后端地址 -> 模型列表
+        self._index: Dict[str, Dict[str, Any]] = {}         # 模型名 -> 模型信息
+        self._refreshed_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _fetch(self, url: str) -> Optional[List[Dict[str, Any]]]:
+        """获取单个后端的模型列表，失败返回None"""
+        try:
+            response = self.pool.session.get(f"{url}/api/tags", timeout=self.config["request_timeout"])
+            if response.status_code == 200:
+                return response.json().get('models', [])
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        return None
+
+    def refresh(self):
+        """立即从所有后端刷新模型目录（并发调用时只执行一次）"""
+        if not self._refresh_lock.acquire(blocking=False):
+            # 已有线程在刷新，等待其完成即可
+            with self._refresh_lock:
+                return
+        try:
+            reachable = {}
+            models = {}
+            for backend in self.backend_pool.backends:
+                fetched = self._fetch(backend.url)
+                reachable[backend.url] = fetched is not None
+                models[backend.url] = fetched or []
+
+            index = {}
+            for url, backend_models in models.items():
+                for model in backend_models:
+                    name = model.get('name')
+                    if name:
+                        index.setdefault(name, model)
+
+            with self._lock:
+                self._reachable = reachable
+                self._models = models
+                self._index = index
+                self._refreshed_at = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"刷新模型目录失败: {e}")
+            if self._stop_event.wait(self.config["refresh_interval"]):
+                break
+
+    def start(self):
+        """启动后台刷新线程"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, name="ollama-model-catalog", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止后台刷新线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _ensure_loaded(self):
+        """首次读取时同步加载一次（已启动后台刷新时由其完成），之后只由后台线程刷新"""
+        if self._refreshed_at is None:
+            self.start()
+            self.refresh()
+        elif time.monotonic() - self._refreshed_at > self.config["ttl"] and (self._thread is None or not self._thread.is_alive()):
+            self.start()
+
+    @property
+    def age(self) -> Optional[float]:
+        """缓存距上次刷新的时间（秒），尚未加载时为None"""
+        if self._refreshed_at is None:
+            return None
+        return time.monotonic() - self._refreshed_at
+
+    def is_connected(self) -> bool:
+        """是否有任一后端可以连接"""
+        self._ensure_loaded()
+        with self._lock:
+            return any(self._reachable.values())
+
+    def has_model(self, name: str) -> bool:
+        """是否有任一可连接的后端拥有该模型"""
+        self._ensure_loaded()
+        with self._lock:
+            return name in self._index
+
+    def get_model(self, name: str) -> Optional[Dict[str, Any]]:
+        """按名称获取模型信息"""
+        self._ensure_loaded()
+        with self._lock:
+            return self._index.get(name)
+
+    def list_models(self) -> Optional[Dict[str, Any]]:
+        """
+        获取模型列表（与 /api/tags 的返回格式一致）
+
+        Returns:
+            Dict: 第一个可连接后端的模型列表，所有后端都不可连接时返回None
+        """
+        self._ensure_loaded()
+        with self._lock:
+            for backend in self.backend_pool.backends:
+                if self._reachable.get(backend.url):
+                    return {"models": list(self._models.get(backend.url, []))}
+        return None
+
+    def get_status(self, model_name: str = None) -> Dict[str, Any]:
+        """
+        获取目录状态（只读缓存，不会触发加载）
+
+        Args:
+            model_name: 提供时在结果中给出该模型是否可用
+
+        Returns:
+            Dict: 目录状态，尚未加载时 connected 和 model_available 为None
+        """
+        with self._lock:
+            age = self.age
+            loaded = self._refreshed_at is not None
+            status = {
+                "loaded": loaded,
+                "connected": any(self._reachable.values()) if loaded else None,
+                "age_seconds": round(age, 2) if age is not None else None,
+                "model_count": len(self._index),
+                "backends": {
+                    url: {"reachable": reachable, "models": len(self._models.get(url, []))}
+                    for url, reachable in self._reachable.items()
+                },
+            }
+            if model_name is not None:
+                status["model_available"] = (model_name in self._index) if loaded else None
+            return status
+
+
+# 进程级共享模型目录（基于共享后端池）
+_shared_catalog: Optional[ModelCatalog] = None
+_shared_catalog_lock = threading.Lock()
+
+
+def get_shared_catalog() -> ModelCatalog:
+    """获取进程内共享的模型目录"""
+    global _shared_catalog
+    if _shared_catalog is None or _shared_catalog.backend_pool is not get_shared_backend_pool():
+        with _shared_catalog_lock:
+            if _shared_catalog is None or _shared_catalog.backend_pool is not get_shared_backend_pool():
+                if _shared_catalog is not None:
+                    _shared_catalog.stop()
+                _shared_catalog = ModelCatalog()
+    return _shared_catalog
+
+
+def close_shared_catalog():
+    """停止共享模型目录的后台刷新"""
+    global _shared_catalog
+    with _shared_catalog_lock:
+        if _shared_catalog is not None:
+            _shared_catalog.stop()
+            _shared_catalog = None
@@ -0,0 +1,112 @@
+"""
+Ollama流式响应的增量NDJSON解码器
+直接处理到达的原始字节，按换行符增量切分帧；token帧只用 scanstring 提取 response / message.content，
+结束帧和其他帧才做完整的JSON解析（安装了 orjson 时使用 orjson）
+"""
+
+import json
+from json.decoder import scanstring
+from typing import Dict, Any, List, Iterable, Iterator, AsyncIterable, AsyncIterator
+
+try:
+    import orjson
+
+    def _loads(data: bytes) -> Any:
+        return orjson.loads(data)
+except ImportError:
+    def _loads(data: bytes) -> Any:
+        return json.loads(data)
+
+
+# Ollama输出紧凑JSON（无多余空格），据此定位字段；格式不符时回退到完整解析
+_RESPONSE_KEY = '"response":"'
+_CONTENT_KEY = '"content":"'
+_MESSAGE_KEY = b'"message":{'
+_DONE_FALSE = b'"done":false'
+
+
+def decode_frame(line: bytes) -> Dict[str, Any]:
+    """
+    解析一帧NDJSON
+
+    未完成的token帧只提取文本字段，返回 {"response": ..., "done": False}
+    或 {"message": {"role": "assistant", "content": ...}, "done": False}；
+    其他帧（结束帧、错误帧、格式不符的帧）完整解析。
+
+    Raises:
+        ValueError: 帧不是合法的JSON
+    """
+    if _DONE_FALSE in line and b'"error"' not in line:
+        text = line.decode('utf-8')
+        if _MESSAGE_KEY in line:
+            start = text.find(_CONTENT_KEY)
+            if start != -1:
+                content, _ = scanstring(text, start + len(_CONTENT_KEY))
+                return {"message": {"role": "assistant", "content": content}, "done": False}
+        else:
+            start = text.find(_RESPONSE_KEY)
+            if start != -1:
+                response, _ = scanstring(text, start + len(_RESPONSE_KEY))
+                return {"response": response, "done": False}
+    return _loads(line)
+
+
+class NDJSONStreamDecoder:
+    """增量NDJSON解码器：喂入任意切分的字节块，返回其中已完整的帧"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[Dict[str, Any]]:
+        """
+        喂入一段字节
+
+        Returns:
+            List[Dict]: 本次喂入后已完整的帧（可能为空）
+        """
+        buffer = self._buffer
+        # 绝大多数情况下一个网络块恰好是一帧，避免拷贝
+        if not buffer and data.endswith(b"\n") and data.count(b"\n") == 1:
+            line = data.strip()
+            return [decode_frame(line)] if line else []
+
+        buffer += data
+        frames = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+            line = bytes(buffer[start:end]).strip()
+            if line:
+                frames.append(decode_frame(line))
+            start = end + 1
+        if start:
+            del buffer[:start]
+        return frames
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """流结束时解析缓冲区中没有换行结尾的最后一帧"""
+        line = bytes(self._buffer).strip()
+        self._buffer.clear()
+        return [decode_frame(line)] if line else []
+
+
+def iter_frames(chunks: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+    """从字节块迭代器（如 response.iter_content(chunk_size=None)）中逐帧解码"""
+    decoder = NDJSONStreamDecoder()
+    for chunk in chunks:
+        if chunk:
+            yield from decoder.feed(chunk)
+    yield from decoder.flush()
+
+
+async def aiter_frames(chunks: AsyncIterable[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    """从异步字节块迭代器（如 response.aiter_bytes()）中逐帧解码"""
+    decoder = NDJSONStreamDecoder()
+    async for chunk in chunks:
+        if chunk:
+            for frame in decoder.feed(chunk):
+                yield frame
+    for frame in decoder.flush():
+        yield frame
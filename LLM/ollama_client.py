@@ -1,140 +1,569 @@
 import requests
-import json
 import sys
-from typing import Optional, Dict, Any, Generator
+import os
+import time
+import queue
+import socket
+import threading
+from typing import Optional, Dict, Any, List, Generator
+
+# 添加上级目录到路径，以便以脚本方式运行时导入LLM模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM.http_pool import OllamaConnectionPool, get_shared_pool, watch_connection
+from LLM.backend_pool import BackendPool, OllamaBackend, get_shared_backend_pool
+from LLM.model_catalog import ModelCatalog, get_shared_catalog
+from LLM.coalescer import StreamCoalescer, coalesce_key
+from LLM.response_cache import get_shared_response_cache, response_cache_key
+from LLM.ndjson import iter_frames
+from LLM.stats import (
+    GenerationStats, TokenStream, StatsCallback, DoneCallback, extract_response, extract_message_content
+)
+from LLM.resilience import OLLAMA_RESILIENCE_CONFIG, hedge_delay
+from LLM.cancellation import CancellationToken, current_cancel_token
+from LLM.exceptions import (
+    OllamaError, OllamaConnectionError, OllamaTimeoutError, OllamaResponseError, GenerationCancelled
+)
 
 ollama_url1 = "http://localhost:11434"
 ollama_url2 = "https://d1ia07vhri0c73f8pm5g-11434.agent.damodel.com/"
 
+
+def _abort_connection(connection):
+    """断开连接，立即唤醒阻塞在读取上的线程"""
+    # 读取线程持有缓冲区锁，直接close()会等到读取返回；关闭socket可立即唤醒阻塞的读取
+    sock = getattr(connection, "sock", None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def _abort_response(response: requests.Response):
+    """断开响应的连接"""
+    _abort_connection(getattr(response.raw, "connection", None))
+
+
+class _HedgeAttempt:
+    """一次对冲请求的状态"""
+    
+    def __init__(self, index: int, backend: OllamaBackend):
+        self.index = index
+        self.backend = backend
+        self.cancelled = threading.Event()
+        self._response = None
+    
+    def bind(self, response: requests.Response):
+        """记录响应对象，以便取消时断开连接、中断阻塞的读取"""
+        self._response = response
+        if self.cancelled.is_set():
+            _abort_response(response)
+    
+    def cancel(self):
+        if not self.cancelled.is_set():
+            self.cancelled.set()
+            if self._response is not None:
+                _abort_response(self._response)
+
+
 class OllamaClient:
-    def __init__(self, base_url: str = ollama_url1):
+    def __init__(self, base_url: str = None, pool: OllamaConnectionPool = None, pool_config: Dict[str, Any] = None,
+                 backend_pool: BackendPool = None, resilience_config: Dict[str, Any] = None):
         """
         初始化Ollama客户端
         
         Args:
-            base_url: Ollama服务器的URL，默认为本地11434端口
+            base_url: Ollama服务器的URL；不提供时使用共享后端池（默认为本地11434端口）
+            pool: 使用的连接池，默认使用进程内共享连接池
+            pool_config: 连接池配置；提供时为该客户端创建独立连接池（close时一并关闭）
+            backend_pool: 使用的后端池，提供时忽略base_url，每次请求按路由策略选择后端
+            resilience_config: 超时与对冲配置，未提供的字段使用 OLLAMA_RESILIENCE_CONFIG 中的默认值
         """
-        self.base_url = base_url
+        if backend_pool is None:
+            backend_pool = BackendPool([base_url]) if base_url else get_shared_backend_pool()
+        self.backend_pool = backend_pool
         self.model_name = "qwen3-redbook-q8:latest"
+        self.resilience_config = {**OLLAMA_RESILIENCE_CONFIG, **(resilience_config or {})}
+        
+        if pool is None and pool_config is not None:
+            pool = OllamaConnectionPool(pool_config)
+            self._owns_pool = True
+        else:
+            self._owns_pool = False
+        self.pool = pool or get_shared_pool()
+        self._catalog: Optional[ModelCatalog] = None
+        self._owns_catalog = False
+        # 相同的进行中生成请求合并为一次上游请求（按请求开启）
+        self.coalescer = StreamCoalescer()
+        # 生成结果缓存（按请求开启，同步和异步客户端共用）
+        self.response_cache = get_shared_response_cache()
+    
+    @property
+    def base_url(self) -> str:
+        """首个后端的URL（单后端时即为服务器地址）"""
+        return self.backend_pool.primary.url
     
-    def check_connection(self) -> bool:
+    @property
+    def session(self) -> requests.Session:
+        """当前使用的HTTP会话（来自连接池）"""
+        return self.pool.session
+    
+    def close(self):
         """
-        检查Ollama服务连接状态
+        关闭客户端
         
-        Returns:
-            bool: 连接成功返回True，否则返回False
+        独立连接池和独立模型目录会被关闭；共享连接池由 close_shared_pool() 统一关闭
+        """
+        if self._owns_catalog:
+            self._catalog.stop()
+        if self._owns_pool:
+            self.pool.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def _request_frames(self, backend: OllamaBackend, path: str, payload: Dict[str, Any], timeout,
+                        on_response=None, cancel_token: CancellationToken = None) -> Generator[Dict[str, Any], None, None]:
+        """
+        向指定后端发送流式请求并逐帧解析，不做后端池记账
+        
+        Args:
+            cancel_token: 取消令牌（可选），取消时立即断开连接，Ollama随之停止生成
+        
+        Raises:
+            OllamaTimeoutError: 连接或读取超时
+            OllamaConnectionError: 连接失败或读取中断
+            OllamaResponseError: 状态码非200、响应无法解析或返回了错误帧
+            GenerationCancelled: 令牌已取消
         """
+        unregister = []
+        
+        def on_connection(connection):
+            # 在等待响应头之前登记，提示词处理期间取消也能立即断开
+            unregister.append(cancel_token.register(lambda: _abort_connection(connection)))
+        
         try:
-            response = requests.get(f"{self.base_url}/api/tags")
-            return response.status_code == 200
-        except requests.exceptions.RequestException:
-            return False
+            with watch_connection(on_connection if cancel_token is not None else None):
+                response = self.session.post(
+                    f"{backend.url}{path}",
+                    json=payload,
+                    stream=True,
+                    timeout=timeout
+                )
+            # 使用with确保提前结束时连接能归还连接池
+            with response:
+                if on_response is not None:
+                    on_response(response)
+                if cancel_token is not None and not unregister:
+                    on_connection(response.raw.connection)
+                try:
+                    if response.status_code != 200:
+                        raise OllamaResponseError(f"Ollama返回状态码 {response.status_code}", backend.url, response.status_code)
+                    # 按到达的原始字节增量解码，不等待凑满固定大小的块
+                    for data in iter_frames(response.iter_content(chunk_size=None)):
+                        if cancel_token is not None:
+                            cancel_token.raise_if_cancelled()
+                        if 'error' in data:
+                            raise OllamaResponseError(f"Ollama返回错误: {data['error']}", backend.url)
+                        yield data
+                        if data.get('done'):
+                            # 读完结束块，使连接可以被连接池复用
+                            response.raw.drain_conn()
+                            break
+                except ValueError:
+                    raise OllamaResponseError("无法解析Ollama响应", backend.url)
+                finally:
+                    # 在连接归还连接池之前注销，之后的取消不会影响复用该连接的其他请求
+                    for callback in unregister:
+                        callback()
+        except (requests.exceptions.RequestException, OllamaConnectionError, OllamaResponseError) as e:
+            # 取消回调断开连接导致的失败
+            if cancel_token is not None and cancel_token.cancelled:
+                raise GenerationCancelled(f"生成已取消: {cancel_token.reason}" if cancel_token.reason else "生成已取消",
+                                          backend.url) from e
+            if isinstance(e, OllamaError):
+                raise
+            if isinstance(e, requests.exceptions.Timeout):
+                raise OllamaTimeoutError(f"请求Ollama超时: {e}", backend.url) from e
+            raise OllamaConnectionError(f"连接Ollama失败: {e}", backend.url) from e
+        finally:
+            for callback in unregister:
+                callback()
     
-    def list_models(self) -> Optional[Dict[str, Any]]:
+    def _stream_frames(self, path: str, payload: Dict[str, Any], user_id: str = None,
+                       timeout=None, cancel_token: CancellationToken = None) -> Generator[Dict[str, Any], None, None]:
         """
-        获取可用模型列表
+        向选中的后端发送流式请求，逐帧返回解析后的JSON
+        
+        负责后端的选择与释放，并记录首字延迟和请求结果供后端池路由和熔断器使用。
+        启用对冲且有多个可用后端时，首个token迟迟未到会向另一个后端发起对冲请求。
+        
+        Args:
+            path: API路径，如 /api/generate
+            payload: 请求体
+            user_id: 用户ID，用于保持用户到后端的粘性
+            timeout: (连接超时, 读取超时)，默认使用 OLLAMA_RESILIENCE_CONFIG
+            cancel_token: 取消令牌（可选），取消后在下一帧之前停止读取并断开上游连接
+            
+        Yields:
+            Dict: 每一帧NDJSON数据
+            
+        Raises:
+            OllamaError: 请求失败或所有后端均已熔断
+            GenerationCancelled: 令牌已取消
+        """
+        if timeout is None:
+            timeout = (self.resilience_config["connect_timeout"], self.resilience_config["read_timeout"])
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        
+        backend = self.backend_pool.acquire(user_id)
+        if self.resilience_config["hedging_enabled"] and len(self.backend_pool.backends) > 1:
+            yield from self._hedged_frames(backend, path, payload, timeout, cancel_token)
+            return
+        
+        start_time = time.monotonic()
+        ttft = None
+        error = False
+        try:
+            for data in self._request_frames(backend, path, payload, timeout, cancel_token=cancel_token):
+                if ttft is None:
+                    ttft = time.monotonic() - start_time
+                yield data
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+        except GenerationCancelled:
+            raise
+        except OllamaError:
+            error = True
+            raise
+        finally:
+            # 取消的请求不计为后端故障
+            self.backend_pool.release(backend, ttft, error,
+                                      cancelled=cancel_token is not None and cancel_token.cancelled)
+    
+    def _run_attempt(self, attempt: "_HedgeAttempt", path: str, payload: Dict[str, Any], timeout, frames: queue.Queue):
+        """在线程中执行一次（对冲）请求，把每一帧放入共享队列"""
+        start_time = time.monotonic()
+        ttft = None
+        error = False
+        try:
+            for data in self._request_frames(attempt.backend, path, payload, timeout, attempt.bind):
+                if attempt.cancelled.is_set():
+                    break
+                if ttft is None:
+                    ttft = time.monotonic() - start_time
+                frames.put((attempt.index, "frame", data))
+            frames.put((attempt.index, "end", None))
+        except Exception as e:
+            # 被取消的请求由关闭连接中断，产生的异常不计为后端故障
+            if not attempt.cancelled.is_set():
+                error = True
+                if not isinstance(e, OllamaError):
+                    e = OllamaConnectionError(f"连接Ollama失败: {e}", attempt.backend.url)
+                frames.put((attempt.index, "error", e))
+        finally:
+            self.backend_pool.release(attempt.backend, ttft, error,
+                                      cancelled=attempt.cancelled.is_set() and ttft is None)
+    
+    def _hedged_frames(self, backend: OllamaBackend, path: str, payload: Dict[str, Any],
+                       timeout, cancel_token: CancellationToken = None) -> Generator[Dict[str, Any], None, None]:
+        """
+        对冲请求：首个token超过阈值（后端TTFT的p95）未到达，或首个请求在出字前失败时，
+        向另一个后端再发一次，保留先开始输出的流并取消其余请求
+        """
+        frames: queue.Queue = queue.Queue()
+        attempts = []
+        
+        def cancel_all():
+            for attempt in list(attempts):
+                attempt.cancel()
+            # 被取消的请求不再放入帧，用哨兵唤醒等待中的读取
+            frames.put((-1, "cancelled", None))
+        
+        def launch(target: OllamaBackend):
+            attempt = _HedgeAttempt(len(attempts), target)
+            attempts.append(attempt)
+            threading.Thread(
+                target=self._run_attempt,
+                args=(attempt, path, payload, timeout, frames),
+                name=f"ollama-hedge-{attempt.index}",
+                daemon=True
+            ).start()
+        
+        def launch_hedge() -> bool:
+            alternative = self.backend_pool.acquire_alternative([a.backend.url for a in attempts])
+            if alternative is None:
+                return False
+            launch(alternative)
+            return True
+        
+        launch(backend)
+        unregister = cancel_token.register(cancel_all) if cancel_token is not None else None
+        hedge_at = time.monotonic() + hedge_delay(backend.p95_ttft, self.resilience_config)
+        hedged = False
+        failed = 0
+        winner = None
+        try:
+            # 等待第一个出字的请求
+            while winner is None:
+                wait = None if hedged else max(0.0, hedge_at - time.monotonic())
+                try:
+                    index, kind, item = frames.get(timeout=wait)
+                except queue.Empty:
+                    hedged = True
+                    launch_hedge()
+                    continue
+                
+                if kind == "cancelled":
+                    cancel_token.raise_if_cancelled()
+                if kind == "error":
+                    failed += 1
+                    if not hedged:
+                        hedged = True
+                        launch_hedge()
+                    if failed == len(attempts):
+                        raise item
+                    continue
+                
+                winner = attempts[index]
+                for attempt in attempts:
+                    if attempt is not winner:
+                        attempt.cancel()
+                if kind == "end":
+                    return
+                yield item
+            
+            # 继续输出获胜请求的后续内容
+            while True:
+                index, kind, item = frames.get()
+                if kind == "cancelled":
+                    cancel_token.raise_if_cancelled()
+                if index != winner.index:
+                    continue
+                if kind == "frame":
+                    yield item
+                elif kind == "error":
+                    raise item
+                else:
+                    return
+        finally:
+            if unregister is not None:
+                unregister()
+            for attempt in attempts:
+                attempt.cancel()
+    
+    def _post_json(self, path: str, payload: Dict[str, Any], user_id: str = None, timeout=None,
+                   cancel_token: CancellationToken = None) -> Optional[Dict[str, Any]]:
+        """
+        向选中的后端发送非流式请求
+        
+        Args:
+            cancel_token: 取消令牌（可选），取消时立即断开连接，Ollama随之停止生成
         
         Returns:
-            Dict: 模型列表，失败返回None
+            Dict: 响应JSON，状态码非200时返回None
+            
+        Raises:
+            OllamaError: 连接失败、超时、响应无法解析或所有后端均已熔断
+            GenerationCancelled: 令牌已取消
         """
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        unregister = []
+        
+        def on_connection(connection):
+            # 非流式请求在生成结束后才返回响应头，等待期间取消也要能断开
+            unregister.append(cancel_token.register(lambda: _abort_connection(connection)))
+        
+        backend = self.backend_pool.acquire(user_id)
+        start_time = time.monotonic()
+        error = True
         try:
-            response = requests.get(f"{self.base_url}/api/tags")
+            with watch_connection(on_connection if cancel_token is not None else None):
+                response = self.session.post(f"{backend.url}{path}", json=payload, timeout=timeout)
             if response.status_code == 200:
-                return response.json()
-            return None
-        except requests.exceptions.RequestException:
+                try:
+                    data = response.json()
+                except ValueError as e:
+                    raise OllamaResponseError("无法解析Ollama响应", backend.url) from e
+                error = False
+                return data
             return None
+        except requests.exceptions.RequestException as e:
+            if cancel_token is not None and cancel_token.cancelled:
+                raise GenerationCancelled(f"生成已取消: {cancel_token.reason}" if cancel_token.reason else "生成已取消",
+                                          backend.url) from e
+            if isinstance(e, requests.exceptions.Timeout):
+                raise OllamaTimeoutError(f"请求Ollama超时: {e}", backend.url) from e
+            raise OllamaConnectionError(f"连接Ollama失败: {e}", backend.url) from e
+        finally:
+            for callback in unregister:
+                callback()
+            # 非流式请求没有首字时间，以总耗时近似；取消的请求不计为后端故障
+            cancelled = error and cancel_token is not None and cancel_token.cancelled
+            self.backend_pool.release(backend, None if error else time.monotonic() - start_time,
+                                      error and not cancelled, cancelled=cancelled)
+    
+    @property
+    def catalog(self) -> ModelCatalog:
+        """模型目录缓存（使用共享后端池时为共享目录）"""
+        if self._catalog is None:
+            if self.backend_pool is get_shared_backend_pool() and self.pool is get_shared_pool():
+                self._catalog = get_shared_catalog()
+            else:
+                self._catalog = ModelCatalog(self.backend_pool, self.pool)
+                self._owns_catalog = True
+        return self._catalog
+    
+    def check_connection(self, use_cache: bool = True) -> bool:
+        """
+        检查Ollama服务连接状态
+        
+        Args:
+            use_cache: 是否读取模型目录缓存（由后台线程定期刷新）；为False时立即访问所有后端
+        
+        Returns:
+            bool: 任一后端连接成功返回True，否则返回False
+        """
+        if not use_cache:
+            self.catalog.refresh()
+        return self.catalog.is_connected()
+    
+    def list_models(self, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        获取可用模型列表
+        
+        Args:
+            use_cache: 是否读取模型目录缓存；为False时立即访问所有后端
+        
+        Returns:
+            Dict: 模型列表（来自第一个可用后端），失败返回None
+        """
+        if not use_cache:
+            self.catalog.refresh()
+        return self.catalog.list_models()
     
     def check_model_exists(self) -> bool:
         """
-        检查qwen3-redbook-q8:latest模型是否存在
+        检查qwen3-redbook-q8:latest模型是否存在（按名称索引查找）
         
         Returns:
             bool: 模型存在返回True，否则返回False
         """
-        models = self.list_models()
-        if models and 'models' in models:
-            for model in models['models']:
-                if model['name'] == self.model_name:
-                    return True
-        return False
+        return self.catalog.has_model(self.model_name)
     
     def pull_model(self) -> bool:
         """
-        拉取模型（如果不存在）
+        拉取模型（如果不存在），在所有后端上执行
         
         Returns:
-            bool: 成功返回True，失败返回False
+            bool: 全部成功返回True，失败返回False
         """
-        try:
-            print(f"正在拉取模型 {self.model_name}...")
-            response = requests.post(
-                f"{self.base_url}/api/pull",
-                json={"name": self.model_name},
-                stream=True
-            )
-            
-            if response.status_code == 200:
-                for line in response.iter_lines():
-                    if line:
-                        data = json.loads(line)
+        success = True
+        for backend in self.backend_pool.backends:
+            try:
+                print(f"正在拉取模型 {self.model_name} ({backend.url})...")
+                with self.session.post(
+                    f"{backend.url}/api/pull",
+                    json={"name": self.model_name},
+                    stream=True
+                ) as response:
+                    if response.status_code != 200:
+                        success = False
+                        continue
+                    for data in iter_frames(response.iter_content(chunk_size=None)):
                         if 'status' in data:
                             print(f"状态: {data['status']}")
                         if data.get('completed'):
                             print("模型拉取完成!")
-                            return True
-                return True
-            return False
-        except requests.exceptions.RequestException as e:
-            print(f"拉取模型失败: {e}")
-            return False
+                            break
+            except requests.exceptions.RequestException as e:
+                print(f"拉取模型失败: {e}")
+                success = False
+        # 模型列表已变化，立即刷新目录缓存
+        self.catalog.refresh()
+        return success
     
-    def generate_stream(self, prompt: str, system_prompt: str = None) -> Generator[str, None, None]:
+    def _build_generate_payload(self, prompt: str, system_prompt: str = None, stream: bool = True,
+                                context: List[int] = None, seed: int = None) -> Dict[str, Any]:
+        """构建 /api/generate 请求体"""
+        payload = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.backend_pool.config["keep_alive"]
+        }
+        
+        # 如果有系统提示词，添加到选项中
+        if system_prompt:
+            payload["options"] = {
+                "system": system_prompt,
+                "temperature": 0.7,
+                "top_p": 0.9
+            }
+        
+        # 延续上一轮返回的上下文token，Ollama只需处理新增的提示词
+        if context:
+            payload["context"] = context
+        
+        # 固定采样种子，相同输入得到相同输出（使用缓存时的确定性模式）
+        if seed is not None:
+            payload.setdefault("options", {})["seed"] = seed
+        return payload
+    
+    def generate_stream(self, prompt: str, system_prompt: str = None, user_id: str = None,
+                        on_stats: StatsCallback = None, context: List[int] = None,
+                        on_done: DoneCallback = None, coalesce: bool = False, use_cache: bool = False,
+                        cancel_token: CancellationToken = None) -> TokenStream:
         """
         生成文本回复的流式生成器
         
         Args:
             prompt: 输入提示词
             system_prompt: 系统提示词（可选）
+            user_id: 用户ID（可选），多后端时保持用户到后端的粘性
+            on_stats: 生成结束时接收 GenerationStats 的回调（可选）
+            context: 上一轮结束帧返回的上下文token（可选），提供时从该上下文继续生成
+            on_done: 读完整个流后的回调（可选），参数为流本身，可从中取得新的 context 和完整文本
+            coalesce: 是否与进行中的相同请求（提示词、系统提示词、选项和上下文都相同）共享同一次上游生成
+            use_cache: 是否使用生成结果缓存（固定采样种子），命中时分片回放缓存的输出
+            cancel_token: 取消令牌（可选，默认为当前线程池任务的令牌），取消后中断上游请求，迭代时抛出 GenerationCancelled；
+                合并的请求由所有订阅者共享，令牌不会中断它，关闭返回的流即可离开
             
-        Yields:
-            str: 生成的文本片段
-        """
-        try:
-            payload = {
-                "model": self.model_name,
-                "prompt": prompt,
-                "stream": True
-            }
-            
-            # 如果有系统提示词，添加到选项中
-            if system_prompt:
-                payload["options"] = {
-                    "system": system_prompt,
-                    "temperature": 0.7,
-                    "top_p": 0.9
-                }
-            
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                stream=True,
-                timeout=(10, 60)  # (连接超时, 读取超时)
-            )
+        Returns:
+            TokenStream: 逐个返回文本片段，结束后 stats 属性为本次生成的统计信息
             
-            if response.status_code == 200:
-                for line in response.iter_lines():
-                    if line:
-                        data = json.loads(line)
-                        if 'response' in data:
-                            chunk = data['response']
-                            yield chunk
-                        if data.get('done'):
-                            break
-        except requests.exceptions.RequestException as e:
-            yield f"生成文本失败: {e}"
+        Raises:
+            OllamaError: 迭代时请求失败（不再把错误信息当作文本片段返回）
+        """
+        if cancel_token is None:
+            cancel_token = current_cancel_token()
+        seed = self.response_cache.seed if use_cache else None
+        payload = self._build_generate_payload(prompt, system_prompt, context=context, seed=seed)
+        
+        def start():
+            if coalesce:
+                return self.coalescer.subscribe(
+                    coalesce_key("/api/generate", payload),
+                    lambda: self._stream_frames("/api/generate", payload, user_id)
+                )
+            return self._stream_frames("/api/generate", payload, user_id, cancel_token=cancel_token)
+        
+        if use_cache:
+            frames = self.response_cache.stream(response_cache_key(payload), start, self.model_name)
+        else:
+            frames = start()
+        return TokenStream(frames, extract_response, on_stats, on_done)
     
-    def generate(self, prompt: str, stream: bool = False, system_prompt: str = None) -> Optional[str]:
+    def generate(self, prompt: str, stream: bool = False, system_prompt: str = None, user_id: str = None,
+                 on_stats: StatsCallback = None, use_cache: bool = False,
+                 cancel_token: CancellationToken = None) -> Optional[str]:
         """
         生成文本回复
         
@@ -142,136 +571,128 @@ class OllamaClient:
             prompt: 输入提示词
             stream: 是否流式输出
             system_prompt: 系统提示词（可选）
+            user_id: 用户ID（可选），多后端时保持用户到后端的粘性
+            on_stats: 生成结束时接收 GenerationStats 的回调（可选）
+            use_cache: 是否使用生成结果缓存（固定采样种子）
+            cancel_token: 取消令牌（可选，默认为当前线程池任务的令牌），取消后中断上游请求
             
         Returns:
             str: 生成的文本，失败返回None
+            
+        Raises:
+            GenerationCancelled: 令牌已取消
         """
+        if cancel_token is None:
+            cancel_token = current_cancel_token()
         try:
-            payload = {
-                "model": self.model_name,
-                "prompt": prompt,
-                "stream": stream
-            }
-            
-            # 如果有系统提示词，添加到选项中
-            if system_prompt:
-                payload["options"] = {
-                    "system": system_prompt,
-                    "temperature": 0.7,
-                    "top_p": 0.9
-                }
-            
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                stream=stream
-            )
-            
-            if response.status_code == 200:
-                if stream:
-                    # 流式输出
-                    full_response = ""
-                    for line in response.iter_lines():
-                        if line:
-                            data = json.loads(line)
-                            if 'response' in data:
-                                chunk = data['response']
-                                print(chunk, end='', flush=True)
-                                full_response += chunk
-                            if data.get('done'):
-                                print()  # 换行
-                                return full_response
-                    return full_response
-                else:
-                    # 非流式输出
-                    result = response.json()
-                    return result.get('response', '')
-            return None
-        except requests.exceptions.RequestException as e:
+            if stream:
+                # 流式输出
+                full_response = ""
+                for chunk in self.generate_stream(prompt, system_prompt, user_id, on_stats, use_cache=use_cache,
+                                                  cancel_token=cancel_token):
+                    print(chunk, end='', flush=True)
+                    full_response += chunk
+                print()  # 换行
+                return full_response
+            else:
+                # 非流式输出
+                seed = self.response_cache.seed if use_cache else None
+                payload = self._build_generate_payload(prompt, system_prompt, stream=False, seed=seed)
+                key = response_cache_key(payload) if use_cache else None
+                if key is not None:
+                    cached = self.response_cache.get(key)
+                    if cached is not None:
+                        if on_stats is not None:
+                            on_stats(GenerationStats(done_reason="cache"))
+                        return cached
+                result = self._post_json("/api/generate", payload, user_id, cancel_token=cancel_token)
+                if result is None:
+                    return None
+                if on_stats is not None:
+                    on_stats(GenerationStats.from_frame(result))
+                if key is not None and result.get('done_reason') in (None, "stop"):
+                    self.response_cache.put(key, result.get('response', ''), self.model_name)
+                return result.get('response', '')
+        except GenerationCancelled:
+            raise
+        except OllamaError as e:
             print(f"生成文本失败: {e}")
             return None
     
-    def chat_stream(self, messages: list) -> Generator[str, None, None]:
+    def chat_stream(self, messages: list, user_id: str = None, on_stats: StatsCallback = None,
+                    cancel_token: CancellationToken = None) -> TokenStream:
         """
         对话模式的流式生成器
         
         Args:
             messages: 对话历史，格式为[{"role": "user", "content": "..."}]
+            user_id: 用户ID（可选），多后端时把同一用户的多轮对话保持在同一后端
+            on_stats: 生成结束时接收 GenerationStats 的回调（可选）
+            cancel_token: 取消令牌（可选，默认为当前线程池任务的令牌），取消后中断上游请求
             
-        Yields:
-            str: 助手回复的文本片段
-        """
-        try:
-            payload = {
-                "model": self.model_name,
-                "messages": messages,
-                "stream": True
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/api/chat",
-                json=payload,
-                stream=True,
-                timeout=(10, 60)  # (连接超时, 读取超时)
-            )
+        Returns:
+            TokenStream: 逐个返回助手回复的文本片段，结束后 stats 属性为本次生成的统计信息
             
-            if response.status_code == 200:
-                for line in response.iter_lines():
-                    if line:
-                        data = json.loads(line)
-                        if 'message' in data and 'content' in data['message']:
-                            chunk = data['message']['content']
-                            yield chunk
-                        if data.get('done'):
-                            break
-        except requests.exceptions.RequestException as e:
-            yield f"对话失败: {e}"
+        Raises:
+            OllamaError: 迭代时请求失败（不再把错误信息当作文本片段返回）
+        """
+        if cancel_token is None:
+            cancel_token = current_cancel_token()
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": True,
+            "keep_alive": self.backend_pool.config["keep_alive"]
+        }
+        return TokenStream(self._stream_frames("/api/chat", payload, user_id, cancel_token=cancel_token),
+                           extract_message_content, on_stats)
     
-    def chat(self, messages: list, stream: bool = False) -> Optional[str]:
+    def chat(self, messages: list, stream: bool = False, user_id: str = None,
+             on_stats: StatsCallback = None, cancel_token: CancellationToken = None) -> Optional[str]:
         """
         对话模式
         
         Args:
             messages: 对话历史，格式为[{"role": "user", "content": "..."}]
             stream: 是否流式输出
+            user_id: 用户ID（可选），多后端时把同一用户的多轮对话保持在同一后端
+            on_stats: 生成结束时接收 GenerationStats 的回调（可选）
+            cancel_token: 取消令牌（可选，默认为当前线程池任务的令牌），取消后中断上游请求
             
         Returns:
             str: 助手回复，失败返回None
+            
+        Raises:
+            GenerationCancelled: 令牌已取消
         """
+        if cancel_token is None:
+            cancel_token = current_cancel_token()
         try:
-            payload = {
-                "model": self.model_name,
-                "messages": messages,
-                "stream": stream
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/api/chat",
-                json=payload,
-                stream=stream
-            )
-            
-            if response.status_code == 200:
-                if stream:
-                    # 流式输出
-                    full_response = ""
-                    for line in response.iter_lines():
-                        if line:
-                            data = json.loads(line)
-                            if 'message' in data and 'content' in data['message']:
-                                chunk = data['message']['content']
-                                print(chunk, end='', flush=True)
-                                full_response += chunk
-                            if data.get('done'):
-                                print()  # 换行
-                                return full_response
-                    return full_response
-                else:
-                    # 非流式输出
-                    result = response.json()
-                    return result.get('message', {}).get('content', '')
-            return None
-        except requests.exceptions.RequestException as e:
+            if stream:
+                # 流式输出
+                full_response = ""
+                for chunk in self.chat_stream(messages, user_id, on_stats, cancel_token=cancel_token):
+                    print(chunk, end='', flush=True)
+                    full_response += chunk
+                print()  # 换行
+                return full_response
+            else:
+                # 非流式输出
+                payload = {
+                    "model": self.model_name,
+                    "messages": messages,
+                    "stream": False,
+                    "keep_alive": self.backend_pool.config["keep_alive"]
+                }
+                result = self._post_json("/api/chat", payload, user_id, cancel_token=cancel_token)
+                if result is None:
+                    return None
+                if on_stats is not None:
+                    on_stats(GenerationStats.from_frame(result))
+                return result.get('message', {}).get('content', '')
+        except GenerationCancelled:
+            raise
+        except OllamaError as e:
             print(f"对话失败: {e}")
             return None
 
@@ -0,0 +1,138 @@
+"""
+Ollama调用的容错机制
+包括每个后端的熔断器，以及根据首字延迟分位数计算对冲请求的触发时间
+"""
+
+import os
+import threading
+import time
+from enum import Enum
+from typing import Optional, Dict, Any
+
+
+# 容错默认配置
+OLLAMA_RESILIENCE_CONFIG = {
+    "connect_timeout": 10,          # 连接超时（秒）
+    "read_timeout": 60,             # 流式读取超时（秒）
+    "failure_threshold": 3,         # 连续失败多少次后打开熔断器
+    "recovery_timeout": 30,         # 熔断器打开多久后进入半开状态（秒）
+    "half_open_max_calls": 1,       # 半开状态下允许的探测请求数
+    "hedging_enabled": os.getenv("OLLAMA_HEDGING", "false").lower() == "true",  # 是否启用对冲请求
+    "hedge_initial_delay": 3.0,     # 尚无TTFT样本时的对冲等待时间（秒）
+    "hedge_min_delay": 0.3,         # 对冲等待时间下限（秒）
+}
+
+
+class CircuitState(Enum):
+    """熔断器状态枚举"""
+    CLOSED = "closed"        # 正常放行
+    OPEN = "open"            # 快速失败
+    HALF_OPEN = "half_open"  # 放行少量探测请求
+
+
+class CircuitBreaker:
+    """熔断器（线程安全）
+
+    连续失败达到阈值后打开；打开一段时间后进入半开状态放行探测请求，
+    探测成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, failure_threshold: int = None, recovery_timeout: float = None, half_open_max_calls: int = None):
+        self.failure_threshold = failure_threshold or OLLAMA_RESILIENCE_CONFIG["failure_threshold"]
+        self.recovery_timeout = recovery_timeout or OLLAMA_RESILIENCE_CONFIG["recovery_timeout"]
+        self.half_open_max_calls = half_open_max_calls or OLLAMA_RESILIENCE_CONFIG["half_open_max_calls"]
+        self._state = CircuitState.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._open_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> CircuitState:
+        """当前状态（打开超时后会自动转为半开）"""
+        with self._lock:
+            self._refresh_locked()
+            return self._state
+
+    def _refresh_locked(self):
+        if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = CircuitState.HALF_OPEN
+            self._half_open_calls = 0
+
+    def is_available(self) -> bool:
+        """是否可以放行请求（不占用半开探测名额）"""
+        with self._lock:
+            self._refresh_locked()
+            if self._state == CircuitState.CLOSED:
+                return True
+            if self._state == CircuitState.HALF_OPEN:
+                return self._half_open_calls < self.half_open_max_calls
+            return False
+
+    def allow_request(self) -> bool:
+        """申请放行一个请求；半开状态下会占用一个探测名额"""
+        with self._lock:
+            self._refresh_locked()
+            if self._state == CircuitState.CLOSED:
+                return True
+            if self._state == CircuitState.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return True
+            return False
+
+    def release_probe(self):
+        """归还被取消请求占用的半开探测名额（取消的请求既不算成功也不算失败）"""
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def record_success(self):
+        """记录一次成功调用"""
+        with self._lock:
+            self._consecutive_failures = 0
+            self._state = CircuitState.CLOSED
+            self._half_open_calls = 0
+
+    def record_failure(self):
+        """记录一次失败调用"""
+        with self._lock:
+            self._refresh_locked()
+            self._consecutive_failures += 1
+            if self._state == CircuitState.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self._state != CircuitState.OPEN:
+                    self._open_count += 1
+                self._state = CircuitState.OPEN
+                self._opened_at = time.monotonic()
+                self._half_open_calls = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出状态信息"""
+        with self._lock:
+            self._refresh_locked()
+            retry_in = None
+            if self._state == CircuitState.OPEN:
+                retry_in = round(max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at)), 2)
+            return {
+                "state": self._state.value,
+                "consecutive_failures": self._consecutive_failures,
+                "open_count": self._open_count,
+                "retry_in_seconds": retry_in,
+            }
+
+
+def hedge_delay(p95_ttft: Optional[float], config: Dict[str, Any] = None) -> float:
+    """
+    计算对冲请求的触发时间
+
+    Args:
+        p95_ttft: 首个后端最近的TTFT 95分位数（秒），没有样本时为None
+        config: 容错配置，默认使用 OLLAMA_RESILIENCE_CONFIG
+
+    Returns:
+        float: 等待首个token的时间（秒），超过后向另一个后端发起对冲请求
+    """
+    config = config or OLLAMA_RESILIENCE_CONFIG
+    if p95_ttft is None:
+        return config["hedge_initial_delay"]
+    return max(config["hedge_min_delay"], p95_ttft)
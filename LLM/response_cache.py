@@ -0,0 +1,300 @@
+"""
+生成结果缓存（按内容寻址）
+以模型、最终提示词、系统提示词和采样选项的摘要为键缓存 /api/generate 的完整输出：
+内存层为有界LRU，磁盘层每个键一个JSON文件、按TTL淘汰。
+使用缓存的请求固定采样种子（确定性模式），相同输入得到相同输出，命中缓存才与重新生成等价
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Iterator, AsyncIterator
+
+from LLM.coalescer import coalesce_key
+
+
+# 生成结果缓存默认配置
+OLLAMA_CACHE_CONFIG = {
+    "memory_max_entries": 256,   # 内存层最多保存的结果数，超出时淘汰最久未使用的结果
+    "disk_enabled": os.getenv("OLLAMA_CACHE_DISK", "true").lower() == "true",  # 是否启用磁盘层
+    "disk_dir": os.getenv("OLLAMA_CACHE_DIR", os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "ollama_responses")),
+    "ttl": int(os.getenv("OLLAMA_CACHE_TTL", str(7 * 24 * 3600))),  # 结果有效期（秒），内存层和磁盘层相同
+    "sweep_interval": 600,       # 清理磁盘层过期文件的最小间隔（秒）
+    "seed": int(os.getenv("OLLAMA_CACHE_SEED", "42")),  # 确定性模式使用的固定采样种子
+    "replay_chunk_chars": 16,    # 命中缓存时每个回放片段的字符数
+}
+
+
+def response_cache_key(payload: Dict[str, Any]) -> str:
+    """计算 /api/generate 请求的缓存键（规范化方式与请求合并相同，见 coalesce_key）"""
+    return coalesce_key("/api/generate", payload)
+
+
+def replay_frames(text: str, chunk_chars: int) -> Iterator[Dict[str, Any]]:
+    """把缓存的文本切成与Ollama格式一致的帧，结束帧的 done_reason 为 "cache" """
+    for start in range(0, len(text), chunk_chars):
+        yield {"response": text[start:start + chunk_chars], "done": False}
+    yield {"response": "", "done": True, "done_reason": "cache"}
+
+
+async def areplay_frames(text: str, chunk_chars: int) -> AsyncIterator[Dict[str, Any]]:
+    """replay_frames 的异步版本"""
+    for frame in replay_frames(text, chunk_chars):
+        yield frame
+
+
+def _cacheable(frame: Dict[str, Any]) -> bool:
+    # 只缓存正常结束的生成，被长度截断的结果不缓存
+    return frame.get("done_reason") in (None, "stop")
+
+
+class ResponseCache:
+    """两级生成结果缓存（线程安全）"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        """
+        初始化缓存
+
+        Args:
+            config: 配置，未提供的字段使用 OLLAMA_CACHE_CONFIG 中的默认值
+        """
+        self.config = {**OLLAMA_CACHE_CONFIG, **(config or {})}
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "memory_evictions": 0,
+            "expired": 0,
+            "disk_errors": 0,
+        }
+
+    @property
+    def seed(self) -> int:
+        return self.config["seed"]
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["created_at"] > self.config["ttl"]
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.config["disk_dir"], key[:2], f"{key}.json")
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.config["memory_max_entries"]:
+                self._memory.popitem(last=False)
+                self._counters["memory_evictions"] += 1
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            self._count("disk_errors")
+            return None
+        if self._expired(entry):
+            self._remove_disk(path)
+            self._count("expired")
+            return None
+        return entry
+
+    def _write_disk(self, key: str, entry: Dict[str, Any]):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再替换，其他进程不会读到写了一半的文件
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self._count("disk_errors")
+            print(f"写入生成缓存失败: {e}")
+
+    @staticmethod
+    def _remove_disk(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        查询缓存（先内存层，再磁盘层；磁盘层命中后提升到内存层）
+
+        Returns:
+            str: 缓存的完整输出，未命中或已过期时返回None
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry):
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return entry["text"]
+                del self._memory[key]
+                self._counters["expired"] += 1
+
+        if self.config["disk_enabled"]:
+            entry = self._read_disk(key)
+            if entry is not None:
+                self._remember(key, entry)
+                self._count("disk_hits")
+                return entry["text"]
+
+        self._count("misses")
+        return None
+
+    def put(self, key: str, text: str, model: str = None):
+        """保存一次完整的生成输出（空文本不保存）"""
+        if not text:
+            return
+        entry = {"text": text, "model": model, "created_at": time.time()}
+        self._remember(key, entry)
+        self._count("stores")
+        if self.config["disk_enabled"]:
+            self._write_disk(key, entry)
+            self._maybe_sweep()
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep < self.config["sweep_interval"]:
+                return
+            self._last_sweep = now
+        self.sweep()
+
+    def sweep(self) -> int:
+        """
+        删除磁盘层中的过期文件
+
+        Returns:
+            int: 删除的文件数
+        """
+        root = self.config["disk_dir"]
+        if not os.path.isdir(root):
+            return 0
+        deadline = time.time() - self.config["ttl"]
+        removed = 0
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    if os.path.getmtime(path) < deadline:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        if removed:
+            self._count("expired", removed)
+        return removed
+
+    def clear(self):
+        """清空内存层和磁盘层"""
+        with self._lock:
+            self._memory.clear()
+        root = self.config["disk_dir"]
+        if os.path.isdir(root):
+            for dirpath, _, filenames in os.walk(root):
+                for name in filenames:
+                    self._remove_disk(os.path.join(dirpath, name))
+
+    def stream(self, key: str, start: Callable[[], Iterator[Dict[str, Any]]],
+               model: str = None) -> Iterator[Dict[str, Any]]:
+        """
+        带缓存的逐帧读取：命中时分片回放缓存的输出，未命中时用 start 发起请求并在正常结束后保存
+
+        Args:
+            key: 缓存键（见 response_cache_key）
+            start: 发起上游请求、逐帧返回响应的函数
+            model: 保存到缓存条目中的模型名
+        """
+        cached = self.get(key)
+        if cached is not None:
+            yield from replay_frames(cached, self.config["replay_chunk_chars"])
+            return
+
+        frames = start()
+        chunks = []
+        try:
+            for frame in frames:
+                text = frame.get("response")
+                if text:
+                    chunks.append(text)
+                if frame.get("done") and _cacheable(frame):
+                    self.put(key, "".join(chunks), model)
+                yield frame
+        finally:
+            close = getattr(frames, "close", None)
+            if close is not None:
+                close()
+
+    async def astream(self, key: str, start: Callable[[], AsyncIterator[Dict[str, Any]]],
+                      model: str = None) -> AsyncIterator[Dict[str, Any]]:
+        """stream 的异步版本，磁盘读写在线程中执行，不阻塞事件循环"""
+        cached = await asyncio.to_thread(self.get, key)
+        if cached is not None:
+            async for frame in areplay_frames(cached, self.config["replay_chunk_chars"]):
+                yield frame
+            return
+
+        frames = start()
+        chunks = []
+        try:
+            async for frame in frames:
+                text = frame.get("response")
+                if text:
+                    chunks.append(text)
+                if frame.get("done") and _cacheable(frame):
+                    await asyncio.to_thread(self.put, key, "".join(chunks), model)
+                yield frame
+        finally:
+            aclose = getattr(frames, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取命中、未命中和淘汰统计"""
+        with self._lock:
+            counters = dict(self._counters)
+            memory_entries = len(self._memory)
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            "memory_entries": memory_entries,
+            "disk_enabled": self.config["disk_enabled"],
+            "hits": hits,
+            **counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+        }
+
+
+# 进程级共享缓存（同步和异步客户端共用）
+_shared_cache: Optional[ResponseCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_response_cache() -> ResponseCache:
+    """获取进程内共享的生成结果缓存"""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                _shared_cache = ResponseCache()
+    return _shared_cache
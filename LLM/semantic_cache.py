@@ -0,0 +1,267 @@
+"""
+主题近似重复缓存
+把主题文本转换为哈希字符n-gram的TF-IDF向量，在同一分区（分类、语言及其他生成参数都相同）内
+做余弦相似度top-k检索，相似度达到阈值时直接返回之前为近似主题生成的文案。
+安装了 NumPy 时使用向量化检索，否则回退到纯Python的稀疏向量实现
+"""
+
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from typing import Optional, Dict, Any, List, Tuple, Hashable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# 近似重复缓存默认配置
+OLLAMA_SEMANTIC_CACHE_CONFIG = {
+    "enabled": os.getenv("OLLAMA_SEMANTIC_CACHE", "false").lower() == "true",  # 是否启用（默认关闭）
+    "threshold": float(os.getenv("OLLAMA_SEMANTIC_THRESHOLD", "0.42")),  # 余弦相似度阈值，越高越严格
+    "ngram_range": (1, 2),         # 字符n-gram长度范围（常见单字由IDF降权）
+    "dimensions": 2048,            # 哈希向量维度
+    "top_k": 3,                    # 每次检索返回的候选数
+    "max_entries_per_partition": 512,  # 每个分区最多保存的主题数，超出时淘汰最早的主题
+    "ttl": 24 * 3600,              # 结果有效期（秒）
+}
+
+# 只保留文字和数字，忽略空白、标点和emoji
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+_NUMBER = re.compile(r"\d+")
+
+
+def normalize_topic(text: str) -> str:
+    """规范化主题文本：转小写并去掉空白和标点"""
+    return _NON_WORD.sub("", text.lower())
+
+
+def _hashed_ngrams(text: str, ngram_range: Tuple[int, int], dimensions: int) -> Dict[int, float]:
+    """提取哈希字符n-gram，返回 {维度: 次线性词频}"""
+    counts: Dict[int, int] = {}
+    low, high = ngram_range
+    for n in range(low, high + 1):
+        for i in range(len(text) - n + 1):
+            index = zlib.crc32(text[i:i + n].encode("utf-8")) % dimensions
+            counts[index] = counts.get(index, 0) + 1
+    # 文本短于最小n-gram时退化为整段文本
+    if not counts and text:
+        counts[zlib.crc32(text.encode("utf-8")) % dimensions] = 1
+    return {index: 1.0 + math.log(count) for index, count in counts.items()}
+
+
+class _Partition:
+    """一个分区内的主题向量（固定容量的环形缓冲区）"""
+
+    def __init__(self, capacity: int, dimensions: int):
+        self.capacity = capacity
+        self.topics: List[Optional[str]] = [None] * capacity
+        self.values: List[Optional[str]] = [None] * capacity
+        self.created_at: List[float] = [0.0] * capacity
+        self.sparse: List[Optional[Dict[int, float]]] = [None] * capacity
+        self.index: Dict[str, int] = {}    # 规范化主题 -> 槽位
+        self.size = 0
+        self.next_slot = 0
+        self.df: Dict[int, int] = {}       # 文档频率（纯Python实现使用）
+        if np is not None:
+            # 矩阵按需倍增，分区较多时不必为每个分区预分配全部容量
+            self.matrix = np.zeros((min(16, capacity), dimensions), dtype=np.float32)
+            self.df_array = np.zeros(dimensions, dtype=np.float32)
+
+    def _ensure_rows(self, slot: int):
+        rows = self.matrix.shape[0]
+        if slot >= rows:
+            matrix = np.zeros((min(self.capacity, max(rows * 2, slot + 1)), self.matrix.shape[1]), dtype=np.float32)
+            matrix[:rows] = self.matrix
+            self.matrix = matrix
+
+    def _remove(self, slot: int):
+        vector = self.sparse[slot]
+        if vector is None:
+            return
+        for index in vector:
+            self.df[index] -= 1
+            if not self.df[index]:
+                del self.df[index]
+        if np is not None:
+            self.df_array -= self.matrix[slot] > 0
+            self.matrix[slot] = 0
+        self.index.pop(self.topics[slot], None)
+        self.topics[slot] = None
+        self.values[slot] = None
+        self.sparse[slot] = None
+        self.size -= 1
+
+    def add(self, topic: str, vector: Dict[int, float], value: str) -> bool:
+        """保存主题，返回是否淘汰了旧主题"""
+        evicted = False
+        slot = self.index.get(topic)
+        if slot is None:
+            slot = self.next_slot
+            self.next_slot = (slot + 1) % self.capacity
+            evicted = self.sparse[slot] is not None
+        self._remove(slot)
+
+        self.topics[slot] = topic
+        self.values[slot] = value
+        self.created_at[slot] = time.time()
+        self.sparse[slot] = vector
+        self.index[topic] = slot
+        self.size += 1
+        for index in vector:
+            self.df[index] = self.df.get(index, 0) + 1
+        if np is not None:
+            self._ensure_rows(slot)
+            row = self.matrix[slot]
+            row[list(vector)] = list(vector.values())
+            self.df_array += row > 0
+        return evicted
+
+    def _idf_scale(self, df: float) -> float:
+        # 平滑IDF，查询本身也计为一篇文档：log((2 + N) / (1 + df)) + 1，
+        # 避免语料较少时只出现在查询中的n-gram权重过高
+        return math.log((2 + self.size) / (1 + df)) + 1.0
+
+    def search(self, vector: Dict[int, float], top_k: int, ttl: float) -> List[Tuple[float, int]]:
+        """返回未过期的 top_k 个 (相似度, 槽位)，按相似度降序"""
+        if not self.size or not vector:
+            return []
+        deadline = time.time() - ttl
+        if np is not None:
+            query = np.zeros(self.matrix.shape[1], dtype=np.float32)
+            query[list(vector)] = list(vector.values())
+            idf = np.log((2 + self.size) / (1 + self.df_array + (query > 0))) + 1.0
+            weighted = self.matrix * idf
+            norms = np.linalg.norm(weighted, axis=1)
+            query *= idf
+            query_norm = np.linalg.norm(query)
+            if not query_norm:
+                return []
+            scores = weighted @ query / np.maximum(norms * query_norm, 1e-12)
+            expired = np.asarray(self.created_at[:len(scores)]) < deadline
+            scores[expired | (norms == 0)] = -1.0
+            k = min(top_k, len(scores))
+            candidates = np.argpartition(-scores, k - 1)[:k]
+            ranked = candidates[np.argsort(-scores[candidates])]
+            return [(float(scores[slot]), int(slot)) for slot in ranked if scores[slot] >= 0]
+
+        query = {index: value * self._idf_scale(self.df.get(index, 0) + 1) for index, value in vector.items()}
+        query_norm = math.sqrt(sum(value * value for value in query.values()))
+        results = []
+        for slot, stored in enumerate(self.sparse):
+            if stored is None or self.created_at[slot] < deadline:
+                continue
+            weighted = {index: value * self._idf_scale(self.df[index] + (index in vector)) for index, value in stored.items()}
+            norm = math.sqrt(sum(value * value for value in weighted.values()))
+            dot = sum(value * weighted.get(index, 0.0) for index, value in query.items())
+            results.append((dot / (norm * query_norm), slot))
+        results.sort(reverse=True)
+        return results[:top_k]
+
+
+class SemanticCache:
+    """按分区保存主题和生成结果的近似重复缓存（线程安全）"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        """
+        初始化缓存
+
+        Args:
+            config: 配置，未提供的字段使用 OLLAMA_SEMANTIC_CACHE_CONFIG 中的默认值
+        """
+        self.config = {**OLLAMA_SEMANTIC_CACHE_CONFIG, **(config or {})}
+        self._partitions: Dict[Hashable, _Partition] = {}
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._hits = 0
+        self._evictions = 0
+        self._hit_similarity_sum = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.config["enabled"]
+
+    def _vectorize(self, topic: str) -> Dict[int, float]:
+        return _hashed_ngrams(topic, self.config["ngram_range"], self.config["dimensions"])
+
+    def search(self, partition: Hashable, topic: str, top_k: int = None) -> List[Dict[str, Any]]:
+        """
+        检索分区内与主题最相似的已缓存主题（不计入命中统计）
+
+        Args:
+            partition: 分区键，其中的参数必须完全相同才会比较主题
+            topic: 主题文本
+            top_k: 返回的候选数，默认使用配置中的 top_k
+
+        Returns:
+            List[Dict]: 按相似度降序的候选，每项包含 topic、similarity 和 value
+        """
+        normalized = normalize_topic(topic)
+        vector = self._vectorize(normalized)
+        with self._lock:
+            bucket = self._partitions.get(partition)
+            if bucket is None:
+                return []
+            return [
+                {"topic": bucket.topics[slot], "similarity": round(score, 4), "value": bucket.values[slot]}
+                for score, slot in bucket.search(vector, top_k or self.config["top_k"], self.config["ttl"])
+            ]
+
+    def lookup(self, partition: Hashable, topic: str) -> Optional[Dict[str, Any]]:
+        """
+        查找近似主题的缓存结果
+
+        Returns:
+            Dict: 相似度最高且达到阈值的候选（topic、similarity、value），没有时返回None
+        """
+        # 数字（型号、年份、价格等）不同的主题即使字面相近也不视为重复
+        numbers = _NUMBER.findall(normalize_topic(topic))
+        match = next((candidate for candidate in self.search(partition, topic)
+                      if candidate["similarity"] >= self.config["threshold"]
+                      and _NUMBER.findall(candidate["topic"]) == numbers), None)
+        with self._lock:
+            self._lookups += 1
+            if match is not None:
+                self._hits += 1
+                self._hit_similarity_sum += match["similarity"]
+        return match
+
+    def add(self, partition: Hashable, topic: str, value: str):
+        """保存主题的生成结果（空结果不保存）"""
+        normalized = normalize_topic(topic)
+        if not value or not normalized:
+            return
+        vector = self._vectorize(normalized)
+        with self._lock:
+            bucket = self._partitions.get(partition)
+            if bucket is None:
+                bucket = _Partition(self.config["max_entries_per_partition"], self.config["dimensions"])
+                self._partitions[partition] = bucket
+            if bucket.add(normalized, vector, value):
+                self._evictions += 1
+
+    def clear(self):
+        """清空所有分区"""
+        with self._lock:
+            self._partitions.clear()
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取命中率等统计"""
+        with self._lock:
+            return {
+                "enabled": self.config["enabled"],
+                "backend": "numpy" if np is not None else "python",
+                "threshold": self.config["threshold"],
+                "partitions": len(self._partitions),
+                "entries": sum(bucket.size for bucket in self._partitions.values()),
+                "lookups": self._lookups,
+                "hits": self._hits,
+                "misses": self._lookups - self._hits,
+                "hit_rate": round(self._hits / self._lookups, 4) if self._lookups else None,
+                "avg_hit_similarity": round(self._hit_similarity_sum / self._hits, 4) if self._hits else None,
+                "evictions": self._evictions,
+            }
@@ -0,0 +1,324 @@
+"""
+Ollama生成统计
+从结束帧中提取 prompt_eval_count、eval_count、各阶段耗时等统计信息，
+并提供携带统计信息的流式结果对象和按维度聚合的统计器
+"""
+
+import threading
+import time
+from dataclasses import dataclass, asdict, fields
+from typing import Optional, Dict, Any, Callable, Iterator, AsyncIterator, List, Tuple, Union
+
+
+def _ns_to_ms(value: Optional[int]) -> Optional[float]:
+    return round(value / 1e6, 2) if value is not None else None
+
+
+@dataclass
+class GenerationStats:
+    """单次生成的统计信息（耗时单位为毫秒）"""
+    prompt_eval_count: Optional[int] = None      # 提示词token数
+    prompt_eval_duration_ms: Optional[float] = None
+    eval_count: Optional[int] = None             # 生成token数
+    eval_duration_ms: Optional[float] = None
+    load_duration_ms: Optional[float] = None     # 模型加载耗时（较大时说明模型被卸载后重新加载）
+    total_duration_ms: Optional[float] = None
+    ttft_ms: Optional[float] = None              # 客户端测得的首字延迟
+    done_reason: Optional[str] = None
+
+    @classmethod
+    def from_frame(cls, frame: Dict[str, Any], ttft: Optional[float] = None) -> "GenerationStats":
+        """
+        从Ollama的结束帧（或非流式响应）构建统计信息
+
+        Args:
+            frame: done为True的帧
+            ttft: 首字延迟（秒）
+        """
+        return cls(
+            prompt_eval_count=frame.get("prompt_eval_count"),
+            prompt_eval_duration_ms=_ns_to_ms(frame.get("prompt_eval_duration")),
+            eval_count=frame.get("eval_count"),
+            eval_duration_ms=_ns_to_ms(frame.get("eval_duration")),
+            load_duration_ms=_ns_to_ms(frame.get("load_duration")),
+            total_duration_ms=_ns_to_ms(frame.get("total_duration")),
+            ttft_ms=round(ttft * 1000, 2) if ttft is not None else None,
+            done_reason=frame.get("done_reason"),
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "GenerationStats":
+        """从 to_dict() 的结果还原（忽略派生的速度指标）"""
+        return cls(**{f.name: data.get(f.name) for f in fields(cls)})
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """生成速度（token/秒）"""
+        if not self.eval_count or not self.eval_duration_ms:
+            return None
+        return round(self.eval_count / (self.eval_duration_ms / 1000), 2)
+
+    @property
+    def prompt_tokens_per_second(self) -> Optional[float]:
+        """提示词处理速度（token/秒）"""
+        if not self.prompt_eval_count or not self.prompt_eval_duration_ms:
+            return None
+        return round(self.prompt_eval_count / (self.prompt_eval_duration_ms / 1000), 2)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出为字典（包含派生的速度指标）"""
+        data = asdict(self)
+        data["tokens_per_second"] = self.tokens_per_second
+        data["prompt_tokens_per_second"] = self.prompt_tokens_per_second
+        return data
+
+
+StatsCallback = Callable[[GenerationStats], None]
+DoneCallback = Callable[[Any], None]
+
+
+class TokenStream:
+    """
+    流式文本结果
+
+    可以像生成器一样迭代文本片段；流结束后 stats 属性为本次生成的统计信息（未收到结束帧时为None），
+    context 属性为 /api/generate 结束帧返回的上下文token，text 属性为已读取的完整文本。
+    """
+
+    def __init__(self, frames: Iterator[Dict[str, Any]], extract: Callable[[Dict[str, Any]], Optional[str]],
+                 on_stats: StatsCallback = None, on_done: DoneCallback = None):
+        """
+        Args:
+            frames: 逐帧返回Ollama响应的迭代器
+            extract: 从帧中取出文本片段的函数，帧中没有文本时返回None
+            on_stats: 收到结束帧时的回调
+            on_done: 完整读完流（包括结束帧的文本）后的回调，参数为流本身
+        """
+        self._frames = frames
+        self._extract = extract
+        self._on_stats = on_stats
+        self._on_done = on_done
+        self._iterator = None
+        self._chunks: List[str] = []
+        self.stats: Optional[GenerationStats] = None
+        self.context: Optional[List[int]] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if self._iterator is None:
+            self._iterator = self._iterate()
+        return next(self._iterator)
+
+    def _iterate(self) -> Iterator[str]:
+        start_time = time.monotonic()
+        ttft = None
+        try:
+            for data in self._frames:
+                text = self._extract(data)
+                if text and ttft is None:
+                    ttft = time.monotonic() - start_time
+                done = data.get('done')
+                if done:
+                    # 先记录统计，保证读到最后一个片段时 stats 已可用
+                    self.stats = GenerationStats.from_frame(data, ttft)
+                    self.context = data.get('context')
+                    if self._on_stats is not None:
+                        self._on_stats(self.stats)
+                if text is not None:
+                    self._chunks.append(text)
+                    yield text
+                if done and self._on_done is not None:
+                    self._on_done(self)
+        finally:
+            close = getattr(self._frames, "close", None)
+            if close is not None:
+                close()
+
+    def close(self):
+        """提前结束读取，释放连接和后端"""
+        if self._iterator is not None:
+            self._iterator.close()
+        else:
+            close = getattr(self._frames, "close", None)
+            if close is not None:
+                close()
+
+
+class AsyncTokenStream:
+    """异步流式文本结果，用法与 TokenStream 相同（async for）"""
+
+    def __init__(self, frames: AsyncIterator[Dict[str, Any]], extract: Callable[[Dict[str, Any]], Optional[str]],
+                 on_stats: StatsCallback = None, on_done: DoneCallback = None):
+        self._frames = frames
+        self._extract = extract
+        self._on_stats = on_stats
+        self._on_done = on_done
+        self._iterator = None
+        self._chunks: List[str] = []
+        self.stats: Optional[GenerationStats] = None
+        self.context: Optional[List[int]] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        if self._iterator is None:
+            self._iterator = self._iterate()
+        return await self._iterator.__anext__()
+
+    async def _iterate(self):
+        start_time = time.monotonic()
+        ttft = None
+        try:
+            async for data in self._frames:
+                text = self._extract(data)
+                if text and ttft is None:
+                    ttft = time.monotonic() - start_time
+                done = data.get('done')
+                if done:
+                    self.stats = GenerationStats.from_frame(data, ttft)
+                    self.context = data.get('context')
+                    if self._on_stats is not None:
+                        self._on_stats(self.stats)
+                if text is not None:
+                    self._chunks.append(text)
+                    yield text
+                if done and self._on_done is not None:
+                    self._on_done(self)
+        finally:
+            aclose = getattr(self._frames, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    async def aclose(self):
+        """提前结束读取，释放连接和后端"""
+        if self._iterator is not None:
+            await self._iterator.aclose()
+        else:
+            aclose = getattr(self._frames, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+
+def extract_response(data: Dict[str, Any]) -> Optional[str]:
+    """/api/generate 帧中的文本"""
+    return data.get('response')
+
+
+def extract_message_content(data: Dict[str, Any]) -> Optional[str]:
+    """/api/chat 帧中的文本"""
+    message = data.get('message')
+    if message is not None:
+        return message.get('content')
+    return None
+
+
+class GenerationStatsAggregator:
+    """按 (端点, 语言) 聚合生成统计（线程安全）"""
+
+    _SUM_FIELDS = ("prompt_eval_count", "prompt_eval_duration_ms", "eval_count", "eval_duration_ms",
+                   "load_duration_ms", "total_duration_ms", "ttft_ms")
+
+    def __init__(self, load_stall_ms: float = 1000.0):
+        """
+        Args:
+            load_stall_ms: 模型加载耗时超过该值的请求计为一次加载停顿
+        """
+        self.load_stall_ms = load_stall_ms
+        self._buckets: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, language: str, stats: Union[GenerationStats, Dict[str, Any], None]):
+        """记录一次生成的统计（也接受 GenerationStats.to_dict() 的结果）"""
+        if stats is None:
+            return
+        if isinstance(stats, dict):
+            stats = GenerationStats.from_dict(stats)
+        with self._lock:
+            bucket = self._bucket(endpoint, language)
+            # 命中生成结果缓存的请求没有模型统计，单独计数，不计入平均值
+            if stats.done_reason == "cache":
+                bucket["cache_hits"] += 1
+                return
+            bucket["requests"] += 1
+            for field in self._SUM_FIELDS:
+                value = getattr(stats, field)
+                if value is not None:
+                    bucket[field] += value
+            if stats.load_duration_ms is not None and stats.load_duration_ms >= self.load_stall_ms:
+                bucket["load_stalls"] += 1
+
+    def _bucket(self, endpoint: str, language: str) -> Dict[str, Any]:
+        key = (endpoint, getattr(language, "value", language) or "unknown")
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = {"requests": 0, "cache_hits": 0, "load_stalls": 0, "cancelled": 0, "tokens_saved": 0,
+                      **{field: 0 for field in self._SUM_FIELDS}}
+            self._buckets[key] = bucket
+        return bucket
+
+    def record_cancelled(self, endpoint: str, language: str, generated_tokens: int = 0) -> int:
+        """
+        记录一次被取消的生成（如SSE客户端提前断开）
+
+        节省的token数按该端点和语言的平均生成token数（没有记录时使用所有端点的平均值）减去取消前已生成的token数估算
+
+        Args:
+            generated_tokens: 取消前已生成的token数（流式帧数）
+
+        Returns:
+            int: 估算节省的token数
+        """
+        with self._lock:
+            bucket = self._bucket(endpoint, language)
+            requests, eval_count = bucket["requests"], bucket["eval_count"]
+            if not requests:
+                requests = sum(b["requests"] for b in self._buckets.values())
+                eval_count = sum(b["eval_count"] for b in self._buckets.values())
+            saved = max(0, round(eval_count / requests) - generated_tokens) if requests else 0
+            bucket["cancelled"] += 1
+            bucket["tokens_saved"] += saved
+        return saved
+
+    def get_summary(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        获取聚合结果
+
+        Returns:
+            Dict: {端点: {语言: 指标}}，指标包含平均值和整体生成/提示词处理速度（只统计实际生成的请求）
+        """
+        summary: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        with self._lock:
+            for (endpoint, language), bucket in self._buckets.items():
+                requests = bucket["requests"]
+                eval_seconds = bucket["eval_duration_ms"] / 1000
+                prompt_seconds = bucket["prompt_eval_duration_ms"] / 1000
+
+                def average(field: str) -> Optional[float]:
+                    return round(bucket[field] / requests, 2) if requests else None
+
+                summary.setdefault(endpoint, {})[language] = {
+                    "requests": requests,
+                    "cache_hits": bucket["cache_hits"],
+                    "load_stalls": bucket["load_stalls"],
+                    "cancelled": bucket["cancelled"],
+                    "tokens_saved": bucket["tokens_saved"],
+                    "avg_prompt_tokens": average("prompt_eval_count"),
+                    "avg_eval_tokens": average("eval_count"),
+                    "avg_ttft_ms": average("ttft_ms"),
+                    "avg_load_duration_ms": average("load_duration_ms"),
+                    "avg_total_duration_ms": average("total_duration_ms"),
+                    "tokens_per_second": round(bucket["eval_count"] / eval_seconds, 2) if eval_seconds else None,
+                    "prompt_tokens_per_second": round(bucket["prompt_eval_count"] / prompt_seconds, 2) if prompt_seconds else None,
+                }
+        return summary
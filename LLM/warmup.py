@@ -0,0 +1,210 @@
+"""
+模型预热与驻留管理
+服务启动时在每个后端加载模型（带 keep_alive 驻留策略），并测量冷启动耗时和预热后的首字延迟；
+之后在后端空闲时定期发送轻量请求，防止模型被Ollama卸载
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Optional, Dict, Any
+
+import httpx
+
+from LLM.async_ollama_client import AsyncOllamaClient
+from LLM.backend_pool import OllamaBackend
+
+
+# 预热默认配置
+OLLAMA_WARMUP_CONFIG = {
+    "enabled": os.getenv("OLLAMA_WARMUP", "true").lower() == "true",  # 是否在启动时预热
+    "load_timeout": 300,        # 加载模型的超时时间（秒），大模型首次加载可能较慢
+    "check_interval": 60,       # 驻留检查间隔（秒）
+    "idle_threshold": 240,      # 后端空闲多久后发送保活请求（秒），应小于 keep_alive
+    "retry_interval": 15,       # 预热失败后的重试间隔（秒）
+    "probe_prompt": "你好",      # 测量预热后首字延迟使用的提示词
+}
+
+
+class ModelWarmupManager:
+    """模型预热与驻留管理器"""
+
+    def __init__(self, client: AsyncOllamaClient = None, config: Dict[str, Any] = None):
+        """
+        初始化预热管理器
+
+        Args:
+            client: 使用的异步客户端，默认创建一个使用共享后端池的客户端
+            config: 预热配置，未提供的字段使用 OLLAMA_WARMUP_CONFIG 中的默认值
+        """
+        self.config = {**OLLAMA_WARMUP_CONFIG, **(config or {})}
+        self._owns_client = client is None
+        self.client = client or AsyncOllamaClient()
+        self._states: Dict[str, Dict[str, Any]] = {
+            backend.url: self._new_state() for backend in self.client.backend_pool.backends
+        }
+        self._task: Optional[asyncio.Task] = None
+        self._started_at: Optional[datetime] = None
+        self._ready_at: Optional[datetime] = None
+
+    @staticmethod
+    def _new_state() -> Dict[str, Any]:
+        return {
+            "status": "pending",        # pending | warming | warm | failed
+            "cold_start_ms": None,      # 首次加载请求的总耗时
+            "load_duration_ms": None,   # Ollama报告的模型加载耗时
+            "warm_ttft_ms": None,       # 预热后探测请求的首字延迟
+            "last_ping_at": None,
+            "pings": 0,
+            "error": None,
+        }
+
+    @property
+    def ready(self) -> bool:
+        """是否就绪：未启用预热，或至少有一个后端已完成预热"""
+        if not self.config["enabled"]:
+            return True
+        return any(state["status"] == "warm" for state in self._states.values())
+
+    def _backend_state(self, backend: OllamaBackend) -> Dict[str, Any]:
+        return self._states.setdefault(backend.url, self._new_state())
+
+    async def _load(self, backend: OllamaBackend) -> Dict[str, Any]:
+        """发送空提示词的请求加载模型并刷新驻留时间（不生成任何token）"""
+        response = await self.client.client.post(
+            f"{backend.url}/api/generate",
+            json={
+                "model": self.client.model_name,
+                "prompt": "",
+                "stream": False,
+                "keep_alive": self.client.backend_pool.config["keep_alive"]
+            },
+            timeout=httpx.Timeout(float(self.config["load_timeout"]), connect=10.0)
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def _probe_ttft(self, backend: OllamaBackend) -> float:
+        """发送只生成1个token的流式请求，返回首字延迟（秒）"""
+        start_time = time.monotonic()
+        ttft = None
+        async with self.client.client.stream(
+            "POST",
+            f"{backend.url}/api/generate",
+            json={
+                "model": self.client.model_name,
+                "prompt": self.config["probe_prompt"],
+                "stream": True,
+                "keep_alive": self.client.backend_pool.config["keep_alive"],
+                "options": {"num_predict": 1}
+            }
+        ) as response:
+            response.raise_for_status()
+            # 读完全部帧（只有一两帧），使连接可以复用
+            async for line in response.aiter_lines():
+                if line and ttft is None:
+                    ttft = time.monotonic() - start_time
+        return ttft if ttft is not None else time.monotonic() - start_time
+
+    async def warm_backend(self, backend: OllamaBackend) -> bool:
+        """
+        预热单个后端
+
+        Returns:
+            bool: 预热成功返回True
+        """
+        state = self._backend_state(backend)
+        state["status"] = "warming"
+        try:
+            start_time = time.monotonic()
+            result = await self._load(backend)
+            state["cold_start_ms"] = round((time.monotonic() - start_time) * 1000, 2)
+            if result.get("load_duration") is not None:
+                state["load_duration_ms"] = round(result["load_duration"] / 1e6, 2)
+
+            state["warm_ttft_ms"] = round(await self._probe_ttft(backend) * 1000, 2)
+            state["status"] = "warm"
+            state["error"] = None
+            state["last_ping_at"] = datetime.now().isoformat()
+            print(f"模型预热完成 ({backend.url}): 冷启动 {state['cold_start_ms']}ms, 预热后首字延迟 {state['warm_ttft_ms']}ms")
+            return True
+        except (httpx.HTTPError, ValueError) as e:
+            state["status"] = "failed"
+            state["error"] = str(e)
+            print(f"模型预热失败 ({backend.url}): {e}")
+            return False
+
+    async def warm_up(self) -> bool:
+        """
+        并发预热所有后端
+
+        Returns:
+            bool: 至少一个后端预热成功返回True
+        """
+        backends = self.client.backend_pool.backends
+        results = await asyncio.gather(*(self.warm_backend(backend) for backend in backends))
+        if any(results) and self._ready_at is None:
+            self._ready_at = datetime.now()
+        return any(results)
+
+    async def _ping(self, backend: OllamaBackend):
+        """空闲保活：刷新模型驻留时间，失败时标记为需要重新预热"""
+        state = self._backend_state(backend)
+        try:
+            await self._load(backend)
+            state["pings"] += 1
+            state["last_ping_at"] = datetime.now().isoformat()
+        except (httpx.HTTPError, ValueError) as e:
+            state["status"] = "failed"
+            state["error"] = str(e)
+
+    async def _residency_loop(self):
+        """启动预热，之后定期检查：未预热的后端重试预热，空闲的后端发送保活请求"""
+        while not await self.warm_up():
+            await asyncio.sleep(self.config["retry_interval"])
+
+        while True:
+            await asyncio.sleep(self.config["check_interval"])
+            now = time.monotonic()
+            for backend in self.client.backend_pool.backends:
+                state = self._backend_state(backend)
+                if state["status"] != "warm":
+                    if await self.warm_backend(backend) and self._ready_at is None:
+                        self._ready_at = datetime.now()
+                    continue
+                last_used = backend.last_request_at
+                if last_used is None or now - last_used >= self.config["idle_threshold"]:
+                    await self._ping(backend)
+                    # 保活请求也算作一次访问，避免每个检查周期都重复发送
+                    backend.last_request_at = time.monotonic()
+
+    def start(self):
+        """在当前事件循环中启动后台预热和驻留任务"""
+        if not self.config["enabled"] or self._task is not None:
+            return
+        self._started_at = datetime.now()
+        self._task = asyncio.create_task(self._residency_loop())
+
+    async def stop(self):
+        """停止后台任务并关闭自有客户端"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._owns_client:
+            await self.client.aclose()
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取预热状态和冷启动指标"""
+        return {
+            "enabled": self.config["enabled"],
+            "ready": self.ready,
+            "keep_alive": self.client.backend_pool.config["keep_alive"],
+            "started_at": self._started_at.isoformat() if self._started_at else None,
+            "ready_at": self._ready_at.isoformat() if self._ready_at else None,
+            "backends": {url: dict(state) for url, state in self._states.items()},
+        }
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+API层吞吐基准
+在进程内启动模拟Ollama服务（LLM/mock_ollama_server.py）和API服务，按不同并发压测流式和异步接口，
+测量线程池、SSE、会话等API层本身的吞吐和额外延迟，结果与GPU速度无关、可以复现。
+也可以用 --api-url 压测已经启动的API（需自行让该API指向模拟Ollama）。
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM.mock_ollama_server import MockOllamaServer
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def start_api(mock_url: str) -> tuple:
+    """在后台线程中启动指向模拟Ollama的API服务，返回 (地址, uvicorn服务)"""
+    # 必须在导入API之前设置，共享后端池在首次使用时读取
+    os.environ["OLLAMA_BACKENDS"] = mock_url
+    import uvicorn
+    from API.main import app
+
+    # 逐请求日志会干扰结果输出
+    for name in ("httpx", "API"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="api-server", daemon=True).start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("API服务启动超时")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+
+def request_body(endpoint: str) -> dict:
+    # 每个请求使用不同的用户和主题，避免命中缓存、共享会话
+    user_id = f"bench-{uuid.uuid4().hex[:8]}"
+    if endpoint.startswith("/chat"):
+        return {"message": "推荐一款秋冬保湿面霜", "user_id": user_id}
+    return {"category": "美妆护肤", "topic": f"秋冬护肤心得 {user_id}", "user_id": user_id}
+
+
+async def sse_request(client: httpx.AsyncClient, base_url: str, endpoint: str) -> dict:
+    """发送一个SSE请求，返回首个文本片段延迟和总耗时"""
+    start = time.perf_counter()
+    first_chunk = None
+    async with client.stream("POST", base_url + endpoint, json=request_body(endpoint)) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            # sse_starlette 会给已格式化的消息再加一层 "data: "，按载荷中的 type 判断事件类型
+            while line.startswith("data:"):
+                line = line[5:].lstrip()
+            if not line.startswith("{"):
+                continue
+            try:
+                kind = json.loads(line).get("type")
+            except ValueError:
+                continue
+            if kind == "chunk" and first_chunk is None:
+                first_chunk = time.perf_counter() - start
+            elif kind == "error":
+                raise RuntimeError(line)
+            elif kind == "complete":
+                break
+    return {"ttfb": first_chunk, "latency": time.perf_counter() - start}
+
+
+async def task_request(client: httpx.AsyncClient, base_url: str, endpoint: str, poll_interval: float = 0.02) -> dict:
+    """提交异步任务并轮询到完成，返回总耗时"""
+    start = time.perf_counter()
+    response = await client.post(base_url + endpoint, json=request_body(endpoint))
+    response.raise_for_status()
+    task_id = response.json()["data"]["task_id"]
+    ttfb = time.perf_counter() - start
+    while True:
+        status = (await client.get(f"{base_url}/tasks/{task_id}/status")).json()["data"]["status"]
+        if status == "completed":
+            return {"ttfb": ttfb, "latency": time.perf_counter() - start}
+        if status in ("failed", "timeout", "cancelled"):
+            raise RuntimeError(f"任务{status}")
+        await asyncio.sleep(poll_interval)
+
+
+async def run_level(base_url: str, endpoint: str, concurrency: int, total: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    results, errors = [], []
+    request = task_request if endpoint in ("/generate/async", "/optimize/async") else sse_request
+    limits = httpx.Limits(max_connections=concurrency + 4, max_keepalive_connections=concurrency + 4)
+
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        async def one():
+            async with semaphore:
+                try:
+                    results.append(await request(client, base_url, endpoint))
+                except Exception as e:
+                    errors.append(str(e))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+
+    latencies = [r["latency"] for r in results]
+    ttfbs = [r["ttfb"] for r in results if r["ttfb"] is not None]
+    return {
+        "ok": len(results),
+        "errors": len(errors),
+        "rps": len(results) / elapsed if elapsed else 0.0,
+        "ttfb_p50": percentile(ttfbs, 0.5),
+        "ttfb_p95": percentile(ttfbs, 0.95),
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_mean": statistics.mean(latencies) if latencies else float("nan"),
+        "first_error": errors[0] if errors else None,
+    }
+
+
+async def main_async(args):
+    mock = None
+    server = None
+    base_url = args.api_url
+    ideal = args.ttft + args.tokens / args.tokens_per_sec if args.tokens_per_sec else args.ttft
+
+    if base_url is None:
+        mock = MockOllamaServer(config={
+            "ttft": args.ttft, "tokens_per_sec": args.tokens_per_sec, "response_tokens": args.tokens,
+            "jitter": args.jitter, "seed": 0,
+        }).start()
+        base_url, server = start_api(mock.url)
+        print(f"模拟Ollama: {mock.url} | API: {base_url}")
+    print(f"单次生成理想耗时 {ideal * 1000:.0f}ms（首字延迟 {args.ttft * 1000:.0f}ms + "
+          f"{args.tokens} token / {args.tokens_per_sec:g} token/s），额外延迟 = 延迟p50 - 理想耗时")
+
+    try:
+        for endpoint in args.endpoints:
+            print(f"\n=== {endpoint} ===")
+            print(f"{'并发':>4} {'成功':>5} {'失败':>4} {'req/s':>8} {'首片段p50':>10} {'首片段p95':>10} "
+                  f"{'延迟p50':>9} {'延迟p95':>9} {'额外延迟':>9}")
+            for concurrency in args.concurrency:
+                stats = await run_level(base_url, endpoint, concurrency, max(args.requests, concurrency))
+                print(f"{concurrency:>4} {stats['ok']:>5} {stats['errors']:>4} {stats['rps']:>8.2f} "
+                      f"{stats['ttfb_p50'] * 1000:>8.0f}ms {stats['ttfb_p95'] * 1000:>8.0f}ms "
+                      f"{stats['latency_p50'] * 1000:>7.0f}ms {stats['latency_p95'] * 1000:>7.0f}ms "
+                      f"{(stats['latency_p50'] - ideal) * 1000:>7.0f}ms")
+                if stats["first_error"]:
+                    print(f"     首个错误: {stats['first_error']}")
+        if mock is not None:
+            print(f"\n模拟Ollama统计: {mock.get_stats()}")
+    finally:
+        if server is not None:
+            server.should_exit = True
+            await asyncio.sleep(0.5)
+        if mock is not None:
+            mock.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API层吞吐基准（使用模拟Ollama）")
+    parser.add_argument("--endpoints", nargs="+",
+                        default=["/generate/stream", "/generate/stream/async", "/chat/stream", "/generate/async"],
+                        help="压测的接口")
+    parser.add_argument("--concurrency", type=lambda value: [int(v) for v in value.split(",")], default=[1, 8, 32],
+                        help="并发数列表，逗号分隔")
+    parser.add_argument("--requests", type=int, default=32, help="每个并发级别的请求数")
+    parser.add_argument("--ttft", type=float, default=0.1, help="模拟首字延迟（秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=100.0, help="模拟生成速度")
+    parser.add_argument("--tokens", type=int, default=50, help="每次生成的token数")
+    parser.add_argument("--jitter", type=float, default=0.0, help="token间隔抖动比例（默认0，结果可复现）")
+    parser.add_argument("--api-url", default=None, help="压测已启动的API，不在进程内启动API和模拟Ollama")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+熔断器半开探测检查
+后端熔断并进入半开状态后，探测请求在出字前被取消（客户端断开、对冲失败方、任务取消）时，
+探测名额要归还给熔断器，后端之后仍能被选中；否则半开名额被永久占用，后端再也不会恢复。
+依次检查后端池的 release(cancelled=True)、异步客户端的非流式请求取消和流式请求在首帧前关闭
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM.async_ollama_client import AsyncOllamaClient
+from LLM.backend_pool import BackendPool
+from LLM.exceptions import OllamaCircuitOpenError
+from LLM.resilience import CircuitBreaker, CircuitState
+
+RECOVERY_TIMEOUT = 0.05
+
+
+def half_open_pool() -> BackendPool:
+    """单后端的后端池，熔断器已打开并超过恢复时间（下一次 acquire 即半开探测）"""
+    pool = BackendPool(["http://ollama.test"])
+    backend = pool.primary
+    backend.breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=RECOVERY_TIMEOUT, half_open_max_calls=1)
+    backend.breaker.record_failure()
+    time.sleep(RECOVERY_TIMEOUT * 2)
+    assert backend.breaker.state == CircuitState.HALF_OPEN
+    return pool
+
+
+def assert_probe_returned(pool: BackendPool, label: str):
+    backend = pool.primary
+    assert backend.in_flight == 0, f"{label}: 在途请求数未归零 ({backend.in_flight})"
+    assert backend.breaker.state == CircuitState.HALF_OPEN, f"{label}: 取消的探测改变了熔断状态"
+    try:
+        pool.release(pool.acquire())
+    except OllamaCircuitOpenError:
+        raise AssertionError(f"{label}: 半开探测名额未归还，后端无法再被选中")
+    print(f"✓ {label}")
+
+
+def check_pool_release():
+    pool = half_open_pool()
+    backend = pool.acquire()
+    try:
+        pool.acquire()
+        raise AssertionError("半开状态只允许一个探测请求")
+    except OllamaCircuitOpenError:
+        pass
+    pool.release(backend, None, False, cancelled=True)
+    assert_probe_returned(pool, "后端池 release(cancelled=True) 归还探测名额")
+
+
+async def slow_handler(request: httpx.Request) -> httpx.Response:
+    # 模拟生成很慢的后端，请求总在收到响应前被取消
+    await asyncio.sleep(10)
+    return httpx.Response(200, json={"done": True})
+
+
+def make_client(pool: BackendPool) -> AsyncOllamaClient:
+    client = AsyncOllamaClient(backend_pool=pool, resilience_config={"hedging_enabled": False})
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(slow_handler))
+    return client
+
+
+async def check_post_json_cancelled():
+    pool = half_open_pool()
+    client = make_client(pool)
+    task = asyncio.ensure_future(client._post_json("/api/generate", {"prompt": "你好"}))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await client._client.aclose()
+    assert_probe_returned(pool, "异步非流式请求被取消后归还探测名额")
+
+
+async def check_stream_closed_before_first_frame():
+    pool = half_open_pool()
+    client = make_client(pool)
+    frames = client._stream_frames("/api/generate", {"prompt": "你好", "stream": True})
+
+    async def consume():
+        async for _ in frames:
+            pass
+
+    task = asyncio.ensure_future(consume())
+    await asyncio.sleep(0.05)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await frames.aclose()
+    await client._client.aclose()
+    assert_probe_returned(pool, "异步流式请求在首帧前取消后归还探测名额")
+
+
+def main():
+    check_pool_release()
+    asyncio.run(check_post_json_cancelled())
+    asyncio.run(check_stream_closed_before_first_frame())
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,8 @@ HTTP/2.0 性能测试脚本
 """
 
 import asyncio
+import os
+import sys
 import time
 import statistics
 import httpx
@@ -30,10 +32,10 @@ class TestResult:
 class HTTP2PerformanceTester:
     """HTTP/2.0性能测试器"""
     
-    def __init__(self, base_url_http1: str = "http://localhost:8000", 
-                 base_url_http2: str = "https://localhost:8443"):
-        self.base_url_http1 = base_url_http1
-        self.base_url_http2 = base_url_http2
+    def __init__(self, base_url_http1: str = None, base_url_http2: str = None):
+        # 服务地址可通过环境变量覆盖（如在CI中指向以模拟Ollama启动的API）
+        self.base_url_http1 = base_url_http1 or os.getenv("API_HTTP1_URL", "http://localhost:8000")
+        self.base_url_http2 = base_url_http2 or os.getenv("API_HTTP2_URL", "https://localhost:8443")
         self.test_data = {
             "topic": "春季护肤",
             "category": "beauty",
@@ -285,12 +287,15 @@ async def main():
     tester = HTTP2PerformanceTester()
     
     print("📋 测试准备:")
-    print("1. 确保HTTP/1.1服务器运行在 http://localhost:8000")
-    print("2. 确保HTTP/2.0服务器运行在 https://localhost:8443")
+    print(f"1. 确保HTTP/1.1服务器运行在 {tester.base_url_http1}")
+    print(f"2. 确保HTTP/2.0服务器运行在 {tester.base_url_http2}")
     print("3. 将测试多种并发场景下的性能差异")
+    print("💡 没有模型时可先启动模拟Ollama（python LLM/mock_ollama_server.py），"
+          "再以 OLLAMA_BACKENDS=http://127.0.0.1:11435 启动API，结果不受GPU速度影响")
     
-    # 等待用户确认
-    input("\n按回车键开始测试...")
+    # 等待用户确认（非交互环境如CI中直接开始）
+    if sys.stdin.isatty():
+        input("\n按回车键开始测试...")
     
     try:
         # 运行综合测试
@@ -10,6 +10,8 @@ import time
 import json
 from typing import List, Dict
 
+TERMINAL_STATUSES = {"completed", "failed", "timeout", "cancelled"}
+
 
 class MultiThreadingDemo:
     """多线程功能演示类"""
@@ -76,38 +78,68 @@ class MultiThreadingDemo:
             return await response.json()
     
     async def wait_for_task_completion(self, task_id: str, timeout: int = 60) -> Dict:
-        """等待任务完成"""
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            status_response = await self.get_task_status(task_id)
-            status_data = status_response["data"]
-            
-            if status_data["status"] in ["completed", "failed", "timeout", "cancelled"]:
-                return status_data
-            
-            await asyncio.sleep(2)  # 每2秒检查一次
-        
-        raise TimeoutError(f"任务 {task_id} 在 {timeout} 秒内未完成")
+        """等待任务完成（订阅任务状态推送，任务结束时服务端立即推送结果，不轮询）"""
+        try:
+            async with self.session.get(
+                f"{self.api_base_url}/tasks/{task_id}/events",
+                timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as response:
+                async for event in self._iter_sse_events(response):
+                    if event.get("type") == "task_status" and event["status"] in TERMINAL_STATUSES:
+                        return event
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"任务 {task_id} 在 {timeout} 秒内未完成")
+        
+        # 推送流意外结束时查询一次最终状态
+        status_data = (await self.get_task_status(task_id))["data"]
+        if status_data["status"] in TERMINAL_STATUSES:
+            return status_data
+        raise TimeoutError(f"任务 {task_id} 的状态推送已断开，任务仍未完成")
+    
+    @staticmethod
+    async def _iter_sse_events(response):
+        """逐个解析SSE流中的JSON事件"""
+        async for raw_line in response.content:
+            payload = raw_line.decode("utf-8").strip()
+            # 服务端的消息已带有 data: 前缀，外层又被包装一次
+            while payload.startswith("data:"):
+                payload = payload[5:].strip()
+            if payload.startswith("{"):
+                yield json.loads(payload)
     
-    async def batch_generate_content(self, requests: List[Dict]) -> List[str]:
-        """批量生成内容（智能体线程池）"""
+    async def batch_generate_content(self, requests: List[Dict]) -> List[Dict]:
+        """批量生成内容（智能体线程池），按结束顺序接收每个条目，返回按序号排列的条目"""
         async with self.session.post(
             f"{self.api_base_url}/batch/generate",
+            params={"stream": "ndjson"},
             json=requests
         ) as response:
-            result = await response.json()
-            return result["data"]["task_ids"]
+            return await self._collect_batch_items(response)
     
-    async def batch_chat(self, messages: List[str], user_id: str) -> List[str]:
-        """批量聊天（智能体线程池）"""
+    async def batch_chat(self, messages: List[str], user_id: str) -> List[Dict]:
+        """批量聊天（智能体线程池），按结束顺序接收每个条目，返回按序号排列的条目"""
         async with self.session.post(
             f"{self.api_base_url}/chat/batch",
-            params={"user_id": user_id},
+            params={"user_id": user_id, "stream": "ndjson"},
             json=messages
         ) as response:
-            result = await response.json()
-            return result["data"]["task_ids"]
+            return await self._collect_batch_items(response)
+    
+    @staticmethod
+    async def _collect_batch_items(response) -> List[Dict]:
+        """读取批次的NDJSON流，直到批次结束事件"""
+        response.raise_for_status()
+        items = []
+        async for raw_line in response.content:
+            if not raw_line.strip():
+                continue
+            event = json.loads(raw_line)
+            if event["type"] == "item":
+                print(f"  条目 {event['index']} {event['status']} ({event['finished']}/{event['total']})")
+                items.append(event)
+            elif event["type"] == "batch":
+                break
+        return sorted(items, key=lambda item: item["index"])
     
     async def demo_thread_pool_separation(self):
         """演示线程池分离功能"""
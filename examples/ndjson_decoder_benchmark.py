@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+NDJSON流式解码微基准
+比较原来的 response.iter_lines() + json.loads 与 LLM.ndjson 增量解码器：
+1. CPU：在内存中解码大量模拟的Ollama token帧，比较每个token的解码耗时
+2. 延迟：本地HTTP服务按固定间隔逐帧发送（chunked），比较每个token从发送到被客户端读出的延迟
+"""
+
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM.ndjson import iter_frames
+
+
+TOKENS = ["小红书", "种草", "，", "这家店", "的", "招牌", "菜", "真的", "绝了", "！", "\n", "#美食探店"]
+
+
+def build_frames(count: int, chat: bool = False) -> list:
+    """构造与Ollama格式一致的帧（最后一帧为带统计信息的结束帧）"""
+    frames = []
+    for i in range(count):
+        token = TOKENS[i % len(TOKENS)]
+        frame = {"model": "qwen3-redbook-q8:latest", "created_at": "2024-05-01T12:00:00.000000Z"}
+        if chat:
+            frame["message"] = {"role": "assistant", "content": token}
+        else:
+            frame["response"] = token
+        frame["done"] = False
+        frames.append(frame)
+    done = {"model": "qwen3-redbook-q8:latest", "created_at": "2024-05-01T12:00:01.000000Z"}
+    if chat:
+        done["message"] = {"role": "assistant", "content": ""}
+    else:
+        done["response"] = ""
+        done["context"] = list(range(512))
+    done.update({
+        "done": True, "done_reason": "stop", "total_duration": 1_000_000_000, "load_duration": 1_000_000,
+        "prompt_eval_count": 30, "prompt_eval_duration": 10_000_000, "eval_count": count, "eval_duration": 900_000_000
+    })
+    frames.append(done)
+    return frames
+
+
+def encode_frames(frames: list) -> bytes:
+    # Ollama 输出紧凑JSON、非ASCII字符不转义
+    return b"".join((json.dumps(f, ensure_ascii=False, separators=(",", ":")) + "\n").encode() for f in frames)
+
+
+def make_response(body: bytes) -> requests.Response:
+    response = requests.Response()
+    response.raw = io.BytesIO(body)
+    response.status_code = 200
+    return response
+
+
+def baseline_decode(body: bytes, chat: bool) -> int:
+    """原实现：iter_lines() 默认512字节块 + 每行 json.loads"""
+    count = 0
+    for line in make_response(body).iter_lines():
+        if line:
+            data = json.loads(line)
+            if chat:
+                count += len(data["message"]["content"])
+            elif "response" in data:
+                count += len(data["response"])
+    return count
+
+
+def incremental_decode(chunks: list, chat: bool) -> int:
+    """新实现：按网络块增量切分 + token帧快速提取"""
+    count = 0
+    for data in iter_frames(chunks):
+        if chat:
+            count += len(data["message"]["content"])
+        elif "response" in data:
+            count += len(data["response"])
+    return count
+
+
+def bench_cpu(token_count: int = 20000, rounds: int = 5):
+    print(f"\n=== CPU：解码 {token_count} 个token帧（取{rounds}轮中位数）===")
+    for chat in (False, True):
+        frames = build_frames(token_count, chat)
+        body = encode_frames(frames)
+        # 真实流中每个token帧通常单独到达
+        chunks = [encode_frames([f]) for f in frames]
+
+        assert baseline_decode(body, chat) == incremental_decode(chunks, chat)
+
+        results = {}
+        for name, func, arg in (("iter_lines + json.loads", baseline_decode, body),
+                                ("NDJSONStreamDecoder", incremental_decode, chunks)):
+            timings = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                func(arg, chat)
+                timings.append(time.perf_counter() - start)
+            results[name] = statistics.median(timings) / (token_count + 1) * 1e6
+
+        label = "/api/chat" if chat else "/api/generate"
+        base, new = results.values()
+        print(f"{label:14s} 原实现 {base:6.2f} µs/token | 增量解码 {new:6.2f} µs/token | 提速 {base / new:4.2f}x")
+
+
+class _TokenHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    token_count = 200
+    interval = 0.005
+    sent_at: list = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        frames = build_frames(self.token_count)
+        _TokenHandler.sent_at = []
+        for i, frame in enumerate(frames):
+            if not frame["done"]:
+                # token文本携带序号，客户端据此找到发送时刻（同一进程内 perf_counter 可直接比较）
+                frame["response"] = f"{i}|{frame['response']}"
+            data = (json.dumps(frame, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+            _TokenHandler.sent_at.append(time.perf_counter())
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+            time.sleep(self.interval)
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def bench_latency(rounds: int = 3):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _TokenHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/generate"
+    session = requests.Session()
+
+    def baseline(response):
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
+    def incremental(response):
+        yield from iter_frames(response.iter_content(chunk_size=None))
+
+    print(f"\n=== 延迟：每 {_TokenHandler.interval * 1000:.0f}ms 发送一帧，共 {_TokenHandler.token_count} 帧（{rounds}轮）===")
+    for name, reader in (("iter_lines + json.loads", baseline), ("NDJSONStreamDecoder", incremental)):
+        delays = []
+        for _ in range(rounds):
+            with session.post(url, json={}, stream=True) as response:
+                for data in reader(response):
+                    received_at = time.perf_counter()
+                    if not data.get("done"):
+                        index = int(data["response"].split("|", 1)[0])
+                        delays.append(received_at - _TokenHandler.sent_at[index])
+        delays.sort()
+        print(f"{name:24s} 平均 {statistics.mean(delays) * 1000:6.3f}ms | "
+              f"p50 {delays[len(delays) // 2] * 1000:6.3f}ms | p99 {delays[int(len(delays) * 0.99)] * 1000:6.3f}ms")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    bench_cpu()
+    bench_latency()
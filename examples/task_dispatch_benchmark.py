@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+线程池任务调度微基准
+对比事件驱动的 ThreadPoolManager 与旧版调度方式（独立分发线程以1秒超时阻塞读取 PriorityQueue，
+再全部提交给 ThreadPoolExecutor）：
+- 提交到开始执行的延迟（空闲线程池）
+- 线程池占满时高优先级任务的等待时间
+- 任务结束到协程得知结果的延迟（wait_task 对比按固定间隔轮询）
+- 空闲时分发线程的唤醒次数和CPU占用
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from API.services import ThreadPoolManager, TaskRequest, TaskStatus
+
+
+class LegacyDispatcher:
+    """旧版调度方式的最小复现"""
+
+    def __init__(self, max_workers: int):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.task_queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.wakeups = 0
+        self._shutdown = False
+        self.thread = threading.Thread(target=self._dispatcher, daemon=True)
+        self.thread.start()
+
+    def submit(self, func, priority: int = 1):
+        self.task_queue.put((priority, next(self.sequence), func))
+
+    def _dispatcher(self):
+        while not self._shutdown:
+            self.wakeups += 1
+            try:
+                priority, sequence, func = self.task_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            self.executor.submit(func)
+
+    def shutdown(self):
+        self._shutdown = True
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+
+
+class EventDrivenPool:
+    """ThreadPoolManager 的薄封装，接口与 LegacyDispatcher 一致"""
+
+    def __init__(self, max_workers: int):
+        self.pool = ThreadPoolManager(max_workers=max_workers, queue_size=10000, pool_name=f"bench_{uuid.uuid4().hex[:6]}")
+        self.task_ids = itertools.count()
+        self.wakeups = 0  # 没有分发线程
+
+    def submit(self, func, priority: int = 1) -> str:
+        return self.pool.submit_task(TaskRequest(
+            task_id=f"bench_{next(self.task_ids)}", user_id="bench", task_type="bench",
+            task_func=func, args=(), kwargs={}, priority=priority,
+        ))
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+def microseconds(values: list) -> str:
+    values = sorted(values)
+    p50 = values[len(values) // 2] * 1e6
+    p99 = values[min(len(values) - 1, int(len(values) * 0.99))] * 1e6
+    return f"p50 {p50:8.1f}us  p99 {p99:8.1f}us  mean {statistics.mean(values) * 1e6:8.1f}us"
+
+
+def bench_submit_to_start(pool_cls, rounds: int) -> list:
+    """空闲线程池中逐个提交空任务，测量提交到开始执行的延迟"""
+    pool = pool_cls(4)
+    delays = []
+    started = threading.Event()
+    try:
+        for _ in range(rounds):
+            started.clear()
+            box = {}
+
+            def task():
+                box["start"] = time.perf_counter()
+                started.set()
+
+            submitted = time.perf_counter()
+            pool.submit(task)
+            started.wait()
+            delays.append(box["start"] - submitted)
+            time.sleep(0.001)  # 让工作线程回到空闲状态
+    finally:
+        pool.shutdown()
+    return delays
+
+
+def bench_priority(pool_cls, workers: int, backlog: int, task_seconds: float) -> float:
+    """线程池占满且有积压时提交一个高优先级任务，返回它的等待时间"""
+    pool = pool_cls(workers)
+    started = threading.Event()
+    box = {}
+    try:
+        for _ in range(workers + backlog):
+            pool.submit(lambda: time.sleep(task_seconds), priority=2)
+        time.sleep(0.05)
+
+        def urgent():
+            box["start"] = time.perf_counter()
+            started.set()
+
+        submitted = time.perf_counter()
+        pool.submit(urgent, priority=0)
+        started.wait()
+        return box["start"] - submitted
+    finally:
+        pool.shutdown()
+
+
+async def bench_completion(rounds: int, poll_interval: float) -> tuple:
+    """任务结束到协程得知结果的延迟：wait_task 对比按 poll_interval 轮询"""
+    pool = EventDrivenPool(2)
+    awaited, polled = [], []
+    try:
+        for _ in range(rounds):
+            for mode in ("wait", "poll"):
+                box = {}
+
+                def task():
+                    time.sleep(0.02)
+                    box["end"] = time.perf_counter()
+
+                task_id = pool.submit(task)
+                if mode == "wait":
+                    result = await pool.pool.wait_task(task_id)
+                else:
+                    while True:
+                        result = pool.pool.get_task_status(task_id)
+                        if result.status == TaskStatus.COMPLETED:
+                            break
+                        await asyncio.sleep(poll_interval)
+                assert result.status == TaskStatus.COMPLETED
+                (awaited if mode == "wait" else polled).append(time.perf_counter() - box["end"])
+    finally:
+        pool.shutdown()
+    return awaited, polled
+
+
+def bench_idle(pool_cls, pools: int, seconds: float) -> tuple:
+    """创建多个空闲线程池，返回 (分发线程唤醒次数/秒, CPU毫秒/秒)"""
+    instances = [pool_cls(4) for _ in range(pools)]
+    try:
+        time.sleep(0.2)
+        wakeups = sum(p.wakeups for p in instances)
+        cpu = time.process_time()
+        time.sleep(seconds)
+        cpu = time.process_time() - cpu
+        wakeups = sum(p.wakeups for p in instances) - wakeups
+    finally:
+        for p in instances:
+            p.shutdown()
+    return wakeups / seconds, cpu * 1000 / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="线程池任务调度微基准")
+    parser.add_argument("--rounds", type=int, default=500, help="延迟测量次数")
+    parser.add_argument("--idle-pools", type=int, default=20, help="空闲测试中创建的线程池数量")
+    parser.add_argument("--idle-seconds", type=float, default=5.0, help="空闲测试时长（秒）")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="对比用的轮询间隔（秒）")
+    args = parser.parse_args()
+
+    # 每个任务的提交、分发日志会干扰计时
+    logging.getLogger("API").setLevel(logging.WARNING)
+
+    pools = (("旧版分发线程", LegacyDispatcher), ("事件驱动", EventDrivenPool))
+
+    print(f"提交到开始执行的延迟（空闲线程池，{args.rounds} 次）")
+    for name, cls in pools:
+        print(f"  {name:<8} {microseconds(bench_submit_to_start(cls, args.rounds))}")
+
+    print("\n线程池占满（4个执行中 + 20个积压，每个0.2s）时高优先级任务的等待时间")
+    for name, cls in pools:
+        print(f"  {name:<8} {bench_priority(cls, 4, 20, 0.2) * 1000:8.1f}ms")
+
+    print(f"\n任务结束到协程得知结果的延迟（{min(args.rounds, 50)} 次）")
+    awaited, polled = asyncio.run(bench_completion(min(args.rounds, 50), args.poll_interval))
+    print(f"  {'wait_task':<12} {microseconds(awaited)}")
+    print(f"  {f'轮询 {args.poll_interval:g}s':<12} {microseconds(polled)}")
+
+    print(f"\n空闲开销（{args.idle_pools} 个线程池，{args.idle_seconds:g}s）")
+    for name, cls in pools:
+        wakeups, cpu = bench_idle(cls, args.idle_pools, args.idle_seconds)
+        print(f"  {name:<8} 分发线程唤醒 {wakeups:6.1f} 次/s  进程CPU {cpu:6.2f}ms/s")
+
+
+if __name__ == "__main__":
+    main()
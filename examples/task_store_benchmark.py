@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+任务存储基准：内存存储对比SQLite持久化存储
+- 状态变更吞吐：每个任务 提交 -> 开始 -> 完成 三次写入（请求线程的耗时，以及全部提交到磁盘的耗时）
+- 状态查询延迟：内存命中，以及从内存淘汰后按主键查询SQLite
+- 线程池端到端：通过 ThreadPoolManager 执行空任务的吞吐
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from API.task_store import TaskResultStore
+from API.sqlite_task_store import SQLiteTaskStore
+from API.services import ThreadPoolManager, TaskRequest, TaskResult, TaskStatus
+
+
+def make_store(backend: str, directory: str, **config):
+    if backend == "sqlite":
+        return SQLiteTaskStore({"sqlite_path": os.path.join(directory, f"bench_{time.monotonic_ns()}.db"), **config},
+                               name="bench")
+    return TaskResultStore(config, name="bench")
+
+
+def make_request(i: int) -> TaskRequest:
+    return TaskRequest(task_id=f"task_{i}", user_id=f"user_{i % 100}", task_type="generate", task_func=None,
+                       args=(), kwargs={}, payload={"topic": "秋季护肤", "index": i})
+
+
+def bench_lifecycle(backend: str, directory: str, tasks: int) -> tuple:
+    """返回 (请求线程的状态变更/秒, 包含提交到磁盘的状态变更/秒)"""
+    store = make_store(backend, directory)
+    result = {"content": "今天分享一款超好用的面霜 ✨" * 20}
+    start = time.perf_counter()
+    for i in range(tasks):
+        task_request = make_request(i)
+        task_result = TaskResult(task_id=task_request.task_id, status=TaskStatus.PENDING)
+        store.put(task_result, user_id=task_request.user_id, task_request=task_request)
+        task_result.status = TaskStatus.RUNNING
+        store.put(task_result)
+        store.put(TaskResult(task_id=task_request.task_id, status=TaskStatus.COMPLETED, result=result))
+    submitted = time.perf_counter() - start
+    store.flush()
+    durable = time.perf_counter() - start
+    store.close()
+    return tasks * 3 / submitted, tasks * 3 / durable
+
+
+def bench_lookup(backend: str, directory: str, tasks: int, lookups: int) -> tuple:
+    """返回 (内存命中的查询耗时, 内存淘汰后的查询耗时)，单位微秒；内存存储淘汰后查不到"""
+    # max_entries 很小：大部分已结束任务只留在SQLite中
+    store = make_store(backend, directory, max_entries=100)
+    for i in range(tasks):
+        task_request = make_request(i)
+        store.put(TaskResult(task_id=task_request.task_id, status=TaskStatus.PENDING),
+                  user_id=task_request.user_id, task_request=task_request)
+        store.put(TaskResult(task_id=task_request.task_id, status=TaskStatus.COMPLETED, result={"content": "x" * 200}))
+    store.flush()
+
+    timings = []
+    for task_ids in ([f"task_{tasks - 1 - i % 100}" for i in range(lookups)],
+                     [f"task_{i * 7919 % (tasks - 100)}" for i in range(lookups)]):
+        start = time.perf_counter()
+        found = sum(1 for task_id in task_ids if store.get(task_id) is not None)
+        timings.append(((time.perf_counter() - start) / lookups * 1e6, found))
+    store.close()
+    return timings
+
+
+def bench_pool(backend: str, directory: str, tasks: int) -> float:
+    """ThreadPoolManager 执行空任务，返回任务/秒（结果全部写入存储后计时结束）"""
+    pool = ThreadPoolManager(max_workers=4, queue_size=tasks, pool_name="bench")
+    pool.task_results.close()
+    pool.task_results = make_store(backend, directory)
+    start = time.perf_counter()
+    for i in range(tasks):
+        pool.submit_task(TaskRequest(task_id=f"task_{i}", user_id=f"user_{i % 100}", task_type="bench",
+                                     task_func=lambda: {"ok": True}, args=(), kwargs={}))
+    pool.shutdown()
+    return tasks / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="任务存储基准：内存 对比 SQLite")
+    parser.add_argument("--tasks", type=int, default=20000, help="状态变更测试的任务数")
+    parser.add_argument("--lookups", type=int, default=20000, help="状态查询次数")
+    parser.add_argument("--pool-tasks", type=int, default=5000, help="线程池端到端测试的任务数")
+    args = parser.parse_args()
+
+    logging.getLogger("API").setLevel(logging.WARNING)
+    directory = tempfile.mkdtemp(prefix="task_store_bench_")
+    backends = ("memory", "sqlite")
+
+    print(f"状态变更吞吐（{args.tasks} 个任务，每个 提交/开始/完成 3次写入）")
+    for backend in backends:
+        submitted, durable = bench_lifecycle(backend, directory, args.tasks)
+        print(f"  {backend:<7} 请求线程 {submitted:>10,.0f} 次/s  写入磁盘 {durable:>10,.0f} 次/s")
+
+    print(f"\n状态查询延迟（{args.lookups} 次）")
+    for backend in backends:
+        (hit, hit_found), (miss, miss_found) = bench_lookup(backend, directory, args.tasks, args.lookups)
+        print(f"  {backend:<7} 内存命中 {hit:6.1f}us ({hit_found}/{args.lookups})  "
+              f"已淘汰 {miss:6.1f}us ({miss_found}/{args.lookups})")
+
+    print(f"\n线程池端到端（{args.pool_tasks} 个空任务，4个工作线程）")
+    for backend in backends:
+        print(f"  {backend:<7} {bench_pool(backend, directory, args.pool_tasks):>10,.0f} 任务/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+任务结果存储浸泡测试
+用模拟时钟按固定速率向 TaskResultStore 写入流式任务结果（并随机读取、按用户列出），
+模拟数天的运行，定期输出进程实际分配的内存（tracemalloc）和存储估算的内存，两者应在达到预算后保持平稳
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from API.task_store import TaskResultStore
+from API.services import TaskResult, TaskStatus
+
+
+def make_result(rng: random.Random, chunks: int) -> dict:
+    # 流式任务结果：每个片段几个字符，与Ollama逐token输出相近
+    pieces = [rng.choice(("今天", "分享", "一款", "超好用的", "面霜", "✨", "\n", "#护肤 ")) for _ in range(chunks)]
+    return {"chunks": pieces, "full_content": "".join(pieces), "chunk_count": chunks,
+            "stats": {"eval_count": chunks, "total_duration_ms": 1234.5}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="任务结果存储浸泡测试（模拟时钟）")
+    parser.add_argument("--days", type=float, default=7, help="模拟运行天数")
+    parser.add_argument("--interval", type=float, default=5.0, help="模拟的任务间隔（秒）")
+    parser.add_argument("--users", type=int, default=500, help="用户数")
+    parser.add_argument("--chunks", type=int, default=400, help="每个结果的片段数")
+    parser.add_argument("--budget-mb", type=float, default=16, help="内存预算（MB）")
+    parser.add_argument("--spill", action="store_true", help="启用落盘（写入临时目录）")
+    parser.add_argument("--reports", type=int, default=14, help="输出次数")
+    args = parser.parse_args()
+
+    clock = [0.0]
+    store = TaskResultStore({
+        "memory_budget_mb": args.budget_mb,
+        "spill_enabled": args.spill,
+        "spill_dir": tempfile.mkdtemp(prefix="task_results_"),
+        "spill_threshold": 16 * 1024,
+    }, name="soak", clock=lambda: clock[0])
+    rng = random.Random(0)
+    total = int(args.days * 86400 / args.interval)
+    report_every = max(1, total // args.reports)
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    print(f"模拟 {args.days:g} 天，共 {total} 个任务，内存预算 {args.budget_mb:g}MB，落盘 {'开启' if args.spill else '关闭'}")
+    print(f"{'模拟时间':>8} {'任务数':>8} {'保留结果':>8} {'估算内存':>10} {'实际分配':>10} {'淘汰':>8} {'过期':>8}")
+    for i in range(total):
+        clock[0] += args.interval
+        task_id = f"task_{i}"
+        user_id = f"user_{rng.randrange(args.users)}"
+        store.put(TaskResult(task_id=task_id, status=TaskStatus.PENDING), user_id=user_id)
+        store.put(TaskResult(task_id=task_id, status=TaskStatus.COMPLETED, result=make_result(rng, args.chunks)))
+        if i % 10 == 0:
+            store.get(f"task_{rng.randrange(i + 1)}")
+            store.list_user_tasks(user_id, 20)
+        if (i + 1) % report_every == 0 or i + 1 == total:
+            status = store.get_status()
+            allocated = tracemalloc.get_traced_memory()[0] - baseline
+            print(f"{clock[0] / 86400:>7.2f}天 {i + 1:>8} {status['finished_tasks']:>8} "
+                  f"{status['memory_bytes'] / 2 ** 20:>8.1f}MB {allocated / 2 ** 20:>8.1f}MB "
+                  f"{status['evictions']:>8} {status['expired']:>8}")
+    tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -261,7 +261,8 @@ def start_uvicorn_fallback():
             "API.main:app",
             host=SERVER_CONFIG['host'],
             port=RUNTIME_CONFIG['port'],
-            reload=True,
+            workers=RUNTIME_CONFIG['workers'],
+            reload=RUNTIME_CONFIG['workers'] == 1,  # 自动重载只支持单进程
             log_level="info",
             access_log=True,
         )
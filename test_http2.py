@@ -6,6 +6,7 @@ HTTP/2.0 快速测试脚本
 
 import asyncio
 import httpx
+import os
 import time
 import json
 from typing import Dict, Any
@@ -14,8 +15,9 @@ class HTTP2QuickTest:
     """HTTP/2.0快速测试类"""
     
     def __init__(self):
-        self.http1_url = "http://localhost:8000"
-        self.http2_url = "https://localhost:8443"
+        # 服务地址可通过环境变量覆盖（如在CI中指向以模拟Ollama启动的API）
+        self.http1_url = os.getenv("API_HTTP1_URL", "http://localhost:8000")
+        self.http2_url = os.getenv("API_HTTP2_URL", "https://localhost:8443")
         self.test_data = {
             "topic": "春季护肤",
             "category": "beauty",